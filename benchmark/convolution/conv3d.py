@@ -0,0 +1,60 @@
+"""
+Compare the loop-based Conv3D ops with their GEMM-based replacements
+(Conv3DGemm, ConvGrad3DGemm, ConvTransp3DGemm).
+
+Usage: python conv3d.py <batch> <rows> <cols> <frames> <in channels>
+                        <filters> <ker rows> <ker cols> <ker frames>
+                        <dtype> [nb_call]
+"""
+import sys
+import timeit
+
+try:
+    batch, rows, cols, frames, in_chan = [int(x) for x in sys.argv[1:6]]
+    nkern, krows, kcols, kframes = [int(x) for x in sys.argv[6:10]]
+    dtype = sys.argv[10]
+except Exception:
+    print >> sys.stderr, ("Usage: %s <batch> <rows> <cols> <frames> "
+                          "<in channels> <filters> <ker rows> <ker cols> "
+                          "<ker frames> <dtype> [nb_call]" % sys.argv[0])
+    sys.exit(-1)
+
+nb_call = 1
+if len(sys.argv) > 11:
+    nb_call = int(sys.argv[11])
+
+setup = """
+import sys
+import numpy
+import theano
+import theano.tensor as T
+from theano.tensor.nnet.Conv3D import conv3D
+
+batch, rows, cols, frames, in_chan = [int(x) for x in sys.argv[1:6]]
+nkern, krows, kcols, kframes = [int(x) for x in sys.argv[6:10]]
+dtype = sys.argv[10]
+rng = numpy.random.RandomState(23455)
+
+V = theano.shared(numpy.asarray(
+    rng.uniform(size=(batch, rows, cols, frames, in_chan)), dtype=dtype))
+W = theano.shared(numpy.asarray(
+    rng.uniform(size=(nkern, krows, kcols, kframes, in_chan)), dtype=dtype))
+b = theano.shared(numpy.zeros(nkern, dtype=dtype))
+d = theano.shared(numpy.ones(3, dtype='int32'))
+
+H = conv3D(V, W, b, d)
+cost = T.sum(H ** 2)
+gV, gW = T.grad(cost, [V, W])
+"""
+
+for name, mode in [('loops', "theano.compile.mode.get_default_mode()"
+                             ".excluding('conv3d_gemm')"),
+                   ('gemm', "theano.compile.mode.get_default_mode()"
+                            ".including('conv3d_gemm')")]:
+    t = timeit.Timer("f()", setup +
+                     "f = theano.function([], H, mode=%s)" % mode)
+    print min(t.repeat(repeat=3, number=nb_call)), 'fprop', name
+
+    t = timeit.Timer("f()", setup +
+                     "f = theano.function([], [gV, gW], mode=%s)" % mode)
+    print min(t.repeat(repeat=3, number=nb_call)), 'fprop+bprop', name
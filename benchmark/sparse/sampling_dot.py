@@ -0,0 +1,101 @@
+"""
+Compare SamplingDot computed with scipy (the Python implementation) and
+with SamplingDotCSR and SamplingDotCSRGrad on 1, 2 and all threads, over a
+range of densities of the pattern.
+
+x has <rows> x <k> elements, y <cols> x <k> and the pattern <rows> x <cols>.
+Each row of the pattern has a run of consecutive columns (e.g. the positive
+items of a user) followed by random ones (the negative samples), so the
+default densities go from a few samples per row to a fairly dense pattern.
+
+Usage: python sampling_dot.py <rows> <cols> <k> <dtype> [nb_call] [densities]
+
+e.g. python sampling_dot.py 1000 20000 64 float32 10 0.001,0.01,0.1
+"""
+import sys
+import timeit
+
+try:
+    rows, cols, k = [int(x) for x in sys.argv[1:4]]
+    dtype = sys.argv[4]
+except Exception:
+    print >> sys.stderr, ("Usage: %s <rows> <cols> <k> <dtype> "
+                          "[nb_call] [densities]" % sys.argv[0])
+    sys.exit(-1)
+
+nb_call = 1
+if len(sys.argv) > 5:
+    nb_call = int(sys.argv[5])
+densities = [0.001, 0.01, 0.1]
+if len(sys.argv) > 6:
+    densities = [float(x) for x in sys.argv[6].split(',')]
+
+setup = """
+import sys
+import numpy
+import scipy.sparse
+import theano
+import theano.sparse
+
+rows, cols, k = [int(x) for x in sys.argv[1:4]]
+dtype = sys.argv[4]
+density = %(density)s
+rng = numpy.random.RandomState(23455)
+
+# Half of the non-zeros of each row are consecutive, half are random.
+per_row = max(int(cols * density), 1)
+run = per_row // 2
+rows_idx = []
+cols_idx = []
+for i in range(rows):
+    start = rng.randint(cols - run + 1)
+    c = numpy.concatenate([numpy.arange(start, start + run),
+                           rng.randint(cols, size=per_row - run)])
+    rows_idx.append(numpy.zeros(len(c), dtype='int64') + i)
+    cols_idx.append(c)
+rows_idx = numpy.concatenate(rows_idx)
+cols_idx = numpy.concatenate(cols_idx)
+p_val = scipy.sparse.coo_matrix(
+    (numpy.ones(len(rows_idx), dtype=dtype), (rows_idx, cols_idx)),
+    shape=(rows, cols)).tocsr()
+p_val.data[:] = 1
+p_val.sort_indices()
+x_val = numpy.asarray(rng.uniform(size=(rows, k)), dtype=dtype)
+y_val = numpy.asarray(rng.uniform(size=(cols, k)), dtype=dtype)
+
+x = theano.tensor.matrix(dtype=dtype)
+y = theano.tensor.matrix(dtype=dtype)
+p = theano.sparse.csr_matrix(dtype=dtype)
+z = theano.sparse.sampling_dot(x, y, p)
+cost = theano.sparse.sp_sum(z, sparse_grad=True)
+gx, gy = theano.grad(cost, [x, y])
+
+theano.config.openmp = %(openmp)s
+theano.config.sparse.num_threads = %(num_threads)s
+mode = theano.compile.mode.get_default_mode()
+if %(python)s:
+    mode = mode.excluding('local_sampling_dot_csr',
+                          'local_sampling_dot_grad_csr')
+"""
+
+# (name, use the Python implementation, config.openmp,
+#  config.sparse.num_threads)
+configs = [('scipy', True, False, 1),
+           ('1 thread', False, False, 1),
+           ('2 threads', False, True, 2),
+           ('all threads', False, True, 0)]
+
+for density in densities:
+    for name, python, openmp, num_threads in configs:
+        s = setup % dict(density=density, python=python, openmp=openmp,
+                         num_threads=num_threads)
+        t = timeit.Timer("f(x_val, y_val, p_val)", s +
+                         "f = theano.function([x, y, p], z, mode=mode)")
+        print min(t.repeat(repeat=3, number=nb_call)), 'fprop', \
+            density, name
+
+        t = timeit.Timer("f(x_val, y_val, p_val)", s +
+                         "f = theano.function([x, y, p], [z, gx, gy],"
+                         " mode=mode)")
+        print min(t.repeat(repeat=3, number=nb_call)), 'fprop+bprop', \
+            density, name
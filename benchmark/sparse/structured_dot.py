@@ -0,0 +1,81 @@
+"""
+Compare the sparse-dense products with 1 thread (scipy for dot, the C
+UsmmCscDense for usmm) and with the OpenMP kernels of StructuredDotCSC,
+StructuredDotCSR and UsmmCscDense, over a range of sparsity levels.
+
+The sparse matrix has <rows> x <cols> elements, the dense one
+<cols> x <batch>. The default densities go from a bag-of-words input
+(0.1%) to a fairly dense one (10%).
+
+Usage: python structured_dot.py <rows> <cols> <batch> <dtype>
+                                [nb_call] [densities]
+
+e.g. python structured_dot.py 1000 50000 256 float32 10 0.001,0.01,0.1
+"""
+import sys
+import timeit
+
+try:
+    rows, cols, batch = [int(x) for x in sys.argv[1:4]]
+    dtype = sys.argv[4]
+except Exception:
+    print >> sys.stderr, ("Usage: %s <rows> <cols> <batch> <dtype> "
+                          "[nb_call] [densities]" % sys.argv[0])
+    sys.exit(-1)
+
+nb_call = 1
+if len(sys.argv) > 5:
+    nb_call = int(sys.argv[5])
+densities = [0.001, 0.01, 0.1]
+if len(sys.argv) > 6:
+    densities = [float(x) for x in sys.argv[6].split(',')]
+
+setup = """
+import sys
+import numpy
+import scipy.sparse
+import theano
+import theano.sparse
+
+rows, cols, batch = [int(x) for x in sys.argv[1:4]]
+dtype = sys.argv[4]
+density = %(density)s
+rng = numpy.random.RandomState(23455)
+
+nnz = int(rows * cols * density)
+x_val = scipy.sparse.coo_matrix(
+    (numpy.asarray(rng.uniform(size=nnz), dtype=dtype),
+     (rng.randint(rows, size=nnz), rng.randint(cols, size=nnz))),
+    shape=(rows, cols)).asformat('%(format)s')
+y_val = numpy.asarray(rng.uniform(size=(cols, batch)), dtype=dtype)
+z_val = numpy.asarray(rng.uniform(size=(rows, batch)), dtype=dtype)
+
+x = theano.sparse.matrix('%(format)s', dtype=dtype)
+y = theano.tensor.matrix(dtype=dtype)
+z = theano.tensor.matrix(dtype=dtype)
+theano.config.openmp = %(openmp)s
+theano.config.sparse.num_threads = %(num_threads)s
+"""
+
+# (name, config.openmp, config.sparse.num_threads)
+configs = [('1 thread', False, 1),
+           ('2 threads', True, 2),
+           ('all threads', True, 0)]
+
+for density in densities:
+    for format in ['csr', 'csc']:
+        for name, openmp, num_threads in configs:
+            s = setup % dict(density=density, format=format, openmp=openmp,
+                             num_threads=num_threads)
+            t = timeit.Timer(
+                "f(x_val, y_val)", s +
+                "f = theano.function([x, y], theano.sparse.dot(x, y))")
+            print min(t.repeat(repeat=3, number=nb_call)), \
+                'dot', format, density, name
+
+            t = timeit.Timer(
+                "f(x_val, y_val, z_val)", s +
+                "f = theano.function([x, y, z],"
+                " z - 0.5 * theano.sparse.dot(x, y))")
+            print min(t.repeat(repeat=3, number=nb_call)), \
+                'usmm', format, density, name
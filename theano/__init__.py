@@ -73,20 +73,32 @@ from compile import \
 
 from misc.safe_asarray import _asarray
 
-import theano.tests
-if hasattr(theano.tests, "TheanoNoseTester"):
-    test = theano.tests.TheanoNoseTester().test
-else:
-    def test():
+# theano.tests imports nose, and scan_module is only needed by graphs that
+# use scan, so they are only imported when first used.
+from misc.lazy import LazyModule, LazyFunction
+
+tests = LazyModule('theano.tests')
+
+
+def test(*args, **kwargs):
+    """Run the Theano tests, see `theano.tests.TheanoNoseTester.test`."""
+    import theano.tests
+    if not hasattr(theano.tests, "TheanoNoseTester"):
         raise ImportError("The nose module is not installed."
                           " It is needed for Theano tests.")
+    return theano.tests.TheanoNoseTester().test(*args, **kwargs)
 
 FancyModule = Module
 
 from printing import \
     pprint, pp
-import scan_module
-from scan_module import scan, map, reduce, foldl, foldr, clone
+scan_module = LazyModule('theano.scan_module')
+scan = LazyFunction('theano.scan_module', 'scan')
+map = LazyFunction('theano.scan_module', 'map')
+reduce = LazyFunction('theano.scan_module', 'reduce')
+foldl = LazyFunction('theano.scan_module', 'foldl')
+foldr = LazyFunction('theano.scan_module', 'foldr')
+clone = LazyFunction('theano.scan_module', 'clone')
 
 from updates import Updates
 
@@ -164,3 +176,21 @@ def dot(l, r):
         raise NotImplementedError("Dot failed for the following reasons:",
                                   (e0, e1))
     return rval
+
+
+def sparse_grad(var):
+    """Return a new variable whose gradient will be sparse.
+
+    `var` must be a matrix indexed by a vector of integers
+    (a_matrix[an_int_vector], i.e. the output of AdvancedSubtensor1).
+    The gradient of a cost that depends on the result, with respect to the
+    matrix, is then a CSR matrix holding only the rows that were indexed,
+    instead of a dense matrix the size of the whole input. This needs
+    scipy.
+
+    When such a gradient is used to update the matrix, as in
+    ``W - lr * grad(cost, W)``, the optimizations turn the update into an
+    increment of the rows used only.
+    """
+    assert isinstance(var.owner.op, tensor.AdvancedSubtensor1)
+    return var.owner.op.__class__(sparse_grad=True)(*var.owner.inputs)
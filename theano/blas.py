@@ -0,0 +1,196 @@
+"""Runtime information and thread control for the BLAS used by Theano.
+
+The C code of the BLAS Ops (theano.tensor.blas, blas_c, ...) is linked with
+the library named by config.blas.ldflags. When that flag is empty, the
+BLAS calls go through numpy or scipy instead. Either way there is a single
+BLAS library loaded in the process. This module opens it with ctypes and
+looks up the thread-control functions it exports. That way we can report
+which library is in use and change its number of threads while the
+program runs.
+
+The library is opened the first time one of the functions below is
+called, not when this module is imported.
+
+Each compiled function records config.blas.num_threads when it is
+created, in its `blas_num_threads` attribute. When that is not 0, the
+BLAS thread count is set to it for the duration of each call and then
+restored. If the library cannot report its thread count (e.g. GotoBLAS),
+it could not be restored, so it is left alone and a warning is printed.
+Setting the attribute on a compiled function changes it for that
+function only. This makes it possible to run many small GEMMs
+single-threaded next to a few large multithreaded ones, without
+oversubscribing the machine.
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import sys
+
+from theano.configparser import config, AddConfigVar, IntParam
+
+_logger = logging.getLogger('theano.blas')
+
+AddConfigVar('blas.num_threads',
+        "Number of threads the BLAS library uses while a compiled function "
+        "runs. The value is read when the function is compiled. "
+        "0 leaves the library's own setting (e.g. OMP_NUM_THREADS) alone.",
+        IntParam(0, lambda i: i >= 0),
+        in_c_key=False)
+
+# (library name, function that sets the number of threads, function that
+#  returns it). The first entry whose setter is exported wins.
+_thread_api = [
+    ('openblas', 'openblas_set_num_threads', 'openblas_get_num_threads'),
+    ('mkl', 'MKL_Set_Num_Threads', 'MKL_Get_Max_Threads'),
+    ('blis', 'bli_thread_set_num_threads', 'bli_thread_get_num_threads'),
+    ('goto', 'goto_set_num_threads', None),
+]
+
+# Modules whose shared object is linked with the BLAS numpy or scipy use.
+_numpy_blas_modules = ['numpy.core._dotblas', 'numpy.core.multiarray',
+                       'scipy.linalg.fblas', 'scipy.linalg._fblas']
+
+
+class _BlasRuntime(object):
+    """The BLAS library found by `_load`, and its thread-control API."""
+    def __init__(self, name, path, set_threads, get_threads):
+        self.name = name
+        self.path = path
+        self.set_threads = set_threads
+        self.get_threads = get_threads
+
+_runtime = None
+
+# True once we warned that the thread count can't be restored.
+_warned_no_restore = False
+
+
+def _library_candidates():
+    """Return the paths of the shared objects that may hold the BLAS."""
+    rval = []
+    if config.blas.ldflags:
+        # Imported here because theano.tensor imports theano.compile,
+        # which imports this module.
+        from theano.tensor.blas import ldflags
+        dirs = ldflags(libs=False, libs_dir=True)
+        for lib in ldflags():
+            found = None
+            for d in dirs:
+                for fname in ['lib%s.so' % lib, 'lib%s.dylib' % lib,
+                              '%s.dll' % lib]:
+                    if os.path.exists(os.path.join(d, fname)):
+                        found = os.path.join(d, fname)
+                        break
+                if found:
+                    break
+            if found is None:
+                found = ctypes.util.find_library(lib)
+            if found:
+                rval.append(found)
+    else:
+        for modname in _numpy_blas_modules:
+            try:
+                __import__(modname)
+            except ImportError:
+                continue
+            fname = getattr(sys.modules[modname], '__file__', None)
+            if fname and not fname.endswith('.py') and \
+                    not fname.endswith('.pyc'):
+                rval.append(fname)
+    return rval
+
+
+def _load():
+    """Open the BLAS library and look up its thread-control functions."""
+    global _runtime
+    if _runtime is not None:
+        return _runtime
+    first_path = None
+    for path in _library_candidates():
+        try:
+            lib = ctypes.CDLL(path, mode=getattr(ctypes, 'RTLD_GLOBAL', 0))
+        except OSError, e:
+            _logger.debug('Could not open %s: %s', path, e)
+            continue
+        if first_path is None:
+            first_path = path
+        for name, set_name, get_name in _thread_api:
+            set_threads = getattr(lib, set_name, None)
+            if set_threads is None:
+                continue
+            set_threads.restype = None
+            if name == 'blis':
+                set_threads.argtypes = [ctypes.c_long]
+            else:
+                set_threads.argtypes = [ctypes.c_int]
+            get_threads = None
+            if get_name is not None:
+                get_threads = getattr(lib, get_name, None)
+                if get_threads is not None:
+                    get_threads.restype = ctypes.c_int
+                    get_threads.argtypes = []
+            _runtime = _BlasRuntime(name, path, set_threads, get_threads)
+            return _runtime
+    # We can call this BLAS, but not control its threads.
+    _runtime = _BlasRuntime(None, first_path, None, None)
+    return _runtime
+
+
+def get_num_threads():
+    """Return the number of threads the BLAS uses, or None if unknown."""
+    rt = _load()
+    if rt.get_threads is None:
+        return None
+    return rt.get_threads()
+
+
+def set_num_threads(n, restorable=False):
+    """Make the BLAS use `n` threads.
+
+    :param restorable: if True, only change the number of threads when the
+        previous one is known, so that it can be restored. Otherwise a
+        warning is printed (once) and nothing is changed.
+
+    :return: the previous number of threads, or None if it is unknown or
+        the library does not let us change it.
+    """
+    global _warned_no_restore
+    rt = _load()
+    if rt.set_threads is None:
+        return None
+    prev = get_num_threads()
+    if prev is None and restorable:
+        if not _warned_no_restore:
+            _logger.warning('The BLAS library (%s) does not report its '
+                            'number of threads, so it is not changed for '
+                            'the calls of the functions with '
+                            'blas_num_threads set.', rt.name)
+            _warned_no_restore = True
+        return None
+    if prev != n:
+        rt.set_threads(n)
+    return prev
+
+
+def info():
+    """Return a dict describing the BLAS in use.
+
+    Keys are 'library' (e.g. 'openblas', 'mkl', or None when we don't
+    recognize it), 'path' (the shared object that was opened, or None),
+    'num_threads' (None if unknown), 'thread_control' (whether
+    set_num_threads has any effect) and 'ldflags'.
+    """
+    rt = _load()
+    return dict(library=rt.name,
+                path=rt.path,
+                num_threads=get_num_threads(),
+                thread_control=rt.set_threads is not None,
+                ldflags=config.blas.ldflags)
+
+
+def print_info(file=sys.stdout):
+    """Print the output of `info` in a readable way."""
+    d = info()
+    for k in ['library', 'path', 'num_threads', 'thread_control', 'ldflags']:
+        print >> file, '    %s=' % k, d[k]
@@ -6,6 +6,8 @@
 __docformat__ = "restructuredtext en"
 
 import time, copy, sys, copy_reg, gc, os
+import Queue
+import threading
 from itertools import izip
 from StringIO import StringIO
 
@@ -18,7 +20,7 @@ from theano.gof.link import raise_with_op
 from theano.gof.cc import CLinker
 from theano.gof.python25 import all, any, product as itertools_product
 from theano.configparser import (config, AddConfigVar, BoolParam, IntParam,
-        StrParam)
+        FloatParam, StrParam)
 from theano.compile.function_module import (FunctionMaker,
         Function,
         infer_reuse_pattern,
@@ -92,6 +94,25 @@ AddConfigVar('DebugMode.check_preallocated_output_ndim',
         IntParam(4, lambda i: i > 0),
         in_c_key=False)
 
+AddConfigVar('DebugMode.check_fraction',
+        ('Fraction of the nodes, chosen at random at each call, whose '
+         'implementations are checked. The other nodes are only computed '
+         '(with their C implementation if there is one).'),
+        FloatParam(1.0, lambda f: 0 <= f <= 1),
+        in_c_key=False)
+
+AddConfigVar('DebugMode.check_once',
+        ('Check each combination of an op and the types and shapes of its '
+         'inputs only once per process.'),
+        BoolParam(False),
+        in_c_key=False)
+
+AddConfigVar('DebugMode.n_workers',
+        ('Number of threads that check the nodes while the main thread '
+         'computes the next ones. 0 checks them in the main thread.'),
+        IntParam(0, lambda i: i >= 0),
+        in_c_key=False)
+
 import logging
 _logger = logging.getLogger("theano.compile.debugmode")
 _logger.setLevel(logging.WARNING)
@@ -886,6 +907,118 @@ def _lessbroken_deepcopy(a):
     return rval
 
 
+def _run_node(node, thunk_py, thunk_c, storage_map, r_vals, dr_vals,
+              active_nodes):
+    """Compute the outputs of `node` without checking them, and store them
+    in `r_vals`.
+
+    The C implementation is used if there is one. Only the inputs that the
+    node destroys are copied, so the values in `r_vals` do not change.
+    """
+    destroyed = []
+    for o_pos, i_pos_list in getattr(node.op, 'destroy_map', {}).iteritems():
+        destroyed.extend(i_pos_list)
+    for i, r in enumerate(node.inputs):
+        if i in destroyed:
+            storage_map[r][0] = _lessbroken_deepcopy(r_vals[r])
+        else:
+            storage_map[r][0] = r_vals[r]
+    thunk = thunk_c
+    if thunk is None:
+        thunk = thunk_py
+    try:
+        thunk()
+    except Exception:
+        raise_with_op(node)
+    if node in active_nodes:
+        for i in destroyed:
+            r = node.inputs[i]
+            dr_vals[r] = (storage_map[r][0], node)
+    for r in node.outputs:
+        r_vals[r] = storage_map[r][0]
+        storage_map[r][0] = None
+    for r in node.inputs:
+        storage_map[r][0] = None
+
+
+# The keys (see _check_key) of the nodes checked in this process, used
+# when DebugMode.check_once is True.
+_checked_keys = set()
+
+
+def _check_key(node, r_vals):
+    """Return the op of `node` and the types and shapes of the values of
+    its inputs, or None if the op is not hashable."""
+    key = (node.op, tuple([(r.type, getattr(r_vals[r], 'shape', None))
+                           for r in node.inputs]))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _can_check_in_thread(node):
+    """Return False if checking `node` changes its op.
+
+    The ops with their own make_thunk or an inner function are checked in
+    the main thread.
+    """
+    return (node.op.make_thunk.im_func in default_make_thunk and
+            type(node.op) not in ops_with_inner_function)
+
+
+class _CheckThreads(object):
+    """Worker threads that run the checks of DebugMode.
+
+    The checks of several nodes run at the same time when their
+    implementations release the GIL, as numpy's BLAS calls do.
+    """
+    def __init__(self, n_workers):
+        self.queue = Queue.Queue()
+        self.errors = []
+        self.lock = threading.Lock()
+        self.threads = []
+        for i in xrange(n_workers):
+            t = threading.Thread(target=self.work)
+            t.setDaemon(True)
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, key, job):
+        """Call job() in a worker. Its errors are reported with `key`."""
+        self.queue.put((key, job))
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            key, job = item
+            try:
+                job()
+            except Exception:
+                self.lock.acquire()
+                try:
+                    self.errors.append((key, sys.exc_info()))
+                finally:
+                    self.lock.release()
+
+    def join(self):
+        """Wait for all the jobs and stop the workers.
+
+        :return: a list of (key, exc_info) for the jobs that failed, sorted
+            by key.
+        """
+        for t in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        errors = self.errors
+        errors.sort(key=lambda e: e[0])
+        return errors
+
+
 def _find_bad_optimizations0(order, reasons, r_vals):
     """Use a simple algorithm to find broken optimizations.
 
@@ -1565,6 +1698,96 @@ class _Linker(gof.link.LocalLinker):
         self.no_recycling = no_recycling
         return self
 
+    def make_node_thunks(self, node, storage_map, no_recycling):
+        """Return the Python and C thunks (or None) of `node`, that use the
+        cells of `storage_map`"""
+        node_input_storage = [storage_map[r] for r in node.inputs]
+        node_output_storage = [storage_map[r] for r in node.outputs]
+
+        try:
+            if not self.maker.mode.check_c_code:
+                raise utils.MethodNotDefined()
+            # Ops that do not inherit from gof.op.Op don't have certain
+            # methods defined that the CLinker expects (Scan is an
+            # exmaple, ifelse is another of such classes that inherit
+            # directly from PureOp)
+            if not isinstance(node.op, gof.op.Op):
+                raise utils.MethodNotDefined()
+            e = FunctionGraph(*graph.clone(node.inputs, node.outputs))
+            e.toposort = lambda: e.nodes  # WARNING: STOCHASTIC ORDER
+            #  Specifically... e.nodes is a set, but of only 1 element
+
+            cl = CLinker().accept(e, [r for r, r2 in zip(e.outputs,
+                                                         node.outputs)
+                                      if r2 in no_recycling])
+
+            thunk, node_input_filters, node_output_filters = cl.make_thunk(
+                input_storage=node_input_storage,
+                output_storage=node_output_storage)
+            thunk.inputs = node_input_storage
+            thunk.outputs = node_output_storage
+            thunk_c = thunk
+        except (NotImplementedError, utils.MethodNotDefined):
+            thunk_c = None
+
+        # Pure ops don't really have a perform ( or their perform just
+        # raises an not implemented exception), so in those cases we
+        # consider that we don't have a python implementation
+        if ((self.maker.mode.check_py_code or thunk_c is None) and
+            node.op.perform.func_code != gof.op.PureOp.perform.func_code):
+            p = node.op.perform
+            thunk = (lambda p=p, i=node_input_storage,
+                     o=node_output_storage,
+                     n=node: p(n, [x[0] for x in i], o))
+            thunk.inputs = node_input_storage
+            thunk.outputs = node_output_storage
+            thunk.perform = p
+            thunk_py = thunk
+        else:
+            thunk_py = None
+
+        # If the op define its own make_thunk, check it
+        if node.op.make_thunk.im_func not in default_make_thunk:
+            compute_map = {}
+            for k in node.inputs:
+                compute_map[k] = [True]
+            for k in node.outputs:
+                compute_map[k] = [False]
+            thunk = node.op.make_thunk(node,
+                                       storage_map,
+                                       compute_map,
+                                       no_recycling)
+
+            # Right now there is no op that when called check if
+            # its ouputs are computed and don't recompute itself.
+            # I think it is not a good idea to do so as we only
+            # call thunk when we want them computed. So those
+            # check would be useless. In case some ops do it at
+            # some point, we reset the compute_map of outputs to
+            # False.
+            #
+            # Note RP: this warp_thunk doesn't work. What happens is
+            # that for all ops that have a make_thunk, the same instance
+            # of `wrap_thunk` gets used ( that has the same `thunk`
+            # function, probably the one of the first of all those ops (
+            # or the last .. I'm not sure). I don't know suffcient about
+            # how python works to understand why. A bunch of tests fail
+            # because of this, one of them being
+            # theano/scan_module/tests/scan_tests.py:T_Scan.test_backwards
+            #def wrap_thunk():
+            #    for k in node.outputs:
+            #        compute_map[k] = [False]
+            #    thunk()
+
+            if thunk_py is None:
+                thunk_py = thunk
+            elif thunk_c is None:
+                thunk_c = thunk
+            else:
+                _logger.warn("We won't check the perform function of node '%s' but we will check its make_thunk function" % node)
+                thunk_py = thunk
+        return thunk_py, thunk_c
+
     def make_all(self, profiler = None, input_storage = None
                  , output_storage = None):
 
@@ -1597,91 +1820,10 @@ class _Linker(gof.link.LocalLinker):
         thunks_c = []  # c thunks
 
         for node in order:
-            node_input_storage = [storage_map[r] for r in node.inputs]
-            node_output_storage = [storage_map[r] for r in node.outputs]
-
-            try:
-                if not self.maker.mode.check_c_code:
-                    raise utils.MethodNotDefined()
-                # Ops that do not inherit from gof.op.Op don't have certain
-                # methods defined that the CLinker expects (Scan is an
-                # exmaple, ifelse is another of such classes that inherit
-                # directly from PureOp)
-                if not isinstance(node.op, gof.op.Op):
-                    raise utils.MethodNotDefined()
-                e = FunctionGraph(*graph.clone(node.inputs, node.outputs))
-                e.toposort = lambda: e.nodes  # WARNING: STOCHASTIC ORDER
-                #  Specifically... e.nodes is a set, but of only 1 element
-
-                cl = CLinker().accept(e, [r for r, r2 in zip(e.outputs,
-                                                             node.outputs)
-                                          if r2 in no_recycling])
-
-                thunk, node_input_filters, node_output_filters = cl.make_thunk(
-                    input_storage=node_input_storage,
-                    output_storage=node_output_storage)
-                thunk.inputs = node_input_storage
-                thunk.outputs = node_output_storage
-                thunks_c.append(thunk)
-            except (NotImplementedError, utils.MethodNotDefined):
-                thunks_c.append(None)
-
-            # Pure ops don't really have a perform ( or their perform just
-            # raises an not implemented exception), so in those cases we
-            # consider that we don't have a python implementation
-            if ((self.maker.mode.check_py_code or thunks_c[-1] is None) and
-                node.op.perform.func_code != gof.op.PureOp.perform.func_code):
-                p = node.op.perform
-                thunk = (lambda p=p, i=node_input_storage,
-                         o=node_output_storage,
-                         n=node: p(n, [x[0] for x in i], o))
-                thunk.inputs = node_input_storage
-                thunk.outputs = node_output_storage
-                thunk.perform = p
-                thunks_py.append(thunk)
-            else:
-                thunks_py.append(None)
-
-            # If the op define its own make_thunk, check it
-            if node.op.make_thunk.im_func not in default_make_thunk:
-                compute_map = {}
-                for k in node.inputs:
-                    compute_map[k] = [True]
-                for k in node.outputs:
-                    compute_map[k] = [False]
-                thunk = node.op.make_thunk(node,
-                                           storage_map,
-                                           compute_map,
-                                           no_recycling)
-
-                # Right now there is no op that when called check if
-                # its ouputs are computed and don't recompute itself.
-                # I think it is not a good idea to do so as we only
-                # call thunk when we want them computed. So those
-                # check would be useless. In case some ops do it at
-                # some point, we reset the compute_map of outputs to
-                # False.
-                #
-                # Note RP: this warp_thunk doesn't work. What happens is
-                # that for all ops that have a make_thunk, the same instance
-                # of `wrap_thunk` gets used ( that has the same `thunk`
-                # function, probably the one of the first of all those ops (
-                # or the last .. I'm not sure). I don't know suffcient about
-                # how python works to understand why. A bunch of tests fail
-                # because of this, one of them being
-                # theano/scan_module/tests/scan_tests.py:T_Scan.test_backwards
-                #def wrap_thunk():
-                #    for k in node.outputs:
-                #        compute_map[k] = [False]
-                #    thunk()
-
-                if thunks_py[-1] is None:
-                    thunks_py[-1] = thunk
-                elif thunks_c[-1] is None:
-                    thunks_c[-1] = thunk
-                else:
-                    _logger.warn("We won't check the perform function of node '%s' but we will check its make_thunk function" % node)
-                    thunks_py[-1] = thunk
+            thunk_py, thunk_c = self.make_node_thunks(node, storage_map,
+                                                      no_recycling)
+            thunks_py.append(thunk_py)
+            thunks_c.append(thunk_c)
 
         if no_recycling is True:
             no_recycling = storage_map.values()
@@ -1696,6 +1838,235 @@ class _Linker(gof.link.LocalLinker):
         except ValueError:
             def_val = 666
 
+        rng = numpy.random.RandomState(def_val)
+
+        def must_check(node, r_vals):
+            """Return True if `node` is checked at this call"""
+            mode = self.maker.mode
+            if (mode.check_fraction < 1 and
+                    rng.uniform() >= mode.check_fraction):
+                return False
+            if mode.check_once:
+                key = _check_key(node, r_vals)
+                if key is not None:
+                    if key in _checked_keys:
+                        return False
+                    _checked_keys.add(key)
+            return True
+
+        # node -> list of (storage_map, thunk_py, thunk_c) that no worker
+        # is using. They are only created in this thread.
+        worker_thunks = {}
+
+        def submit_check(pool, i, node, r_vals, init_outputs):
+            """Run `check_node` for `node` in a worker of `pool`"""
+            free = worker_thunks.setdefault(node, [])
+            if free:
+                thunks = free.pop()
+            else:
+                node_storage = dict([(r, [None])
+                                     for r in node.inputs + node.outputs])
+                thunks = (node_storage,) + self.make_node_thunks(
+                        node, node_storage, self.no_recycling)
+            # The values of the inputs do not change: only copies of the
+            # inputs are destroyed.
+            node_r_vals = dict([(r, r_vals[r]) for r in node.inputs])
+
+            def job():
+                node_storage, thunk_py, thunk_c = thunks
+                try:
+                    check_node(i, node, thunk_py, thunk_c, node_storage,
+                               node_r_vals, {}, init_outputs)
+                finally:
+                    for cell in node_storage.values():
+                        cell[0] = None
+                    free.append(thunks)
+            pool.submit(i, job)
+
+        def check_node(i, node, thunk_py, thunk_c, storage_map, r_vals,
+                       dr_vals, init_outputs):
+            """Run and check the implementations of `node`, on copies of
+            the values of its inputs in `r_vals`, and store the values of
+            its outputs in `r_vals`."""
+            _logger.debug("%i - starting node %i %s", i, i, node)
+
+            # put a copy of each input into the storage_map
+            # also, check that inputs have valid values
+            for r in node.inputs:
+                assert isinstance(r, gof.Variable)
+                assert r in r_vals
+                # print >> sys.stderr,i,  "DEBUGMODE: deepcopy input ", r
+                storage_map[r][0] = _lessbroken_deepcopy(r_vals[r])
+                if not r.type.is_valid_value(storage_map[r][0]):
+                    raise InvalidValueError(r, storage_map[r][0],
+                                            client_node=node)
+
+            ## On the first call to thunk_py(), its output
+            ## storage will be None
+            if thunk_py:
+                _logger.debug("%i - running thunk_py with None as "
+                        "output storage", i)
+                try:
+                    thunk_py()
+                except utils.MethodNotDefined:
+                    # shouldn't have put it into the list in
+                    # the first place
+                    thunk_py = None
+
+            if thunk_py:
+                # check output values for type-correctness
+                for r in node.outputs:
+                    if not r.type.is_valid_value(storage_map[r][0]):
+                        hint2 = r.type.value_validity_msg(
+                            storage_map[r][0])
+                        raise InvalidValueError(r, storage_map[r][0],
+                                                hint='perform output',
+                                                specific_hint=hint2)
+                py_inplace_outs = _check_inputs(
+                        node, storage_map, r_vals, dr_vals,
+                        active_order_set,
+                        clobber_dr_vals=True, perform='py',
+                        warn_input_not_reused=config.DebugMode.warn_input_not_reused)
+
+                _check_viewmap(node, storage_map)
+
+                # Retrieve each output from the storage_map
+                # The return values of this first run will be the reference ones
+                for r in node.outputs:
+                    assert r not in r_vals
+                    # print >> sys.stderr, i, "DEBUGMODE storing reference output %x" % id(storage_map[r][0])
+                    r_vals[r] = storage_map[r][0]
+                    # clear the storage_map of outputs for the thunk_c
+                    storage_map[r][0] = None
+
+                if self.maker.mode.check_preallocated_output:
+                    prealloc_modes = \
+                            self.maker.mode.check_preallocated_output
+                    _logger.debug(
+                            '%i - calling _check_preallocated_output '
+                            'with thunk_py', i)
+                    _check_preallocated_output(
+                            node=node,
+                            thunk=thunk_py,
+                            prealloc_modes=prealloc_modes,
+                            def_val=def_val,
+                            storage_map=storage_map,
+                            r_vals=r_vals,
+                            dr_vals=dr_vals,
+                            perform='py',
+                            active_order_set=active_order_set,
+                            inplace_outs=py_inplace_outs,
+                            init_outputs=init_outputs)
+
+                # print >> sys.stderr, i, "DEBUGMODE thunk_py %100s %50s %30s" % (node,
+                    #[(id(o), numpy.asarray(storage_map[o][0])[0,0]) for o in node.inputs],
+                    #[(id(o), numpy.asarray(storage_map[o][0])[0,0]) for o in node.outputs])
+                sys.stdout.flush()
+
+            if thunk_c:
+
+                clobber = True
+                if thunk_py:
+                    dmap = getattr(node.op, 'destroy_map', {})
+                    vmap = getattr(node.op, 'view_map', {})
+                    for i, r in enumerate(node.inputs):
+                        # if thunk_py ran, and we still got this far,
+                        # it means that the destroy_map of the Op (and view_map) are
+                        # accurate
+                        # so we can assume that inputs not marked as destroyed have in
+                        # fact not been destroyed.
+                        # Therefore... we only need to overwrite inputs that *have*
+                        # been marked as destroyed.
+                        # Inputs marked as viewd are unsafe too,
+                        # because the corresponding output can
+                        # be destroyed.
+                        if any(i in v for v in (dmap.values() + vmap.values())):
+                            storage_map[r][0] = _lessbroken_deepcopy(r_vals[r])
+
+                    clobber = False
+
+                _logger.debug("%i - running thunk_c", i)
+                ## First time, with None in output_storage
+                try:
+                    thunk_c()
+                except Exception:
+                    raise_with_op(node)
+
+                for r in node.outputs:
+                    # check output values for type-correctness
+                    if not r.type.is_valid_value(storage_map[r][0]):
+                        raise InvalidValueError(r, storage_map[r][0], hint='c output')
+
+                    if thunk_py:
+                        assert r in r_vals #because we put it in during the thunk_py branch
+                        # check for stride correctness (may raise exception)
+                        _check_strides_match(r_vals[r],
+                            storage_map[r][0],
+                            self.maker.mode.require_matching_strides,
+                            node.op)
+
+                c_inplace_outs = _check_inputs(
+                        node, storage_map, r_vals,
+                        dr_vals, active_order_set,
+                        clobber_dr_vals=clobber, perform='c',
+                        warn_input_not_reused=config.DebugMode.warn_input_not_reused)
+
+                _check_viewmap(node, storage_map)
+
+                # Check with Python result
+                for r in node.outputs:
+                    if r in r_vals:
+                        #print >> sys.stderr, i, "DEBUGMODE clearing output", r
+                        # compares the version from thunk_py (in r_vals)
+                        # to the version produced by thunk_c (in storage_map)
+                        if not r.type.values_eq_approx(r_vals[r], storage_map[r][0]):
+                            #import pdb; pdb.set_trace()
+                            #r.type.values_eq_approx(r_vals[r], storage_map[r][0])
+                            raise BadThunkOutput(r,
+                                    thunk1='perform', val1=r_vals[r],
+                                    thunk2='c_code', val2=storage_map[r][0])
+                    else:
+                        #print >> sys.stderr, i, "DEBUGMODE storing reference output %x" % id(storage_map[r][0])
+                        #retrieve each output from the storage_map
+                        r_vals[r] = storage_map[r][0]
+                    storage_map[r][0] = None #clear the storage_map for the thunk_c
+
+                if self.maker.mode.check_preallocated_output:
+                    prealloc_modes = \
+                            self.maker.mode.check_preallocated_output
+                    def thunk():
+                        try:
+                            thunk_c()
+                        except Exception:
+                            raise_with_op(node)
+                    _logger.debug(
+                            '%i - calling _check_preallocated_output '
+                            'with thunk_c', i)
+                    _check_preallocated_output(
+                            node=node,
+                            thunk=thunk,
+                            prealloc_modes=prealloc_modes,
+                            def_val=def_val,
+                            storage_map=storage_map,
+                            r_vals=r_vals,
+                            dr_vals=dr_vals,
+                            perform='c code',
+                            active_order_set=active_order_set,
+                            inplace_outs=c_inplace_outs,
+                            init_outputs=init_outputs)
+
+                # print >> sys.stderr, i, "DEBUGMODE thunk_c  %100s %50s %30s" % (node,
+                    #[(id(o), numpy.asarray(storage_map[o][0])[0,0]) for o in node.inputs],
+                    #[(id(o), numpy.asarray(storage_map[o][0])[0,0]) for o in node.outputs])
+                sys.stdout.flush()
+
+            # we're done with this thunk
+            # clear everything out of the storage_map
+            for r in node.inputs:
+                #print >> sys.stderr, i, "DEBUGMODE clearing input", r
+                storage_map[r][0] = None
+            _logger.debug("%i - done with node", i)
+
         #####
         # This is the function that runs when you evaluate the graph
         #####
@@ -1715,6 +2086,7 @@ class _Linker(gof.link.LocalLinker):
             # storage_map when an exception is raised
             original_storage_map_keys = [r for r in storage_map
                                          if r.owner is None]
+            pool = None
 
             try:
                 equiv_vals = {}
@@ -1770,191 +2142,34 @@ class _Linker(gof.link.LocalLinker):
                         print r, s
                     assert s[0] is None
 
+                if self.maker.mode.n_workers > 0:
+                    pool = _CheckThreads(self.maker.mode.n_workers)
+
                 #try:
                 # compute the value of all variables
                 for i, (thunk_py, thunk_c, node) in enumerate(zip(thunks_py,
                                                                   thunks_c,
                                                                   order)):
-                    this_node_destroyed_variables = set()
-
-                    _logger.debug("%i - starting node %i %s", i, i, node)
-
-                    # put a copy of each input into the storage_map
-                    # also, check that inputs have valid values
-                    for r in node.inputs:
-                        assert isinstance(r, gof.Variable)
-                        assert r in r_vals
-                        # print >> sys.stderr,i,  "DEBUGMODE: deepcopy input ", r
-                        storage_map[r][0] = _lessbroken_deepcopy(r_vals[r])
-                        if not r.type.is_valid_value(storage_map[r][0]):
-                            raise InvalidValueError(r, storage_map[r][0],
-                                                    client_node=node)
-
-                    ## On the first call to thunk_py(), its output
-                    ## storage will be None
-                    if thunk_py:
-                        _logger.debug("%i - running thunk_py with None as "
-                                "output storage", i)
-                        try:
-                            thunk_py()
-                        except utils.MethodNotDefined:
-                            # shouldn't have put it into the list in
-                            # the first place
-                            thunk_py = None
-
-                    if thunk_py:
-                        # check output values for type-correctness
-                        for r in node.outputs:
-                            if not r.type.is_valid_value(storage_map[r][0]):
-                                hint2 = r.type.value_validity_msg(
-                                    storage_map[r][0])
-                                raise InvalidValueError(r, storage_map[r][0],
-                                                        hint='perform output',
-                                                        specific_hint=hint2)
-                        py_inplace_outs = _check_inputs(
-                                node, storage_map, r_vals, dr_vals,
-                                active_order_set,
-                                clobber_dr_vals=True, perform='py',
-                                warn_input_not_reused=config.DebugMode.warn_input_not_reused)
-
-                        _check_viewmap(node, storage_map)
-
-                        # Retrieve each output from the storage_map
-                        # The return values of this first run will be the reference ones
-                        for r in node.outputs:
-                            assert r not in r_vals
-                            # print >> sys.stderr, i, "DEBUGMODE storing reference output %x" % id(storage_map[r][0])
-                            r_vals[r] = storage_map[r][0]
-                            # clear the storage_map of outputs for the thunk_c
-                            storage_map[r][0] = None
-
-                        if self.maker.mode.check_preallocated_output:
-                            prealloc_modes = \
-                                    self.maker.mode.check_preallocated_output
-                            _logger.debug(
-                                    '%i - calling _check_preallocated_output '
-                                    'with thunk_py', i)
-                            _check_preallocated_output(
-                                    node=node,
-                                    thunk=thunk_py,
-                                    prealloc_modes=prealloc_modes,
-                                    def_val=def_val,
-                                    storage_map=storage_map,
-                                    r_vals=r_vals,
-                                    dr_vals=dr_vals,
-                                    perform='py',
-                                    active_order_set=active_order_set,
-                                    inplace_outs=py_inplace_outs,
-                                    init_outputs=init_outputs)
-
-                        # print >> sys.stderr, i, "DEBUGMODE thunk_py %100s %50s %30s" % (node,
-                            #[(id(o), numpy.asarray(storage_map[o][0])[0,0]) for o in node.inputs],
-                            #[(id(o), numpy.asarray(storage_map[o][0])[0,0]) for o in node.outputs])
-                        sys.stdout.flush()
-
-                    if thunk_c:
-
-                        clobber = True
-                        if thunk_py:
-                            dmap = getattr(node.op, 'destroy_map', {})
-                            vmap = getattr(node.op, 'view_map', {})
-                            for i, r in enumerate(node.inputs):
-                                # if thunk_py ran, and we still got this far,
-                                # it means that the destroy_map of the Op (and view_map) are
-                                # accurate
-                                # so we can assume that inputs not marked as destroyed have in
-                                # fact not been destroyed.
-                                # Therefore... we only need to overwrite inputs that *have*
-                                # been marked as destroyed.
-                                # Inputs marked as viewd are unsafe too,
-                                # because the corresponding output can
-                                # be destroyed.
-                                if any(i in v for v in (dmap.values() + vmap.values())):
-                                    storage_map[r][0] = _lessbroken_deepcopy(r_vals[r])
-
-                            clobber = False
-
-                        _logger.debug("%i - running thunk_c", i)
-                        ## First time, with None in output_storage
-                        try:
-                            thunk_c()
-                        except Exception:
-                            raise_with_op(node)
+                    if not must_check(node, r_vals):
+                        _run_node(node, thunk_py, thunk_c, storage_map,
+                                  r_vals, dr_vals, active_order_set)
+                    elif pool is not None and _can_check_in_thread(node):
+                        # The checks run in a worker on copies of the
+                        # inputs, while this thread computes the outputs.
+                        submit_check(pool, i, node, r_vals, init_outputs)
+                        _run_node(node, thunk_py, thunk_c, storage_map,
+                                  r_vals, dr_vals, active_order_set)
+                    else:
+                        check_node(i, node, thunk_py, thunk_c, storage_map,
+                                   r_vals, dr_vals, init_outputs)
 
-                        for r in node.outputs:
-                            # check output values for type-correctness
-                            if not r.type.is_valid_value(storage_map[r][0]):
-                                raise InvalidValueError(r, storage_map[r][0], hint='c output')
-
-                            if thunk_py:
-                                assert r in r_vals #because we put it in during the thunk_py branch
-                                # check for stride correctness (may raise exception)
-                                _check_strides_match(r_vals[r],
-                                    storage_map[r][0],
-                                    self.maker.mode.require_matching_strides,
-                                    node.op)
-
-                        c_inplace_outs = _check_inputs(
-                                node, storage_map, r_vals,
-                                dr_vals, active_order_set,
-                                clobber_dr_vals=clobber, perform='c',
-                                warn_input_not_reused=config.DebugMode.warn_input_not_reused)
-
-                        _check_viewmap(node, storage_map)
-
-                        # Check with Python result
-                        for r in node.outputs:
-                            if r in r_vals:
-                                #print >> sys.stderr, i, "DEBUGMODE clearing output", r
-                                # compares the version from thunk_py (in r_vals)
-                                # to the version produced by thunk_c (in storage_map)
-                                if not r.type.values_eq_approx(r_vals[r], storage_map[r][0]):
-                                    #import pdb; pdb.set_trace()
-                                    #r.type.values_eq_approx(r_vals[r], storage_map[r][0])
-                                    raise BadThunkOutput(r,
-                                            thunk1='perform', val1=r_vals[r],
-                                            thunk2='c_code', val2=storage_map[r][0])
-                            else:
-                                #print >> sys.stderr, i, "DEBUGMODE storing reference output %x" % id(storage_map[r][0])
-                                #retrieve each output from the storage_map
-                                r_vals[r] = storage_map[r][0]
-                            storage_map[r][0] = None #clear the storage_map for the thunk_c
-
-                        if self.maker.mode.check_preallocated_output:
-                            prealloc_modes = \
-                                    self.maker.mode.check_preallocated_output
-                            def thunk():
-                                try:
-                                    thunk_c()
-                                except Exception:
-                                    raise_with_op(node)
-                            _logger.debug(
-                                    '%i - calling _check_preallocated_output '
-                                    'with thunk_c', i)
-                            _check_preallocated_output(
-                                    node=node,
-                                    thunk=thunk,
-                                    prealloc_modes=prealloc_modes,
-                                    def_val=def_val,
-                                    storage_map=storage_map,
-                                    r_vals=r_vals,
-                                    dr_vals=dr_vals,
-                                    perform='c code',
-                                    active_order_set=active_order_set,
-                                    inplace_outs=c_inplace_outs,
-                                    init_outputs=init_outputs)
-
-                        # print >> sys.stderr, i, "DEBUGMODE thunk_c  %100s %50s %30s" % (node,
-                            #[(id(o), numpy.asarray(storage_map[o][0])[0,0]) for o in node.inputs],
-                            #[(id(o), numpy.asarray(storage_map[o][0])[0,0]) for o in node.outputs])
-                        sys.stdout.flush()
-
-                    # we're done with this thunk
-                    # clear everything out of the storage_map
-                    for r in node.inputs:
-                        #print >> sys.stderr, i, "DEBUGMODE clearing input", r
-                        storage_map[r][0] = None
-                    _logger.debug("%i - done with node", i)
+                if pool is not None:
+                    errors = pool.join()
+                    pool = None
+                    if errors:
+                        # Raise the error of the first node in the order.
+                        exc_info = errors[0][1]
+                        raise exc_info[0], exc_info[1], exc_info[2]
 
                 if False:
                     #This could be useful to help finding refcount problem.
@@ -2002,6 +2217,9 @@ class _Linker(gof.link.LocalLinker):
                         else:
                             storage_map[r][0] = dr_vals[r][0]
             except Exception:
+                if pool is not None:
+                    # Wait for the workers, they use r_vals.
+                    pool.join()
                 # Restore the initial state of storage_map
                 for r in storage_map:
                     if r in original_storage_map_keys:
@@ -2393,6 +2611,24 @@ class DebugMode(Mode):
     (all of the above).
     """
 
+    check_fraction = config.DebugMode.check_fraction
+    """
+    Fraction of the nodes, drawn at random at each call, whose
+    implementations are checked. The other ones are only computed.
+    """
+
+    check_once = config.DebugMode.check_once
+    """
+    Should we check each combination of an op and input types and shapes
+    only once per process?
+    """
+
+    n_workers = config.DebugMode.n_workers
+    """
+    Number of threads that run the checks. With 0, they run in the
+    calling thread.
+    """
+
     # This function will be used to create a FunctionMaker in
     # function_module.function
     def function_maker(self, i, o, m, *args, **kwargs):
@@ -2410,7 +2646,10 @@ class DebugMode(Mode):
             check_isfinite=None,
             check_preallocated_output=None,
             require_matching_strides=None,
-            linker=None):
+            linker=None,
+            check_fraction=None,
+            check_once=None,
+            n_workers=None):
 
         """Initialize member variables.
 
@@ -2447,6 +2686,15 @@ class DebugMode(Mode):
         if require_matching_strides is not None:
             self.require_matching_strides = require_matching_strides
 
+        if check_fraction is not None:
+            self.check_fraction = check_fraction
+
+        if check_once is not None:
+            self.check_once = check_once
+
+        if n_workers is not None:
+            self.n_workers = n_workers
+
         if not (self.check_c_code or self.check_py_code):
             raise ValueError('DebugMode has to check at least one of c and py '
                              'code')
@@ -2,19 +2,26 @@
 """
 __docformat__ = "restructuredtext en"
 
+import copy
 import sys, traceback, logging
 _logger = logging.getLogger('theano.compile.function')
 
+import numpy
+
+from theano import config
 from io import In
 from function_module import orig_function
 from profiling import ProfileStats
-from pfunc import pfunc
+from pfunc import pfunc, Param
 from numpy import any #for to work in python 2.4
 
+# Number of versions kept by function(..., specialize_shapes=True)
+default_shape_versions = 8
+
 def function(inputs, outputs=None, mode=None, updates=None, givens=None,
              no_default_updates=False, accept_inplace=False, name=None,
              rebuild_strict=True, allow_input_downcast=None, profile=None,
-             on_unused_input=None):
+             on_unused_input=None, specialize_shapes=False):
     """
     Return a callable object that will calculate `outputs` from `inputs`.
 
@@ -68,6 +75,13 @@ def function(inputs, outputs=None, mode=None, updates=None, givens=None,
     :param on_unused_input: What to do if a variable in the 'inputs' list is
     not used in the graph. Possible values are 'raise', 'warn', 'ignore' and None.
 
+    :type specialize_shapes: Boolean or int
+    :param specialize_shapes: if True, return a `ShapeSpecializedFunction`,
+    that compiles a version of the function for each combination of the
+    shapes of its tensor inputs it is called with. The optimizer then knows
+    these shapes as constants. It keeps the `default_shape_versions` most
+    recently used versions, or this number of versions if it is an int.
+
     :rtype: Function instance
     :returns: a callable object that will compute the outputs (given the inputs)
     and update the implicit function arguments according to the `updates`.
@@ -179,6 +193,31 @@ def function(inputs, outputs=None, mode=None, updates=None, givens=None,
                                    (hasattr(i,'mutable') and i.mutable)) ):
             check_for_aliased_inputs = True
 
+    if specialize_shapes:
+        if uses_In or uses_tuple:
+            raise NotImplementedError('specialize_shapes is not supported '
+                                      'with In() instances and tuple inputs')
+        if specialize_shapes is True:
+            specialize_shapes = default_shape_versions
+        if profile is None:
+            profile = config.profile
+        if profile == True:
+            # All the versions accumulate in the same profile.
+            profile = ProfileStats(message=name)
+        fn = ShapeSpecializedFunction(inputs, specialize_shapes,
+                outputs=outputs,
+                mode=mode,
+                updates=updates,
+                givens=givens,
+                no_default_updates=no_default_updates,
+                accept_inplace=accept_inplace, name=name,
+                rebuild_strict=rebuild_strict,
+                allow_input_downcast=allow_input_downcast,
+                on_unused_input=on_unused_input,
+                profile=profile)
+        fn._check_for_aliased_inputs = check_for_aliased_inputs
+        return fn
+
     if uses_In or uses_tuple:
         # we must use old semantics in this case.
         if profile:
@@ -204,3 +243,117 @@ def function(inputs, outputs=None, mode=None, updates=None, givens=None,
     # borrowed used defined inputs
     fn._check_for_aliased_inputs = check_for_aliased_inputs
     return fn
+
+
+class ShapeSpecializedFunction(object):
+    """A function that is compiled again for the shapes of its inputs.
+
+    Each version is a `Function` where the tensor inputs are passed through
+    `SpecifyShape` with the shapes of the arguments, and where the
+    dimensions of length 1 are broadcastable. The optimizer knows these
+    shapes as constants (see ShapeFeature), so it can remove the shape
+    computations and checks, and the C code can use the static broadcast
+    pattern.
+
+    The versions are kept in a LRU cache of `max_versions` entries, keyed by
+    the shapes of the arguments. The arguments that are not tensors, or
+    that have a different number of dimensions than their input, are not
+    specialized. All the versions use the same shared variables.
+    """
+    def __init__(self, inputs, max_versions, **kwargs):
+        if max_versions < 1:
+            raise ValueError('specialize_shapes must keep at least one '
+                             'version', max_versions)
+        self.inputs = list(inputs)
+        self.max_versions = max_versions
+        # The arguments of pfunc, except the inputs
+        self.kwargs = kwargs
+        self.profile = kwargs['profile']
+        # shapes -> Function, and the shapes from the least to the most
+        # recently used.
+        self.versions = {}
+        self.lru = []
+        self.compile_count = 0
+        self._check_for_aliased_inputs = False
+        self.input_index = {}
+        for i, inp in enumerate(self.inputs):
+            name = getattr(inp, 'name', None)
+            if name is None and isinstance(inp, Param):
+                name = inp.variable.name
+            if name is not None:
+                self.input_index[name] = i
+
+    def shapes(self, args, kwargs):
+        """Return the key of the version for these arguments: the shapes
+        of the arguments, None for those that are not specialized."""
+        from theano.tensor import TensorType
+        values = list(args) + [None] * (len(self.inputs) - len(args))
+        given = [True] * len(args) + [False] * (len(self.inputs) - len(args))
+        for name, value in kwargs.items():
+            if name not in self.input_index:
+                raise TypeError('Unknown input or state: %s' % name)
+            values[self.input_index[name]] = value
+            given[self.input_index[name]] = True
+        rval = []
+        for inp, value, is_given in zip(self.inputs, values, given):
+            var = getattr(inp, 'variable', inp)
+            shape = None
+            if (is_given and isinstance(var.type, TensorType) and
+                    var.ndim > 0):
+                shape = tuple(numpy.shape(value))
+                if len(shape) != var.ndim:
+                    shape = None
+            rval.append(shape)
+        return tuple(rval)
+
+    def compile(self, shapes):
+        """Return a new Function specialized to `shapes`"""
+        from theano import tensor
+        kwargs = dict(self.kwargs)
+        givens = kwargs['givens']
+        if isinstance(givens, dict):
+            givens = givens.items()
+        givens = list(givens)
+        params = []
+        for inp, shape in zip(self.inputs, shapes):
+            if shape is None:
+                params.append(inp)
+                continue
+            var = getattr(inp, 'variable', inp)
+            new_var = tensor.TensorType(
+                    var.dtype, [s == 1 for s in shape])(name=var.name)
+            value = tensor.specify_shape(new_var, shape)
+            if value.broadcastable != var.broadcastable:
+                value = tensor.patternbroadcast(value, var.broadcastable)
+            givens.append((var, value))
+            if isinstance(inp, Param):
+                inp = copy.copy(inp)
+                inp.variable = new_var
+            else:
+                inp = new_var
+            params.append(inp)
+        kwargs['givens'] = givens
+        fn = pfunc(params=params, **kwargs)
+        fn._check_for_aliased_inputs = self._check_for_aliased_inputs
+        self.compile_count += 1
+        _logger.debug('compiled version %i for shapes %s',
+                      self.compile_count, shapes)
+        return fn
+
+    def version(self, *args, **kwargs):
+        """Return the Function that computes the call with these arguments,
+        compiling it if it is not in the cache."""
+        shapes = self.shapes(args, kwargs)
+        fn = self.versions.get(shapes)
+        if fn is None:
+            fn = self.compile(shapes)
+            if len(self.lru) >= self.max_versions:
+                del self.versions[self.lru.pop(0)]
+            self.versions[shapes] = fn
+        else:
+            self.lru.remove(shapes)
+        self.lru.append(shapes)
+        return fn
+
+    def __call__(self, *args, **kwargs):
+        return self.version(*args, **kwargs)(*args, **kwargs)
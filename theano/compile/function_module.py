@@ -13,6 +13,7 @@ import warnings
 import numpy
 
 import theano
+from theano import blas
 from theano import gof
 from theano.gof.python25 import partial
 import mode as mode_module
@@ -347,6 +348,12 @@ class Function(object):
     It maps container -> SymbolicInput
     """
 
+    blas_num_threads = 0
+    """Int. Number of threads the BLAS library uses during a call, 0 to
+    leave it alone. Defaults to config.blas.num_threads when the function
+    is created. See `theano.blas`.
+    """
+
     def __init__(self, fn, input_storage, output_storage, indices, outputs, defaults, unpack_single, return_none, maker):
         """
         Initialize attributes. create finder, inv_finder.
@@ -363,6 +370,7 @@ class Function(object):
         self.return_none = return_none
         self.maker = maker
         self.profile = None # reassigned in FunctionMaker.create
+        self.blas_num_threads = theano.config.blas.num_threads
 
         # We will be popping stuff off this `containers` object.  It is a copy.
         containers = list(self.input_storage)
@@ -531,6 +539,7 @@ class Function(object):
     def __copy__(self):
         defaults = [default for _1, _2, default in self.defaults]
         cpy = self.maker.create(defaults, trustme = True)
+        cpy.blas_num_threads = self.blas_num_threads
         for (input,_1,_2), here, there in zip(self.indices, self.input_storage, cpy.input_storage):
             if input.mutable and here is not None:
                 there.data = copy.copy(here.data)
@@ -638,18 +647,32 @@ class Function(object):
                             self.inv_finder[c]))
 
         # Do the actual work
+        if profile:
+            self.fn.time_thunks = profile.sample_call()
+            if self.fn.time_thunks and profile.trace_events is not None:
+                t0_trace = gof.vm.timer()
+            else:
+                t0_trace = None
+        if self.blas_num_threads:
+            prev_blas_threads = blas.set_num_threads(self.blas_num_threads,
+                                                     restorable=True)
         t0_fn = time.time()
         try:
-            outputs = self.fn()
-        except Exception:
-            if hasattr(self.fn, 'position_of_error'):
-                # this is a new vm-provided function
-                # the C VM needs this because the exception manipulation
-                # done by raise_with_op is not implemented in C.
-                gof.vm.raise_with_op(self.fn.nodes[self.fn.position_of_error])
-            else:
-                # old-style linkers raise their own exceptions
-                raise
+            try:
+                outputs = self.fn()
+            except Exception:
+                if hasattr(self.fn, 'position_of_error'):
+                    # this is a new vm-provided function
+                    # the C VM needs this because the exception manipulation
+                    # done by raise_with_op is not implemented in C.
+                    gof.vm.raise_with_op(
+                            self.fn.nodes[self.fn.position_of_error])
+                else:
+                    # old-style linkers raise their own exceptions
+                    raise
+        finally:
+            if self.blas_num_threads and prev_blas_threads is not None:
+                blas.set_num_threads(prev_blas_threads)
 
         dt_fn = time.time() - t0_fn
         self.maker.mode.fn_time += dt_fn
@@ -702,8 +725,13 @@ class Function(object):
         if profile:
             profile.fct_callcount += 1
             profile.fct_call_time += dt_call
+            if t0_trace is not None:
+                # The event of the whole call, that contains those of the
+                # thunks.
+                profile.trace_events.append((None, t0_trace, gof.vm.timer()))
             if hasattr(self.fn, 'update_profile'):
                 self.fn.update_profile(profile)
+            profile.maybe_flush()
 
         if self.return_none:
             return None
@@ -1237,6 +1265,8 @@ class FunctionMaker(object):
         if self.profile:
             self.profile.linker_time += linker_time
             _fn.time_thunks = self.profile.flag_time_thunks
+            if self.profile.trace_events is not None:
+                _fn.trace = []
 
 
         fn = self.function_builder(_fn, _i, _o, self.indices, self.outputs,
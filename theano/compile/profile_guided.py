@@ -0,0 +1,192 @@
+"""Compile a function again using what its profiles measured.
+
+A `ProfileGuide` collects the profiles of the runs of one function and
+turns them into a compilation Mode:
+
+ - the local optimizers that never changed the graph (this needs
+   config.profile_optimizer) are excluded, so the optimization is faster
+   and gives the same graph;
+ - allow_gc is turned off when the memory profile (config.profile_memory)
+   shows that keeping the intermediate results costs little memory, so the
+   ops can reuse their output buffers from one call to the next;
+ - `tune` measures variants of the optimizer that choose between
+   alternative implementations (e.g. Gemv or Gemm, fused or not fused
+   elemwise), and the fastest one is used.
+
+The guide only contains names and numbers, so it can be pickled with
+`save` and reloaded with `ProfileGuide.load` in a later process:
+
+    guide = ProfileGuide()
+    profile = ProfileStats(atexit_print=False)
+    f = theano.function(inputs, outputs, profile=profile)
+    ... run f on real data ...
+    guide.add_profile(profile)
+    tune(inputs, outputs, values, guide=guide)
+    guide.save('f.guide')
+
+    # later
+    guide = ProfileGuide.load('f.guide')
+    f = theano.function(inputs, outputs, mode=guide.mode())
+
+A guide describes one function: its decisions are not valid for another
+graph.
+"""
+import cPickle
+import logging
+
+import theano
+from theano import gof
+from theano.compile.mode import get_mode, Mode
+from theano.compile.profiling import ProfileStats
+
+_logger = logging.getLogger('theano.compile.profile_guided')
+
+# Optimizations to exclude to get the alternative implementations that
+# `tune` measures by default. The empty variant is the default optimizer.
+default_variants = [(),
+                    ('local_gemm_to_gemv',),
+                    ('fusion',)]
+
+
+def optimizer_counts(optimizer, prof, counts=None):
+    """Count how many times each local optimizer changed the graph.
+
+    :param optimizer: an optimizer and `prof` the profile it returned, as
+        stored in ProfileStats.optimizer_profile.
+
+    :return: dict name -> count, for the local optimizers of the
+        EquilibriumOptimizers found in `optimizer`.
+    """
+    if counts is None:
+        counts = {}
+    if isinstance(optimizer, gof.SeqOptimizer):
+        sub_opts, sub_profs = prof[0], prof[5]
+        if len(sub_opts) == len(sub_profs):
+            for sub_opt, sub_prof in zip(sub_opts, sub_profs):
+                if sub_prof:
+                    optimizer_counts(sub_opt, sub_prof, counts)
+    elif isinstance(optimizer, gof.EquilibriumOptimizer):
+        for lopt, count in prof[2].items():
+            name = getattr(lopt, 'name', None)
+            if name:
+                counts[name] = counts.get(name, 0) + count
+    return counts
+
+
+class ProfileGuide(object):
+    """The decisions learned from the profiles of one function.
+
+    :param max_extra_bytes: allow_gc is turned off if that raises the peak
+        memory by at most this many bytes.
+    """
+    def __init__(self, max_extra_bytes=16 * 1024 * 1024):
+        self.max_extra_bytes = max_extra_bytes
+        # optimizer name -> number of times it changed the graph
+        self.optimizer_counts = {}
+        # None (no memory profile), True or False
+        self.allow_gc = None
+        # variant (a tuple of excluded tags) -> time per call in seconds
+        self.variant_times = {}
+
+    def add_profile(self, profile):
+        """Learn from a ProfileStats of the function"""
+        if profile.optimizer_profile:
+            optimizer_counts(profile.optimizer_profile[0],
+                             profile.optimizer_profile[1],
+                             self.optimizer_counts)
+        if profile.memory_order:
+            with_gc = profile.memory_timeline(allow_gc=True)['peak']
+            without_gc = profile.memory_timeline(allow_gc=False)['peak']
+            allow_gc = without_gc - with_gc > self.max_extra_bytes
+            # Once a profile needed the GC, keep it.
+            self.allow_gc = allow_gc or bool(self.allow_gc)
+
+    def unused_optimizers(self):
+        """Return the sorted names of the optimizers that never fired"""
+        rval = [name for name, count in self.optimizer_counts.items()
+                if count == 0]
+        rval.sort()
+        return rval
+
+    def best_variant(self):
+        """Return the fastest variant measured by `tune`, or None"""
+        if not self.variant_times:
+            return None
+        times = [(t, v) for v, t in self.variant_times.items()]
+        times.sort()
+        return times[0][1]
+
+    def mode(self, mode=None):
+        """Return `mode` (by default the configured one) with the
+        decisions of this guide applied."""
+        mode = get_mode(mode)
+        excluding = list(self.best_variant() or ())
+        # The optimizers that never fired were measured with the default
+        # variant: the others can create graphs where they fire.
+        if not excluding:
+            excluding = self.unused_optimizers()
+        if excluding:
+            mode = mode.excluding(*excluding)
+        linker = mode.linker
+        if (self.allow_gc is not None and
+                isinstance(linker, gof.vm.VM_Linker) and
+                linker.allow_gc != self.allow_gc):
+            linker = gof.vm.VM_Linker(allow_gc=self.allow_gc,
+                                      use_cloop=linker.use_cloop,
+                                      callback=linker.callback,
+                                      lazy=linker.lazy)
+            mode = Mode(linker=linker, optimizer=mode.provided_optimizer)
+        return mode
+
+    def save(self, path):
+        f = open(path, 'wb')
+        try:
+            cPickle.dump(self, f, protocol=cPickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+
+    @staticmethod
+    def load(path):
+        f = open(path, 'rb')
+        try:
+            return cPickle.load(f)
+        finally:
+            f.close()
+
+
+def tune(inputs, outputs, values, variants=None, mode=None, n_calls=10,
+         guide=None, updates=None):
+    """Measure the optimizer variants on `values` and record the times.
+
+    Each variant is a tuple of optimization tags or names to exclude. The
+    function is compiled with each of them and called `n_calls` times
+    (after a first call that is not timed).
+
+    :param guide: the ProfileGuide where the times are recorded, a new
+        one by default.
+
+    :return: the guide.
+    """
+    if variants is None:
+        variants = default_variants
+    if guide is None:
+        guide = ProfileGuide()
+    mode = get_mode(mode)
+    for variant in variants:
+        variant = tuple(variant)
+        if variant:
+            variant_mode = mode.excluding(*variant)
+        else:
+            variant_mode = mode
+        profile = ProfileStats(atexit_print=False, flag_time_thunks=False,
+                               message='variant %s' % (variant,))
+        f = theano.function(inputs, outputs, mode=variant_mode,
+                            updates=updates, profile=profile)
+        f(*values)
+        t0 = profile.vm_call_time
+        for i in xrange(n_calls):
+            f(*values)
+        guide.variant_times[variant] = (profile.vm_call_time - t0) / n_calls
+        _logger.debug('variant %s: %es per call', variant,
+                      guide.variant_times[variant])
+    return guide
@@ -1,7 +1,6 @@
 """ProfileStats object for runtime and memory profiling.
 """
 #
-# TODO: measure memory usage like ProfileMode did
 # TODO: put the optimization tips into a tips section??
 # TODO: add tip to use specify_shape (is specify_shape even in library doc?)
 # TODO: ensure field width for string fields makes columns line up
@@ -16,13 +15,16 @@ __contact__ = "theano-dev <theano-dev@googlegroups.com>"
 __docformat__ = "restructuredtext en"
 import atexit
 import copy
+import csv
+import os
 import sys
 import time
 
 import numpy
 
 import theano
-from theano.configparser import AddConfigVar, BoolParam
+from theano.configparser import (AddConfigVar, BoolParam, FloatParam,
+                                 IntParam, StrParam)
 
 import_time = time.time()
 config = theano.config
@@ -34,6 +36,26 @@ AddConfigVar('profiling.time_thunks',
              """Time individual thunks when profiling""",
         BoolParam(True))
 
+AddConfigVar('profiling.sample_every',
+             """Time the thunks of only one call in N when profiling.
+             Values above 1 make the overhead small enough to profile a
+             live service.""",
+        IntParam(1, lambda i: i >= 1))
+
+AddConfigVar('profiling.flush_file',
+             """If not empty, periodically write the node times of the
+             profiles to this file: as CSV if its name ends with .csv,
+             else as JSON.""",
+        StrParam(''))
+
+AddConfigVar('profiling.flush_every',
+             """Minimum number of seconds between two writes of
+             profiling.flush_file""",
+        FloatParam(60.0, lambda x: x >= 0))
+
+# path -> the ProfileStats written to that file
+_flush_profiles = {}
+
 
 def _atexit_print_fn():
     """Print ProfileStat objects in _atexit_print_list to _atexit_print_file
@@ -54,7 +76,7 @@ def _atexit_print_fn():
 #                   if not isinstance(ps, ScanProfileStats)]:
             for attr in ["compile_time", "fct_call_time", "fct_callcount",
                          "vm_call_time", "optimizer_time", "linker_time",
-                         "validate_time"]:
+                         "validate_time", "sampled_callcount"]:
                 setattr(cum, attr, getattr(cum, attr) + getattr(ps, attr))
 
             #merge dictonary
@@ -65,6 +87,9 @@ def _atexit_print_fn():
                     assert key not in cum_attr
                     cum_attr[key] = val
 
+            # The memory of different functions can't be added.
+            cum.memory_order = None
+
             if cum.optimizer_profile and ps.optimizer_profile:
                 merge = cum.optimizer_profile[0].merge_profile(
                     cum.optimizer_profile[1],
@@ -79,6 +104,271 @@ def _atexit_print_fn():
 atexit.register(_atexit_print_fn)
 
 
+def _atexit_flush_fn():
+    """Write the profiles one last time to their profiling.flush_file"""
+    for path, profiles in _flush_profiles.items():
+        write_report(path, profiles)
+
+
+atexit.register(_atexit_flush_fn)
+
+
+def report_rows(profile):
+    """Return the node times of `profile` as a list of dicts.
+
+    The keys are 'function' (the message of the profile), 'node' (its
+    position in the toposort), 'op', 'apply', 'c_impl', 'calls' and
+    'time' (of the sampled calls), 'time_per_call' and 'estimated_time'
+    (the time extrapolated to all the calls of the function).
+    """
+    if profile.sampled_callcount > 0:
+        scale = float(profile.fct_callcount) / profile.sampled_callcount
+    else:
+        scale = 1.0
+    position = {}
+    for node in profile.apply_time:
+        fgraph = getattr(node, 'fgraph', None)
+        if fgraph is not None and node not in position:
+            for i, n in enumerate(fgraph.toposort()):
+                position[n] = i
+    rows = []
+    for node, t in profile.apply_time.items():
+        calls = profile.apply_callcount.get(node, 0)
+        if calls:
+            per_call = t / calls
+        else:
+            per_call = 0.0
+        rows.append(dict(function=str(profile.message),
+                         node=position.get(node, -1),
+                         op=str(node.op), apply=str(node),
+                         c_impl=bool(profile.apply_cimpl.get(node, False)),
+                         calls=calls, time=t, time_per_call=per_call,
+                         estimated_time=t * scale))
+    rows.sort(key=lambda row: row['time'], reverse=True)
+    return rows
+
+
+_report_fields = ['function', 'node', 'op', 'apply', 'c_impl', 'calls',
+                  'time', 'time_per_call', 'estimated_time']
+
+
+def write_report(path, profiles):
+    """Write the node times of `profiles` to the file `path`.
+
+    The format is CSV (one row per node, see `report_rows`) if the file
+    name ends with .csv, else JSON. The file is replaced atomically, so
+    a reader never sees a partial report.
+    """
+    tmp = '%s.%i.tmp' % (path, os.getpid())
+    f = open(tmp, 'wb')
+    try:
+        if path.endswith('.csv'):
+            writer = csv.DictWriter(f, _report_fields)
+            writer.writerow(dict(zip(_report_fields, _report_fields)))
+            for profile in profiles:
+                writer.writerows(report_rows(profile))
+        else:
+            import json
+            functions = []
+            for profile in profiles:
+                functions.append(dict(
+                    function=str(profile.message),
+                    calls=profile.fct_callcount,
+                    sampled_calls=profile.sampled_callcount,
+                    call_time=profile.fct_call_time,
+                    nodes=report_rows(profile)))
+            json.dump(dict(time=time.time(), pid=os.getpid(),
+                           functions=functions), f)
+    finally:
+        f.close()
+    if sys.platform == 'win32' and os.path.exists(path):
+        # rename does not replace an existing file on Windows.
+        os.remove(path)
+    os.rename(tmp, path)
+
+
+def trace_events(profiles=None):
+    """Return the events recorded with config.profile_trace.
+
+    :param profiles: a list of ProfileStats, by default the ones printed
+        at exit (which include the profiles of the scan inner functions).
+
+    :return: a list of (start, end, name, node, profile), sorted by start
+        time, the outer event first when two start together. `node` is
+        None for a whole call to a function, and `name` is then the
+        message of its profile, else it is the name of the node's op.
+    """
+    if profiles is None:
+        profiles = _atexit_print_list
+    events = []
+    for profile in profiles:
+        for node, start, end in profile.trace_events or []:
+            if node is None:
+                name = str(profile.message or 'function')
+            else:
+                name = str(node.op)
+            events.append((start, end, name, node, profile))
+    events.sort(key=lambda e: (e[0], -e[1]))
+    return events
+
+
+def write_chrome_trace(path, profiles=None):
+    """Write the traced events to `path` in the Chrome trace event format.
+
+    Open the file with chrome://tracing: the thunks are shown inside the
+    call of their function (and the thunks of scan inner functions inside
+    their Scan node), so the gaps between them are the Python overhead.
+    """
+    events = trace_events(profiles)
+    if events:
+        t0 = events[0][0]
+    rows = []
+    pid = os.getpid()
+    for start, end, name, node, profile in events:
+        if node is None:
+            cat = 'function'
+            args = {}
+        else:
+            cat = 'thunk'
+            args = dict(apply=str(node), function=str(profile.message))
+        rows.append(dict(name=name, cat=cat, ph='X', pid=pid, tid=0,
+                         ts=(start - t0) * 1e6, dur=(end - start) * 1e6,
+                         args=args))
+    import json
+    f = open(path, 'w')
+    try:
+        json.dump(dict(traceEvents=rows, displayTimeUnit='ms'), f)
+    finally:
+        f.close()
+
+
+def folded_stacks(profiles=None):
+    """Return the self time of each stack of traced events.
+
+    An event is in the stack of the events that contain it in time: a
+    thunk is inside the call of its function, and the thunks of a scan
+    inner function are inside their Scan node.
+
+    :return: dict tuple of names -> self time in seconds, the time spent
+        in the last event of the stack and not in its children.
+    """
+    stack = []
+    rval = {}
+    for start, end, name, node, profile in trace_events(profiles):
+        while stack and stack[-1][0] <= start:
+            stack.pop()
+        if stack:
+            path = stack[-1][1] + (name,)
+            # Don't count the part outside of the parent, that is due to
+            # the clock resolution.
+            parent_end = stack[-1][0]
+            rval[stack[-1][1]] -= min(end, parent_end) - start
+        else:
+            path = (name,)
+        rval[path] = rval.get(path, 0) + end - start
+        stack.append((end, path))
+    return rval
+
+
+def write_folded_stacks(path, profiles=None):
+    """Write the traced events to `path` in the folded stack format.
+
+    Each line is a stack of names separated by ';' followed by its self
+    time in microseconds, the input of flamegraph.pl.
+    """
+    stacks = folded_stacks(profiles).items()
+    stacks.sort()
+    f = open(path, 'w')
+    try:
+        for names, t in stacks:
+            us = int(round(t * 1e6))
+            if us > 0:
+                names = [name.replace(';', ',') for name in names]
+                f.write('%s %i\n' % (';'.join(names), us))
+    finally:
+        f.close()
+
+
+def compute_memory(order, nbytes, outputs, allow_gc=True):
+    """Simulate the memory used while the nodes of `order` are executed.
+
+    :param order: the Apply nodes, in the order they were executed.
+    :param nbytes: dict variable -> size in bytes of its value.
+    :param outputs: the outputs of the function, never freed.
+    :param allow_gc: if True, an intermediate result is freed after its
+        last use, as the VM does with config.allow_gc.
+
+    An output in the view_map or destroy_map of its node does not allocate
+    memory: it shares the buffer of its input, and its size is counted as
+    saved by that node. The inputs of the function are not counted.
+
+    :return: a dict with the keys
+
+        - 'timeline': list of (node, bytes allocated by node, bytes alive
+          while node runs), in execution order.
+        - 'peak': the largest number of bytes alive, 'peak_index' the index
+          of the node in `order` where it happens.
+        - 'peak_live': the buffers alive at the peak, as a list of
+          (bytes, variable), the largest first.
+        - 'saved': dict node -> bytes not allocated thanks to view_map and
+          destroy_map.
+    """
+    # Each variable maps to the variable that owns its buffer.
+    root = {}
+
+    def get_root(var):
+        return root.get(var, var)
+
+    for node in order:
+        vmap = getattr(node.op, 'view_map', {})
+        dmap = getattr(node.op, 'destroy_map', {})
+        for idx, out in enumerate(node.outputs):
+            aliased = vmap.get(idx, []) + dmap.get(idx, [])
+            if aliased:
+                root[out] = get_root(node.inputs[aliased[0]])
+
+    # A buffer is freed after the last node that uses a variable in it.
+    last_use = {}
+    for i, node in enumerate(order):
+        for inp in node.inputs:
+            last_use[get_root(inp)] = i
+    keep = set([get_root(out) for out in outputs])
+
+    live = {}
+    timeline = []
+    saved = {}
+    peak = -1
+    peak_index = -1
+    peak_live = []
+    for i, node in enumerate(order):
+        allocated = 0
+        for out in node.outputs:
+            size = nbytes.get(out, 0)
+            if get_root(out) is out:
+                live[out] = size
+                allocated += size
+            else:
+                saved[node] = saved.get(node, 0) + size
+                # An inplace op may return a bigger view (e.g. a
+                # reshape of a broadcasted input): keep the largest.
+                r = get_root(out)
+                if r in live and size > live[r]:
+                    live[r] = size
+        current = sum(live.values())
+        timeline.append((node, allocated, current))
+        if current > peak:
+            peak = current
+            peak_index = i
+            peak_live = [(nbytes, v) for v, nbytes in live.items()]
+        if allow_gc:
+            for var in live.keys():
+                if last_use.get(var, -1) == i and var not in keep:
+                    del live[var]
+    peak_live.sort(key=lambda x: x[0], reverse=True)
+    return dict(timeline=timeline, peak=max(peak, 0), peak_index=peak_index,
+                peak_live=peak_live, saved=saved)
+
+
 class ProfileStats(object):
     """
     Object to store runtime and memory profiling information for all of
@@ -140,17 +430,59 @@ class ProfileStats(object):
     linker_time = 0.0
     # time spent linking graph (FunctionMaker.create)
 
+    sampled_callcount = 0
+    # Number of calls whose thunks were timed.
+    # This is fct_callcount when sample_every is 1.
+
+    sample_every = 1
+    # Time the thunks of one call in sample_every.
+
+    flush_file = ''
+    # If not empty, the file where the node times are written
+
+    flush_every = 60.0
+    # Minimum time in seconds between two writes of flush_file
+
+    trace_events = None
+    # list of (node, start, end) for each timed thunk and of (None, start,
+    # end) for each call, filled when config.profile_trace is True
+
     line_width = 140
 
     optimizer_profile = None
     # None or tuple (the optimizer, the profile it returned)
 
+    variable_nbytes = None
+    # variable -> largest size in bytes of its value
+    # Only filled when config.profile_memory is True.
+
+    variable_shape = None
+    # variable -> shape of its largest value
+
+    variable_nnz = None
+    # sparse variable -> number of stored elements of its largest value
+
+    memory_order = None
+    # list of the Apply nodes in the order they ran at the last call
+
+    memory_outputs = None
+    # the outputs of the function, they are never freed
+
+    memory_allow_gc = True
+    # whether the VM frees intermediate results
+
     # param is called flag_time_thunks because most other attributes with time
     # in the name are times *of* something, rather than configuration flags.
-    def __init__(self, atexit_print=True, flag_time_thunks=None, **kwargs):
+    def __init__(self, atexit_print=True, flag_time_thunks=None,
+                 sample_every=None, flush_file=None, **kwargs):
         """
         atexit_print - bool. True means that this object will be printed to
                        stderr (using .summary()) at the end of the program.
+        sample_every - int. Time the thunks of one call in that many.
+                       Defaults to config.profiling.sample_every.
+        flush_file - str. If not empty, periodically write the node times
+                     to that file (see write_report). Defaults to
+                     config.profiling.flush_file.
         **kwargs - misc initializers. These should (but need not) match the
                    names of the class vars declared in this class.
         """
@@ -159,16 +491,91 @@ class ProfileStats(object):
         self.apply_time = {}
         self.apply_cimpl = {}
         self.outputs_size = {}
+        self.variable_nbytes = {}
+        self.variable_shape = {}
+        self.variable_nnz = {}
         if flag_time_thunks is None:
             self.flag_time_thunks = config.profiling.time_thunks
         else:
             self.flag_time_thunks = flag_time_thunks
+        if sample_every is None:
+            sample_every = config.profiling.sample_every
+        self.sample_every = sample_every
+        if flush_file is None:
+            flush_file = config.profiling.flush_file
+        self.flush_file = flush_file
+        self.flush_every = config.profiling.flush_every
+        self.last_flush = time.time()
+        if config.profile_trace:
+            self.trace_events = []
         self.__dict__.update(kwargs)
+        if self.flush_file:
+            _flush_profiles.setdefault(self.flush_file, []).append(self)
         #print >> sys.stderr, "self.message", self.message
         if atexit_print:
             global _atexit_print_list
             _atexit_print_list.append(self)
 
+    def sample_call(self):
+        """Return True if the thunks of the next call must be timed"""
+        if not self.flag_time_thunks:
+            return False
+        if self.fct_callcount % self.sample_every:
+            return False
+        self.sampled_callcount += 1
+        return True
+
+    def maybe_flush(self):
+        """Write flush_file if flush_every seconds passed since the last
+        write"""
+        if self.flush_file:
+            now = time.time()
+            if now - self.last_flush >= self.flush_every:
+                self.last_flush = now
+                write_report(self.flush_file,
+                             _flush_profiles.get(self.flush_file, [self]))
+
+    def record_memory(self, order, nbytes, shapes, outputs, allow_gc,
+                      nnz=None):
+        """Store the memory information that the VM collected"""
+        self.memory_order = list(order)
+        self.memory_outputs = list(outputs)
+        self.memory_allow_gc = allow_gc
+        if nnz is None:
+            nnz = {}
+        for var, size in nbytes.items():
+            if size >= self.variable_nbytes.get(var, -1):
+                self.variable_nbytes[var] = size
+                self.variable_shape[var] = shapes.get(var)
+                if var in nnz:
+                    self.variable_nnz[var] = nnz[var]
+
+    def node_cost(self, node):
+        """Return the (flops, bytes read, bytes written) of one execution
+        of `node`, estimated by `node.op.cost` from the shapes of the
+        largest call.
+
+        Return None if the shapes are unknown (they are recorded when
+        config.profile_memory is True).
+        """
+        if not [v for v in node.outputs if v in self.variable_shape]:
+            return None
+        input_shapes = [self.variable_shape.get(v) for v in node.inputs]
+        output_shapes = [self.variable_shape.get(v) for v in node.outputs]
+        input_nnz = [self.variable_nnz.get(v) for v in node.inputs]
+        return node.op.cost(node, input_shapes, output_shapes, input_nnz)
+
+    def memory_timeline(self, allow_gc=None):
+        """Return the result of `compute_memory` for the last call.
+
+        :param allow_gc: the GC policy to simulate, by default the one
+            used by the function.
+        """
+        if allow_gc is None:
+            allow_gc = self.memory_allow_gc
+        return compute_memory(self.memory_order, self.variable_nbytes,
+                              self.memory_outputs, allow_gc)
+
     def class_time(self):
         """dict op -> total time on thunks"""
         # timing is stored by node, we compute timing by class on demand
@@ -253,30 +660,15 @@ class ProfileStats(object):
         return rval
 
     def op_flops(self):
-        """dict op -> total number of flops"""
-        # timing is stored by node, we compute timing by Op on demand
+        """dict op -> total number of flops, for the ops whose cost is
+        known (see node_cost)"""
         rval = {}
-        return rval  # TODO: continue here
         for node, count in self.apply_callcount.items():
-            rval.setdefault(node.op, 0)
-            rval[node.op] += 1
+            cost = self.node_cost(node)
+            if cost is None or cost[0] is None:
+                continue
+            rval[node.op] = rval.get(node.op, 0) + cost[0] * count
         return rval
-        for a, t in self.op_time.items():
-            if hasattr(a, 'flops'):
-                op_flops[a] = a.flops * op_call[a] / t / 1e6
-
-        flops_msg = ''
-        if op_flops:
-            flops_msg = ' <MFlops/s>'
-            print ('\nHACK WARNING: we print the flops for some OP, but the'
-                   ' logic does not always work. You need to know the internal'
-                   ' of Theano to make it work correctly.'
-                   ' Otherwise don\'t use!')
-        print ('\nOp-wise summary:'
-               ' <%% of local_time spent on this kind of Op>'
-               ' <cumulative %%> <self seconds> <cumulative seconds>'
-               ' <time per call> %s <nb_call> <nb apply> <Op name>' % (
-                flops_msg))
 
     def summary_class(self, file=sys.stderr, N=None):
         if self.apply_time:
@@ -382,7 +774,7 @@ class ProfileStats(object):
         op_flops = self.op_flops()
         op_impl = self.op_impl()
         if N is None:
-            N = len(self.op_flops)
+            N = len(op_time)
         otimes = [(t * 100 / local_time,
                     t,
                     op,
@@ -544,6 +936,10 @@ class ProfileStats(object):
             if local_time > 0:
                 print >> file, '  Time in thunks: %es (%.3f%%)' % (
                         local_time, 100*local_time / self.fct_call_time)
+        if self.sample_every > 1:
+            print >> file, ('  Thunks timed in %i of the calls'
+                            ' (profiling.sample_every=%i)' % (
+                                self.sampled_callcount, self.sample_every))
         print >> file, '  Total compile time: %es' % self.compile_time
         print >> file, '    Theano Optimizer time: %es' % self.optimizer_time
         print >> file, '       Theano validate time: %es' % self.validate_time
@@ -555,6 +951,94 @@ class ProfileStats(object):
         # The validation time is a subset of optimizer_time
         assert self.validate_time < self.optimizer_time
 
+    def summary_memory(self, file=sys.stderr, N=None):
+        if not self.memory_order:
+            print >> file, ('ProfileStats.summary_memory: no memory'
+                            ' information (hint: try config'
+                            ' profile_memory=1)')
+            return
+        with_gc = self.memory_timeline(allow_gc=True)
+        without_gc = self.memory_timeline(allow_gc=False)
+        if self.memory_allow_gc:
+            mem = with_gc
+        else:
+            mem = without_gc
+        inputs = [v for v in self.variable_nbytes if v.owner is None]
+        input_bytes = sum([self.variable_nbytes[v] for v in inputs])
+
+        print >> file, 'Memory Profile'
+        print >> file, '--------------'
+        print >> file, '  (Sizes of the largest call, in KB)'
+        print >> file, '  Peak of intermediate results and outputs:'
+        print >> file, '    with allow_gc=True: %iKB' % (
+                with_gc['peak'] // 1024)
+        print >> file, '    with allow_gc=False: %iKB' % (
+                without_gc['peak'] // 1024)
+        print >> file, '    (the function used allow_gc=%s)' % (
+                self.memory_allow_gc)
+        print >> file, '  Inputs and constants: %iKB' % (input_bytes // 1024)
+        print >> file, ('  Not allocated thanks to view_map and'
+                        ' destroy_map: %iKB' % (
+                            sum(mem['saved'].values()) // 1024))
+        if mem['peak_index'] >= 0:
+            print >> file, '  Peak reached at node %i of %i: %s' % (
+                    mem['peak_index'], len(mem['timeline']),
+                    mem['timeline'][mem['peak_index']][0])
+        print >> file, ''
+        print >> file, '  Buffers alive at the peak:'
+        print >> file, '    <size KB> <% of peak> <shape> <variable> <Apply>'
+        peak = max(mem['peak'], 1)
+        for size, var in mem['peak_live'][:N]:
+            print >> file, '    %9i %6.2f%%  %s  %s  %s' % (
+                    size // 1024, 100. * size / peak,
+                    self.variable_shape.get(var), var, var.owner)
+        if N is not None and len(mem['peak_live']) > N:
+            print >> file, '    ... (remaining %i buffers)' % (
+                    len(mem['peak_live']) - N)
+        print >> file, ''
+
+    def summary_cost(self, file=sys.stderr, N=None):
+        if not self.variable_shape or not self.apply_time:
+            print >> file, ('ProfileStats.summary_cost: no shapes or no'
+                            ' node time (hint: try config profile_memory=1'
+                            ' and profiling.time_thunks=1)')
+            return
+        rows = []
+        for node, t in self.apply_time.items():
+            nb_call = self.apply_callcount[node]
+            cost = self.node_cost(node)
+            if nb_call == 0 or cost is None:
+                continue
+            flops, read, written = cost
+            t_call = t / nb_call
+            gflops = gbytes = 0
+            if t_call > 0:
+                if flops is not None:
+                    gflops = flops / t_call / 1e9
+                gbytes = (read + written) / t_call / 1e9
+            rows.append((t, t_call, flops, gflops, gbytes, node))
+        rows.sort()
+        rows.reverse()
+
+        print >> file, 'Cost Model'
+        print >> file, '----------'
+        print >> file, ('  (flops and bytes estimated by Op.cost from the'
+                        ' shapes of the largest call)')
+        print >> file, ('  <time per call> <flops per call> <GFLOP/s>'
+                        ' <GB/s> <Apply>')
+        for t, t_call, flops, gflops, gbytes, node in rows[:N]:
+            if flops is None:
+                flops_str = '%8s  %8s' % ('?', '?')
+            else:
+                flops_str = '%.2e  %8.3f' % (flops, gflops)
+            print >> file, '     %.2es       %s %8.3f  %s' % (
+                    t_call, flops_str, gbytes,
+                    str(node)[:self.line_width - 50])
+        if N is not None and len(rows) > N:
+            print >> file, '   ... (remaining %i Apply instances)' % (
+                    len(rows) - N)
+        print >> file, ''
+
     def summary(self, file=sys.stderr, n_ops_to_print=20,
                 n_applies_to_print=20):
         self.summary_function(file)
@@ -570,6 +1054,10 @@ class ProfileStats(object):
             print "Optimizer Profile"
             print "-----------------"
             self.optimizer_profile[0].print_profile(file, self.optimizer_profile[1])
+        if self.memory_order:
+            self.summary_memory(file, n_applies_to_print)
+            if local_time > 0:
+                self.summary_cost(file, n_applies_to_print)
 
 
 if 0: # old code still to be ported from ProfileMode
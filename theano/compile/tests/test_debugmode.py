@@ -220,6 +220,53 @@ def test_badthunkoutput():
     assert False  # an error should have been detected
 
 
+def test_badthunkoutput_workers():
+    a = theano.tensor.dvector()
+    b = theano.tensor.dvector()
+    f = theano.function([a, b], inconsistent(a, b) * 2,
+            mode=debugmode.DebugMode(check_c_code=True, n_workers=2))
+    try:
+        f([1.0, 2.0, 3.0], [2, 3, 4])
+    except debugmode.BadThunkOutput, e:
+        assert e.r.owner.op is inconsistent
+    else:
+        assert False  # an error should have been detected
+    # The workers stopped and the function can be called again.
+    g = theano.function([a, b], off_by_half(a, b) * 2,
+            mode=debugmode.DebugMode(check_c_code=True, n_workers=2))
+    assert numpy.allclose(g([1.0, 2.0, 3.0], [2, 3, 4]), [7, 11, 15])
+
+
+def test_check_fraction_and_once():
+    a = theano.tensor.dvector()
+    b = theano.tensor.dvector()
+    # Without checks, the nodes are only computed, by their C code.
+    f = theano.function([a, b], inconsistent(a, b),
+            mode=debugmode.DebugMode(check_c_code=True, check_fraction=0))
+    assert numpy.allclose(f([1.0, 2.0, 3.0], [2, 3, 4]), [3.5, 5.5, 7.5])
+
+    debugmode._checked_keys.clear()
+    f = theano.function([a, b], inconsistent(a, b),
+            mode=debugmode.DebugMode(check_c_code=True, check_once=True))
+    try:
+        try:
+            f([1.0, 2.0, 3.0], [2, 3, 4])
+        except debugmode.BadThunkOutput:
+            pass
+        else:
+            assert False  # an error should have been detected
+        # The same shapes are not checked again, other shapes are.
+        f([1.0, 2.0, 3.0], [2, 3, 4])
+        try:
+            f([1.0, 2.0], [2, 3])
+        except debugmode.BadThunkOutput:
+            pass
+        else:
+            assert False  # an error should have been detected
+    finally:
+        debugmode._checked_keys.clear()
+
+
 def test_badoptimization():
     @gof.local_optimizer([theano.tensor.add])
     def insert_broken_add(node):
@@ -386,6 +386,35 @@ class T_function(unittest.TestCase):
         self.assertRaises(UnusedInputError, function, [m, mt], mt*2)
         f = function([m, mt], mt*2, on_unused_input='ignore')
 
+    def test_specialize_shapes(self):
+        x = T.matrix('x')
+        n = T.iscalar('n')
+        s = theano.shared(0)
+        f = function([x, n], x.sum() * n, updates={s: s + 1},
+                     specialize_shapes=2)
+        assert isinstance(f, theano.compile.ShapeSpecializedFunction)
+        a = N.ones((3, 4), dtype=config.floatX)
+        assert f(a, 2) == 24
+        assert f(n=3, x=a) == 36
+        assert f.compile_count == 1
+        # The scalar is not specialized.
+        version = f.versions[((3, 4), None)]
+        assert [node for node in version.maker.fgraph.toposort()
+                if isinstance(node.op, T.SpecifyShape)]
+
+        # The dimensions of length 1 are broadcastable.
+        assert f(a[:1], 1) == 4
+        version = f.versions[((1, 4), None)]
+        assert version.maker.fgraph.inputs[0].broadcastable == (True, False)
+
+        # The least recently used version is dropped, and all the versions
+        # update the same shared variable.
+        assert f(a[:2], 1) == 8
+        assert f.compile_count == 3
+        assert sorted(f.versions.keys()) == [((1, 4), None), ((2, 4), None)]
+        assert s.get_value() == 4
+        self.assertRaises(TypeError, f, a, m=1)
+
 
 class T_picklefunction(unittest.TestCase):
 
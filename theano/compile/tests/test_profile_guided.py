@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+
+import numpy
+
+import theano
+import theano.tensor as T
+from theano import config
+from theano.compile.profile_guided import ProfileGuide, tune
+from theano.compile.profiling import ProfileStats
+
+
+def _graph():
+    x = T.matrix('x')
+    w = T.matrix('w')
+    return [x, w], T.tanh(T.dot(x, w) * 2 + 1).sum()
+
+
+def _values():
+    rng = numpy.random.RandomState(1)
+    return [numpy.asarray(rng.rand(20, 10), dtype=config.floatX),
+            numpy.asarray(rng.rand(10, 5), dtype=config.floatX)]
+
+
+def test_guide_from_profile():
+    old = config.profile_optimizer, config.profile_memory
+    config.profile_optimizer = True
+    config.profile_memory = True
+    try:
+        inputs, output = _graph()
+        mode = theano.Mode(linker='cvm', optimizer='fast_run')
+        profile = ProfileStats(atexit_print=False)
+        f = theano.function(inputs, output, mode=mode, profile=profile)
+        expected = f(*_values())
+        guide = ProfileGuide()
+        guide.add_profile(profile)
+    finally:
+        config.profile_optimizer, config.profile_memory = old
+
+    unused = guide.unused_optimizers()
+    assert unused
+    assert [n for n, c in guide.optimizer_counts.items() if c > 0]
+    # The intermediate results are small.
+    assert guide.allow_gc is False
+
+    guided = guide.mode(mode)
+    assert guided.linker.allow_gc is False
+    for name in unused:
+        assert name in guided.provided_optimizer.exclude
+    g = theano.function(inputs, output, mode=guided)
+    assert numpy.allclose(g(*_values()), expected)
+    # Skipping the optimizers that never fired gives the same graph.
+    assert ([str(n.op) for n in f.maker.fgraph.toposort()] ==
+            [str(n.op) for n in g.maker.fgraph.toposort()])
+
+
+def test_tune_and_save():
+    inputs, output = _graph()
+    mode = theano.Mode(linker='cvm', optimizer='fast_run')
+    guide = tune(inputs, output, _values(), mode=mode, n_calls=2,
+                 variants=[(), ('fusion',)])
+    assert set(guide.variant_times.keys()) == set([(), ('fusion',)])
+    best = guide.best_variant()
+    for tag in best:
+        assert tag in guide.mode(mode).provided_optimizer.exclude
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'f.guide')
+        guide.save(path)
+        loaded = ProfileGuide.load(path)
+        assert loaded.variant_times == guide.variant_times
+        assert loaded.best_variant() == best
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,203 @@
+"""
+Test the memory information, sampling, reports, traces and cost model of
+ProfileStats
+"""
+import csv
+import os
+import shutil
+import StringIO
+import tempfile
+
+import numpy
+
+import theano
+import theano.tensor as T
+from theano.tensor import inplace
+from theano.tensor.blas import Dot22
+from theano import config
+from theano.compile.profiling import (ProfileStats, compute_memory,
+                                      _flush_profiles, folded_stacks,
+                                      trace_events, write_chrome_trace,
+                                      write_folded_stacks)
+
+
+def test_profile_memory():
+    old = config.profile_memory
+    config.profile_memory = True
+    try:
+        x = T.vector('x')
+        y = T.exp(x) * 2
+        z = T.dot(y, y) + T.sum(y)
+        for allow_gc in [True, False]:
+            linker = theano.gof.vm.VM_Linker(allow_gc=allow_gc,
+                                             use_cloop=False)
+            profile = ProfileStats(atexit_print=False)
+            f = theano.function([x], z, profile=profile,
+                                mode=theano.Mode(linker=linker,
+                                                 optimizer='fast_run'))
+            f(numpy.ones(1000, dtype=config.floatX))
+
+            itemsize = numpy.dtype(config.floatX).itemsize
+            x = f.maker.fgraph.inputs[0]
+            assert profile.variable_nbytes[x] == 1000 * itemsize
+            assert profile.variable_shape[x] == (1000,)
+            assert len(profile.memory_order) == len(
+                f.maker.fgraph.toposort())
+            mem = profile.memory_timeline()
+            # The vector is the largest intermediate result.
+            assert mem['peak'] >= 1000 * itemsize
+            assert mem['peak_live'][0][0] == 1000 * itemsize
+            assert mem['peak'] <= profile.memory_timeline(False)['peak']
+
+            out = StringIO.StringIO()
+            profile.summary(file=out)
+            assert 'Memory Profile' in out.getvalue()
+    finally:
+        config.profile_memory = old
+
+
+def test_compute_memory_views():
+    # The inplace exp does not allocate, and the result of the addition is
+    # freed after the first exp when GC is allowed.
+    x = T.vector('x')
+    e = T.exp(x + 1)
+    ie = inplace.exp_inplace(e)
+    s = T.sum(ie)
+    order = [e.owner.inputs[0].owner, e.owner, ie.owner, s.owner]
+    nbytes = {e.owner.inputs[0]: 80, e: 80, ie: 80, s: 8}
+    mem = compute_memory(order, nbytes, [s], allow_gc=True)
+    assert [alive for node, allocated, alive in mem['timeline']] == [
+        80, 160, 80, 88]
+    assert mem['saved'] == {ie.owner: 80}
+    assert mem['peak'] == 160 and mem['peak_index'] == 1
+    mem = compute_memory(order, nbytes, [s], allow_gc=False)
+    assert mem['peak'] == 168
+
+
+def test_sampling_and_flush():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        x = T.vector('x')
+        for ext in ['.csv', '.json']:
+            path = os.path.join(tmpdir, 'profile' + ext)
+            profile = ProfileStats(atexit_print=False, flag_time_thunks=True,
+                                   sample_every=3, flush_file=path,
+                                   flush_every=0, message='f' + ext)
+            f = theano.function([x], T.exp(x) * 2, profile=profile,
+                                mode=theano.Mode(linker='cvm',
+                                                 optimizer='fast_run'))
+            for i in range(7):
+                f(numpy.ones(10, dtype=config.floatX))
+            # The calls 0, 3 and 6 were timed.
+            assert profile.fct_callcount == 7
+            assert profile.sampled_callcount == 3
+            n_nodes = len(f.maker.fgraph.toposort())
+            assert len(profile.apply_callcount) == n_nodes
+            assert set(profile.apply_callcount.values()) == set([3])
+
+            if ext == '.csv':
+                rows = list(csv.DictReader(open(path)))
+                assert len(rows) == n_nodes
+                assert int(rows[0]['calls']) == 3
+                assert rows[0]['function'] == 'f.csv'
+            else:
+                import json
+                report = json.load(open(path))
+                [function] = report['functions']
+                assert function['calls'] == 7
+                assert function['sampled_calls'] == 3
+                for node in function['nodes']:
+                    assert abs(node['estimated_time'] -
+                               node['time'] * 7 / 3.) < 1e-8
+            del _flush_profiles[path]
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_trace():
+    old = config.profile_trace
+    config.profile_trace = True
+    tmpdir = tempfile.mkdtemp()
+    try:
+        x = T.vector('x')
+        profile = ProfileStats(atexit_print=False, flag_time_thunks=True,
+                               message='f')
+        f = theano.function([x], T.exp(x) * 2 + T.log(x), profile=profile,
+                            mode=theano.Mode(linker='cvm',
+                                             optimizer='fast_run'))
+        for i in range(2):
+            f(numpy.ones(10, dtype=config.floatX))
+        n_nodes = len(f.maker.fgraph.toposort())
+        events = trace_events([profile])
+        assert len(events) == 2 * (n_nodes + 1)
+        # The first event is the call, that contains its thunks.
+        start, end, name, node, p = events[0]
+        assert node is None and name == 'f'
+        for e in events[1:n_nodes + 1]:
+            assert start <= e[0] <= e[1] <= end
+
+        stacks = folded_stacks([profile])
+        assert ('f',) in stacks
+        assert len(stacks) <= n_nodes + 1
+        assert abs(sum(stacks.values()) -
+                   sum([e[1] - e[0] for e in events if e[3] is None])) < 1e-6
+
+        path = os.path.join(tmpdir, 'trace.json')
+        write_chrome_trace(path, [profile])
+        import json
+        rows = json.load(open(path))['traceEvents']
+        assert len(rows) == len(events)
+        assert rows[0]['ts'] == 0 and rows[0]['cat'] == 'function'
+        path = os.path.join(tmpdir, 'trace.folded')
+        write_folded_stacks(path, [profile])
+        for line in open(path):
+            assert line.startswith('f')
+            assert int(line.split()[-1]) > 0
+    finally:
+        config.profile_trace = old
+        shutil.rmtree(tmpdir)
+
+
+def test_folded_stacks_nesting():
+    # A scan inner function is traced in its own profile, inside the Scan
+    # node of the outer function.
+    class FakeNode(object):
+        def __init__(self, op):
+            self.op = op
+    outer = ProfileStats(atexit_print=False, message='f')
+    inner = ProfileStats(atexit_print=False, message='scan')
+    a, b, scan, c = [FakeNode(op) for op in ['A', 'B', 'Scan', 'C']]
+    outer.trace_events = [(None, 0, 10), (a, 1, 3), (scan, 4, 9),
+                          (b, 9, 9.5)]
+    inner.trace_events = [(c, 5, 6), (c, 7, 8.5)]
+    assert folded_stacks([outer, inner]) == {
+        ('f',): 2.5, ('f', 'A'): 2, ('f', 'Scan'): 2.5,
+        ('f', 'Scan', 'C'): 2.5, ('f', 'B'): 0.5}
+
+
+def test_cost():
+    old = config.profile_memory
+    config.profile_memory = True
+    try:
+        x = T.matrix('x')
+        y = T.matrix('y')
+        profile = ProfileStats(atexit_print=False, flag_time_thunks=True)
+        f = theano.function([x, y], T.exp(T.dot(x, y)), profile=profile,
+                            mode=theano.Mode(linker='cvm',
+                                             optimizer='fast_run'))
+        f(numpy.ones((20, 30), dtype=config.floatX),
+          numpy.ones((30, 40), dtype=config.floatX))
+        dot = [n for n in f.maker.fgraph.toposort()
+               if isinstance(n.op, Dot22)][0]
+        flops, read, written = profile.node_cost(dot)
+        itemsize = numpy.dtype(config.floatX).itemsize
+        assert flops == 2 * 20 * 30 * 40
+        assert read == (20 * 30 + 30 * 40) * itemsize
+        assert written == 20 * 40 * itemsize
+        assert profile.op_flops()[dot.op] == flops
+
+        out = StringIO.StringIO()
+        profile.summary(file=out)
+        assert 'Cost Model' in out.getvalue()
+    finally:
+        config.profile_memory = old
@@ -18,66 +18,70 @@ _logger = logging.getLogger('theano.configdefaults_late')
 
 config = TheanoConfigParser()
 
-#http://pyprocessing.berlios.de/
-#True if the environment variable (OMP_NUM_THREADS!=1 or
-#if we detect more then 1 CPU core) and g++ support OpenMP
-#Otherwise False.
-default_openmp = True
 
-#Test if the env variable is set
-var = os.getenv('OMP_NUM_THREADS', None)
-if var:
-    try:
-        int(var)
-    except ValueError:
-        raise TypeError("The environment variable OMP_NUM_THREADS"
-                        " should be a number, got '%s'." % var)
-    else:
-        default_openmp = not int(var) == 1
-else:
-    #Check the number of cores availables.
-    count = cpuCount()
-    if count == -1:
-        _logger.warning("We are not able to detect the number of CPU cores."
-                        " We disable openmp by default. To remove this"
-                        " warning, set the environment variable"
-                        " OMP_NUM_THREADS to the number of threads you"
-                        " want theano to use.")
-    default_openmp = count > 1
+def default_openmp():
+    """Return the default value of config.openmp.
+
+    True if the environment variable OMP_NUM_THREADS != 1 (or if we detect
+    more then 1 CPU core when it is not set) and g++ supports OpenMP.
 
-dummy_stdin = open(os.devnull)
+    This compiles a test file, so it is only called the first time
+    config.openmp is used, not when Theano is imported.
+    """
+    #http://pyprocessing.berlios.de/
+    #Test if the env variable is set
+    var = os.getenv('OMP_NUM_THREADS', None)
+    if var:
+        try:
+            int(var)
+        except ValueError:
+            raise TypeError("The environment variable OMP_NUM_THREADS"
+                            " should be a number, got '%s'." % var)
+        else:
+            openmp = not int(var) == 1
+    else:
+        #Check the number of cores availables.
+        count = cpuCount()
+        if count == -1:
+            _logger.warning("We are not able to detect the number of CPU"
+                            " cores. We disable openmp by default. To"
+                            " remove this warning, set the environment"
+                            " variable OMP_NUM_THREADS to the number of"
+                            " threads you want theano to use.")
+        openmp = count > 1
 
-if default_openmp and theano.configdefaults.gxx_avail:
-    #check if g++ support openmp. We need to compile a file as the EPD
-    #version have openmp enabled in the specs file but do not include
-    #the OpenMP files.
-    try:
-        code = """
-        #include <omp.h>
+    if openmp and theano.configdefaults.gxx_avail:
+        #check if g++ support openmp. We need to compile a file as the EPD
+        #version have openmp enabled in the specs file but do not include
+        #the OpenMP files.
+        dummy_stdin = open(os.devnull)
+        try:
+            code = """
+            #include <omp.h>
 int main( int argc, const char* argv[] )
 {
-        int res[10];
+            int res[10];
 
-        for(int i=0; i < 10; i++){
-            res[i] = i;
-        }
+            for(int i=0; i < 10; i++){
+                res[i] = i;
+            }
 }
-        """
-        p = os.path.join(config.compiledir, 'test_omp.c')
-        f = open(p, 'w')
-        f.write(code)
-        f.close()
-        p = subprocess.Popen(['g++', '-fopenmp', p], stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE,
-                         stdin=dummy_stdin.fileno())
-        p.wait()
-        if p.returncode != 0:
-            default_openmp = False
-    except OSError, e:
-        default_openmp = False
-
-
-del dummy_stdin
+            """
+            p = os.path.join(config.compiledir, 'test_omp.c')
+            f = open(p, 'w')
+            f.write(code)
+            f.close()
+            p = subprocess.Popen(['g++', '-fopenmp', p],
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE,
+                                 stdin=dummy_stdin.fileno())
+            p.wait()
+            if p.returncode != 0:
+                openmp = False
+        except OSError:
+            openmp = False
+        dummy_stdin.close()
+    return openmp
 
 
 AddConfigVar('openmp',
@@ -126,7 +126,7 @@ def _config_print(thing, buf):
     for cv in _config_var_list:
         print >> buf, cv
         print >> buf, "    Doc: ", cv.doc
-        print >> buf, "    Value: ", cv.val
+        print >> buf, "    Value: ", cv.__get__()
         print >> buf, ""
 
 
@@ -141,7 +141,8 @@ def get_config_md5():
     all_opts = sorted([c for c in _config_var_list if c.in_c_key],
                       key=lambda cv: cv.fullname)
     return theano.gof.cc.hash_from_code('\n'.join(
-                    ['%s = %s' % (cv.fullname, cv.val) for cv in all_opts]))
+                    ['%s = %s' % (cv.fullname, cv.__get__())
+                     for cv in all_opts]))
 
 
 class TheanoConfigParser(object):
@@ -227,7 +228,16 @@ def AddConfigVar(name, doc, configparam, root=config, in_c_key=True):
         configparam.doc = doc
         configparam.in_c_key = in_c_key
         # trigger a read of the value from config files and env vars
-        configparam.__get__()
+        if callable(configparam.default):
+            # The default is computed on first access, as that can be
+            # slow, but a value set by the user is checked now.
+            try:
+                configparam.__set__(None,
+                                    fetch_val_for_key(configparam.fullname))
+            except KeyError:
+                pass
+        else:
+            configparam.__get__()
         setattr(root.__class__, sections[0], configparam)
         _config_var_list.append(configparam)
 
@@ -238,6 +248,11 @@ class ConfigParam(object):
         """
         If allow_override is False, we can't change the value after the import
         of Theano. So the value should be the same during all the execution.
+
+        If default is callable, it is called without argument the first
+        time the value is needed, and only if the user did not set it. Use
+        this for defaults that are slow to compute (e.g. that probe the
+        compiler or a library), so that importing Theano stays fast.
         """
         self.default = default
         self.filter = filter
@@ -259,6 +274,8 @@ class ConfigParam(object):
                 val_str = fetch_val_for_key(self.fullname)
             except KeyError:
                 val_str = self.default
+                if callable(val_str):
+                    val_str = val_str()
             self.__set__(None, val_str)
         #print "RVAL", self.val
         return self.val
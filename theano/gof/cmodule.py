@@ -16,8 +16,6 @@ import time
 
 import distutils.sysconfig
 
-import numpy.distutils  # TODO: TensorType should handle this
-
 import theano
 from theano.gof.utils import flatten
 from theano.configparser import config
@@ -1394,6 +1392,9 @@ def get_gcc_shared_library_arg():
 
 
 def std_include_dirs():
+    # numpy.distutils is slow to import, so it is only imported when we
+    # compile something.
+    import numpy.distutils  # TODO: TensorType should handle this
     return (numpy.distutils.misc_util.get_numpy_include_dirs()
             + [distutils.sysconfig.get_python_inc()])
 
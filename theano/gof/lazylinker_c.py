@@ -13,7 +13,7 @@ if config.compiledir not in sys.path:
     sys.path.append(config.compiledir)
 
 force_compile = False
-version = 0.18 # must match constant returned in function get_version()
+version = 0.19 # must match constant returned in function get_version()
 
 
 try:
@@ -54,8 +54,12 @@ except ImportError:
             if not os.path.exists(loc):
                 os.mkdir(loc)
             args = cmodule.GCC_compiler.compile_args()
+            libs = []
+            if sys.platform.startswith('linux'):
+                # clock_gettime is in librt before glibc 2.17.
+                libs.append('rt')
             cmodule.GCC_compiler.compile_str(dirname, code, location=loc,
-                                             preargs=args)
+                                             libs=libs, preargs=args)
             # Save version into the __init__.py file.
             init_py = os.path.join(loc, '__init__.py')
             open(init_py, 'w').write('_version = %s\n' % version)
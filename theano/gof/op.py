@@ -15,6 +15,8 @@ __docformat__ = "restructuredtext en"
 import logging
 import warnings
 
+import numpy
+
 import theano
 from theano import config
 
@@ -276,6 +278,45 @@ class CLinkerOp(CLinkerObject):
                 type(self), self.__class__.__name__)
 
 
+def shape_nbytes(variable, shape, nnz=None):
+    """Return the size in bytes of a value of `variable` of shape `shape`.
+
+    :param nnz: for a sparse value, its number of stored elements. The
+        size then counts the data and its int32 indices.
+
+    Return 0 if the shape is unknown or the type has no dtype.
+    """
+    dtype = getattr(variable.type, 'dtype', None)
+    if shape is None or dtype is None:
+        return 0
+    itemsize = numpy.dtype(dtype).itemsize
+    if nnz is not None:
+        return nnz * (itemsize + 4)
+    size = 1
+    for s in shape:
+        size *= s
+    return size * itemsize
+
+
+def default_cost_bytes(node, input_shapes, output_shapes, input_nnz=None):
+    """Return (bytes read, bytes written) by one execution of `node`.
+
+    Each input is read once and each output written once, except the
+    outputs in the view_map of the op, that are not written at all.
+    """
+    if input_nnz is None:
+        input_nnz = [None] * len(node.inputs)
+    read = 0
+    for var, shape, nnz in zip(node.inputs, input_shapes, input_nnz):
+        read += shape_nbytes(var, shape, nnz)
+    written = 0
+    view_map = getattr(node.op, 'view_map', {})
+    for i, (var, shape) in enumerate(zip(node.outputs, output_shapes)):
+        if i not in view_map:
+            written += shape_nbytes(var, shape)
+    return read, written
+
+
 class PureOp(object):
     """
     An :term:`Op` is a type of operation.
@@ -519,6 +560,29 @@ class PureOp(object):
         """
         return True
 
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        """
+        Optional: estimate the work of one execution of `node`.
+
+        :Parameters:
+         `input_shapes` : list
+            the shapes of the inputs of `node` (None when unknown)
+         `output_shapes` : list
+            the shapes of its outputs
+         `input_nnz` : None or list
+            for each sparse input, its number of stored elements
+
+        :Returns: a tuple (flops, bytes read, bytes written). The
+        profiler divides them by the time of the node to report the
+        achieved GFLOP/s and GB/s.
+
+        The default does not know the number of floating point operations
+        (None) and reads each input and writes each output once (see
+        `default_cost_bytes`).
+        """
+        return (None,) + default_cost_bytes(node, input_shapes,
+                                            output_shapes, input_nnz)
+
 
 class Op(utils.object2, PureOp, CLinkerOp):
     """Convenience class to bundle `PureOp` and `CLinkerOp`"""
@@ -6,8 +6,9 @@ VM was a better name at some point
 import link
 import logging
 import sys
-import time
 import warnings
+# The most precise clock of the platform, to time the thunks.
+from timeit import default_timer as timer
 
 from theano.gof.python25 import all
 
@@ -24,6 +25,15 @@ AddConfigVar('profile',
 AddConfigVar('profile_optimizer',
         "If VM should collect optimizer profile information",
         BoolParam(False))
+AddConfigVar('profile_memory',
+        "If VM should collect the size of each intermediate result, so that "
+        "the profile reports the peak memory. This uses the Stack VM.",
+        BoolParam(False))
+AddConfigVar('profile_trace',
+        "If VM should record the start and end of each timed thunk, to "
+        "export a trace of the profiled calls. This uses the Python VMs "
+        "instead of the CVM.",
+        BoolParam(False))
 
 
 def filter_vm_lazy(val):
@@ -47,6 +57,24 @@ AddConfigVar('vm.lazy',
 raise_with_op = link.raise_with_op
 
 
+def value_nbytes(value):
+    """Return the memory used by the data of `value`, in bytes.
+
+    This handles numpy arrays and CudaNdarray, scipy sparse matrices and
+    numpy scalars, and returns 0 for other objects.
+    """
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if hasattr(value, 'indptr'):
+        # scipy CSR and CSC matrices
+        return (value_nbytes(value.data) + value_nbytes(value.indices) +
+                value_nbytes(value.indptr))
+    if hasattr(value, 'size') and hasattr(value, 'dtype'):
+        # CudaNdarray has no itemsize, it is always float32.
+        return int(value.size) * 4
+    return 0
+
+
 class VM(object):
     """
     A VM object's __call__ method evaluates a Theano program.
@@ -70,6 +98,9 @@ class VM(object):
         the amount of runtime spent on thunks[i] in the course of
         computations performed by call_with_timers().
 
+    trace - None or list. If a list, the Python VMs append to it a tuple
+        (node, start, end) for each thunk they time.
+
     need_update_inputs - bool. True indicates that Function.__call__
         must implement the feedback from output storage to input
         storage. False means it *must not* repeat that feedback.
@@ -94,6 +125,7 @@ class VM(object):
         self.call_counts = [0] * len(nodes)
         self.call_times = [0] * len(nodes)
         self.time_thunks = False
+        self.trace = None
 
         # This variable (self.need_update_inputs) is overshadowed by
         # CLazyLinker in CVM which has an attribute of the same name that
@@ -131,6 +163,12 @@ class VM(object):
 
             profile.apply_cimpl[node] = hasattr(thunk, 'cthunk')
 
+        # The CVM does not have a trace.
+        trace = getattr(self, 'trace', None)
+        if trace and profile.trace_events is not None:
+            profile.trace_events.extend(trace)
+            del trace[:]
+
         # clear the timer info out of the buffers
         for i in xrange(len(self.call_times)):
             self.call_times[i] = 0.0
@@ -149,11 +187,13 @@ class Loop(VM):
             try:
                 for i, (thunk, node) in enumerate(zip(self.thunks,
                                                       self.nodes)):
-                    t0 = time.time()
+                    t0 = timer()
                     thunk()
-                    t1 = time.time()
+                    t1 = timer()
                     self.call_counts[i] += 1
                     self.call_times[i] += t1 - t0
+                    if self.trace is not None:
+                        self.trace.append((node, t0, t1))
             except:
                 raise_with_op(node)
         else:
@@ -186,11 +226,13 @@ class LoopGC(VM):
                 for thunk, node, old_storage in zip(self.thunks,
                                                     self.nodes,
                                                     self.post_thunk_clear):
-                    t0 = time.time()
+                    t0 = timer()
                     thunk()
-                    t1 = time.time()
+                    t1 = timer()
                     self.call_counts[i] += 1
                     self.call_times[i] += t1 - t0
+                    if self.trace is not None:
+                        self.trace.append((node, t0, t1))
                     for old_s in old_storage:
                         old_s[0] = None
                     i += 1
@@ -250,6 +292,14 @@ class Stack(VM):
         self.compute_map = compute_map
         self.node_idx = node_idx = {}
         self.callback = callback
+        # Filled when config.profile_memory is True: the nodes in the order
+        # they ran during the last call, and the largest size and the shape
+        # (and number of stored elements, if sparse) of the value of each
+        # variable.
+        self.executed = []
+        self.variable_nbytes = {}
+        self.variable_shape = {}
+        self.variable_nnz = {}
 
         ords = fgraph.orderings()
 
@@ -292,14 +342,19 @@ class Stack(VM):
         Calls self.callback if it is defined.
         """
         idx = self.node_idx[node]
-        t0 = time.time()
+        t0 = timer()
         rval = self.thunks[idx]()
 
         # Some thunks on some computers run faster than the granularity
-        # of the time.time clock.
+        # of the clock.
         # Profile output looks buggy if a node has run but takes 0 time.
         # (and profile code might hide real bugs if it rounds up 0)
-        dt = max(time.time() - t0, 1e-10)
+        dt = max(timer() - t0, 1e-10)
+        if self.time_thunks:
+            self.call_counts[idx] += 1
+            self.call_times[idx] += dt
+            if self.trace is not None:
+                self.trace.append((node, t0, t0 + dt))
         if self.callback is not None:
             self.callback(
                     node=node,
@@ -309,11 +364,34 @@ class Stack(VM):
                     )
         return rval, dt
 
+    def record_memory(self, variables):
+        """Record the size and shape of the current value of `variables`"""
+        for v in variables:
+            value = self.storage_map[v][0]
+            nbytes = value_nbytes(value)
+            if nbytes >= self.variable_nbytes.get(v, -1):
+                self.variable_nbytes[v] = nbytes
+                self.variable_shape[v] = getattr(value, 'shape', None)
+                if hasattr(value, 'nnz'):
+                    self.variable_nnz[v] = value.nnz
+
+    def update_profile(self, profile):
+        super(Stack, self).update_profile(profile)
+        if config.profile_memory:
+            profile.record_memory(self.executed, self.variable_nbytes,
+                                  self.variable_shape, self.outputs,
+                                  self.allow_gc, self.variable_nnz)
+
     def __call__(self):
         storage_map = self.storage_map
         compute_map = self.compute_map
         thunks = self.thunks
         dependencies = self.dependencies
+        profile_memory = config.profile_memory
+        if profile_memory:
+            self.executed = []
+            # The inputs and constants are not freed during the call.
+            self.record_memory([k for k in storage_map if k.owner is None])
         for k in self.storage_map:
             compute_map[k][0] = (k.owner is None)
 
@@ -378,6 +456,9 @@ class Stack(VM):
                             self.outputs_size[current_apply] = size
                     except Exception:
                         raise_with_op(current_apply)
+                    if profile_memory:
+                        self.executed.append(current_apply)
+                        self.record_memory(current_apply.outputs)
                     for o in current_apply.outputs:
                         compute_map[o][0] = 1
                     if self.allow_gc:
@@ -444,6 +525,9 @@ class Stack(VM):
                         if current_apply.inputs[r].owner:
                             apply_stack.append(current_apply.inputs[r].owner)
                 else:
+                    if profile_memory:
+                        self.executed.append(current_apply)
+                        self.record_memory(current_apply.outputs)
                     if config.profile:
                         size = []
                         for (idx, o) in enumerate(thunks[
@@ -620,9 +704,15 @@ class VM_Linker(link.LocalLinker):
 
         pre_call_clear = [storage_map[v] for v in self.no_recycling]
 
-        if self.callback is not None:
-            if self.use_cloop:
+        if self.use_cloop and config.profile_trace:
+            logger.warn('CLoop does not support tracing, using the Python'
+                        ' VM.')
+        if self.callback is not None or config.profile_memory:
+            if self.use_cloop and self.callback is not None:
                 logger.warn('CLoop does not support callback, using Stack VM.')
+            elif self.use_cloop:
+                logger.warn('CLoop does not support memory profiling, using'
+                            ' Stack VM.')
             deps = None
             if self.allow_gc:
                 deps = self.compute_gc_dependencies(storage_map)
@@ -632,7 +722,7 @@ class VM_Linker(link.LocalLinker):
                     self.fgraph, self.allow_gc,
                     dependencies=deps,
                     callback=self.callback)
-        elif self.use_cloop:
+        elif self.use_cloop and not config.profile_trace:
             # create a map from nodes to ints and vars to ints
             nodes_idx = {}
             vars_idx = {}
@@ -56,7 +56,60 @@ def format_as(use_list, use_tuple, outputs):
         return outputs
 
 
-def grad_sources_inputs(sources, graph_inputs, warn_type=True):
+class _GradCache(dict):
+    """Gradients already built for one Apply node or Variable, `owner`.
+
+    It is stored in the tag of the node or variable, so it lives as long
+    as the graph, and it is not pickled or copied with it. The clones of
+    a node share a shallow copy of its tag, so the cache is only used
+    when it belongs to the node itself.
+    """
+    def __init__(self, owner=None):
+        dict.__init__(self)
+        self.owner = owner
+
+    def __reduce__(self):
+        return (_GradCache, ())
+
+    def __copy__(self):
+        return _GradCache()
+
+    def __repr__(self):
+        return '<%i cached gradients>' % len(self)
+
+
+def _memoized(obj, name, key, compute):
+    """Return compute(), cached in `obj.tag.<name>` under `key`.
+
+    The result is only cached when `key` is a tuple of Variables (and
+    None): the same symbolic gradients then give the same result.
+    """
+    for k in key:
+        if k is not None and not isinstance(k, Variable):
+            return compute()
+    cache = getattr(obj.tag, name, None)
+    if cache is None or cache.owner is not obj:
+        cache = _GradCache(obj)
+        setattr(obj.tag, name, cache)
+    if key not in cache:
+        cache[key] = compute()
+    return cache[key]
+
+
+def _sum_grads(r, terms):
+    """Return the sum of the gradients `terms` of variable `r`"""
+    if len(terms) == 1:
+        return terms[0]
+
+    def compute():
+        total = terms[0]
+        for term in terms[1:]:
+            total = total + term
+        return total
+    return _memoized(r, 'grad_sums', tuple(terms), compute)
+
+
+def grad_sources_inputs(sources, graph_inputs, warn_type=True, wrt=None):
     """
     A gradient source is a pair (``v``, ``g_v``), in which ``v`` is
     a `Variable`, and ``g_v`` is a `Variable` that is a gradient wrt
@@ -100,6 +153,9 @@ def grad_sources_inputs(sources, graph_inputs, warn_type=True):
     :param warn_type: True will trigger warnings via the logging module when
        the gradient on an expression has a different type than the original
        expression
+    :type wrt: None or list of Variable
+    :param wrt: if given, only the gradients needed to compute the
+        gradients of these variables are built.
 
     :rtype: dictionary whose keys and values are of type Variable
     :return: mapping from each Variable encountered in the backward
@@ -109,25 +165,44 @@ def grad_sources_inputs(sources, graph_inputs, warn_type=True):
     sources, so that for each v, gradient-on-v is the gradient of J with
     respect to v
 
+    The result of each ``op.grad(...)`` call is cached in the tag of the
+    node, keyed by its inputs and output gradients, so that computing again
+    the gradient of the same cost (for instance wrt other variables) reuses
+    the gradient graph built the first time.
     """
-    gmap = {}
+    # variable -> list of the gradients it receives, summed when needed
+    terms = {}
     for (r, g_r) in sources:
         if not hasattr(r, 'type'):
             raise TypeError('sources must be Variables', r)
         if g_r is not None:
-            if r in gmap:
-                gmap[r] = gmap[r] + g_r
-            else:
-                gmap[r] = g_r
+            terms.setdefault(r, []).append(g_r)
 
     graph_outputs = gof.utils.uniq([r for r, g in sources])
 
     if graph_inputs is None:
         graph_inputs = gof.graph.inputs(graph_outputs)
 
-    for node in gof.graph.io_toposort(graph_inputs,
-                                      graph_outputs).__reversed__():
-        g_outputs = [gmap.get(o, None) for o in node.outputs]
+    order = gof.graph.io_toposort(graph_inputs, graph_outputs)
+    if wrt is not None:
+        # The other nodes do not propagate any gradient to `wrt`.
+        depends = set(wrt)
+        needed = []
+        for node in order:
+            for i in node.inputs:
+                if i in depends:
+                    depends.update(node.outputs)
+                    needed.append(node)
+                    break
+        order = needed
+
+    for node in order.__reversed__():
+        g_outputs = []
+        for o in node.outputs:
+            if o in terms:
+                g_outputs.append(_sum_grads(o, terms[o]))
+            else:
+                g_outputs.append(None)
 
         #if all output gradients are None, continue
         if all(map(lambda x: x is None, g_outputs)): continue
@@ -161,16 +236,18 @@ def grad_sources_inputs(sources, graph_inputs, warn_type=True):
         #  Other possibilities:
         #    * return a partial back-prop
         #
-        op_grad = node.op.grad(input_arg, output_arg)
-        if not isinstance(op_grad, (list, tuple)):
-            raise ValueError(_msg_retType, node.op)
-        g_inputs = op_grad
-        assert isinstance(g_inputs, (list, tuple))
-        if len(g_inputs) != len(node.inputs):
-            raise ValueError(_msg_badlen,
-                    node.op,
-                    len(g_inputs),
-                    len(node.inputs))
+        def compute():
+            op_grad = node.op.grad(input_arg, output_arg)
+            if not isinstance(op_grad, (list, tuple)):
+                raise ValueError(_msg_retType, node.op)
+            if len(op_grad) != len(node.inputs):
+                raise ValueError(_msg_badlen,
+                        node.op,
+                        len(op_grad),
+                        len(node.inputs))
+            return op_grad
+        g_inputs = _memoized(node, 'grad_cache',
+                             tuple(node.inputs) + tuple(output_arg), compute)
         for ii, (r, g_r) in enumerate(zip(node.inputs, g_inputs)):
             if warn_type:
                 if g_r and (getattr(r, 'type', 0) != getattr(g_r, 'type', 1)):
@@ -181,10 +258,11 @@ def grad_sources_inputs(sources, graph_inputs, warn_type=True):
                             node.op, g_r_type, ii, r_type)
             if g_r is not None:
                 assert r is not None
-                if r in gmap:
-                    gmap[r] = gmap[r] + g_r
-                else:
-                    gmap[r] = g_r
+                terms.setdefault(r, []).append(g_r)
+
+    gmap = {}
+    for r, r_terms in terms.iteritems():
+        gmap[r] = _sum_grads(r, r_terms)
     return gmap
 
 
@@ -315,7 +393,14 @@ def Rop(f, wrt, eval_points):
                 else:
                     same_type_eval_points.append(y)
 
-            seen_nodes[node] = op.R_op(node.inputs, same_type_eval_points)
+            try:
+                seen_nodes[node] = op.R_op(node.inputs,
+                                           same_type_eval_points)
+            except NotImplementedError:
+                if not hasattr(op, 'grad'):
+                    raise
+                seen_nodes[node] = _R_op_from_grad(node,
+                                                   same_type_eval_points)
             return None
 
     # Populate the dictionary
@@ -335,6 +420,32 @@ def Rop(f, wrt, eval_points):
     return format_as(using_list, using_tuple, rval)
 
 
+def _R_op_from_grad(node, eval_points):
+    """Return the R_op of `node`, computed from the grad of its op.
+
+    This is used for the ops that do not implement R_op. ``op.grad``
+    returns J^T u for an output gradient u: it is linear in u, so its L
+    operator wrt u at the eval points is J v, whatever the value of u.
+    """
+    rval = []
+    for idx, out in enumerate(node.outputs):
+        if not hasattr(out, 'zeros_like'):
+            rval.append(None)
+            continue
+        # The value of u does not matter.
+        g_outputs = [o.zeros_like() for o in node.outputs]
+        u = g_outputs[idx]
+        g_inputs = node.op.grad(node.inputs, g_outputs)
+        sources = [(g, v) for g, v in zip(g_inputs, eval_points)
+                   if g is not None and v is not None]
+        if not sources:
+            rval.append(None)
+            continue
+        gmap = grad_sources_inputs(sources, None, warn_type=False, wrt=[u])
+        rval.append(gmap.get(u))
+    return rval
+
+
 def Lop(f, wrt, eval_points, consider_constant=None, warn_type=False,
          disconnected_inputs='raise'):
     """
@@ -371,11 +482,16 @@ def Lop(f, wrt, eval_points, consider_constant=None, warn_type=False,
     if not isinstance(f, (list, tuple)):
         f = [f]
 
+    if not isinstance(wrt, (list, tuple)):
+        wrt_list = [wrt]
+    else:
+        wrt_list = wrt
     inputs = gof.graph.inputs(f)
     gmap = grad_sources_inputs(
         zip(f, eval_points),
         list(inputs) + list(consider_constant),
-        warn_type=warn_type)
+        warn_type=warn_type,
+        wrt=wrt_list)
 
     # Note : If p is not in gmap there can be several reasons, among which
     # is the fact that p might not be part of the computational graph. A
@@ -477,12 +593,19 @@ def grad(cost, wrt, g_cost=None, consider_constant=None, warn_type=False,
 
     if g_cost is None:
         from theano import tensor
-        g_cost = tensor.ones_like(cost)
+        # The same variable each time, so that the gradients are reused.
+        g_cost = _memoized(cost, 'grad_ones', (),
+                           lambda: tensor.ones_like(cost))
+    if not isinstance(wrt, (list, tuple)):
+        wrt_list = [wrt]
+    else:
+        wrt_list = wrt
     inputs = gof.graph.inputs([cost])
     gmap = grad_sources_inputs(
         [(cost, g_cost)],
         list(inputs) + list(consider_constant),
-        warn_type=warn_type)
+        warn_type=warn_type,
+        wrt=wrt_list)
 
     # Note : If p is not in gmap there can be several reasons, among which
     # is the fact that p might not be part of the computational graph. A
@@ -953,15 +1076,12 @@ def jacobian(expression, wrt, consider_constant=None, warn_type=False,
     def inner_function(*args):
         idx = args[0]
         expr = args[1]
-        rvals = []
-        for inp in args[2:]:
-            rval = grad(expr[idx],
-                     inp,
-                     consider_constant=consider_constant,
-                     warn_type=warn_type,
-                     disconnected_inputs=disconnected_inputs)
-            rvals.append(rval)
-        return rvals
+        # One backward pass gives the rows of all the jacobians.
+        return grad(expr[idx],
+                    list(args[2:]),
+                    consider_constant=consider_constant,
+                    warn_type=warn_type,
+                    disconnected_inputs=disconnected_inputs)
     # Computing the gradients does not affect the random seeds on any random
     # generator used n expression (because during computing gradients we are
     # just backtracking over old values. (rp Jan 2012 - if anyone has a
@@ -1041,3 +1161,56 @@ def hessian(cost, wrt, consider_constant=None, warn_type=False,
                  "script that generated the error)")
         hessians.append(hess)
     return format_as(using_list, using_tuple, hessians)
+
+
+def hessian_vector_product(cost, wrt, vectors, consider_constant=None,
+                           method='auto', disconnected_inputs='raise'):
+    """
+    :type cost: Scalar (0-dimensional) Variable.
+    :type wrt: Variable or list of Variables.
+    :type vectors: Variable or list of Variables, of the same types as
+        `wrt`.
+
+    :param method: how the product is computed:
+        - 'forward': the R operator of the gradient (forward-over-reverse),
+          usually the cheapest.
+        - 'reverse': the gradient of the dot product of the gradient with
+          `vectors` (reverse-over-reverse).
+        - 'auto': 'forward', or 'reverse' if some op of the gradient has
+          neither R_op nor grad.
+
+    :return: symbolic expression of the product of the Hessian of `cost`
+        wrt `wrt` by `vectors`, without building the Hessian. It has the
+        same form as `wrt`: a list/tuple or Variable.
+    """
+    using_list = isinstance(wrt, list)
+    using_tuple = isinstance(wrt, tuple)
+    if isinstance(wrt, (list, tuple)):
+        wrt = list(wrt)
+    else:
+        wrt = [wrt]
+    if not isinstance(vectors, (list, tuple)):
+        vectors = [vectors]
+    if len(vectors) != len(wrt):
+        raise ValueError('hessian_vector_product needs one vector per '
+                         'variable of wrt', len(wrt), len(vectors))
+    if method not in ('auto', 'forward', 'reverse'):
+        raise ValueError("Invalid value for keyword 'method', valid "
+                         "values are 'auto', 'forward' and 'reverse'.")
+
+    grads = grad(cost, wrt, consider_constant=consider_constant,
+                 disconnected_inputs=disconnected_inputs)
+    rval = None
+    if method in ('auto', 'forward'):
+        try:
+            rval = Rop(grads, wrt, vectors)
+        except NotImplementedError:
+            if method == 'forward':
+                raise
+    if rval is None:
+        dot = (grads[0] * vectors[0]).sum()
+        for g, v in zip(grads[1:], vectors[1:]):
+            dot = dot + (g * v).sum()
+        rval = grad(dot, wrt, consider_constant=consider_constant,
+                    disconnected_inputs=disconnected_inputs)
+    return format_as(using_list, using_tuple, rval)
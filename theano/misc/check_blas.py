@@ -46,6 +46,10 @@ def execute(execute=True, verbose=True, M=2000, N=2000, K=2000,
         print '    MKL_NUM_THREADS=', os.getenv('MKL_NUM_THREADS')
         print '    OMP_NUM_THREADS=', os.getenv('OMP_NUM_THREADS')
         print '    GOTO_NUM_THREADS=', os.getenv('GOTO_NUM_THREADS')
+        print '    OPENBLAS_NUM_THREADS=', os.getenv('OPENBLAS_NUM_THREADS')
+        print
+        print 'BLAS library found at runtime:'
+        theano.blas.print_info()
         print
         print ('Numpy config: (used when the Theano flag'
                ' "blas.ldflags" is empty)')
@@ -91,6 +95,58 @@ def execute(execute=True, verbose=True, M=2000, N=2000, K=2000,
     return t1 - t0, impl
 
 
+def execute_dot22_modes(M=2000, N=2000, K=2000, iters=10, order='C',
+                        modes=('gemm', 'blocked', 'strassen'),
+                        memmap_dir=None):
+    """Time dot(a, b) with each value of the blas.dot22_mode flag.
+
+    :param modes: the values of blas.dot22_mode to compare.
+    :param memmap_dir: if not None, a and b are numpy.memmap arrays
+        stored in this directory instead of arrays in memory.
+
+    :return: a list of (mode, execution time, max abs difference with the
+        result of the first mode).
+    """
+    rng = numpy.random.RandomState(1234)
+    av = rng.uniform(size=(M, N)).astype(theano.config.floatX)
+    bv = rng.uniform(size=(N, K)).astype(theano.config.floatX)
+    if order == 'F':
+        av = numpy.asfortranarray(av)
+        bv = numpy.asfortranarray(bv)
+    if memmap_dir is not None:
+        mapped = []
+        for name, v in [('a', av), ('b', bv)]:
+            m = numpy.memmap(os.path.join(memmap_dir, 'check_blas_%s.dat'
+                                          % name),
+                             dtype=v.dtype, mode='w+', shape=v.shape,
+                             order=order)
+            m[...] = v
+            m.flush()
+            mapped.append(m)
+        av, bv = mapped
+    a = theano.shared(av, borrow=True)
+    b = theano.shared(bv, borrow=True)
+
+    rval = []
+    ref = None
+    orig_mode = theano.config.blas.dot22_mode
+    for mode in modes:
+        theano.config.blas.dot22_mode = mode
+        try:
+            f = theano.function([], T.dot(a, b))
+        finally:
+            theano.config.blas.dot22_mode = orig_mode
+        out = f()
+        t0 = time.time()
+        for i in range(iters):
+            out = f()
+        t1 = time.time()
+        if ref is None:
+            ref = numpy.array(out)
+        rval.append((mode, t1 - t0, abs(out - ref).max()))
+    return rval
+
+
 def jobman_job(state, channel):
     execute()
     return channel.COMPLETE
@@ -128,6 +184,17 @@ parser.add_option('--order', action='store', dest='order',
                   help="The numpy memory layout parameter used when creating"
                   " the numpy.ndarray objects. It accepts 'C' for C memory"
                   " order and 'F' for Fortran order (for all matrices).")
+parser.add_option('--dot22_modes', action='store', dest='dot22_modes',
+                  default=None,
+                  help="Instead of gemm, time dot(a, b) with each of these"
+                  " comma-separated values of the blas.dot22_mode flag"
+                  " (e.g. gemm,blocked,strassen). Use the"
+                  " blas.dot22_block_size and blas.strassen_min_size flags"
+                  " to change the other parameters.")
+parser.add_option('--memmap_dir', action='store', dest='memmap_dir',
+                  default=None,
+                  help="With --dot22_modes, store the inputs in numpy.memmap"
+                  " files in this directory.")
 
 
 if __name__ == "__main__":
@@ -137,6 +204,25 @@ if __name__ == "__main__":
         print options.help
         sys.exit(0)
 
+    if options.dot22_modes:
+        modes = options.dot22_modes.split(',')
+        res = execute_dot22_modes(M=options.M, N=options.N, K=options.K,
+                                  iters=options.iter, order=options.order,
+                                  modes=modes,
+                                  memmap_dir=options.memmap_dir)
+        print "We executed", options.iter,
+        print "calls to dot with a and b matrices of shapes",
+        print "(%d, %d) and (%d, %d)." % (options.M, options.N,
+                                          options.N, options.K)
+        print "block size: %d, strassen min size: %d" % (
+            theano.config.blas.dot22_block_size,
+            theano.config.blas.strassen_min_size)
+        print
+        print '%-10s %10s %14s' % ('mode', 'time (s)', 'max abs diff')
+        for mode, t, err in res:
+            print '%-10s %10.2f %14g' % (mode, t, err)
+        sys.exit(0)
+
     if not options.quiet:
         print """
         Some results that you can compare against. They were 10 executions
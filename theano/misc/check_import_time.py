@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""
+Measure how long `import theano` takes, to track regressions.
+
+Each measure is done in a new Python process, as the second import of a
+module is free. The time to start the interpreter is not counted.
+
+    python check_import_time.py              # time `import theano`
+    python check_import_time.py -p 20        # and the 20 slowest modules
+    python check_import_time.py --max-time 2 # exit with status 1 if slower
+
+It also checks that the modules Theano imports lazily (see
+theano/misc/lazy.py) are not imported by `import theano`.
+"""
+import subprocess
+import sys
+from optparse import OptionParser
+
+# Modules that `import theano` must not import, as they are slow to import
+# and only needed by some functions.
+lazy_modules = ['nose', 'scipy', 'numpy.distutils', 'theano.tests',
+                'theano.scan_module', 'theano.sparse']
+
+_time_code = """
+import time
+t0 = time.time()
+import %(module)s
+print repr(time.time() - t0)
+"""
+
+_modules_code = """
+import sys
+import %(module)s
+print repr(sorted(sys.modules.keys()))
+"""
+
+# Time each first import, by wrapping __import__. The time of a module
+# includes the modules it imports; the self time does not.
+_profile_code = """
+import __builtin__
+import sys
+import time
+
+times = {}
+stack = []
+_import = __builtin__.__import__
+
+
+def timed_import(name, *args):
+    before = set(sys.modules)
+    t0 = time.time()
+    stack.append(0.0)
+    try:
+        return _import(name, *args)
+    finally:
+        t = time.time() - t0
+        nested = stack.pop()
+        if stack:
+            stack[-1] += t
+        new = [m for m in sys.modules if m not in before and
+               sys.modules[m] is not None]
+        if new:
+            # Name the time after the module asked for, which may be a
+            # relative import, and else after its outermost new package.
+            named = [m for m in new if m == name or m.endswith('.' + name)]
+            if named:
+                new = named
+            new.sort(key=len)
+            times[new[0]] = (t, t - nested)
+
+__builtin__.__import__ = timed_import
+import %(module)s
+__builtin__.__import__ = _import
+print repr(times)
+"""
+
+
+def _run(code, module, python=None, env=None):
+    """Run `code` in a new interpreter and return what it prints, eval'ed."""
+    if python is None:
+        python = sys.executable
+    p = subprocess.Popen([python, '-c', code % dict(module=module)],
+                         stdout=subprocess.PIPE, env=env)
+    out = p.communicate()[0]
+    if p.returncode != 0:
+        raise RuntimeError('Importing %s failed (status %s)' %
+                           (module, p.returncode))
+    return eval(out.strip().split('\n')[-1])
+
+
+def import_times(module='theano', repeat=5, python=None, env=None):
+    """Return the times, in seconds, of `repeat` imports of `module`.
+
+    :param python: the interpreter to use, by default this one.
+    :param env: the environment of the processes, by default this one.
+    """
+    return [_run(_time_code, module, python, env) for i in xrange(repeat)]
+
+
+def imported_modules(module='theano', python=None, env=None):
+    """Return the names of the modules loaded by `import module`."""
+    return _run(_modules_code, module, python, env)
+
+
+def eager_lazy_modules(module='theano', python=None, env=None):
+    """Return the modules of `lazy_modules` that `import module` loads."""
+    loaded = imported_modules(module, python, env)
+    return [m for m in lazy_modules if m in loaded]
+
+
+def slowest_imports(module='theano', n=20, python=None, env=None):
+    """Return the `n` modules that take the most time to import.
+
+    :return: a list of (self time, total time, module name), the slowest
+        (by self time) first.
+    """
+    times = _run(_profile_code, module, python, env)
+    rval = [(self_t, t, name) for name, (t, self_t) in times.items()]
+    rval.sort()
+    rval.reverse()
+    return rval[:n]
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]',
+                          description=__doc__.strip().split('\n')[0])
+    parser.add_option('-m', '--module', default='theano',
+                      help='Module to import (default theano)')
+    parser.add_option('-r', '--repeat', type='int', default=5,
+                      help='Number of imports to time (default 5)')
+    parser.add_option('-p', '--profile', type='int', default=0,
+                      metavar='N', help='Print the N slowest modules')
+    parser.add_option('--max-time', type='float', default=None,
+                      help='Exit with status 1 if the fastest import takes'
+                      ' longer than this (in seconds)')
+    options, args = parser.parse_args(argv)
+
+    times = import_times(options.module, options.repeat)
+    times.sort()
+    print 'import %s: best %.3fs, median %.3fs over %d runs' % (
+        options.module, times[0], times[len(times) // 2], len(times))
+
+    status = 0
+    eager = eager_lazy_modules(options.module)
+    if eager:
+        print 'Modules that should only be imported on use:', ', '.join(eager)
+        status = 1
+
+    if options.profile:
+        print
+        print ' <self time> <total time> <module>'
+        for self_t, t, name in slowest_imports(options.module,
+                                               options.profile):
+            print '   %.4fs     %.4fs    %s' % (self_t, t, name)
+
+    if options.max_time is not None and times[0] > options.max_time:
+        print 'Slower than --max-time=%s' % options.max_time
+        status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
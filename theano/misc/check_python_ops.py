@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""
+Report the ops that still run their Python implementation.
+
+An op without C code (or whose C code does not support the node at hand)
+is executed by calling its `perform` method, which goes through the
+Python interpreter at each call. This script compiles a small zoo of
+models with the default optimizer, runs them under the profiler and
+lists the op classes that ran in Python, sorted by the time spent in
+them, so that the remaining Python hot spots are visible.
+
+`python_ops_report` can also be called on the ProfileStats of your own
+functions:
+
+    profile = theano.compile.profiling.ProfileStats(atexit_print=False)
+    f = theano.function(inputs, outputs, profile=profile)
+    ...
+    python_ops_report([profile])
+"""
+import sys
+from optparse import OptionParser
+
+import numpy
+
+import theano
+import theano.tensor as T
+from theano.compile.profiling import ProfileStats
+
+
+def python_op_times(profiles):
+    """Return the time spent in each op class, split by implementation.
+
+    :param profiles: a list of ProfileStats.
+
+    :return: a tuple (per_class, total_time) where per_class maps the op
+        class name to a dict with the keys 'time', 'py_time', 'calls',
+        'py_nodes' and 'nodes'.
+    """
+    per_class = {}
+    total_time = 0.0
+    for profile in profiles:
+        for node, calls in profile.apply_callcount.items():
+            t = profile.apply_time.get(node, 0.0)
+            total_time += t
+            d = per_class.setdefault(node.op.__class__.__name__,
+                                     dict(time=0.0, py_time=0.0, calls=0,
+                                          py_nodes=0, nodes=0))
+            d['time'] += t
+            d['calls'] += calls
+            d['nodes'] += 1
+            if not profile.apply_cimpl.get(node, False):
+                d['py_time'] += t
+                d['py_nodes'] += 1
+    return per_class, total_time
+
+
+def python_ops_report(profiles, file=sys.stdout, N=None):
+    """Print the op classes that ran in Python, the slowest first.
+
+    :param profiles: a list of ProfileStats.
+    :param N: if not None, only print that many op classes.
+
+    :return: the fraction of the total time spent in Python ops.
+    """
+    per_class, total_time = python_op_times(profiles)
+    py = [(d['py_time'], name, d) for name, d in per_class.items()
+          if d['py_nodes']]
+    py.sort()
+    py.reverse()
+    py_time = sum([t for t, name, d in py])
+    if total_time > 0:
+        fraction = py_time / total_time
+    else:
+        fraction = 0.0
+
+    print >> file, 'Ops executed in Python'
+    print >> file, '======================'
+    print >> file, ('Time in Python ops: %.3es, %.1f%% of the %.3es spent'
+                    ' in all ops' % (py_time, 100 * fraction, total_time))
+    print >> file, ''
+    print >> file, ' <% time> <time> <calls> <Py nodes/nodes> <op class>'
+    for t, name, d in py[:N]:
+        if total_time > 0:
+            pct = 100 * t / total_time
+        else:
+            pct = 0.0
+        print >> file, '  %6.2f%%  %.3es %7d %7d/%-7d %s' % (
+            pct, t, d['calls'], d['py_nodes'], d['nodes'], name)
+    if N is not None and len(py) > N:
+        print >> file, '   ... (%d other op classes)' % (len(py) - N)
+    return fraction
+
+
+def _floatX(rng, *shape):
+    return numpy.asarray(rng.uniform(-1, 1, size=shape),
+                         dtype=theano.config.floatX)
+
+
+def logistic_regression(rng):
+    x = T.matrix('x')
+    y = T.ivector('y')
+    w = theano.shared(_floatX(rng, 100, 10) * 0)
+    b = theano.shared(_floatX(rng, 10) * 0)
+    p = T.nnet.softmax(T.dot(x, w) + b)
+    cost = -T.mean(T.log(p)[T.arange(y.shape[0]), y])
+    gw, gb = T.grad(cost, [w, b])
+    updates = [(w, w - 0.1 * gw), (b, b - 0.1 * gb)]
+    values = [_floatX(rng, 64, 100),
+              rng.randint(10, size=64).astype('int32')]
+    return [x, y], [cost], updates, values
+
+
+def mlp(rng):
+    x = T.matrix('x')
+    y = T.ivector('y')
+    w1 = theano.shared(_floatX(rng, 100, 50) * 0.1)
+    w2 = theano.shared(_floatX(rng, 50, 10) * 0.1)
+    h = T.tanh(T.dot(x, w1))
+    p = T.nnet.softmax(T.dot(h, w2))
+    cost = T.mean(T.nnet.categorical_crossentropy(p, y))
+    g1, g2 = T.grad(cost, [w1, w2])
+    updates = [(w1, w1 - 0.1 * g1), (w2, w2 - 0.1 * g2)]
+    values = [_floatX(rng, 64, 100),
+              rng.randint(10, size=64).astype('int32')]
+    return [x, y], [cost], updates, values
+
+
+def convnet(rng):
+    from theano.tensor.nnet.conv import conv2d
+    from theano.tensor.signal.downsample import max_pool_2d
+    x = T.tensor4('x')
+    w = theano.shared(_floatX(rng, 4, 1, 5, 5) * 0.1)
+    h = max_pool_2d(T.tanh(conv2d(x, w)), (2, 2))
+    cost = T.sum(h ** 2)
+    gw = T.grad(cost, w)
+    return [x], [cost], [(w, w - 0.01 * gw)], [_floatX(rng, 8, 1, 28, 28)]
+
+
+def rnn(rng):
+    x = T.matrix('x')
+    w = theano.shared(_floatX(rng, 20, 20) * 0.1)
+    h, _ = theano.scan(lambda x_t, h_tm1: T.tanh(x_t + T.dot(h_tm1, w)),
+                       sequences=x, outputs_info=T.zeros_like(x[0]))
+    cost = T.sum(h[-1])
+    gw = T.grad(cost, w)
+    return [x], [cost], [(w, w - 0.01 * gw)], [_floatX(rng, 30, 20)]
+
+
+def indexing(rng):
+    x = T.matrix('x')
+    i = T.lvector('i')
+    a, b = T.split(x, [10, 30], 2, axis=1)
+    y = T.join(0, a[i], T.inc_subtensor(b[:, :10][1:], 1)[::2])
+    return [x, i], [T.sum(y ** 2)], [], [_floatX(rng, 40, 40),
+                                         rng.randint(40, size=20)]
+
+
+def extra_ops(rng):
+    from theano.tensor import extra_ops, sort
+    x = T.matrix('x')
+    i = T.lvector('i')
+    outs = [sort.sort(x), sort.argsort(x, axis=0),
+            extra_ops.diff(x, n=2), extra_ops.repeat(x, 3, axis=1),
+            extra_ops.bincount(i, minlength=50),
+            extra_ops.fill_diagonal(x, 0), extra_ops.bartlett(i.shape[0])]
+    return [x, i], outs, [], [_floatX(rng, 40, 40),
+                              rng.randint(40, size=100)]
+
+
+model_zoo = [logistic_regression, mlp, convnet, rnn, indexing, extra_ops]
+
+
+def profile_model_zoo(models=None, n_calls=10, mode=None, seed=23):
+    """Compile and run the models, and return one ProfileStats per model.
+
+    :param models: functions returning (inputs, outputs, updates, input
+        values) for a model, defaults to `model_zoo`.
+    :param n_calls: number of calls to each compiled function.
+    :param mode: the compilation mode, defaults to the configured one.
+    """
+    if models is None:
+        models = model_zoo
+    profiles = []
+    for model in models:
+        rng = numpy.random.RandomState(seed)
+        inputs, outputs, updates, values = model(rng)
+        profile = ProfileStats(atexit_print=False, flag_time_thunks=True,
+                               message=model.__name__)
+        f = theano.function(inputs, outputs, updates=updates, mode=mode,
+                            profile=profile)
+        for i in xrange(n_calls):
+            f(*values)
+        profiles.append(profile)
+    return profiles
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options] [model ...]',
+                          description=__doc__.strip().split('\n')[0])
+    parser.add_option('-n', '--calls', type='int', default=10,
+                      help='Number of calls to each function (default 10)')
+    parser.add_option('-N', '--print', type='int', default=None,
+                      dest='n_print',
+                      help='Only print that many op classes')
+    parser.add_option('--each', action='store_true', default=False,
+                      help='Also print a report for each model')
+    options, args = parser.parse_args(argv)
+
+    by_name = dict([(m.__name__, m) for m in model_zoo])
+    for name in args:
+        if name not in by_name:
+            parser.error('unknown model %s, expected one of %s' % (
+                name, ', '.join([m.__name__ for m in model_zoo])))
+    models = [by_name[name] for name in args] or None
+
+    profiles = profile_model_zoo(models, n_calls=options.calls)
+    if options.each:
+        for profile in profiles:
+            print '\n%s:' % profile.message
+            python_ops_report([profile], N=options.n_print)
+        print '\nAll models:'
+    python_ops_report(profiles, N=options.n_print)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Defer the import of modules that are slow to import and rarely needed.
+
+`import theano` should be fast, so that short-lived scripts don't spend
+most of their time importing code they won't use. The objects defined here
+stand for a module (or a function of a module) and only import it the
+first time they are used.
+
+Modules that register Ops, optimizations or shared variable constructors
+must not be made lazy: their side effects are needed before the first
+graph is built or compiled.
+"""
+import sys
+import types
+
+
+def _import(name):
+    __import__(name)
+    return sys.modules[name]
+
+
+class LazyModule(types.ModuleType):
+    """Stand-in for a module, that imports it when an attribute is used.
+
+    When the module is a submodule of a package, the stand-in is replaced
+    by the real module in the package once it is imported, as a normal
+    import would do.
+    """
+    def __init__(self, name, doc=None):
+        types.ModuleType.__init__(self, name, doc)
+        self.__dict__['_lazy_module'] = None
+
+    def _lazy_load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            module = _import(self.__name__)
+            self.__dict__['_lazy_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        if attr.startswith('__') and attr.endswith('__'):
+            # Don't import the module for attributes that introspection
+            # tools look up, like __file__ or __path__.
+            raise AttributeError(attr)
+        return getattr(self._lazy_load(), attr)
+
+    def __repr__(self):
+        if self.__dict__['_lazy_module'] is None:
+            return "<lazy module '%s' (not imported)>" % self.__name__
+        return repr(self.__dict__['_lazy_module'])
+
+
+class LazyFunction(object):
+    """Stand-in for a function of a module, that imports it when called.
+
+    :param module: the full name of the module that defines the function.
+    :param name: the name of the function in that module.
+    """
+    def __init__(self, module, name):
+        self.module = module
+        self.__name__ = name
+        self.__doc__ = ('%s.%s, imported when first used. See its own'
+                        ' documentation once imported.' % (module, name))
+        self.function = None
+
+    def _lazy_load(self):
+        if self.function is None:
+            self.function = getattr(_import(self.module), self.__name__)
+        return self.function
+
+    def __call__(self, *args, **kwargs):
+        return self._lazy_load()(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        if attr.startswith('__') and attr.endswith('__'):
+            raise AttributeError(attr)
+        return getattr(self._lazy_load(), attr)
+
+    def __repr__(self):
+        return '<lazy function %s.%s>' % (self.module, self.__name__)
@@ -0,0 +1,22 @@
+from StringIO import StringIO
+
+import theano
+from theano.misc.check_python_ops import (extra_ops, profile_model_zoo,
+                                          python_op_times, python_ops_report)
+
+
+def test_extra_ops():
+    mode = theano.Mode(linker='cvm', optimizer='fast_run')
+    profiles = profile_model_zoo([extra_ops], n_calls=2, mode=mode)
+    per_class, total_time = python_op_times(profiles)
+    assert total_time > 0
+    for name in ['SortOp', 'ArgSortOp', 'DiffOp', 'RepeatOp', 'BinCountOp',
+                 'FillDiagonal', 'Bartlett']:
+        assert per_class[name]['calls'] == 2 * per_class[name]['nodes']
+        # They all have C code now.
+        assert per_class[name]['py_nodes'] == 0, name
+
+    out = StringIO()
+    fraction = python_ops_report(profiles, file=out, N=3)
+    assert 0 <= fraction <= 1
+    assert 'Ops executed in Python' in out.getvalue()
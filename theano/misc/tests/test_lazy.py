@@ -0,0 +1,36 @@
+import sys
+
+import theano
+from theano.misc.check_import_time import eager_lazy_modules, import_times
+from theano.misc.lazy import LazyFunction, LazyModule
+
+
+def test_lazy_module():
+    # colorsys is a small module of the standard library that Theano
+    # does not use.
+    sys.modules.pop('colorsys', None)
+    m = LazyModule('colorsys')
+    assert 'colorsys' not in sys.modules
+    assert 'not imported' in repr(m)
+    assert m.rgb_to_hsv(1, 0, 0) == (0, 1, 1)
+    assert 'colorsys' in sys.modules
+    assert m.rgb_to_hsv is sys.modules['colorsys'].rgb_to_hsv
+
+    f = LazyFunction('colorsys', 'hsv_to_rgb')
+    assert f(0, 1, 1) == (1, 0, 0)
+    assert f.__name__ == 'hsv_to_rgb'
+
+
+def test_theano_lazy_attributes():
+    # These work whether or not their modules were already imported.
+    assert isinstance(theano.scan_module.scan_op.Scan, type)
+    x = theano.tensor.vector()
+    y, _ = theano.scan(lambda v: v * 2, sequences=x)
+    f = theano.function([x], y)
+    assert list(f([1, 2])) == [2, 4]
+
+
+def test_import_is_lazy():
+    assert eager_lazy_modules('theano') == []
+    times = import_times('theano', repeat=1)
+    assert len(times) == 1 and times[0] > 0
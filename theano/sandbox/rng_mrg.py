@@ -24,24 +24,39 @@ if cuda_available:
                                      float32_shared_constructor)
 
 
-def mulmod(a, b, c, m):
-    r = numpy.int32((numpy.int64(a)*b + c) % m)
-    if r >= 0:
-        return r
-    else:
-        return r+m
-
 def matVecModM(A, s, m):
     # return (A * s) % m
-    err_orig = numpy.seterr(over='ignore')
-    try:
-        x = numpy.zeros_like(s)
-        for i in xrange(len(x)):
-            for j in xrange(len(s)):
-                x[i] = mulmod(A[i][j], s[j], x[i], m)
-        return x
-    finally:
-        numpy.seterr(**err_orig)
+    # Python integers don't overflow, and are much faster than numpy
+    # scalars.
+    m = int(m)
+    return [sum([int(A[i][j]) * int(s[j]) for j in xrange(3)]) % m
+            for i in xrange(3)]
+
+def matMatModM(A, B, m):
+    # return (A * B) % m
+    m = int(m)
+    return [[sum([int(A[i][k]) * int(B[k][j]) for k in xrange(3)]) % m
+             for j in xrange(3)] for i in xrange(3)]
+
+def matPowModM(A, e, m):
+    # return (A ** e) % m, by repeated squaring
+    r = [[1, 0, 0], [0, 1, 0], [0, 0, 1]]
+    while e:
+        if e & 1:
+            r = matMatModM(r, A, m)
+        A = matMatModM(A, A, m)
+        e >>= 1
+    return r
+
+def matVecModM_rows(A, V, m):
+    # return (A * v) % m for each row v of the int64 matrix V. Each
+    # product of an element of A by one of V is below 2**62.
+    m = numpy.int64(m)
+    r = numpy.zeros_like(V)
+    for i in xrange(3):
+        for j in xrange(3):
+            r[:, i] = (r[:, i] + V[:, j] * numpy.int64(A[i][j]) % m) % m
+    return r
 
 def multMatVect(v, A, m1, B, m2):
     #multiply the first half of v by A with a modulo of m1
@@ -141,6 +156,176 @@ def mrg_next_value(rstate, new_rstate):
     finally:
         numpy.seterr(**err_orig)
 
+
+# The MRG31k3p step in C, shared by the CPU ops below.
+mrg_c_support_code = """
+// Advance the MRG31k3p stream whose state is s[0..5] by one step, and
+// return the new value, in [1, M1]. Multiplied by 1 / (M1 + 1), this is
+// a uniform sample in ]0, 1[.
+static inline npy_int32 mrg_next_int(npy_int32 * s)
+{
+    const npy_int32 i7 = 7;
+    const npy_int32 i9 = 9;
+    const npy_int32 i15 = 15;
+    const npy_int32 i16 = 16;
+    const npy_int32 i22 = 22;
+    const npy_int32 i24 = 24;
+
+    const npy_int32 M1 = 2147483647;      //2^31 - 1
+    const npy_int32 M2 = 2147462579;      //2^31 - 21069
+    const npy_int32 MASK12 = 511;       //2^9 - 1
+    const npy_int32 MASK13 = 16777215;  //2^24 - 1
+    const npy_int32 MASK2 = 65535;      //2^16 - 1
+    const npy_int32 MULT2 = 21069;
+
+    npy_int32 y1, y2;
+    npy_int32 x11 = s[0], x12 = s[1], x13 = s[2];
+    npy_int32 x21 = s[3], x22 = s[4], x23 = s[5];
+
+    y1 = ((x12 & MASK12) << i22) + (x12 >> i9) + ((x13 & MASK13) << i7) + (x13 >> i24);
+    if ((y1 < 0 || y1 >= M1))     //must also check overflow
+        y1 -= M1;
+    y1 += x13;
+    if ((y1 < 0 || y1 >= M1))
+        y1 -= M1;
+    x13 = x12;
+    x12 = x11;
+    x11 = y1;
+
+    y1 = ((x21 & MASK2) << i15) + (MULT2 * (x21 >> i16));
+    if (y1 < 0 || y1 >= M2)
+        y1 -= M2;
+    y2 = ((x23 & MASK2) << i15) + (MULT2 * (x23 >> i16));
+    if (y2 < 0 || y2 >= M2)
+        y2 -= M2;
+    y2 += x23;
+    if (y2 < 0 || y2 >= M2)
+        y2 -= M2;
+    y2 += y1;
+    if (y2 < 0 || y2 >= M2)
+        y2 -= M2;
+
+    x23 = x22;
+    x22 = x21;
+    x21 = y2;
+
+    s[0] = x11;
+    s[1] = x12;
+    s[2] = x13;
+    s[3] = x21;
+    s[4] = x22;
+    s[5] = x23;
+
+    if (x11 <= x21)
+        return x11 - x21 + M1;
+    else
+        return x11 - x21;
+}
+"""
+mrg_c_version = 1
+
+
+def mrg_c_norm(dtype):
+    """Return the C type of `dtype` and the constant turning the result of
+    mrg_next_int into a uniform sample of that type."""
+    if dtype == 'float32':
+        # this was determined by finding the biggest number such that
+        # numpy.float32(number * M1) < 1.0
+        return 'float', '4.6566126e-10f' #numpy.float32(1.0/(2**31+65))
+    else:
+        return 'double', '4.656612873077392578125e-10'
+
+
+def mrg_c_size_code(size, o_sample, ndim, o_type_num, op_name, fail):
+    """C code checking the `size` input, and allocating `o_sample` of that
+    shape. It declares `odims` and `n_elements`."""
+    return """
+        npy_intp odims[%(ndim)s];
+        int n_elements = 1;
+        int must_alloc_sample = ((NULL == %(o_sample)s)
+                                 || (%(o_sample)s->nd != %(ndim)s)
+                                 || !(PyArray_ISCONTIGUOUS(%(o_sample)s)));
+        if (%(size)s->nd != 1)
+        {
+            PyErr_SetString(PyExc_ValueError, "size must be vector");
+            %(fail)s
+        }
+        if (%(size)s->dimensions[0] != %(ndim)s)
+        {
+            PyErr_Format(PyExc_ValueError, "size must have length %%i (not %%i)",
+                %(ndim)s, int(%(size)s->dimensions[0]));
+            %(fail)s
+        }
+        if (%(size)s->descr->type_num != PyArray_INT32)
+        {
+            PyErr_SetString(PyExc_ValueError, "size must be int32");
+            %(fail)s
+        }
+        for (int i = 0; i < %(ndim)s; ++i)
+        {
+            odims[i] = ((npy_int32*)(%(size)s->data + %(size)s->strides[0] * i))[0];
+            n_elements *= odims[i];
+            must_alloc_sample = must_alloc_sample || (%(o_sample)s->dimensions[i] != odims[i]);
+        }
+        if (must_alloc_sample)
+        {
+            Py_XDECREF(%(o_sample)s);
+            %(o_sample)s = (PyArrayObject*)PyArray_SimpleNew(%(ndim)s, odims, %(o_type_num)s);
+            if(!%(o_sample)s) {
+                PyErr_SetString(PyExc_MemoryError, "failed to alloc %(op_name)s output");
+                %(fail)s
+            }
+        }
+    """ % locals()
+
+
+def mrg_c_rstate_code(rstate, o_rstate, inplace, fail):
+    """C code checking the `rstate` input and copying it to `o_rstate`,
+    unless `inplace`. It declares `n_streams` and `state_data`."""
+    if inplace:
+        o_rstate_requirement = 'NPY_C_CONTIGUOUS|NPY_ALIGNED'
+    else:
+        o_rstate_requirement = 'NPY_ENSURECOPY|NPY_C_CONTIGUOUS|NPY_ALIGNED'
+    return """
+        int n_streams = 0;
+        npy_int32 * state_data;
+        Py_XDECREF(%(o_rstate)s);
+        %(o_rstate)s = (PyArrayObject*)PyArray_FromAny(py_%(rstate)s, NULL, 0, 0, %(o_rstate_requirement)s,NULL);
+        if (!%(o_rstate)s)
+        {
+            %(fail)s
+        }
+        if (%(o_rstate)s->nd != 2)
+        {
+            PyErr_SetString(PyExc_ValueError, "rstate must be matrix");
+            %(fail)s
+        }
+        if (%(o_rstate)s->dimensions[1] != 6)
+        {
+            PyErr_Format(PyExc_ValueError, "rstate must have 6 columns");
+            %(fail)s
+        }
+        if (%(o_rstate)s->descr->type_num != PyArray_INT32)
+        {
+            PyErr_SetString(PyExc_ValueError, "rstate must be int32");
+            %(fail)s
+        }
+        n_streams = %(o_rstate)s->dimensions[0];
+        state_data = (npy_int32 *) %(o_rstate)s->data;
+    """ % locals()
+
+
+def mrg_uniform_values(rstate, n_elements):
+    """Return `n_elements` uniform float64 samples, and update the stream
+    states in `rstate` inplace. Sample i is drawn from stream
+    i % rstate.shape[0]."""
+    n_streams, _ = rstate.shape
+    rval = numpy.zeros(n_elements, dtype='float64')
+    for i in xrange(n_elements):
+        rval[i] = mrg_next_value(rstate[i % n_streams], rstate[i % n_streams])
+    return rval
+
+
 class mrg_uniform_base(Op):
     def __init__(self, output_type, inplace=False):
         Op.__init__(self)
@@ -207,177 +392,443 @@ class mrg_uniform(mrg_uniform_base):
         for s in size:
             n_elements *= s
 
-        n_streams,_ = rstate.shape
-
-        rval = numpy.zeros(n_elements, dtype=self.output_type.dtype)
-
-        for i in xrange(n_elements):
-            sample = mrg_next_value(rstate[i%n_streams], rstate[i%n_streams])
-            rval[i] = sample
+        rval = mrg_uniform_values(rstate, n_elements).astype(
+                self.output_type.dtype)
 
         o_rstate[0] = node.outputs[0].type.filter(rstate) # send to GPU if necessary
         o_sample[0] = node.outputs[1].type.filter(rval.reshape(size))# send to GPU if necessary
 
+    def c_support_code(self):
+        return mrg_c_support_code
+
     def c_code(self, node, name, inp, out, sub):
         rstate, size = inp
         o_rstate, o_sample = out
-        if self.inplace:
-            o_rstate_requirement = 'NPY_C_CONTIGUOUS|NPY_ALIGNED'
-        else:
-            o_rstate_requirement = 'NPY_ENSURECOPY|NPY_C_CONTIGUOUS|NPY_ALIGNED'
         ndim = self.output_type.ndim
         o_type_num = numpy.asarray(0, dtype=self.output_type.dtype).dtype.num
         fail = sub['fail']
-        if self.output_type.dtype == 'float32':
-            otype = 'float'
-            NORM = '4.6566126e-10f' #numpy.float32(1.0/(2**31+65))
-            # this was determined by finding the biggest number such that
-            # numpy.float32(number * M1) < 1.0
-        else:
-            otype = 'double'
-            NORM = '4.656612873077392578125e-10'
+        otype, NORM = mrg_c_norm(self.output_type.dtype)
+        size_code = mrg_c_size_code(size, o_sample, ndim, o_type_num,
+                                    'mrg_uniform', fail)
+        rstate_code = mrg_c_rstate_code(rstate, o_rstate, self.inplace, fail)
         return """
         //////// <code generated by mrg_uniform>
+        {
+        %(size_code)s
+        %(rstate_code)s
+        %(otype)s * sample_data = (%(otype)s *) %(o_sample)s->data;
+        for (int i = 0; i < n_elements; ++i)
+        {
+            npy_int32 * state_data_i = state_data + (i%%n_streams)*6;
+            sample_data[i] = mrg_next_int(state_data_i) * %(NORM)s;
+        }
+        }
+        //////// </ code generated by mrg_uniform>
+        """ % locals()
 
-        npy_intp odims[%(ndim)s];
-        int n_elements = 1;
-        int n_streams = 0;
-        int must_alloc_sample = ((NULL == %(o_sample)s)
-                                 || (%(o_sample)s->nd != %(ndim)s)
-                                 || !(PyArray_ISCONTIGUOUS(%(o_sample)s)));
-        %(otype)s * sample_data;
-        npy_int32 * state_data;
+    def c_code_cache_version(self):
+        return (3, mrg_c_version)
 
-        const npy_int32 i0 = 0;
-        const npy_int32 i7 = 7;
-        const npy_int32 i9 = 9;
-        const npy_int32 i15 = 15;
-        const npy_int32 i16 = 16;
-        const npy_int32 i22 = 22;
-        const npy_int32 i24 = 24;
-
-        const npy_int32 M1 = 2147483647;      //2^31 - 1
-        const npy_int32 M2 = 2147462579;      //2^31 - 21069
-        const npy_int32 MASK12 = 511;       //2^9 - 1
-        const npy_int32 MASK13 = 16777215;  //2^24 - 1
-        const npy_int32 MASK2 = 65535;      //2^16 - 1
-        const npy_int32 MULT2 = 21069;
 
-        if (%(size)s->nd != 1)
+class mrg_normal(mrg_uniform):
+    """Draw standard normal samples from MRG31k3p streams.
+
+    This fuses the uniform sampling with the Box-Muller transform that
+    MRG_RandomStreams.normal used to build out of tensor ops, and draws
+    the same values: the n samples come from ceil(n/2) * 2 uniform
+    samples u, drawn like mrg_uniform does. With h = ceil(n/2), sample k
+    is sqrt(-2 log(u[k])) * cos(2 pi u[h + k]) and sample h + k is
+    sqrt(-2 log(u[k])) * sin(2 pi u[h + k]).
+
+    The C code stores u[:h] in the output until it is transformed, so it
+    allocates no temporary.
+    """
+
+    def perform(self, node, inp, out):
+        rstate, size = inp
+        o_rstate, o_sample = out
+        if not self.inplace:
+            rstate = rstate.copy()
+        dtype = self.output_type.dtype
+        n_elements = int(numpy.prod(size))
+        half = (n_elements + 1) // 2
+        u = mrg_uniform_values(rstate, 2 * half).astype(dtype)
+        r = numpy.sqrt(-2.0 * numpy.log(u[:half].astype('float64')))
+        theta = 2.0 * numpy.pi * u[half:].astype('float64')
+        rval = numpy.concatenate([r * numpy.cos(theta),
+                                  r * numpy.sin(theta)])[:n_elements]
+        o_rstate[0] = rstate
+        o_sample[0] = rval.astype(dtype).reshape(size)
+
+    def c_code(self, node, name, inp, out, sub):
+        rstate, size = inp
+        o_rstate, o_sample = out
+        ndim = self.output_type.ndim
+        o_type_num = numpy.asarray(0, dtype=self.output_type.dtype).dtype.num
+        fail = sub['fail']
+        otype, NORM = mrg_c_norm(self.output_type.dtype)
+        size_code = mrg_c_size_code(size, o_sample, ndim, o_type_num,
+                                    'mrg_normal', fail)
+        rstate_code = mrg_c_rstate_code(rstate, o_rstate, self.inplace, fail)
+        return """
+        //////// <code generated by mrg_normal>
         {
-            PyErr_SetString(PyExc_ValueError, "size must be vector");
-            %(fail)s
-        }
-        if (%(size)s->dimensions[0] != %(ndim)s)
+        %(size_code)s
+        %(rstate_code)s
+        %(otype)s * sample_data = (%(otype)s *) %(o_sample)s->data;
+        int half = (n_elements + 1) / 2;
+        for (int i = 0; i < half; ++i)
         {
-            PyErr_Format(PyExc_ValueError, "size must have length %%i (not %%i)",
-                %(ndim)s, int(%(size)s->dimensions[0]));
-            %(fail)s
+            npy_int32 * state_data_i = state_data + (i%%n_streams)*6;
+            sample_data[i] = mrg_next_int(state_data_i) * %(NORM)s;
         }
-        if (%(size)s->descr->type_num != PyArray_INT32)
+        for (int i = half; i < 2 * half; ++i)
         {
-            PyErr_SetString(PyExc_ValueError, "size must be int32");
-            %(fail)s
+            npy_int32 * state_data_i = state_data + (i%%n_streams)*6;
+            %(otype)s u2 = mrg_next_int(state_data_i) * %(NORM)s;
+            int k = i - half;
+            double r = sqrt(-2.0 * log((double)sample_data[k]));
+            double theta = 6.283185307179586476925286766559 * u2;
+            sample_data[k] = r * cos(theta);
+            if (i < n_elements)
+                sample_data[i] = r * sin(theta);
         }
-        for (int i = 0; i < %(ndim)s; ++i)
-        {
-            odims[i] = ((npy_int32*)(%(size)s->data + %(size)s->strides[0] * i))[0];
-            n_elements *= odims[i];
-            must_alloc_sample = must_alloc_sample || (%(o_sample)s->dimensions[i] != odims[i]);
-            //fprintf(stderr, "size %%i %%i\\n", i, (int)odims[i]);
         }
-        if (must_alloc_sample)
+        //////// </ code generated by mrg_normal>
+        """ % locals()
+
+    def c_code_cache_version(self):
+        return (1, mrg_c_version)
+
+
+class mrg_binomial(mrg_uniform_base):
+    """Draw Bernoulli samples from MRG31k3p streams.
+
+    Sample i is 1 if the uniform sample i, drawn like mrg_uniform does,
+    is smaller than the matching element of p, else 0. The uniform is
+    computed in the precision of p, and never stored.
+
+    The inputs are the state, the size of the sample and p, that is
+    broadcasted to that size.
+    """
+
+    @classmethod
+    def new(cls, rstate, ndim, dtype, size, p):
+        v_size = as_tensor_variable(size)
+        if ndim is None:
+            ndim = get_vector_length(v_size)
+        op = cls(TensorType(dtype, (False,)*ndim))
+        return op(rstate, cast(v_size, 'int32'), p)
+
+    def make_node(self, rstate, size, p):
+        p = as_tensor_variable(p)
+        ndim = self.output_type.ndim
+        if p.ndim > ndim:
+            raise TypeError('p has more dimensions than the sample', p.ndim,
+                            ndim)
+        if p.dtype not in ('float32', 'float64'):
+            raise TypeError('p must be float32 or float64', p.dtype)
+        p = p.dimshuffle(['x'] * (ndim - p.ndim) + range(p.ndim))
+        return Apply(self,
+                [rstate, size, p],
+                [rstate.type(), self.output_type()])
+
+    def perform(self, node, inp, out):
+        rstate, size, p = inp
+        o_rstate, o_sample = out
+        if not self.inplace:
+            rstate = rstate.copy()
+        p_b = numpy.empty(tuple(size), dtype=p.dtype)
+        p_b[...] = p
+        u = mrg_uniform_values(rstate, p_b.size).astype(p.dtype)
+        rval = u < p_b.reshape(-1)
+        o_rstate[0] = rstate
+        o_sample[0] = rval.astype(self.output_type.dtype).reshape(size)
+
+    def c_support_code(self):
+        return mrg_c_support_code
+
+    def c_code(self, node, name, inp, out, sub):
+        rstate, size, p = inp
+        o_rstate, o_sample = out
+        ndim = self.output_type.ndim
+        o_type_num = numpy.asarray(0, dtype=self.output_type.dtype).dtype.num
+        otype = self.output_type.dtype_specs()[1]
+        fail = sub['fail']
+        ptype, NORM = mrg_c_norm(node.inputs[2].type.dtype)
+        size_code = mrg_c_size_code(size, o_sample, ndim, o_type_num,
+                                    'mrg_binomial', fail)
+        rstate_code = mrg_c_rstate_code(rstate, o_rstate, self.inplace, fail)
+        return """
+        //////// <code generated by mrg_binomial>
         {
-            Py_XDECREF(%(o_sample)s);
-            %(o_sample)s = (PyArrayObject*)PyArray_SimpleNew(%(ndim)s, odims, %(o_type_num)s);
-            if(!%(o_sample)s) {
-                PyErr_SetString(PyExc_MemoryError, "failed to alloc mrg_uniform output");
+        %(size_code)s
+        %(rstate_code)s
+        %(otype)s * sample_data = (%(otype)s *) %(o_sample)s->data;
+        // Index of the current element in the sample, and offset of the
+        // matching element of p.
+        npy_intp idx[%(ndim)s + 1];
+        npy_intp p_strides[%(ndim)s + 1];
+        npy_intp p_offset = 0;
+        for (int d = 0; d < %(ndim)s; ++d)
+        {
+            if (%(p)s->dimensions[d] != 1 && %(p)s->dimensions[d] != odims[d])
+            {
+                PyErr_Format(PyExc_ValueError,
+                    "p has shape %%i instead of 1 or %%i in dimension %%i",
+                    int(%(p)s->dimensions[d]), int(odims[d]), d);
                 %(fail)s
             }
+            idx[d] = 0;
+            p_strides[d] = (%(p)s->dimensions[d] == 1) ? 0 : %(p)s->strides[d];
         }
-        Py_XDECREF(%(o_rstate)s);
-        %(o_rstate)s = (PyArrayObject*)PyArray_FromAny(py_%(rstate)s, NULL, 0, 0, %(o_rstate_requirement)s,NULL);
+        for (int i = 0; i < n_elements; ++i)
+        {
+            npy_int32 * state_data_i = state_data + (i%%n_streams)*6;
+            %(ptype)s u = mrg_next_int(state_data_i) * %(NORM)s;
+            sample_data[i] = u < *(%(ptype)s *)(%(p)s->data + p_offset);
+            for (int d = %(ndim)s - 1; d >= 0; --d)
+            {
+                p_offset += p_strides[d];
+                if (++idx[d] < odims[d])
+                    break;
+                p_offset -= p_strides[d] * idx[d];
+                idx[d] = 0;
+            }
+        }
+        }
+        //////// </ code generated by mrg_binomial>
+        """ % locals()
 
-        if (%(o_rstate)s->nd != 2)
+    def c_code_cache_version(self):
+        return (1, mrg_c_version)
+
+
+def _dropout_bits(mask, n_elements):
+    """Unpack the first `n_elements` bits of the uint8 vector `mask`, the
+    bit of element i being bit i % 8 of byte i // 8."""
+    idx = numpy.arange(n_elements)
+    return (mask[idx >> 3] >> (idx & 7).astype('uint8')) & 1
+
+
+class mrg_dropout(mrg_uniform_base):
+    """Apply dropout to a tensor with MRG31k3p streams.
+
+    The inputs are the state, a tensor x and a scalar keep_prob. Element
+    i of x is kept, and divided by keep_prob, if the uniform sample i,
+    drawn like mrg_uniform does, is smaller than keep_prob. Otherwise it
+    is set to 0.
+
+    The outputs are the new state, the result, and the mask of the kept
+    elements packed in a uint8 vector, 8 elements per byte. The mask is
+    all the gradient needs, so no sample the size of x is kept.
+
+    :param output_type: the type of x.
+    """
+
+    def make_node(self, rstate, x, keep_prob):
+        x = as_tensor_variable(x)
+        if x.type != self.output_type:
+            raise TypeError('x must be a %s' % self.output_type, x.type)
+        keep_prob = cast(as_tensor_variable(keep_prob), x.dtype)
+        if keep_prob.ndim != 0:
+            raise TypeError('keep_prob must be a scalar', keep_prob.type)
+        return Apply(self,
+                [rstate, x, keep_prob],
+                [rstate.type(), self.output_type(),
+                 TensorType('uint8', (False,))()])
+
+    def grad(self, inputs, ograd):
+        rstate, x, keep_prob = inputs
+        g_y = ograd[1]
+        # This node is merged with the one whose gradient we compute.
+        mask = self(*inputs)[2]
+        return [None, mrg_dropout_grad(g_y, mask, keep_prob), None]
+
+    def infer_shape(self, node, shapes):
+        x_shape = shapes[1]
+        n_elements = 1
+        for s in x_shape:
+            n_elements = n_elements * s
+        return [shapes[0], x_shape, ((n_elements + 7) // 8,)]
+
+    def perform(self, node, inp, out):
+        rstate, x, keep_prob = inp
+        o_rstate, o_y, o_mask = out
+        if not self.inplace:
+            rstate = rstate.copy()
+        u = mrg_uniform_values(rstate, x.size).astype(x.dtype)
+        keep = u < keep_prob
+        o_rstate[0] = rstate
+        scale = x.dtype.type(1.0 / keep_prob)
+        o_y[0] = numpy.where(keep, x.reshape(-1) * scale,
+                             0).astype(x.dtype).reshape(x.shape)
+        bits = numpy.zeros((x.size + 7) // 8 * 8, dtype='uint8')
+        bits[:x.size] = keep
+        o_mask[0] = (bits.reshape(-1, 8) <<
+                     numpy.arange(8, dtype='uint8')).sum(axis=1).astype(
+                             'uint8')
+
+    def c_support_code(self):
+        return mrg_c_support_code
+
+    def c_code(self, node, name, inp, out, sub):
+        rstate, x, keep_prob = inp
+        o_rstate, o_y, o_mask = out
+        otype, NORM = mrg_c_norm(self.output_type.dtype)
+        fail = sub['fail']
+        rstate_code = mrg_c_rstate_code(rstate, o_rstate, self.inplace, fail)
+        return """
+        //////// <code generated by mrg_dropout>
+        {
+        %(rstate_code)s
+        PyArrayObject * xc = PyArray_GETCONTIGUOUS(%(x)s);
+        if (!xc)
         {
-            PyErr_SetString(PyExc_ValueError, "rstate must be matrix");
             %(fail)s
         }
-        if (%(o_rstate)s->dimensions[1] != 6)
+        npy_intp n_elements = PyArray_SIZE(xc);
+        npy_intp n_bytes = (n_elements + 7) / 8;
+        if ((NULL == %(o_y)s) || !PyArray_ISCONTIGUOUS(%(o_y)s)
+            || !PyArray_SAMESHAPE(%(o_y)s, xc))
         {
-            PyErr_Format(PyExc_ValueError, "rstate must have 6 columns");
-            %(fail)s
+            Py_XDECREF(%(o_y)s);
+            %(o_y)s = (PyArrayObject*)PyArray_SimpleNew(xc->nd,
+                xc->dimensions, xc->descr->type_num);
+            if (!%(o_y)s)
+            {
+                Py_DECREF(xc);
+                %(fail)s
+            }
         }
-        if (%(o_rstate)s->descr->type_num != PyArray_INT32)
+        if ((NULL == %(o_mask)s) || (%(o_mask)s->dimensions[0] != n_bytes)
+            || !PyArray_ISCONTIGUOUS(%(o_mask)s))
         {
-            PyErr_SetString(PyExc_ValueError, "rstate must be int32");
-            %(fail)s
+            Py_XDECREF(%(o_mask)s);
+            %(o_mask)s = (PyArrayObject*)PyArray_SimpleNew(1, &n_bytes,
+                                                           NPY_UINT8);
+            if (!%(o_mask)s)
+            {
+                Py_DECREF(xc);
+                %(fail)s
+            }
         }
-        n_streams = %(o_rstate)s->dimensions[0];
-
-        sample_data = (%(otype)s *) %(o_sample)s->data;
-        state_data = (npy_int32 *) %(o_rstate)s->data;
-        for (int i = 0; i < n_elements; ++i)
+        const %(otype)s p = ((%(otype)s*)%(keep_prob)s->data)[0];
+        const %(otype)s scale = 1.0 / p;
+        const %(otype)s * x_data = (%(otype)s*)xc->data;
+        %(otype)s * y_data = (%(otype)s*)%(o_y)s->data;
+        npy_uint8 * mask_data = (npy_uint8*)%(o_mask)s->data;
+        memset(mask_data, 0, n_bytes);
+        for (npy_intp i = 0; i < n_elements; ++i)
         {
             npy_int32 * state_data_i = state_data + (i%%n_streams)*6;
-            npy_int32 y1, y2, x11, x12, x13, x21, x22, x23;
-
-            x11 = state_data_i[0];
-            x12 = state_data_i[1];
-            x13 = state_data_i[2];
-            x21 = state_data_i[3];
-            x22 = state_data_i[4];
-            x23 = state_data_i[5];
-
-            y1 = ((x12 & MASK12) << i22) + (x12 >> i9) + ((x13 & MASK13) << i7) + (x13 >> i24);
-            if ((y1 < 0 || y1 >= M1))     //must also check overflow
-                y1 -= M1;
-            y1 += x13;
-            if ((y1 < 0 or y1 >= M1))
-                y1 -= M1;
-            x13 = x12;
-            x12 = x11;
-            x11 = y1;
-
-            y1 = ((x21 & MASK2) << i15) + (MULT2 * (x21 >> i16));
-            if (y1 < 0 || y1 >= M2)
-                y1 -= M2;
-            y2 = ((x23 & MASK2) << i15) + (MULT2 * (x23 >> i16));
-            if (y2 < 0 || y2 >= M2)
-                y2 -= M2;
-            y2 += x23;
-            if (y2 < 0 || y2 >= M2)
-                y2 -= M2;
-            y2 += y1;
-            if (y2 < 0 or y2 >= M2)
-                y2 -= M2;
-
-            x23 = x22;
-            x22 = x21;
-            x21 = y2;
-
-            if (x11 <= x21) {
-                assert((x11 - x21 + M1) <= M1);
-                sample_data[i] = (x11 - x21 + M1) * %(NORM)s;
+            %(otype)s u = mrg_next_int(state_data_i) * %(NORM)s;
+            if (u < p)
+            {
+                y_data[i] = x_data[i] * scale;
+                mask_data[i >> 3] |= (npy_uint8)(1 << (i & 7));
             }
             else
             {
-                assert(x11 - x21 <= M1);
-                sample_data[i] = (x11 - x21) * %(NORM)s;
+                y_data[i] = 0;
             }
+        }
+        Py_DECREF(xc);
+        }
+        //////// </ code generated by mrg_dropout>
+        """ % locals()
+
+    def c_code_cache_version(self):
+        return (1, mrg_c_version)
+
+
+class MRGDropoutGrad(Op):
+    """Gradient of mrg_dropout with respect to x.
+
+    The inputs are the gradient of the result, the packed mask and
+    keep_prob.
+    """
+
+    def __eq__(self, other):
+        return type(self) == type(other)
+
+    def __hash__(self):
+        return hash(type(self))
+
+    def __str__(self):
+        return self.__class__.__name__
 
-            state_data_i[0]= x11;
-            state_data_i[1]= x12;
-            state_data_i[2]= x13;
-            state_data_i[3]= x21;
-            state_data_i[4]= x22;
-            state_data_i[5]= x23;
+    def make_node(self, gy, mask, keep_prob):
+        gy = as_tensor_variable(gy)
+        mask = as_tensor_variable(mask)
+        if mask.type != TensorType('uint8', (False,)):
+            raise TypeError('mask must be a uint8 vector', mask.type)
+        if gy.dtype not in ('float32', 'float64'):
+            raise TypeError('gy must be float32 or float64', gy.dtype)
+        keep_prob = cast(as_tensor_variable(keep_prob), gy.dtype)
+        return Apply(self, [gy, mask, keep_prob], [gy.type()])
+
+    def infer_shape(self, node, shapes):
+        return [shapes[0]]
+
+    def perform(self, node, inp, out):
+        gy, mask, keep_prob = inp
+        gx, = out
+        keep = _dropout_bits(mask, gy.size).reshape(gy.shape)
+        scale = gy.dtype.type(1.0 / keep_prob)
+        gx[0] = numpy.where(keep, gy * scale, 0).astype(gy.dtype)
+
+    def c_code(self, node, name, inp, out, sub):
+        gy, mask, keep_prob = inp
+        gx, = out
+        otype = node.inputs[0].type.dtype_specs()[1]
+        fail = sub['fail']
+        return """
+        {
+        PyArrayObject * gyc = PyArray_GETCONTIGUOUS(%(gy)s);
+        if (!gyc)
+        {
+            %(fail)s
+        }
+        npy_intp n_elements = PyArray_SIZE(gyc);
+        if (%(mask)s->dimensions[0] * 8 < n_elements)
+        {
+            PyErr_SetString(PyExc_ValueError, "mask too small");
+            Py_DECREF(gyc);
+            %(fail)s
+        }
+        if ((NULL == %(gx)s) || !PyArray_ISCONTIGUOUS(%(gx)s)
+            || !PyArray_SAMESHAPE(%(gx)s, gyc))
+        {
+            Py_XDECREF(%(gx)s);
+            %(gx)s = (PyArrayObject*)PyArray_SimpleNew(gyc->nd,
+                gyc->dimensions, gyc->descr->type_num);
+            if (!%(gx)s)
+            {
+                Py_DECREF(gyc);
+                %(fail)s
+            }
+        }
+        const %(otype)s scale = 1.0 / ((%(otype)s*)%(keep_prob)s->data)[0];
+        const %(otype)s * gy_data = (%(otype)s*)gyc->data;
+        %(otype)s * gx_data = (%(otype)s*)%(gx)s->data;
+        const npy_uint8 * mask_data = (npy_uint8*)%(mask)s->data;
+        const npy_intp mask_stride = %(mask)s->strides[0];
+        for (npy_intp i = 0; i < n_elements; ++i)
+        {
+            if ((mask_data[(i >> 3) * mask_stride] >> (i & 7)) & 1)
+                gx_data[i] = gy_data[i] * scale;
+            else
+                gx_data[i] = 0;
+        }
+        Py_DECREF(gyc);
         }
-        //////// </ code generated by mrg_uniform>
         """ % locals()
 
     def c_code_cache_version(self):
-        return (2,)
+        return (1,)
+
+mrg_dropout_grad = MRGDropoutGrad()
 
 
 class GPU_mrg_uniform(mrg_uniform_base, GpuOp):
@@ -646,7 +1097,8 @@ class MRG_RandomStreams(object):
     def updates(self):
         return list(self.state_updates)
 
-    def __init__(self, seed=12345, use_cuda=None):
+    def __init__(self, seed=12345, use_cuda=None, worker_id=0,
+                 num_workers=1):
         """
         :type seed: int or list of 6 int.
 
@@ -656,6 +1108,14 @@ class MRG_RandomStreams(object):
             and not all 0; and the last 3 values must all be less than
             M2 = 2147462579, and not all 0.
 
+        :param worker_id, num_workers: when `num_workers` processes
+            use the same seed, give each one a different `worker_id`
+            between 0 and `num_workers` - 1. Each random variable
+            starts a new stream, 2**134 steps after the previous one.
+            Worker `worker_id` uses the streams `worker_id`,
+            `worker_id` + `num_workers`, `worker_id` + 2 * `num_workers`,
+            ... so the workers never share a stream. With the default
+            values, all the streams are used.
         """
         super(MRG_RandomStreams, self).__init__()
         if isinstance(seed, int):
@@ -681,9 +1141,23 @@ class MRG_RandomStreams(object):
         else:
             self.use_cuda = use_cuda
 
+        if num_workers < 1 or not 0 <= worker_id < num_workers:
+            raise ValueError('worker_id should be between 0 and'
+                             ' num_workers - 1', worker_id, num_workers)
+        self.worker_id = worker_id
+        self.num_workers = num_workers
+        if worker_id > 0:
+            self.rstate = multMatVect(self.rstate,
+                    matPowModM(A1p134, worker_id, M1), M1,
+                    matPowModM(A2p134, worker_id, M2), M2)
+        self.stream_jump = (matPowModM(A1p134, num_workers, M1),
+                            matPowModM(A2p134, num_workers, M2))
+
     def inc_rstate(self):
-        """Update self.rstate to be skipped 2^134 steps forward to the next stream start"""
-        self.rstate = ff_2p134(self.rstate)
+        """Update self.rstate to be skipped num_workers * 2^134 steps
+        forward to the next stream start of this worker"""
+        self.rstate = multMatVect(self.rstate, self.stream_jump[0], M1,
+                                  self.stream_jump[1], M2)
         assert self.rstate.dtype == numpy.int32
 
     def get_substream_rstates(self, n_streams, inc_rstate=True):
@@ -692,13 +1166,22 @@ class MRG_RandomStreams(object):
         """
         assert n_streams < 2**72
         assert n_streams > 0
-        rval = numpy.zeros((n_streams,6), dtype='int32')
+        rval = numpy.zeros((n_streams,6), dtype='int64')
         rval[0] = self.rstate
-        for i in xrange(1, n_streams):
-            rval[i] = ff_2p72(rval[i-1])
+        # Once the first `done` rows are filled, jumping each of them
+        # `done` * 2**72 steps ahead gives the next `done` rows.
+        A1, A2 = A1p72, A2p72
+        done = 1
+        while done < n_streams:
+            n = min(done, n_streams - done)
+            rval[done:done + n, :3] = matVecModM_rows(A1, rval[:n, :3], M1)
+            rval[done:done + n, 3:] = matVecModM_rows(A2, rval[:n, 3:], M2)
+            done += n
+            A1 = matMatModM(A1, A1, M1)
+            A2 = matMatModM(A2, A2, M2)
         if inc_rstate:
             self.inc_rstate()
-        return rval
+        return rval.astype('int32')
 
     def n_streams(self, size):
         return guess_n_streams(size, warn=True)
@@ -710,6 +1193,20 @@ class MRG_RandomStreams(object):
         node_rstate.default_update = new_rstate
         return sample
 
+    def check_size(self, size):
+        if isinstance(size, tuple):
+            msg = "size must be a tuple of int or a Theano variable"
+            assert all([isinstance(i,int) or isinstance(i,Variable)
+                for i in size]), msg
+            if any([isinstance(i, int) and i <= 0 for i in size]):
+                raise ValueError(
+                    "The specified size contains a dimension with value <= 0",
+                    size)
+
+        else:
+            msg = "size must be a tuple of int or a Theano variable"
+            assert isinstance(size, Variable) and size.ndim==1, msg
+
     def uniform(self, size, low=0.0, high=1.0, ndim=None, dtype=None,
                 nstreams=None):
         """
@@ -741,18 +1238,7 @@ class MRG_RandomStreams(object):
         low = cast(low, dtype=dtype)
         high = cast(high, dtype=dtype)
 
-        if isinstance(size, tuple):
-            msg = "size must be a tuple of int or a Theano variable"
-            assert all([isinstance(i,int) or isinstance(i,Variable)
-                for i in size]), msg
-            if any([isinstance(i, int) and i <= 0 for i in size]):
-                raise ValueError(
-                    "The specified size contains a dimension with value <= 0",
-                    size)
-
-        else:
-            msg = "size must be a tuple of int or a Theano variable"
-            assert isinstance(size, Variable) and size.ndim==1, msg
+        self.check_size(size)
 
         if nstreams is None:
             nstreams = self.n_streams(size)
@@ -791,12 +1277,29 @@ class MRG_RandomStreams(object):
 
     def binomial(self, size=None, n=1, p=0.5, ndim=None, dtype='int64',
                  nstreams=None):
+        """
+        On the CPU, when p does not have more dimensions than the sample,
+        the sample is drawn by mrg_binomial, without storing the uniform
+        samples it compares to p.
+        """
         if n == 1:
+            p = as_tensor_variable(p)
             if dtype == 'float32' and self.use_cuda:
                 x = self.uniform(size=size, dtype=dtype, nstreams=nstreams)
-            else:
+                return cast(x < p, dtype)
+            self.check_size(size)
+            if ndim is None:
+                ndim = get_vector_length(size)
+            if p.ndim > ndim:
                 x = self.uniform(size=size, nstreams=nstreams)
-            return cast(x < p, dtype)
+                return cast(x < p, dtype)
+            # Compare to uniforms of the precision uniform() would use.
+            p = cast(p, scal.upcast(config.floatX, p.dtype))
+            if nstreams is None:
+                nstreams = self.n_streams(size)
+            node_rstate = shared(self.get_substream_rstates(nstreams))
+            return self.pretty_return(node_rstate,
+                    *mrg_binomial.new(node_rstate, ndim, dtype, size, p))
         else:
             raise NotImplementedError("MRG_RandomStreams.binomial with n > 1")
 
@@ -846,6 +1349,9 @@ class MRG_RandomStreams(object):
         precise as floatX.
 
         :param nstreams: Number of streams.
+
+        On the CPU, the sample is drawn by mrg_normal, which computes the
+        same transform as the graph built here for the GPU.
         """
         # We need an even number of ]0,1[ samples. Then we split them
         # in two halves. First half becomes our U1's for Box-Muller,
@@ -860,6 +1366,22 @@ class MRG_RandomStreams(object):
         avg = cast(avg, dtype)
         std = cast(std, dtype)
 
+        if not (self.use_cuda and dtype == 'float32'):
+            self.check_size(size)
+            if nstreams is None:
+                if (isinstance(size, tuple) and
+                        all([isinstance(i, int) for i in size])):
+                    n_samples = numpy.prod(size)
+                    nstreams = self.n_streams((n_samples + n_samples % 2,))
+                else:
+                    nstreams = self.n_streams(size)
+            node_rstate = shared(self.get_substream_rstates(nstreams))
+            normal_samples = self.pretty_return(node_rstate,
+                    *mrg_normal.new(node_rstate, ndim, dtype, size))
+            final_samples = avg + std * normal_samples
+            assert final_samples.dtype == dtype
+            return final_samples
+
         evened = False
         constant = False
         if isinstance(size, tuple) and all([isinstance(i,int) for i in size]):
@@ -910,10 +1432,32 @@ class MRG_RandomStreams(object):
         assert final_samples.dtype == dtype
         return final_samples
 
+    def dropout(self, x, keep_prob=0.5, nstreams=None):
+        """
+        Set each element of x to 0 with probability 1 - keep_prob, and
+        divide the others by keep_prob.
+
+        On the CPU, this is done by mrg_dropout, whose gradient only
+        needs a mask of 1 bit per element.
+
+        :param keep_prob: a scalar.
+        """
+        x = as_tensor_variable(x)
+        if self.use_cuda and x.dtype == 'float32':
+            mask = self.binomial(size=x.shape, p=keep_prob, dtype=x.dtype,
+                                 nstreams=nstreams)
+            return x * mask / cast(keep_prob, x.dtype)
+        if nstreams is None:
+            nstreams = self.n_streams(x.shape)
+        node_rstate = shared(self.get_substream_rstates(nstreams))
+        new_rstate, y = mrg_dropout(x.type)(node_rstate, x, keep_prob)[:2]
+        return self.pretty_return(node_rstate, new_rstate, y)
+
 @local_optimizer([None])
 def mrg_random_make_inplace(node):
     op = node.op
-    if isinstance(op, mrg_uniform) and not op.inplace:
+    if (isinstance(op, (mrg_uniform, mrg_binomial, mrg_dropout)) and
+            not op.inplace):
         # op might be gpu version
         new_op = op.__class__(op.output_type, inplace=True)
         return new_op.make_node(*node.inputs).outputs
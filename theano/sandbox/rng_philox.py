@@ -0,0 +1,589 @@
+"""
+Implementation of the Philox4x32-10 counter-based random number generator
+for Theano
+
+Salmon, Moraes, Dror & Shaw, "Parallel Random Numbers: As Easy as 1, 2, 3",
+SC 2011. Reference code in the Random123 library:
+http://www.deshawresearch.com/resources_random123.html
+
+A counter-based generator has no sequential state. Block number `i` of a
+stream is a fixed function of (key, counter + i), so any number of blocks
+can be computed independently, in any order and by any number of threads,
+and always give the same result.
+
+The state of a stream is a uint32 vector of 6 elements:
+[ctr0, ctr1, ctr2, ctr3, key0, key1]. ctr0 and ctr1 are the low and high
+words of the number of blocks already used, ctr2 and ctr3 identify the
+stream, and key0 and key1 hold the seed. Only the block count changes
+when samples are drawn.
+"""
+import numpy
+
+from theano import Op, Apply, shared, config, Variable
+from theano.tensor import (raw_random, TensorType, as_tensor_variable,
+        get_vector_length, cast, opt, scal)
+from theano.tensor import sqrt, log, sin, cos, join, prod
+from theano.compile import optdb
+from theano.gof import local_optimizer
+from theano.gof.python25 import all, any
+
+import multinomial
+
+
+# Philox4x32 constants
+PHILOX_M0 = 0xD2511F53
+PHILOX_M1 = 0xCD9E8D57
+PHILOX_W0 = 0x9E3779B9  # golden ratio
+PHILOX_W1 = 0xBB67AE85  # sqrt(3) - 1
+MASK32 = 0xFFFFFFFF
+
+
+def philox4x32(ctr, key, rounds=10):
+    """Return the Philox4x32 blocks of the counters `ctr` under `key`.
+
+    :param ctr: 4 integers or arrays of uint32 values, the words of the
+        counters.
+    :param key: 2 integers, the words of the key.
+
+    :return: 4 uint64 arrays holding the uint32 words of the blocks.
+    """
+    u64 = numpy.uint64
+    c0, c1, c2, c3 = [numpy.asarray(c, dtype='uint64') for c in ctr]
+    k0, k1 = int(key[0]) & MASK32, int(key[1]) & MASK32
+    m0, m1, mask, s32 = u64(PHILOX_M0), u64(PHILOX_M1), u64(MASK32), u64(32)
+    for r in xrange(rounds):
+        if r > 0:
+            k0 = (k0 + PHILOX_W0) & MASK32
+            k1 = (k1 + PHILOX_W1) & MASK32
+        # The products of two 32 bits words fit in 64 bits.
+        p0 = m0 * c0
+        p1 = m1 * c2
+        c0, c1, c2, c3 = ((p1 >> s32) ^ c1 ^ u64(k0), p1 & mask,
+                          (p0 >> s32) ^ c3 ^ u64(k1), p0 & mask)
+    return c0, c1, c2, c3
+
+
+def philox_lanes(dtype):
+    """Return the number of samples of `dtype` drawn from one block."""
+    if dtype == 'float32':
+        return 4
+    elif dtype == 'float64':
+        return 2
+    raise TypeError('philox_uniform only supports float32 and float64',
+                    dtype)
+
+
+def philox_uniform_values(rstate, n, dtype):
+    """Return `n` uniform samples in (0, 1) and the updated state.
+
+    This is the reference implementation of `philox_uniform`. Sample `i`
+    comes from lane ``i % L`` of block ``i // L``, where L is
+    ``philox_lanes(dtype)``. float32 samples use 23 bits of one word and
+    float64 samples 52 bits of two words, so that 0 and 1 can not be
+    returned.
+    """
+    rstate = numpy.array(rstate, dtype='uint32')
+    lanes = philox_lanes(dtype)
+    n_blocks = (n + lanes - 1) // lanes
+    base = int(rstate[0]) + (int(rstate[1]) << 32)
+    blocks = (numpy.arange(n_blocks, dtype='uint64') +
+              numpy.uint64(base))
+    words = philox4x32(
+            (blocks & numpy.uint64(MASK32), blocks >> numpy.uint64(32),
+             rstate[2], rstate[3]),
+            rstate[4:])
+    words = numpy.asarray(words).T.reshape(-1)
+    if dtype == 'float32':
+        u = ((words[:n] >> numpy.uint64(9)).astype('float64') + 0.5) / 2 ** 23
+    else:
+        words = words.reshape(-1, 2)[:n]
+        hi = (words[:, 0] >> numpy.uint64(6)).astype('float64')
+        lo = (words[:, 1] >> numpy.uint64(6)).astype('float64')
+        u = (hi * 2 ** 26 + lo + 0.5) / 2 ** 52
+    base = (base + n_blocks) & 0xFFFFFFFFFFFFFFFF
+    rstate[0] = base & MASK32
+    rstate[1] = base >> 32
+    return u.astype(dtype), rstate
+
+
+class philox_uniform(Op):
+    """Draw uniform samples in (0, 1) from a Philox4x32-10 stream.
+
+    The inputs are the stream state (see the module docstring) and the
+    shape of the sample. The outputs are the new state, whose block
+    counter was advanced past the blocks used, and the sample.
+
+    The C code splits the blocks between OpenMP threads. As each block
+    only depends on its counter, the sample does not depend on the number
+    of threads.
+
+    :param openmp: by default, config.openmp.
+    """
+    def __init__(self, output_type, inplace=False, openmp=None):
+        Op.__init__(self)
+        self.output_type = output_type
+        self.inplace = inplace
+        if inplace:
+            self.destroy_map = {0: [0]}
+        if openmp is None:
+            openmp = config.openmp
+        self.openmp = openmp
+
+    def __eq__(self, other):
+        return (type(self) == type(other) and
+                self.output_type == other.output_type and
+                self.inplace == other.inplace and
+                self.openmp == other.openmp)
+
+    def __hash__(self):
+        return (hash(type(self)) ^ hash(self.output_type) ^
+                hash(self.inplace) ^ hash(self.openmp))
+
+    def __str__(self):
+        if self.inplace:
+            s = "inplace"
+        else:
+            s = "no_inplace"
+        return self.__class__.__name__ + "{%s,%s}" % (self.output_type, s)
+
+    @classmethod
+    def new(cls, rstate, ndim, dtype, size):
+        v_size = as_tensor_variable(size)
+        if ndim is None:
+            ndim = get_vector_length(v_size)
+        op = cls(TensorType(dtype, (False,) * ndim))
+        return op(rstate, cast(v_size, 'int32'))
+
+    def make_node(self, rstate, size):
+        # Call through PhiloxRandomStreams instead.
+        philox_lanes(self.output_type.dtype)
+        rstate = as_tensor_variable(rstate)
+        size = as_tensor_variable(size)
+        if rstate.type != TensorType('uint32', (False,)):
+            raise TypeError('rstate must be a uint32 vector', rstate.type)
+        if size.type.ndim != 1 or size.type.dtype != 'int32':
+            raise TypeError('size must be an int32 vector', size.type)
+        return Apply(self,
+                [rstate, size],
+                [rstate.type(), self.output_type()])
+
+    def grad(self, inputs, ograd):
+        return [None for i in inputs]
+
+    def R_op(self, inputs, eval_points):
+        return [None for i in eval_points]
+
+    def perform(self, node, inp, out):
+        rstate, size = inp
+        o_rstate, o_sample = out
+        if rstate.shape != (6,):
+            raise ValueError('rstate must have 6 elements', rstate.shape)
+        if len(size) != self.output_type.ndim:
+            raise ValueError('size must have length %i' %
+                             self.output_type.ndim, size)
+        n_elements = 1
+        for s in size:
+            n_elements *= int(s)
+        rval, new_rstate = philox_uniform_values(rstate, n_elements,
+                                                 self.output_type.dtype)
+        if self.inplace:
+            rstate[...] = new_rstate
+            new_rstate = rstate
+        o_rstate[0] = new_rstate
+        o_sample[0] = rval.reshape(size)
+
+    def c_support_code(self):
+        return """
+        #define PHILOX_M0 0xD2511F53U
+        #define PHILOX_M1 0xCD9E8D57U
+        #define PHILOX_W0 0x9E3779B9U
+        #define PHILOX_W1 0xBB67AE85U
+
+        // Philox4x32-10: replace the counter c by its block under (k0, k1).
+        static inline void philox4x32_10(npy_uint32 c[4], npy_uint32 k0,
+                                         npy_uint32 k1)
+        {
+            for (int r = 0; r < 10; ++r)
+            {
+                npy_uint64 p0 = (npy_uint64)PHILOX_M0 * c[0];
+                npy_uint64 p1 = (npy_uint64)PHILOX_M1 * c[2];
+                npy_uint32 x0 = (npy_uint32)(p1 >> 32) ^ c[1] ^ k0;
+                npy_uint32 x2 = (npy_uint32)(p0 >> 32) ^ c[3] ^ k1;
+                c[0] = x0;
+                c[1] = (npy_uint32)p1;
+                c[2] = x2;
+                c[3] = (npy_uint32)p0;
+                k0 += PHILOX_W0;
+                k1 += PHILOX_W1;
+            }
+        }
+        """
+
+    def c_compile_args(self):
+        if self.openmp:
+            return ['-fopenmp']
+        return []
+
+    def c_code(self, node, name, inp, out, sub):
+        rstate, size = inp
+        o_rstate, o_sample = out
+        if self.inplace:
+            o_rstate_requirement = 'NPY_C_CONTIGUOUS|NPY_ALIGNED'
+        else:
+            o_rstate_requirement = 'NPY_ENSURECOPY|NPY_C_CONTIGUOUS|NPY_ALIGNED'
+        ndim = self.output_type.ndim
+        o_type_num = numpy.asarray(0, dtype=self.output_type.dtype).dtype.num
+        fail = sub['fail']
+        lanes = philox_lanes(self.output_type.dtype)
+        if self.output_type.dtype == 'float32':
+            otype = 'float'
+            # 23 bits, so that the largest value rounds below 1.
+            convert = """
+                for (int j = 0; j < %(lanes)s && i * %(lanes)s + j < n_elements; ++j)
+                    sample_data[i * %(lanes)s + j] =
+                        ((c[j] >> 9) + 0.5f) * 1.1920928955078125e-07f;
+            """ % locals()
+        else:
+            otype = 'double'
+            # 52 bits from two words.
+            convert = """
+                for (int j = 0; j < %(lanes)s && i * %(lanes)s + j < n_elements; ++j)
+                    sample_data[i * %(lanes)s + j] =
+                        ((c[2 * j] >> 6) * 67108864.0 + (c[2 * j + 1] >> 6)
+                         + 0.5) * 2.220446049250313080847263336181640625e-16;
+            """ % locals()
+        if self.openmp:
+            omp_pragma = '#pragma omp parallel for schedule(static)'
+        else:
+            omp_pragma = ''
+        return """
+        //////// <code generated by philox_uniform>
+        {
+        npy_intp odims[%(ndim)s];
+        npy_intp n_elements = 1;
+        long n_blocks;
+        npy_uint64 base;
+        npy_uint32 key0, key1, ctr2, ctr3;
+        int must_alloc_sample = ((NULL == %(o_sample)s)
+                                 || (%(o_sample)s->nd != %(ndim)s)
+                                 || !(PyArray_ISCONTIGUOUS(%(o_sample)s)));
+        %(otype)s * sample_data;
+        npy_uint32 * state_data;
+
+        if (%(size)s->nd != 1)
+        {
+            PyErr_SetString(PyExc_ValueError, "size must be vector");
+            %(fail)s
+        }
+        if (%(size)s->dimensions[0] != %(ndim)s)
+        {
+            PyErr_Format(PyExc_ValueError, "size must have length %%i (not %%i)",
+                %(ndim)s, int(%(size)s->dimensions[0]));
+            %(fail)s
+        }
+        if (%(size)s->descr->type_num != PyArray_INT32)
+        {
+            PyErr_SetString(PyExc_ValueError, "size must be int32");
+            %(fail)s
+        }
+        for (int i = 0; i < %(ndim)s; ++i)
+        {
+            odims[i] = ((npy_int32*)(%(size)s->data + %(size)s->strides[0] * i))[0];
+            n_elements *= odims[i];
+            must_alloc_sample = must_alloc_sample || (%(o_sample)s->dimensions[i] != odims[i]);
+        }
+        if (must_alloc_sample)
+        {
+            Py_XDECREF(%(o_sample)s);
+            %(o_sample)s = (PyArrayObject*)PyArray_SimpleNew(%(ndim)s, odims, %(o_type_num)s);
+            if(!%(o_sample)s) {
+                PyErr_SetString(PyExc_MemoryError, "failed to alloc philox_uniform output");
+                %(fail)s
+            }
+        }
+        Py_XDECREF(%(o_rstate)s);
+        %(o_rstate)s = (PyArrayObject*)PyArray_FromAny(py_%(rstate)s, NULL, 0, 0, %(o_rstate_requirement)s,NULL);
+        if (!%(o_rstate)s)
+        {
+            %(fail)s
+        }
+        if (%(o_rstate)s->nd != 1 || %(o_rstate)s->dimensions[0] != 6)
+        {
+            PyErr_SetString(PyExc_ValueError, "rstate must be a vector of 6 elements");
+            %(fail)s
+        }
+        if (%(o_rstate)s->descr->type_num != PyArray_UINT32)
+        {
+            PyErr_SetString(PyExc_ValueError, "rstate must be uint32");
+            %(fail)s
+        }
+
+        sample_data = (%(otype)s *) %(o_sample)s->data;
+        state_data = (npy_uint32 *) %(o_rstate)s->data;
+        base = state_data[0] | ((npy_uint64)state_data[1] << 32);
+        ctr2 = state_data[2];
+        ctr3 = state_data[3];
+        key0 = state_data[4];
+        key1 = state_data[5];
+        n_blocks = (n_elements + %(lanes)s - 1) / %(lanes)s;
+
+        %(omp_pragma)s
+        for (long i = 0; i < n_blocks; ++i)
+        {
+            npy_uint64 b = base + i;
+            npy_uint32 c[4];
+            c[0] = (npy_uint32)b;
+            c[1] = (npy_uint32)(b >> 32);
+            c[2] = ctr2;
+            c[3] = ctr3;
+            philox4x32_10(c, key0, key1);
+            %(convert)s
+        }
+
+        base += n_blocks;
+        state_data[0] = (npy_uint32)base;
+        state_data[1] = (npy_uint32)(base >> 32);
+        }
+        //////// </ code generated by philox_uniform>
+        """ % locals()
+
+    def c_code_cache_version(self):
+        return (1, self.openmp)
+
+
+class PhiloxRandomStreams(object):
+    """Module component with similar interface to numpy.random
+    (numpy.random.RandomState), based on the Philox4x32-10 generator.
+
+    Each random variable gets its own stream: the seed is the key and
+    the index of the variable in this object is in the counter. No jump
+    ahead is needed to make the streams independent, and no state array
+    proportional to the number of threads.
+    """
+
+    def updates(self):
+        return list(self.state_updates)
+
+    def __init__(self, seed=12345, worker_id=0, num_workers=1):
+        """
+        :type seed: int
+
+        :param seed: a default seed, between 0 and 2**64 - 1.
+
+        :param worker_id, num_workers: when `num_workers` processes
+            use the same seed, give each one a different `worker_id`
+            between 0 and `num_workers` - 1. The k-th random variable
+            of worker `worker_id` uses stream
+            k * `num_workers` + `worker_id`, so the workers never share
+            a stream.
+        """
+        super(PhiloxRandomStreams, self).__init__()
+        if num_workers < 1 or not 0 <= worker_id < num_workers:
+            raise ValueError('worker_id should be between 0 and'
+                             ' num_workers - 1', worker_id, num_workers)
+        self.worker_id = worker_id
+        self.num_workers = num_workers
+        self.state_updates = []
+        """A list of pairs of the form (input_r, output_r), representing
+        the update rules of all the random states generated by this
+        object"""
+        self.n_streams = 0
+        self.set_seed(seed)
+
+    def set_seed(self, seed):
+        if not isinstance(seed, (int, long)):
+            raise TypeError('seed should be an integer', seed)
+        if seed < 0 or seed >= 2 ** 64:
+            raise ValueError('seed should be between 0 and 2**64 - 1', seed)
+        self.key = (seed & MASK32, seed >> 32)
+
+    def seed(self, seed=None):
+        """Re-initialize the streams of all the random variables made so
+        far, with a new seed.
+
+        :param seed: if None, the current seed is kept, and the streams
+            restart at their first sample.
+        """
+        if seed is not None:
+            self.set_seed(seed)
+        for old_r, new_r in self.state_updates:
+            rstate = old_r.get_value(borrow=True).copy()
+            rstate[:2] = 0
+            rstate[4:] = self.key
+            old_r.set_value(rstate, borrow=True)
+
+    def new_rstate(self):
+        """Return the initial state of a new stream."""
+        idx = self.n_streams * self.num_workers + self.worker_id
+        self.n_streams += 1
+        return numpy.asarray([0, 0, idx & MASK32, (idx >> 32) & MASK32,
+                              self.key[0], self.key[1]], dtype='uint32')
+
+    def pretty_return(self, node_rstate, new_rstate, sample):
+        sample.rstate = node_rstate
+        sample.update = (node_rstate, new_rstate)
+        self.state_updates.append((node_rstate, new_rstate))
+        node_rstate.default_update = new_rstate
+        return sample
+
+    def check_size(self, size):
+        if isinstance(size, tuple):
+            msg = "size must be a tuple of int or a Theano variable"
+            assert all([isinstance(i, (int, long)) or isinstance(i, Variable)
+                for i in size]), msg
+            if any([isinstance(i, (int, long)) and i <= 0 for i in size]):
+                raise ValueError(
+                    "The specified size contains a dimension with value <= 0",
+                    size)
+        else:
+            msg = "size must be a tuple of int or a Theano variable"
+            assert isinstance(size, Variable) and size.ndim == 1, msg
+
+    def uniform(self, size, low=0.0, high=1.0, ndim=None, dtype=None):
+        """
+        Sample a tensor of given size whose element from a uniform
+        distribution between low and high.
+
+        :param size: Can be a list of integer or Theano variable
+                (ex: the shape of other Theano Variable)
+
+        :param dtype: The output data type. If dtype is not specified, it
+        will be inferred from the dtype of low and high, but will be at
+        least as precise as floatX.
+        """
+        low = as_tensor_variable(low)
+        high = as_tensor_variable(high)
+        if dtype is None:
+            dtype = scal.upcast(config.floatX, low.dtype, high.dtype)
+
+        low = cast(low, dtype=dtype)
+        high = cast(high, dtype=dtype)
+        self.check_size(size)
+
+        node_rstate = shared(self.new_rstate())
+        u = self.pretty_return(node_rstate,
+                *philox_uniform.new(node_rstate, ndim, dtype, size))
+        r = u * (high - low) + low
+
+        if u.type.broadcastable != r.type.broadcastable:
+            raise NotImplementedError('Increase the size to match the broadcasting pattern of `low` and `high` arguments')
+
+        assert r.dtype == dtype
+        return r
+
+    def binomial(self, size=None, n=1, p=0.5, ndim=None, dtype='int64'):
+        """
+        Sample `n` trials of probability `p`, by comparing `n` uniform
+        samples to `p` for each output element.
+
+        :param n: a python integer.
+        """
+        if not isinstance(n, (int, long)) or n < 1:
+            raise NotImplementedError(
+                    "PhiloxRandomStreams.binomial with a non-constant n")
+        if n == 1:
+            x = self.uniform(size=size, ndim=ndim)
+            return cast(x < p, dtype)
+        self.check_size(size)
+        if isinstance(size, tuple):
+            trials_size = (n,) + size
+            trials_ndim = None
+        else:
+            if ndim is None:
+                ndim = get_vector_length(size)
+            trials_size = join(0, as_tensor_variable([n]), cast(size, 'int64'))
+            trials_ndim = ndim + 1
+        x = self.uniform(size=trials_size, ndim=trials_ndim)
+        return cast(x < p, dtype).sum(axis=0, dtype=dtype)
+
+    def multinomial(self, size=None, n=1, pvals=None, ndim=None,
+                    dtype='int64'):
+        """
+        Sample `n` (currently `n` needs to be 1) times from a multinomial
+        distribution defined by probabilities pvals.
+
+        Example : pvals = [[.98, .01, .01], [.01, .98, .01]] will
+        probably result in [[1,0,0],[0,1,0]].
+        """
+        if pvals is None:
+            raise TypeError("You have to specify pvals")
+        pvals = as_tensor_variable(pvals)
+        if size is not None:
+            if any([isinstance(i, int) and i <= 0 for i in size]):
+                raise ValueError(
+                    "The specified size contains a dimension with value <= 0",
+                    size)
+
+        if n == 1 and pvals.ndim == 2:
+            ndim, size, bcast = raw_random._infer_ndim_bcast(
+                    ndim, size, pvals[:, 0])
+            assert ndim == 1
+            unis = self.uniform(size=size, ndim=1)
+            op = multinomial.MultinomialFromUniform(dtype)
+            return op(pvals, unis)
+        else:
+            raise NotImplementedError(("PhiloxRandomStreams.multinomial only"
+                " implemented with n == 1 and pvals.ndim = 2"))
+
+    def normal(self, size=None, avg=0.0, std=1.0, ndim=None, dtype=None):
+        """
+        Sample from a normal distribution with the Box-Muller transform.
+
+        :param size: Can be a list of integers or Theano variables (ex: the
+        shape of another Theano Variable)
+
+        :param dtype: The output data type. If dtype is not specified, it
+        will be inferred from the dtype of avg and std, but will be at
+        least as precise as floatX.
+        """
+        avg = as_tensor_variable(avg)
+        std = as_tensor_variable(std)
+
+        if dtype is None:
+            dtype = scal.upcast(config.floatX, avg.dtype, std.dtype)
+
+        avg = cast(avg, dtype)
+        std = cast(std, dtype)
+
+        self.check_size(size)
+        if (isinstance(size, tuple) and
+                all([isinstance(i, (int, long)) for i in size])):
+            n_samples = int(numpy.prod(size))
+        else:
+            n_samples = prod(size)
+        # We need an even number of samples in (0, 1): the first half
+        # are the U1's of the Box-Muller transform, the second half the
+        # U2's.
+        n_even = n_samples + n_samples % 2
+        flattened = self.uniform(size=(n_even,), ndim=1, dtype=dtype)
+        U1 = flattened[:n_even // 2]
+        U2 = flattened[n_even // 2:]
+
+        sqrt_ln_U1 = sqrt(numpy.array(-2.0, dtype=dtype) * log(U1))
+        theta = numpy.array(2.0 * numpy.pi, dtype=dtype) * U2
+        normal_samples = join(0, sqrt_ln_U1 * cos(theta),
+                              sqrt_ln_U1 * sin(theta))
+        final_samples = normal_samples[:n_samples]
+        if isinstance(size, tuple):
+            final_samples = final_samples.reshape(size)
+        else:
+            if ndim is None:
+                ndim = get_vector_length(size)
+            final_samples = final_samples.reshape(size, ndim)
+
+        final_samples = avg + std * final_samples
+
+        assert final_samples.dtype == dtype
+        return final_samples
+
+
+@local_optimizer([None])
+def philox_random_make_inplace(node):
+    op = node.op
+    if isinstance(op, philox_uniform) and not op.inplace:
+        new_op = op.__class__(op.output_type, inplace=True, openmp=op.openmp)
+        return new_op.make_node(*node.inputs).outputs
+    return False
+optdb.register('random_make_inplace_philox',
+               opt.in2out(philox_random_make_inplace, ignore_newtrees=True),
+               99, 'fast_run', 'inplace')
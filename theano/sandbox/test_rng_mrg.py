@@ -673,3 +673,108 @@ class T_MRG(unittest.TestCase):
             self.assertRaises(ValueError, R.binomial, size)
             self.assertRaises(ValueError, R.multinomial, size, 1, [])
             self.assertRaises(ValueError, R.normal, size)
+
+
+def test_normal_fused():
+    # mrg_normal draws what the Box-Muller graph built from uniform
+    # samples does.
+    for size in [(7, 5), (4, 4)]:
+        n_even = numpy.prod(size) + numpy.prod(size) % 2
+        nstreams = rng_mrg.guess_n_streams((n_even,), warn=False)
+        R = MRG_RandomStreams(234, use_cuda=False)
+        n = R.normal(size=size, avg=1., std=2., dtype='float64')
+        assert any([isinstance(node.op, rng_mrg.mrg_normal)
+                    for node in theano.gof.graph.io_toposort([], [n])])
+        out = theano.function([], n, mode=mode)()
+
+        RR = MRG_RandomStreams(234, use_cuda=False)
+        u = theano.function([], RR.uniform(size=(n_even,), dtype='float64',
+                                           nstreams=nstreams))()
+        half = n_even // 2
+        r = numpy.sqrt(-2 * numpy.log(u[:half]))
+        z = numpy.concatenate([r * numpy.cos(2 * numpy.pi * u[half:]),
+                               r * numpy.sin(2 * numpy.pi * u[half:])])
+        assert numpy.allclose(out, 1 + 2 * z[:numpy.prod(size)].reshape(size))
+
+
+def test_fused_ops_c_vs_py():
+    x = tensor.matrix()
+    x_val = numpy.arange(1, 36, dtype=config.floatX).reshape(7, 5)
+    p_val = numpy.asarray([[.1], [.5], [.9], [.3], [.2], [.7], [.6]],
+                          dtype=config.floatX)
+    outs = []
+    for linker in ['py', 'c|py']:
+        R = MRG_RandomStreams(234, use_cuda=False)
+        f = theano.function([x], [
+                R.normal(size=(7, 5), nstreams=4),
+                R.binomial(size=(7, 5), p=p_val, nstreams=3),
+                R.dropout(x, keep_prob=.6, nstreams=5)],
+                mode=theano.Mode(linker=linker))
+        outs.append(f(x_val) + f(x_val))
+    for py_val, c_val in zip(*outs):
+        assert numpy.allclose(py_val, c_val)
+
+
+def test_binomial_fused():
+    R = MRG_RandomStreams(234, use_cuda=False)
+    p = tensor.col()
+    size = (500, 50)
+    b = R.binomial(size=size, p=p, nstreams=30, dtype='int8')
+    assert b.dtype == 'int8'
+    f = theano.function([p], b, mode=mode)
+    p_val = numpy.linspace(0.1, 0.9, size[0]).astype(config.floatX)[:, None]
+    out = f(p_val)
+    assert set(numpy.unique(out)) <= set([0, 1])
+    # Each row has its own probability.
+    assert abs(out.mean(axis=1) - p_val[:, 0]).mean() < 0.05
+
+
+def test_dropout():
+    R = MRG_RandomStreams(234, use_cuda=False)
+    x = tensor.matrix()
+    keep_prob = .7
+    y = R.dropout(x, keep_prob=keep_prob, nstreams=10)
+    g = theano.grad((y * 3).sum(), x)
+    f = theano.function([x], [y, g], mode=mode)
+    x_val = numpy.random.RandomState(utt.fetch_seed()).uniform(
+            1, 2, size=(300, 40)).astype(config.floatX)
+    y_val, g_val = f(x_val)
+    kept = y_val != 0
+    assert abs(kept.mean() - keep_prob) < 0.02
+    assert numpy.allclose(y_val[kept], x_val[kept] / keep_prob)
+    # The gradient uses the same mask as the output.
+    assert numpy.allclose(g_val, kept * 3 / keep_prob)
+    # The next call draws another mask.
+    assert numpy.any((f(x_val)[0] != 0) != kept)
+
+
+def test_substream_rstates():
+    # The batched jumps give the same states as jumping one by one.
+    R = MRG_RandomStreams(234, use_cuda=False)
+    rstates = R.get_substream_rstates(13, inc_rstate=False)
+    rstate = R.rstate
+    for i in range(13):
+        assert numpy.all(rstates[i] == rstate)
+        rstate = rng_mrg.ff_2p72(rstate)
+    assert rstates.dtype == 'int32'
+
+
+def test_workers():
+    # Worker w of n starts at stream w, and then skips n streams.
+    R = MRG_RandomStreams(234, use_cuda=False)
+    stream_starts = [R.rstate]
+    for i in range(5):
+        R.inc_rstate()
+        stream_starts.append(R.rstate)
+    for w in range(3):
+        Rw = MRG_RandomStreams(234, use_cuda=False, worker_id=w,
+                               num_workers=3)
+        assert numpy.all(Rw.rstate == stream_starts[w])
+        Rw.inc_rstate()
+        assert numpy.all(Rw.rstate == stream_starts[w + 3])
+    for w, n in [(3, 3), (-1, 3), (0, 0)]:
+        try:
+            MRG_RandomStreams(234, worker_id=w, num_workers=n)
+            assert False
+        except ValueError:
+            pass
@@ -0,0 +1,197 @@
+import numpy
+
+import theano
+from theano import tensor, config
+from theano.sandbox.rng_philox import (PhiloxRandomStreams, philox4x32,
+        philox_uniform, philox_uniform_values)
+from theano.tests import unittest_tools as utt
+
+mode = theano.compile.mode.get_default_mode()
+
+
+def tensor_type(dtype, ndim):
+    return tensor.TensorType(dtype, (False,) * ndim)
+
+
+def test_philox4x32_known_answers():
+    # Known answers of Philox4x32-10 from the Random123 distribution.
+    kat = [((0, 0, 0, 0), (0, 0),
+            (0x6627e8d5, 0xe169c58d, 0xbc57ac4c, 0x9b00dbd8)),
+           ((0xffffffff,) * 4, (0xffffffff,) * 2,
+            (0x408f276d, 0x41c83b0e, 0xa20bc7c6, 0x6d5451fd)),
+           ((0x243f6a88, 0x85a308d3, 0x13198a2e, 0x03707344),
+            (0xa4093822, 0x299f31d0),
+            (0xd16cfe09, 0x94fdcceb, 0x5001e420, 0x24126ea1))]
+    for ctr, key, expected in kat:
+        got = [int(w) for w in philox4x32(ctr, key)]
+        assert got == list(expected), (got, expected)
+
+
+def test_uniform_values():
+    rstate = numpy.asarray([5, 0, 7, 0, 12345, 0], dtype='uint32')
+    u, new = philox_uniform_values(rstate, 6, 'float64')
+    assert numpy.all(new == [8, 0, 7, 0, 12345, 0])
+    # The state was not modified.
+    assert rstate[0] == 5
+    # Drawing in two steps gives the same values as in one.
+    u1, new1 = philox_uniform_values(rstate, 4, 'float64')
+    u2, new2 = philox_uniform_values(new1, 2, 'float64')
+    assert numpy.all(numpy.concatenate([u1, u2]) == u)
+    assert numpy.all(new2 == new)
+
+    u32, new32 = philox_uniform_values(rstate, 7, 'float32')
+    assert numpy.all(new32 == [7, 0, 7, 0, 12345, 0])
+    assert u32.dtype == 'float32'
+    assert numpy.allclose(u32[[0, 2]], u[:2], atol=2 ** -22)
+
+
+def test_c_matches_python():
+    rstate = theano.shared(numpy.asarray([2 ** 32 - 2, 3, 1, 0, 42, 7],
+                                         dtype='uint32'))
+    size = tensor.ivector()
+    for dtype in ['float32', 'float64']:
+        for openmp in [False, True]:
+            op = philox_uniform(tensor_type(dtype, 2), openmp=openmp)
+            new_rstate, u = op(rstate, size)
+            outs = []
+            for linker in ['py', 'c']:
+                f = theano.function([size], [new_rstate, u],
+                        mode=theano.Mode(linker=linker, optimizer=None))
+                outs.append(f(numpy.asarray([13, 9], dtype='int32')))
+            (r_py, u_py), (r_c, u_c) = outs
+            assert numpy.all(r_py == r_c)
+            assert numpy.all(u_py == u_c)
+            # The block counter carried into its high word.
+            assert r_c[1] == 4
+            assert u_c.shape == (13, 9)
+            assert 0 < u_c.min() and u_c.max() < 1
+
+
+def test_openmp_deterministic():
+    # The sample does not depend on how the blocks are split between
+    # threads.
+    rstate = numpy.asarray([0, 0, 3, 0, 1, 2], dtype='uint32')
+    size = numpy.asarray([1001], dtype='int32')
+    outs = []
+    for openmp in [False, True]:
+        op = philox_uniform(tensor_type(config.floatX, 1), openmp=openmp)
+        f = theano.function([], op(theano.shared(rstate.copy()), size)[1])
+        outs.append(f())
+    assert numpy.all(outs[0] == outs[1])
+    expected = philox_uniform_values(rstate, 1001, config.floatX)[0]
+    assert numpy.all(outs[0] == expected)
+
+
+def test_streams_deterministic():
+    seed = utt.fetch_seed()
+    R = PhiloxRandomStreams(seed=seed)
+    u = R.uniform(size=(10, 20))
+    f = theano.function([], u)
+    fsample1 = f()
+    fsample2 = f()
+    assert not numpy.allclose(fsample1, fsample2)
+
+    R2 = PhiloxRandomStreams(seed=seed)
+    u2 = R2.uniform(size=(10, 20))
+    g = theano.function([], u2)
+    assert numpy.allclose(fsample1, g())
+    assert numpy.allclose(fsample2, g())
+
+    # Each variable has its own stream.
+    v = R2.uniform(size=(10, 20))
+    assert not numpy.allclose(theano.function([], v)(), fsample1)
+
+    # seed() restarts all the streams.
+    R.seed()
+    assert numpy.allclose(f(), fsample1)
+    R.seed(seed + 1)
+    assert not numpy.allclose(f(), fsample1)
+
+
+def test_streams_inplace():
+    R = PhiloxRandomStreams(234)
+    f = theano.function([], R.uniform(size=(5,)), mode=mode)
+    ops = [node.op for node in f.maker.fgraph.toposort()
+           if isinstance(node.op, philox_uniform)]
+    assert len(ops) == 1
+    if theano.config.mode != 'FAST_COMPILE':
+        assert ops[0].inplace
+
+
+def test_streams_distributions():
+    R = PhiloxRandomStreams(utt.fetch_seed())
+    size = (200, 150)
+
+    u = theano.function([], R.uniform(size=size, low=-2, high=3))()
+    assert u.shape == size
+    assert -2 < u.min() and u.max() < 3
+    assert abs(u.mean() - 0.5) < 0.05
+
+    n = theano.function([], R.normal(size=size, avg=1, std=2))()
+    assert n.shape == size
+    assert abs(n.mean() - 1) < 0.05
+    assert abs(n.std() - 2) < 0.05
+
+    b = theano.function([], R.binomial(size=size, p=0.3))()
+    assert b.shape == size
+    assert set(numpy.unique(b)) <= set([0, 1])
+    assert abs(b.mean() - 0.3) < 0.01
+
+    b5 = theano.function([], R.binomial(size=size, n=5, p=0.3))()
+    assert b5.shape == size
+    assert b5.min() >= 0 and b5.max() <= 5
+    assert abs(b5.mean() - 1.5) < 0.05
+
+    pvals = numpy.asarray([[.98, .01, .01], [.01, .98, .01]] * 500,
+                          dtype=config.floatX)
+    m = theano.function([], R.multinomial(pvals=pvals))()
+    assert m.shape == pvals.shape
+    assert numpy.all(m.sum(axis=1) == 1)
+    assert abs(m.argmax(axis=1) - pvals.argmax(axis=1)).mean() < 0.05
+
+
+def test_symbolic_size():
+    R = PhiloxRandomStreams(utt.fetch_seed())
+    x = tensor.matrix()
+    odd = numpy.zeros((3, 5), dtype=config.floatX)
+    f = theano.function([x], [R.uniform(size=x.shape),
+                              R.normal(size=x.shape),
+                              R.binomial(size=x.shape, n=3)])
+    for out in f(odd):
+        assert out.shape == (3, 5)
+
+
+def test_bad_args():
+    R = PhiloxRandomStreams(0)
+    for seed in [-1, 2 ** 64]:
+        try:
+            PhiloxRandomStreams(seed)
+            assert False
+        except ValueError:
+            pass
+    try:
+        R.uniform(size=(2, 0))
+        assert False
+    except ValueError:
+        pass
+    try:
+        R.uniform(size=(2,), dtype='int32')
+        assert False
+    except TypeError:
+        pass
+
+
+def test_workers():
+    # Worker w of n gets the streams w, w + n, ...
+    R = PhiloxRandomStreams(5)
+    values = [theano.function([], R.uniform(size=(4,)))() for i in range(6)]
+    for w in range(3):
+        Rw = PhiloxRandomStreams(5, worker_id=w, num_workers=3)
+        for k in range(2):
+            u = theano.function([], Rw.uniform(size=(4,)))()
+            assert numpy.all(u == values[k * 3 + w])
+    try:
+        PhiloxRandomStreams(5, worker_id=3, num_workers=3)
+        assert False
+    except ValueError:
+        pass
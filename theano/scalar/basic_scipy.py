@@ -9,18 +9,31 @@ from theano.scalar.basic import (upgrade_to_float_no_complex,
                                  complex_types,
                                  upcast)
 
-imported_scipy_special = False
-try:
-    import scipy.special
-    imported_scipy_special = True
-except ImportError:
-    pass
+# scipy.special, False if it can't be imported, or None before the first
+# call to _scipy_special.
+_special = None
+
+
+def _scipy_special():
+    """Return scipy.special, or None if scipy is not available.
+
+    Importing scipy is slow, so it is only done the first time one of the
+    Python implementations below is used.
+    """
+    global _special
+    if _special is None:
+        try:
+            import scipy.special
+            _special = scipy.special
+        except ImportError:
+            _special = False
+    return _special or None
 
 
 class Erf(UnaryScalarOp):
     def impl(self, x):
-        if imported_scipy_special:
-            return scipy.special.erf(x)
+        if _scipy_special():
+            return _scipy_special().erf(x)
         else:
             super(Erf, self).impl(x)
 
@@ -47,8 +60,8 @@ erf = Erf(upgrade_to_float, name='erf')
 
 class Erfc(UnaryScalarOp):
     def impl(self, x):
-        if imported_scipy_special:
-            return scipy.special.erfc(x)
+        if _scipy_special():
+            return _scipy_special().erfc(x)
         else:
             super(Erfc, self).impl(x)
 
@@ -81,7 +94,7 @@ class GammaLn(UnaryScalarOp):
     """
     @staticmethod
     def st_impl(x):
-        return scipy.special.gammaln(x)
+        return _scipy_special().gammaln(x)
 
     def impl(self, x):
         return GammaLn.st_impl(x)
@@ -113,7 +126,7 @@ class Psi(UnaryScalarOp):
     """
     @staticmethod
     def st_impl(x):
-        return scipy.special.psi(x)
+        return _scipy_special().psi(x)
 
     def impl(self, x):
         return Psi.st_impl(x)
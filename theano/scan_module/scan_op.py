@@ -1063,6 +1063,28 @@ class Scan(PureOp):
         self.t_call = t_call
         self.t_fn = t_fn
 
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        # The shapes of the inner graph are not known from the outer ones:
+        # use those recorded by the profile of the inner function, if any,
+        # and its average number of steps per call.
+        profile = getattr(getattr(self, 'fn', None), 'maker', None)
+        profile = getattr(profile, 'profile', None)
+        if not profile or not profile.callcount:
+            return PureOp.cost(self, node, input_shapes, output_shapes,
+                               input_nnz)
+        flops = read = written = 0
+        for inner_node in self.fn.maker.fgraph.toposort():
+            cost = profile.node_cost(inner_node)
+            if cost is None:
+                return PureOp.cost(self, node, input_shapes, output_shapes,
+                                   input_nnz)
+            # Count the flops that are known.
+            flops += cost[0] or 0
+            read += cost[1]
+            written += cost[2]
+        n_steps = profile.nbsteps / profile.callcount
+        return (flops * n_steps, read * n_steps, written * n_steps)
+
     ### Infer Shape
     def infer_shape(self, node, input_shapes):
         # input_shapes correspond to the shapes of node.inputs
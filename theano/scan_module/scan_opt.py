@@ -1190,3 +1190,68 @@ scan_seqopt.register('scanOp_merge_inouts',
                      3,
                      'fast_run',
                      'scan')
+
+
+@gof.local_optimizer([None])
+def scan_batched_dot(node):
+    """
+    Replace a scan whose only output is the product of matrix slices by a
+    single batched product:
+
+        scan(lambda a, b: dot(a, b), sequences=[A, B])
+            -> batched_dot(A[:n_steps], B[:n_steps])
+        scan(lambda a: dot(a, W), sequences=[A], non_sequences=[W])
+            -> dot(A[:n_steps].reshape((-1, K)), W).reshape((n_steps, M, N))
+
+    This removes the per-step python and thunk overhead of the scan.
+    """
+    if not isinstance(node.op, scan_op.Scan):
+        return False
+    op = node.op
+    if (op.as_while or len(node.outputs) != 1 or op.n_nit_sot != 1 or
+            op.n_mit_mot or op.n_mit_sot or op.n_sit_sot or
+            op.n_shared_outs):
+        return False
+
+    a = scan_args(node.inputs, node.outputs,
+                  op.inputs, op.outputs, op.info)
+    out, = a.inner_out_nit_sot
+    if not (out.owner and out.owner.op == tensor.dot):
+        return False
+    n_steps = a.n_steps
+
+    def outer_of(var):
+        # Return ('seq', outer) or ('non_seq', outer) for an inner input
+        if var in a.inner_in_seqs:
+            return 'seq', a.outer_in_seqs[a.inner_in_seqs.index(var)]
+        if var in a.inner_in_non_seqs:
+            return ('non_seq',
+                    a.outer_in_non_seqs[a.inner_in_non_seqs.index(var)])
+        return None, None
+
+    x, y = out.owner.inputs
+    if x.ndim != 2 or y.ndim != 2:
+        return False
+    kx, ox = outer_of(x)
+    ky, oy = outer_of(y)
+    if kx != 'seq' or ky not in ('seq', 'non_seq'):
+        return False
+    if ox.dtype != oy.dtype or ox.dtype not in ('float32', 'float64'):
+        return False
+
+    ox = ox[:n_steps]
+    if ky == 'seq':
+        rval = tensor.batched_dot(ox, oy[:n_steps])
+    else:
+        rval = tensor.dot(ox.reshape((ox.shape[0] * ox.shape[1],
+                                      ox.shape[2])), oy)
+        rval = rval.reshape((ox.shape[0], ox.shape[1], oy.shape[1]))
+    if rval.type.dtype != node.outputs[0].type.dtype:
+        return False
+    return [tensor.patternbroadcast(rval, node.outputs[0].broadcastable)]
+
+scan_seqopt.register('scanOp_batched_dot',
+                     opt.in2out(scan_batched_dot, ignore_newtrees=True),
+                     3.5,
+                     'fast_run',
+                     'scan')
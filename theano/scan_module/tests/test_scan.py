@@ -3023,6 +3023,29 @@ class T_Scan(unittest.TestCase):
                          dtype=theano.config.floatX)
         assert numpy.allclose(f(vx, vA), vR)
 
+    def test_batched_dot_opt(self):
+        """
+        Verify that a scan computing one dot per step over two sequences
+        is replaced by a single BatchedDot.
+        """
+        A = theano.tensor.tensor3('A')
+        B = theano.tensor.tensor3('B')
+
+        z, updates = theano.scan(theano.dot, sequences=[A, B])
+        f = theano.function([A, B], z, mode=mode_with_opt)
+        topo = f.maker.fgraph.toposort()
+        if theano.config.mode != "FAST_COMPILE":
+            assert any([isinstance(node.op, tensor.blas.BatchedDot)
+                        for node in topo])
+            assert not any([isinstance(node.op, theano.scan_module.scan_op.Scan)
+                            for node in topo])
+
+        rng = numpy.random.RandomState(utt.fetch_seed())
+        vA = rng.uniform(size=(4, 2, 3)).astype(theano.config.floatX)
+        vB = rng.uniform(size=(4, 3, 5)).astype(theano.config.floatX)
+        vR = numpy.asarray([numpy.dot(a, b) for a, b in zip(vA, vB)])
+        assert numpy.allclose(f(vA, vB), vR)
+
     def test_savemem_opt(self):
         y0 = theano.shared(numpy.ones((2, 10)))
         [y1, y2], updates = theano.scan(lambda y: [y, y],
@@ -15,6 +15,7 @@ import theano
 import scipy.sparse
 
 from theano import gof, tensor, compile, scalar, config
+from theano.configparser import AddConfigVar, IntParam
 from theano.gof.python25 import all
 from theano.tensor import blas
 from theano.sparse.utils import hash_from_sparse
@@ -22,6 +23,17 @@ import theano.tests.unittest_tools as utt
 
 sparse_formats = ['csc', 'csr']
 
+AddConfigVar('sparse.num_threads',
+        "Number of OpenMP threads used by the C implementations of the "
+        "sparse-dense products (StructuredDotCSC, StructuredDotCSR, "
+        "UsmmCscDense, SamplingDotCSR and its gradient). 0 lets OpenMP "
+        "decide (e.g. from OMP_NUM_THREADS), "
+        "1 (the default) uses the single-threaded kernels and does not "
+        "rewrite the sparse-dense dots to them. Ignored when config.openmp "
+        "is False. The value is read when a function is compiled.",
+        IntParam(1, lambda i: i >= 0),
+        in_c_key=False)
+
 
 #TODO: move this decorator to the compile submodule
 def register_specialize(lopt, *tags, **kwargs):
@@ -90,6 +102,29 @@ def _is_dense(x):
     return isinstance(x, numpy.ndarray)
 
 
+def _sparse_dot_cost(node, x, y, input_shapes, output_shapes, input_nnz):
+    """Return the (flops, bytes read, bytes written) of the product of
+    the inputs `x` and `y` of `node` (indices), one of them sparse.
+
+    There is a multiplication and an addition per stored element of the
+    sparse operand and column (or row) of the other one.
+    """
+    if input_nnz is None:
+        input_nnz = [None] * len(node.inputs)
+    xshp, yshp = input_shapes[x], input_shapes[y]
+    flops = None
+    if input_nnz[x] is not None and yshp is not None:
+        flops = 2 * input_nnz[x]
+        if node.inputs[y].ndim == 2:
+            flops *= yshp[1]
+    elif input_nnz[y] is not None and xshp is not None:
+        flops = 2 * input_nnz[y]
+        if node.inputs[x].ndim == 2:
+            flops *= xshp[0]
+    return (flops,) + gof.op.default_cost_bytes(node, input_shapes,
+                                                output_shapes, input_nnz)
+
+
 def _kmap_eq(a, b):
     if a is None and b is None:
         return True
@@ -177,6 +212,11 @@ def verify_grad_sparse(op, pt, structured=False, *args, **kwargs):
             return CSC(spdata, ind, indptr, shp)
         return f
 
+    def conv_bsr(ind, indptr, shp):
+        def f(spdata):
+            return BSR(spdata, ind, indptr, shp)
+        return f
+
     iconv = []
     dpt = []
 
@@ -198,6 +238,8 @@ def verify_grad_sparse(op, pt, structured=False, *args, **kwargs):
                                           p.shape))
                 else:
                     iconv.append(csc_from_dense)
+            elif p.format == 'bsr' and structured:
+                iconv.append(conv_bsr(p.indices, p.indptr, p.shape))
             else:
                 raise NotImplementedError("No conv for %s" % (p.format,))
         else:
@@ -234,6 +276,9 @@ def constant(x, name=None):
 
 def sp_ones_like(x):
     # TODO: don't restrict to CSM formats
+    if x.format == 'bsr':
+        data, indices, indptr, shape = bsm_properties(x)
+        return BSR(tensor.ones_like(data), indices, indptr, shape)
     data, indices, indptr, shape = csm_properties(x)
     return CSM(format=x.format)(tensor.ones_like(data), indices, indptr, shape)
 
@@ -384,7 +429,8 @@ class SparseType(gof.Type):
     have dimension 2.
     """
     format_cls = {'csr': scipy.sparse.csr_matrix,
-                  'csc': scipy.sparse.csc_matrix}
+                  'csc': scipy.sparse.csc_matrix,
+                  'bsr': scipy.sparse.bsr_matrix}
     dtype_set = set(['int8', 'int16', 'int32', 'int64', 'float32',
                      'float64', 'complex64', 'complex128'])
     ndim = 2
@@ -512,6 +558,10 @@ def csr_matrix(name=None, dtype=None):
     return matrix('csr', name, dtype)
 
 
+def bsr_matrix(name=None, dtype=None):
+    return matrix('bsr', name, dtype)
+
+
 # for more dtypes, call SparseType(format, dtype)
 csc_dmatrix = SparseType(format='csc', dtype='float64')
 csr_dmatrix = SparseType(format='csr', dtype='float64')
@@ -961,6 +1011,338 @@ class CSMGradC(gof.Op):
 csm_grad_c = CSMGradC()
 
 
+class BSMProperties(gof.Op):
+    """Extract .data, .indices, .indptr and .shape of a BSR matrix.
+
+    :param bsm: Sparse matrix in BSR format.
+
+    :return: (data, indices, indptr, shape), the properties
+             of `bsm`. `data` is a 3d tensor holding the blocks, of
+             shape (number of blocks,) + blocksize.
+
+    :note:
+    - The grad implemented is regular, i.e. not structured.
+    - `infer_shape` method is not available for this op, see
+      CSMProperties.
+    """
+
+    view_map = {0: [0], 1: [0], 2: [0]}
+
+    def __eq__(self, other):
+        return type(self) == type(other)
+
+    def __hash__(self):
+        return hash(type(self))
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    def make_node(self, bsm):
+        bsm = as_sparse_variable(bsm)
+        if bsm.type.format != 'bsr':
+            raise TypeError('BSMProperties needs a bsr matrix', bsm.type)
+        data = tensor.TensorType(dtype=bsm.type.dtype,
+                                 broadcastable=(False,) * 3).make_variable()
+        return gof.Apply(self, [bsm],
+                [data, tensor.ivector(), tensor.ivector(), tensor.ivector()])
+
+    def perform(self, node, (bsm,), out):
+        out[0][0] = bsm.data
+        out[1][0] = theano._asarray(bsm.indices, dtype='int32')
+        out[2][0] = theano._asarray(bsm.indptr, dtype='int32')
+        out[3][0] = theano._asarray(bsm.shape, dtype='int32')
+
+    def grad(self, (bsm,), g):
+        assert [gg is None for gg in g[1:]]
+        data, indices, indptr, shape = bsm_properties(bsm)
+        return [BSR(g[0], indices, indptr, shape)]
+# don't make this a function or it breaks some optimizations
+bsm_properties = BSMProperties()
+
+
+class BSM(gof.Op):
+    """Construct a BSR (block sparse row) matrix from its internal
+    representation.
+
+    :param data: Three dimensionnal tensor holding the dense blocks, of
+                 shape (number of blocks, R, C). (R, C) is the blocksize.
+    :param indices: One dimensionnal tensor of integers, the block column
+                    of each block.
+    :param indptr: One dimensionnal tensor of integers, where the blocks
+                   of each row of blocks start in `data` and `indices`.
+    :param shape: One dimensionnal tensor of integers representing the
+                  shape of the sparse matrix to construct. It must be a
+                  multiple of the blocksize.
+
+    :return: A sparse matrix in BSR format.
+
+    :note:
+    - The grad with respect to `data` is regular, i.e. not structured.
+    """
+
+    def __eq__(self, other):
+        return type(self) == type(other)
+
+    def __hash__(self):
+        return hash(type(self))
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    def make_node(self, data, indices, indptr, shape):
+        data = tensor.as_tensor_variable(data)
+
+        if not isinstance(indices, tensor.TensorVariable):
+            indices = theano._asarray(indices, dtype='int32')
+        if not isinstance(indptr, tensor.TensorVariable):
+            indptr = theano._asarray(indptr, dtype='int32')
+        if not isinstance(shape, tensor.TensorVariable):
+            shape = theano._asarray(shape, dtype='int32')
+        indices = tensor.as_tensor_variable(indices)
+        indptr = tensor.as_tensor_variable(indptr)
+        shape = tensor.as_tensor_variable(shape)
+
+        if data.type.ndim != 3:
+            raise TypeError('data argument must be a 3d tensor', data.type,
+                            data.type.ndim)
+        if indices.type.ndim != 1 or indices.type.dtype not in discrete_dtypes:
+            raise TypeError('indices must be vector of integers', indices,
+                            indices.type)
+        if indptr.type.ndim != 1 or indptr.type.dtype not in discrete_dtypes:
+            raise TypeError('indptr must be vector of integers', indptr,
+                            indptr.type)
+        if shape.type.ndim != 1 or shape.type.dtype not in discrete_dtypes:
+            raise TypeError('shape must be vector of integers', shape,
+                            shape.type)
+
+        return gof.Apply(self,
+                         [data, indices, indptr, shape],
+                         [SparseType(dtype=data.type.dtype,
+                                     format='bsr').make_variable()])
+
+    def perform(self, node, (data, indices, indptr, shape), (out,)):
+        if len(shape) != 2:
+            raise ValueError('Shape should be an array of length 2')
+        if data.shape[0] != indices.shape[0]:
+            raise ValueError('data (shape %s) must have one block for each '
+                             'element of indices (shape %s)' %
+                             (data.shape, indices.shape))
+        out[0] = scipy.sparse.bsr_matrix((data, indices.copy(),
+                                          indptr.copy()),
+                                         shape=tuple(shape), copy=False)
+
+    def grad(self, (x_data, x_indices, x_indptr, x_shape), (g_out,)):
+        g_data = bsm_grad(x_data, x_indices, x_indptr, g_out)
+        return [g_data, None, None, None]
+
+    def infer_shape(self, node, shapes):
+        return [(node.inputs[3][0], node.inputs[3][1])]
+
+BSR = BSM()
+
+
+class BSMGrad(gof.op.Op):
+    # The gradient of BSM with respect to its data: the blocks of the
+    # gradient of the output that are at the position of the blocks of
+    # the input.
+
+    # :param x_data, x_indices, x_indptr: The structure of the input.
+    # :param g_out: The gradient of the output, sparse or dense.
+
+    # :return: A 3d tensor of the shape of `x_data`.
+
+    def __eq__(self, other):
+        return type(self) == type(other)
+
+    def __hash__(self):
+        return hash(type(self))
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    def make_node(self, x_data, x_indices, x_indptr, g_out):
+        x_data = tensor.as_tensor_variable(x_data)
+        if not _is_sparse_variable(g_out):
+            g_out = tensor.as_tensor_variable(g_out)
+        return gof.Apply(self, [x_data, x_indices, x_indptr, g_out],
+                         [tensor.TensorType(
+                             dtype=g_out.type.dtype,
+                             broadcastable=(False,) * 3).make_variable()])
+
+    def perform(self, node, (x_data, x_indices, x_indptr, g_out), (out,)):
+        R, C = x_data.shape[1:]
+        dtype = node.outputs[0].type.dtype
+        if (_is_sparse(g_out) and g_out.format == 'bsr' and
+                g_out.blocksize == (R, C) and
+                g_out.indices.shape == x_indices.shape and
+                numpy.all(g_out.indptr == x_indptr) and
+                numpy.all(g_out.indices == x_indices)):
+            # Same structure, the common case.
+            out[0] = theano._asarray(g_out.data, dtype=dtype).copy()
+            return
+        if _is_sparse(g_out):
+            g_out = g_out.toarray()
+        M, N = g_out.shape
+        blocks = g_out.reshape(M // R, R, N // C, C).transpose(0, 2, 1, 3)
+        rows = numpy.repeat(numpy.arange(len(x_indptr) - 1),
+                            numpy.diff(x_indptr))
+        out[0] = theano._asarray(blocks[rows, x_indices], dtype=dtype)
+
+    def infer_shape(self, node, shapes):
+        return [shapes[0]]
+bsm_grad = BSMGrad()
+
+
+# Helpers for the Ops that work directly on the data, indices and indptr
+# arrays of a CSC or CSR matrix (as returned by csm_properties). They are
+# inserted by the optimizations in opt.py, in place of Ops whose perform
+# goes through scipy.sparse. The `outer` dimension of a matrix is the
+# compressed one, i.e. the rows of a CSR matrix or the columns of a CSC
+# matrix, and the `inner` dimension is the other one.
+
+# Shared by all those Ops, so that it is included only once in a module.
+_csx_support_code = """
+// Clip a slice bound like Python does for a step of 1.
+static npy_intp csx_slice_bound(npy_int64 v, npy_intp n)
+{
+    if (v < 0)
+    {
+        v += n;
+        if (v < 0)
+            v = 0;
+    }
+    else if (v > n)
+        v = n;
+    return v;
+}
+"""
+
+
+def _csx_c_check(val, ind, ptr, fail):
+    """Return C code checking the data, indices and indptr arrays of a
+    CSC or CSR matrix, and that indptr is a valid index into the two
+    others."""
+    return """
+    if (%(val)s->nd != 1 || %(ind)s->nd != 1 || %(ptr)s->nd != 1)
+    {PyErr_SetString(PyExc_ValueError, "data, indices and indptr must be vectors"); %(fail)s;}
+    if (%(ind)s->descr->type_num != PyArray_INT32 || %(ptr)s->descr->type_num != PyArray_INT32)
+    {PyErr_SetString(PyExc_NotImplementedError, "indices and indptr must be int32"); %(fail)s;}
+    if (%(val)s->dimensions[0] != %(ind)s->dimensions[0])
+    {PyErr_SetString(PyExc_ValueError, "data and indices have different lengths"); %(fail)s;}
+    if (%(ptr)s->dimensions[0] < 1)
+    {PyErr_SetString(PyExc_ValueError, "indptr is empty"); %(fail)s;}
+    {
+        const npy_intp S = %(ptr)s->strides[0] / %(ptr)s->descr->elsize;
+        const npy_int32* P = (npy_int32*)%(ptr)s->data;
+        const npy_intp n = %(ptr)s->dimensions[0] - 1;
+        int ok = P[0] >= 0 && P[n * S] <= %(ind)s->dimensions[0];
+        for (npy_intp i = 0; ok && i < n; ++i)
+            ok = P[i * S] <= P[(i + 1) * S];
+        if (!ok)
+        {PyErr_SetString(PyExc_ValueError, "invalid indptr"); %(fail)s;}
+    }
+    """ % locals()
+
+
+def _csx_c_shape_check(shape, fail):
+    """Return C code checking the shape vector of a sparse matrix."""
+    return """
+    if (%(shape)s->nd != 1 || %(shape)s->dimensions[0] != 2 ||
+        %(shape)s->descr->type_num != PyArray_INT32)
+    {PyErr_SetString(PyExc_ValueError, "the shape must be an int32 vector of length 2"); %(fail)s;}
+    """ % locals()
+
+
+def _csx_c_vars(prefix, val, ind, ptr):
+    """Return C code declaring pointers and strides (in elements) to the
+    data, indices and indptr arrays of a CSC or CSR matrix, and its size
+    along the outer dimension."""
+    return """
+    const dtype_%(val)s* const %(prefix)s_val = (dtype_%(val)s*)%(val)s->data;
+    const npy_int32* const %(prefix)s_ind = (npy_int32*)%(ind)s->data;
+    const npy_int32* const %(prefix)s_ptr = (npy_int32*)%(ptr)s->data;
+    const npy_intp %(prefix)s_Sval = %(val)s->strides[0] / %(val)s->descr->elsize;
+    const npy_intp %(prefix)s_Sind = %(ind)s->strides[0] / %(ind)s->descr->elsize;
+    const npy_intp %(prefix)s_Sptr = %(ptr)s->strides[0] / %(ptr)s->descr->elsize;
+    const npy_intp %(prefix)s_nouter = %(ptr)s->dimensions[0] - 1;
+    """ % locals()
+
+
+def _csx_c_dims(prefix, shape, format):
+    """Return C code declaring the sizes of a matrix along its outer and
+    inner dimensions, read from its shape vector."""
+    outer, inner = 0, 1
+    if format == 'csc':
+        outer, inner = 1, 0
+    return """
+    const npy_intp %(prefix)s_douter = *(npy_int32*)PyArray_GETPTR1(%(shape)s, %(outer)s);
+    const npy_intp %(prefix)s_dinner = *(npy_int32*)PyArray_GETPTR1(%(shape)s, %(inner)s);
+    """ % locals()
+
+
+def _csx_c_alloc(out, size, typenum, fail):
+    """Return C code replacing `out` by a new vector of `size` elements.
+
+    The outputs are always new arrays: the matrices built from them may
+    still be used after the next call.
+    """
+    return """
+    Py_XDECREF(%(out)s);
+    {
+        npy_intp dims[] = {0};
+        dims[0] = %(size)s;
+        %(out)s = (PyArrayObject*) PyArray_SimpleNew(1, dims, %(typenum)s);
+    }
+    if (!%(out)s)
+        %(fail)s;
+    """ % locals()
+
+
+def _csx_c_shape_out(out, outer, inner, format, fail):
+    """Return C code setting `out` to the shape vector of a matrix."""
+    first, second = outer, inner
+    if format == 'csc':
+        first, second = inner, outer
+    return _csx_c_alloc(out, 2, 'PyArray_INT32', fail) + """
+    ((npy_int32*)%(out)s->data)[0] = %(first)s;
+    ((npy_int32*)%(out)s->data)[1] = %(second)s;
+    """ % locals()
+
+
+def _csx_from_arrays(format, val, ind, ptr, shape):
+    """Return the scipy matrix with the given properties, without copy."""
+    cls = {'csr': scipy.sparse.csr_matrix,
+           'csc': scipy.sparse.csc_matrix}[format]
+    return cls((val, ind, ptr), tuple(shape), copy=False)
+
+
+class _CSxOp(gof.Op):
+    # Base class of the Ops working on the data, indices and indptr arrays
+    # of a sparse matrix.
+
+    # :param format: 'csr' or 'csc', the format of the matrices.
+
+    def __init__(self, format):
+        if format not in ('csr', 'csc'):
+            raise ValueError("format must be one of: 'csr', 'csc'", format)
+        self.format = format
+
+    def __eq__(self, other):
+        return type(self) == type(other) and self.format == other.format
+
+    def __hash__(self):
+        return hash(type(self)) ^ hash(self.format)
+
+    def __str__(self):
+        return '%s{%s}' % (self.__class__.__name__, self.format)
+
+    def c_support_code(self):
+        return _csx_support_code
+
+    def c_code_cache_version(self):
+        return (1,)
+
+
 class Cast(gof.op.Op):
     """Cast sparse variable to the desired dtype.
 
@@ -1067,6 +1449,12 @@ class DenseFromSparse(gof.op.Op):
             out[0] = x.toarray()
         assert _is_dense(out[0])
 
+    def R_op(self, inputs, eval_points):
+        # The op is linear.
+        if eval_points[0] is None:
+            return [None]
+        return self.make_node(*eval_points).outputs
+
     def grad(self, (x, ), (gz, )):
         if self.sparse_grad:
             return [sp_ones_like(x) * gz]
@@ -1133,6 +1521,12 @@ class SparseFromDense(gof.op.Op):
     def perform(self, node, (x, ), (out, )):
         out[0] = SparseType.format_cls[self.format](x)
 
+    def R_op(self, inputs, eval_points):
+        # The op is linear.
+        if eval_points[0] is None:
+            return [None]
+        return self.make_node(*eval_points).outputs
+
     def grad(self, (x, ), (gz, )):
         gx = dense_from_sparse(gz)
         gx = tensor.patternbroadcast(gx, x.broadcastable)
@@ -1257,6 +1651,156 @@ class GetItem2d(gof.op.Op):
 get_item_2d = GetItem2d()
 
 
+class GetItem2dCSx(_CSxOp):
+    # Take a slice of a sparse matrix. It is the same as GetItem2d, working
+    # on the data, indices and indptr arrays.
+
+    # :param x_val: The data of the sparse matrix.
+    # :param x_ind: The indices of the sparse matrix.
+    # :param x_ptr: The indptr of the sparse matrix.
+    # :param x_shape: The shape of the sparse matrix.
+    # :param outer_start, outer_stop: Bounds of the slice along the outer
+    #   dimension, with the Python semantic.
+    # :param inner_start, inner_stop: Bounds of the slice along the inner
+    #   dimension.
+
+    # :return: The data, indices, indptr and shape of the slice.
+
+    # :note:
+    # - When the slice takes all of the inner dimension, the data and
+    #   indices returned are views of the inputs.
+    # - This op is used as an optimization of GetItem2d.
+
+    view_map = {0: [0], 1: [1]}
+
+    def make_node(self, x_val, x_ind, x_ptr, x_shape,
+                  outer_start, outer_stop, inner_start, inner_stop):
+        x_val = tensor.as_tensor_variable(x_val)
+        bounds = [tensor.cast(b, 'int64') for b in
+                  (outer_start, outer_stop, inner_start, inner_stop)]
+        return gof.Apply(self, [x_val, x_ind, x_ptr, x_shape] + bounds,
+                         [x_val.type(), tensor.ivector(), tensor.ivector(),
+                          tensor.ivector()])
+
+    def perform(self, node, inputs, (z_val, z_ind, z_ptr, z_shape)):
+        x_val, x_ind, x_ptr, x_shape = inputs[:4]
+        douter, dinner = [int(d) for d in x_shape]
+        if self.format == 'csc':
+            douter, dinner = dinner, douter
+        o0, o1, i0, i1 = [int(b) for b in inputs[4:]]
+        o0, o1 = slice(o0, o1).indices(douter)[:2]
+        i0, i1 = slice(i0, i1).indices(dinner)[:2]
+        o1 = max(o0, o1)
+        i1 = max(i0, i1)
+        b, e = x_ptr[o0], x_ptr[o1]
+        if i0 == 0 and i1 == dinner:
+            z_val[0] = x_val[b:e]
+            z_ind[0] = x_ind[b:e]
+            ptr = x_ptr[o0:o1 + 1] - b
+        else:
+            ind = x_ind[b:e]
+            mask = (ind >= i0) & (ind < i1)
+            rows = numpy.repeat(numpy.arange(o1 - o0),
+                                numpy.diff(x_ptr[o0:o1 + 1]))
+            counts = numpy.bincount(rows[mask], minlength=o1 - o0)
+            z_val[0] = x_val[b:e][mask]
+            z_ind[0] = theano._asarray(ind[mask] - i0, dtype='int32')
+            ptr = numpy.concatenate([[0], numpy.cumsum(counts)])
+        z_ptr[0] = theano._asarray(ptr, dtype='int32')
+        shape = [o1 - o0, i1 - i0]
+        if self.format == 'csc':
+            shape.reverse()
+        z_shape[0] = theano._asarray(shape, dtype='int32')
+
+    def c_code(self, node, name, inputs, outputs, sub):
+        x_val, x_ind, x_ptr, x_shape, o0, o1, i0, i1 = inputs
+        z_val, z_ind, z_ptr, z_shape = outputs
+        fail = sub['fail']
+        typenum_z_val = node.outputs[0].type.dtype_specs()[-1]
+        check = (_csx_c_check(x_val, x_ind, x_ptr, fail) +
+                 _csx_c_shape_check(x_shape, fail))
+        x_vars = _csx_c_vars('x', x_val, x_ind, x_ptr)
+        x_dims = _csx_c_dims('x', x_shape, self.format)
+        alloc_ptr = _csx_c_alloc(z_ptr, 'n_out + 1', 'PyArray_INT32', fail)
+        alloc_val = _csx_c_alloc(z_val, 'nnz', typenum_z_val, fail)
+        alloc_ind = _csx_c_alloc(z_ind, 'nnz', 'PyArray_INT32', fail)
+        shape_out = _csx_c_shape_out(z_shape, 'o1 - o0', 'i1 - i0',
+                                     self.format, fail)
+        return """
+        %(check)s
+        {
+            %(x_vars)s
+            %(x_dims)s
+            if (x_nouter != x_douter)
+            {PyErr_SetString(PyExc_ValueError, "indptr doesn't match the shape"); %(fail)s;}
+
+            const npy_intp o0 = csx_slice_bound(((npy_int64*)%(o0)s->data)[0], x_douter);
+            npy_intp o1 = csx_slice_bound(((npy_int64*)%(o1)s->data)[0], x_douter);
+            const npy_intp i0 = csx_slice_bound(((npy_int64*)%(i0)s->data)[0], x_dinner);
+            npy_intp i1 = csx_slice_bound(((npy_int64*)%(i1)s->data)[0], x_dinner);
+            if (o1 < o0)
+                o1 = o0;
+            if (i1 < i0)
+                i1 = i0;
+            const npy_intp n_out = o1 - o0;
+
+            %(alloc_ptr)s
+            npy_int32* const z_ptr = (npy_int32*)%(z_ptr)s->data;
+
+            if (i0 == 0 && i1 == x_dinner)
+            {
+                // The data and indices we want are contiguous, return views.
+                const npy_intp b = x_ptr[o0 * x_Sptr];
+                const npy_intp e = x_ptr[o1 * x_Sptr];
+                Py_XDECREF(%(z_val)s);
+                %(z_val)s = (PyArrayObject*)PySequence_GetSlice((PyObject*)%(x_val)s, b, e);
+                if (!%(z_val)s)
+                    %(fail)s;
+                Py_XDECREF(%(z_ind)s);
+                %(z_ind)s = (PyArrayObject*)PySequence_GetSlice((PyObject*)%(x_ind)s, b, e);
+                if (!%(z_ind)s)
+                    %(fail)s;
+                for (npy_intp k = 0; k <= n_out; ++k)
+                    z_ptr[k] = x_ptr[(o0 + k) * x_Sptr] - b;
+            }
+            else
+            {
+                npy_intp nnz = 0;
+                for (npy_intp k = o0; k < o1; ++k)
+                {
+                    for (npy_intp jj = x_ptr[k * x_Sptr]; jj < x_ptr[(k + 1) * x_Sptr]; ++jj)
+                    {
+                        const npy_intp j = x_ind[jj * x_Sind];
+                        if (j >= i0 && j < i1)
+                            ++nnz;
+                    }
+                }
+                %(alloc_val)s
+                %(alloc_ind)s
+                dtype_%(z_val)s* const z_val = (dtype_%(z_val)s*)%(z_val)s->data;
+                npy_int32* const z_ind = (npy_int32*)%(z_ind)s->data;
+                npy_intp pos = 0;
+                z_ptr[0] = 0;
+                for (npy_intp k = o0; k < o1; ++k)
+                {
+                    for (npy_intp jj = x_ptr[k * x_Sptr]; jj < x_ptr[(k + 1) * x_Sptr]; ++jj)
+                    {
+                        const npy_intp j = x_ind[jj * x_Sind];
+                        if (j >= i0 && j < i1)
+                        {
+                            z_val[pos] = x_val[jj * x_Sval];
+                            z_ind[pos] = j - i0;
+                            ++pos;
+                        }
+                    }
+                    z_ptr[k - o0 + 1] = pos;
+                }
+            }
+            %(shape_out)s
+        }
+        """ % dict(locals(), **sub)
+
+
 class GetItemScalar(gof.op.Op):
     """Implement a subtensor of a sparse variable that take
     two scalar as index and return a scalar.
@@ -1316,6 +1860,78 @@ class GetItemScalar(gof.op.Op):
 get_item_scalar = GetItemScalar()
 
 
+class ConstructSparseFromList(gof.op.Op):
+    """Construct a CSR matrix of the shape of `x`, whose rows `ilist`
+    are `values`.
+
+    This is the sparse gradient of x[ilist] with respect to `x`, see
+    `theano.sparse_grad`.
+
+    :param x: A dense matrix. Only its shape is used.
+    :param values: A dense matrix with one row for each element of
+                   `ilist`.
+    :param ilist: A dense vector of integers, rows of the output.
+
+    :return: A CSR matrix with the rows `ilist` set to `values`. The
+             rows of `values` that go to the same row are summed.
+
+    :note:
+    - The grad implemented is regular, i.e. not structured.
+    """
+
+    def __eq__(self, other):
+        return type(self) == type(other)
+
+    def __hash__(self):
+        return hash(type(self))
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    def make_node(self, x, values, ilist):
+        x = tensor.as_tensor_variable(x)
+        values = tensor.as_tensor_variable(values)
+        ilist = tensor.as_tensor_variable(ilist)
+
+        if ilist.type.dtype not in tensor.discrete_dtypes:
+            raise TypeError('index must be integers')
+        if ilist.type.ndim != 1:
+            raise TypeError('index must be vector')
+        if x.type.ndim != 2 or values.type.ndim != 2:
+            raise TypeError('x and values must be matrices',
+                            x.type, values.type)
+
+        return gof.Apply(self, [x, values, ilist],
+                         [SparseType(dtype=values.type.dtype,
+                                     format='csr').make_variable()])
+
+    def perform(self, node, (x, values, ilist), (out, )):
+        n_rows, n_cols = x.shape
+        if values.shape != (len(ilist), n_cols):
+            raise ValueError('values must have one row of %d columns for '
+                             'each index' % n_cols, values.shape)
+        ilist = numpy.asarray(ilist, dtype='int64')
+        if len(ilist) and (ilist.min() < -n_rows or ilist.max() >= n_rows):
+            raise IndexError('index out of bounds')
+        ilist = numpy.where(ilist < 0, ilist + n_rows, ilist)
+        rows = numpy.repeat(ilist, n_cols)
+        cols = numpy.tile(numpy.arange(n_cols), len(ilist))
+        # The duplicated rows are summed by the conversion to CSR.
+        out[0] = scipy.sparse.coo_matrix((values.ravel(), (rows, cols)),
+                                         shape=(n_rows, n_cols),
+                                         dtype=values.dtype).tocsr()
+
+    def grad(self, (x, values, ilist), (gz, )):
+        if _is_sparse_variable(gz):
+            gz = dense_from_sparse(gz)
+        return [None, tensor.advanced_subtensor1(gz, ilist), None]
+
+    def infer_shape(self, node, shapes):
+        return [shapes[0]]
+
+construct_sparse_from_list = ConstructSparseFromList()
+
+
 # Linear Algebra
 class Transpose(gof.op.Op):
     """Return the transpose of the sparse matrix.
@@ -1332,7 +1948,8 @@ class Transpose(gof.op.Op):
     """
 
     format_map = {'csr': 'csc',
-                  'csc': 'csr'}
+                  'csc': 'csr',
+                  'bsr': 'bsr'}
 
     def __eq__(self, other):
         return (type(self) == type(other))
@@ -1355,6 +1972,12 @@ class Transpose(gof.op.Op):
         assert _is_sparse(x)
         out[0] = x.transpose()
 
+    def R_op(self, inputs, eval_points):
+        # The op is linear.
+        if eval_points[0] is None:
+            return [None]
+        return self.make_node(*eval_points).outputs
+
     def grad(self, (x,), (gz,)):
         assert _is_sparse_variable(x) and _is_sparse_variable(gz)
         return transpose(gz),
@@ -1392,6 +2015,12 @@ class Neg(gof.op.Op):
         assert _is_sparse(x)
         out[0] = -x
 
+    def R_op(self, inputs, eval_points):
+        # The op is linear.
+        if eval_points[0] is None:
+            return [None]
+        return self.make_node(*eval_points).outputs
+
     def grad(self, (x,), (gz,)):
         assert _is_sparse_variable(x) and _is_sparse_variable(gz)
         return -gz,
@@ -1601,6 +2230,12 @@ class SpSum(gof.op.Op):
         else:
             z[0] = numpy.asarray(x.sum(self.axis)).ravel()
 
+    def R_op(self, inputs, eval_points):
+        # The op is linear.
+        if eval_points[0] is None:
+            return [None]
+        return self.make_node(*eval_points).outputs
+
     def grad(self, (x,), (gz,)):
         if x.dtype not in continuous_dtypes:
             return [None]
@@ -1650,6 +2285,123 @@ def sp_sum(x, axis=None, sparse_grad=False):
     return SpSum(axis, sparse_grad)(x)
 
 
+class SpSumCSx(_CSxOp):
+    # Sum of a sparse matrix along an axis. It is the same as SpSum,
+    # working on the data, indices and indptr arrays.
+
+    # :param x_val: The data of the sparse matrix.
+    # :param x_ind: The indices of the sparse matrix.
+    # :param x_ptr: The indptr of the sparse matrix.
+    # :param x_shape: The shape of the sparse matrix.
+
+    # :return: The sum, a dense scalar or vector.
+
+    # :note:
+    # - This op is used as an optimization of SpSum.
+
+    def __init__(self, format, axis=None):
+        super(SpSumCSx, self).__init__(format)
+        if axis not in (None, 0, 1):
+            raise ValueError('Illegal value for axis.')
+        self.axis = axis
+
+    def __eq__(self, other):
+        return (super(SpSumCSx, self).__eq__(other) and
+                self.axis == other.axis)
+
+    def __hash__(self):
+        return super(SpSumCSx, self).__hash__() ^ hash(self.axis)
+
+    def __str__(self):
+        return '%s{%s,axis=%s}' % (self.__class__.__name__, self.format,
+                                   self.axis)
+
+    def _along_inner(self):
+        # True when we sum the elements of each row of a CSR matrix, or of
+        # each column of a CSC matrix.
+        return ((self.format == 'csr' and self.axis == 1) or
+                (self.format == 'csc' and self.axis == 0))
+
+    def make_node(self, x_val, x_ind, x_ptr, x_shape):
+        x_val = tensor.as_tensor_variable(x_val)
+        b = ()
+        if self.axis is not None:
+            b = (False,)
+        return gof.Apply(self, [x_val, x_ind, x_ptr, x_shape],
+                         [tensor.TensorType(dtype=x_val.dtype,
+                                            broadcastable=b)()])
+
+    def perform(self, node, (x_val, x_ind, x_ptr, x_shape), (z,)):
+        x = _csx_from_arrays(self.format, x_val, x_ind, x_ptr, x_shape)
+        if self.axis is None:
+            r = x.sum()
+        else:
+            r = numpy.asarray(x.sum(self.axis)).ravel()
+        z[0] = theano._asarray(r, dtype=node.outputs[0].dtype)
+
+    def c_code(self, node, name, (x_val, x_ind, x_ptr, x_shape), (z,), sub):
+        fail = sub['fail']
+        typenum_z = node.outputs[0].type.dtype_specs()[-1]
+        check = (_csx_c_check(x_val, x_ind, x_ptr, fail) +
+                 _csx_c_shape_check(x_shape, fail))
+        x_vars = _csx_c_vars('x', x_val, x_ind, x_ptr)
+        x_dims = _csx_c_dims('x', x_shape, self.format)
+        if self.axis is None:
+            alloc = """
+            Py_XDECREF(%(z)s);
+            %(z)s = (PyArrayObject*) PyArray_SimpleNew(0, NULL, %(typenum_z)s);
+            if (!%(z)s)
+                %(fail)s;
+            """ % locals()
+            loop = """
+            dtype_%(z)s s = 0;
+            for (npy_intp jj = x_ptr[0]; jj < x_ptr[x_nouter * x_Sptr]; ++jj)
+                s += x_val[jj * x_Sval];
+            ((dtype_%(z)s*)%(z)s->data)[0] = s;
+            """ % locals()
+        elif self._along_inner():
+            alloc = _csx_c_alloc(z, 'x_douter', typenum_z, fail)
+            loop = """
+            const npy_intp Sz = %(z)s->strides[0] / %(z)s->descr->elsize;
+            dtype_%(z)s* const z = (dtype_%(z)s*)%(z)s->data;
+            for (npy_intp k = 0; k < x_nouter; ++k)
+            {
+                dtype_%(z)s s = 0;
+                for (npy_intp jj = x_ptr[k * x_Sptr]; jj < x_ptr[(k + 1) * x_Sptr]; ++jj)
+                    s += x_val[jj * x_Sval];
+                z[k * Sz] = s;
+            }
+            """ % locals()
+        else:
+            alloc = _csx_c_alloc(z, 'x_dinner', typenum_z, fail)
+            loop = """
+            const npy_intp Sz = %(z)s->strides[0] / %(z)s->descr->elsize;
+            dtype_%(z)s* const z = (dtype_%(z)s*)%(z)s->data;
+            for (npy_intp j = 0; j < x_dinner; ++j)
+                z[j * Sz] = 0;
+            for (npy_intp jj = x_ptr[0]; jj < x_ptr[x_nouter * x_Sptr]; ++jj)
+            {
+                const npy_intp j = x_ind[jj * x_Sind];
+                if (j < 0 || j >= x_dinner)
+                {PyErr_SetString(PyExc_ValueError, "index out of bounds"); %(fail)s;}
+                z[j * Sz] += x_val[jj * x_Sval];
+            }
+            """ % locals()
+        return """
+        %(check)s
+        {
+            %(x_vars)s
+            %(x_dims)s
+            if (x_nouter != x_douter)
+            {PyErr_SetString(PyExc_ValueError, "indptr doesn't match the shape"); %(fail)s;}
+            %(alloc)s
+            {
+                %(loop)s
+            }
+        }
+        """ % dict(locals(), **sub)
+
+
 class Diag(gof.op.Op):
     """Extract the diagonal of a square sparse matrix as a dense
     vector.
@@ -1757,20 +2509,21 @@ class EnsureSortedIndices(gof.op.Op):
     def __init__(self, inplace):
         self.inplace = inplace
         if self.inplace:
-            self.view_map = {0: [0]}
+            self.destroy_map = {0: [0]}
 
     def __eq__(self, other):
-        return type(self) == type(other)
+        return type(self) == type(other) and self.inplace == other.inplace
 
     def __hash__(self):
-        return hash(type(self))
+        return hash(type(self)) ^ hash(self.inplace)
 
     def make_node(self, x):
         return gof.Apply(self, [x], [x.type()])
 
     def perform(self, node, (x, ), (z, )):
         if self.inplace:
-            z[0] = x.sort_indices()
+            x.sort_indices()
+            z[0] = x
         else:
             z[0] = x.sorted_indices()
 
@@ -1788,27 +2541,127 @@ class EnsureSortedIndices(gof.op.Op):
 ensure_sorted_indices = EnsureSortedIndices(inplace=False)
 
 
-def clean(x):
-    """Remove explicit zeros from a sparse matrix, and
-    resort indices.
+class EnsureSortedIndicesCSx(gof.Op):
+    # Sort the indices of each row of a CSR matrix, or of each column of a
+    # CSC matrix. It is the same as EnsureSortedIndices, working on the
+    # data, indices and indptr arrays.
 
-    CSR column indices are not necessarily sorted. Likewise
-    for CSC row indices. Use `clean` when sorted
-    indices are required (e.g. when passing data to other
-    libraries) and to ensure there is no zeros in the data.
+    # :param x_val: The data of the sparse matrix.
+    # :param x_ind: The indices of the sparse matrix.
+    # :param x_ptr: The indptr of the sparse matrix.
 
-    :param x: A sparse matrix.
+    # :return: The data and indices with the indices sorted. The indptr
+    #   doesn't change.
 
-    :return: The same as `x` with indices sorted and zeros
-             removed.
+    # :note:
+    # - Rows that are already sorted are only copied.
+    # - This op is used as an optimization of EnsureSortedIndices.
 
-    :note:
-    - The grad implemented is regular, i.e. not structured.
-    """
-    return ensure_sorted_indices(remove0(x))
+    def __eq__(self, other):
+        return type(self) == type(other)
 
+    def __hash__(self):
+        return hash(type(self))
 
-class AddSS(gof.op.Op):
+    def __str__(self):
+        return self.__class__.__name__
+
+    def make_node(self, x_val, x_ind, x_ptr):
+        x_val = tensor.as_tensor_variable(x_val)
+        return gof.Apply(self, [x_val, x_ind, x_ptr],
+                         [x_val.type(), tensor.ivector()])
+
+    def perform(self, node, (x_val, x_ind, x_ptr), (z_val, z_ind)):
+        val = x_val.copy()
+        ind = x_ind.copy()
+        for k in xrange(len(x_ptr) - 1):
+            b, e = x_ptr[k], x_ptr[k + 1]
+            if numpy.all(x_ind[b:e - 1] <= x_ind[b + 1:e]):
+                continue
+            # Ties are sorted by value, like the C code does.
+            order = numpy.lexsort((x_val[b:e], x_ind[b:e]))
+            val[b:e] = x_val[b:e][order]
+            ind[b:e] = x_ind[b:e][order]
+        z_val[0] = val
+        z_ind[0] = theano._asarray(ind, dtype='int32')
+
+    def c_headers(self):
+        return ['<algorithm>', '<utility>', '<vector>']
+
+    def c_code(self, node, name, (x_val, x_ind, x_ptr), (z_val, z_ind), sub):
+        fail = sub['fail']
+        if node.inputs[0].type.dtype in ('complex64', 'complex128'):
+            raise NotImplementedError('Complex types are not supported for '
+                                      'x_val')
+        typenum_z_val = node.outputs[0].type.dtype_specs()[-1]
+        check = _csx_c_check(x_val, x_ind, x_ptr, fail)
+        x_vars = _csx_c_vars('x', x_val, x_ind, x_ptr)
+        alloc_val = _csx_c_alloc(z_val, 'nnz', typenum_z_val, fail)
+        alloc_ind = _csx_c_alloc(z_ind, 'nnz', 'PyArray_INT32', fail)
+        return """
+        %(check)s
+        {
+            %(x_vars)s
+            const npy_intp nnz = %(x_ind)s->dimensions[0];
+            %(alloc_val)s
+            %(alloc_ind)s
+            dtype_%(z_val)s* const z_val = (dtype_%(z_val)s*)%(z_val)s->data;
+            npy_int32* const z_ind = (npy_int32*)%(z_ind)s->data;
+            for (npy_intp jj = 0; jj < nnz; ++jj)
+            {
+                z_val[jj] = x_val[jj * x_Sval];
+                z_ind[jj] = x_ind[jj * x_Sind];
+            }
+
+            std::vector<std::pair<npy_int32, dtype_%(z_val)s> > row;
+            for (npy_intp k = 0; k < x_nouter; ++k)
+            {
+                const npy_intp b = x_ptr[k * x_Sptr];
+                const npy_intp e = x_ptr[(k + 1) * x_Sptr];
+                npy_intp jj = b + 1;
+                while (jj < e && z_ind[jj - 1] <= z_ind[jj])
+                    ++jj;
+                if (jj >= e)
+                    continue;
+                row.clear();
+                for (jj = b; jj < e; ++jj)
+                    row.push_back(std::make_pair(z_ind[jj], z_val[jj]));
+                std::sort(row.begin(), row.end());
+                for (jj = b; jj < e; ++jj)
+                {
+                    z_ind[jj] = row[jj - b].first;
+                    z_val[jj] = row[jj - b].second;
+                }
+            }
+        }
+        """ % dict(locals(), **sub)
+
+    def c_code_cache_version(self):
+        return (1,)
+ensure_sorted_indices_csx = EnsureSortedIndicesCSx()
+
+
+def clean(x):
+    """Remove explicit zeros from a sparse matrix, and
+    resort indices.
+
+    CSR column indices are not necessarily sorted. Likewise
+    for CSC row indices. Use `clean` when sorted
+    indices are required (e.g. when passing data to other
+    libraries) and to ensure there is no zeros in the data.
+
+    :param x: A sparse matrix.
+
+    :return: The same as `x` with indices sorted and zeros
+             removed.
+
+    :note:
+    - The grad implemented is regular, i.e. not structured.
+    """
+    return ensure_sorted_indices(remove0(x))
+
+
+class AddSS(gof.op.Op):
     """Add tw sparse matrix.
 
     :param x: A sparse matrix.
@@ -1846,6 +2699,11 @@ class AddSS(gof.op.Op):
         assert x.shape == y.shape
         out[0] = x + y
 
+    def R_op(self, inputs, eval_points):
+        if None in eval_points:
+            return [None]
+        return self.make_node(*eval_points).outputs
+
     def grad(self, (x, y), (gz,)):
         assert _is_sparse_variable(x) and _is_sparse_variable(y)
         assert _is_sparse_variable(gz)
@@ -1857,6 +2715,262 @@ class AddSS(gof.op.Op):
 add_s_s = AddSS()
 
 
+class _BinopSSCSx(_CSxOp):
+    # Base class of AddSSCSx and MulSSCSx: an element-wise operation
+    # between two sparse matrices of the same format and shape, working on
+    # their data, indices and indptr arrays.
+
+    # The result has sorted indices, no duplicates and no explicit zeros.
+    # When the indices of both inputs are sorted without duplicates, the
+    # rows are merged. Otherwise, the elements of a row are accumulated in
+    # dense work arrays of the size of the inner dimension.
+
+    def make_node(self, x_val, x_ind, x_ptr, x_shape,
+                  y_val, y_ind, y_ptr, y_shape):
+        x_val = tensor.as_tensor_variable(x_val)
+        y_val = tensor.as_tensor_variable(y_val)
+        if x_val.type != y_val.type:
+            raise NotImplementedError()
+        return gof.Apply(self, [x_val, x_ind, x_ptr, x_shape,
+                                y_val, y_ind, y_ptr, y_shape],
+                         [x_val.type(), tensor.ivector(), tensor.ivector()])
+
+    def perform(self, node, inputs, (z_val, z_ind, z_ptr)):
+        x = _csx_from_arrays(self.format, *inputs[:4])
+        y = _csx_from_arrays(self.format, *inputs[4:])
+        r = self.scipy_op(x, y).asformat(self.format)
+        r.sum_duplicates()
+        r.eliminate_zeros()
+        r.sort_indices()
+        z_val[0] = theano._asarray(r.data, dtype=node.outputs[0].dtype)
+        z_ind[0] = theano._asarray(r.indices, dtype='int32')
+        z_ptr[0] = theano._asarray(r.indptr, dtype='int32')
+
+    def c_headers(self):
+        return ['<algorithm>']
+
+    def c_code(self, node, name, inputs, outputs, sub):
+        x_val, x_ind, x_ptr, x_shape, y_val, y_ind, y_ptr, y_shape = inputs
+        z_val, z_ind, z_ptr = outputs
+        fail = sub['fail']
+        if node.inputs[0].type.dtype in ('complex64', 'complex128'):
+            raise NotImplementedError('Complex types are not supported for '
+                                      'x_val')
+        typenum_z_val = node.outputs[0].type.dtype_specs()[-1]
+        check = (_csx_c_check(x_val, x_ind, x_ptr, fail) +
+                 _csx_c_shape_check(x_shape, fail) +
+                 _csx_c_check(y_val, y_ind, y_ptr, fail) +
+                 _csx_c_shape_check(y_shape, fail))
+        x_vars = _csx_c_vars('x', x_val, x_ind, x_ptr)
+        y_vars = _csx_c_vars('y', y_val, y_ind, y_ptr)
+        x_dims = _csx_c_dims('x', x_shape, self.format)
+        y_dims = _csx_c_dims('y', y_shape, self.format)
+        alloc_ptr = _csx_c_alloc(z_ptr, 'x_nouter + 1', 'PyArray_INT32',
+                                 fail)
+        op_xy = self.c_op('x_val[a * x_Sval]', 'y_val[b * y_Sval]')
+        op_x = self.c_op('x_val[a * x_Sval]', '0')
+        op_y = self.c_op('0', 'y_val[b * y_Sval]')
+        op_AB = self.c_op('A[j]', 'B[j]')
+        return """
+        %(check)s
+        {
+            %(x_vars)s
+            %(y_vars)s
+            %(x_dims)s
+            %(y_dims)s
+            if (x_nouter != x_douter || y_nouter != y_douter)
+            {PyErr_SetString(PyExc_ValueError, "indptr doesn't match the shape"); %(fail)s;}
+            if (x_douter != y_douter || x_dinner != y_dinner)
+            {PyErr_SetString(PyExc_ValueError, "the matrices have different shapes"); %(fail)s;}
+            const npy_intp n_inner = x_dinner;
+
+            // Check the indices, and if the rows are sorted without
+            // duplicates.
+            int canonical = 1;
+            for (npy_intp k = 0; k < x_nouter; ++k)
+            {
+                for (npy_intp a = x_ptr[k * x_Sptr]; a < x_ptr[(k + 1) * x_Sptr]; ++a)
+                {
+                    const npy_intp j = x_ind[a * x_Sind];
+                    if (j < 0 || j >= n_inner)
+                    {PyErr_SetString(PyExc_ValueError, "index out of bounds"); %(fail)s;}
+                    if (a > x_ptr[k * x_Sptr] && x_ind[(a - 1) * x_Sind] >= j)
+                        canonical = 0;
+                }
+                for (npy_intp b = y_ptr[k * y_Sptr]; b < y_ptr[(k + 1) * y_Sptr]; ++b)
+                {
+                    const npy_intp j = y_ind[b * y_Sind];
+                    if (j < 0 || j >= n_inner)
+                    {PyErr_SetString(PyExc_ValueError, "index out of bounds"); %(fail)s;}
+                    if (b > y_ptr[k * y_Sptr] && y_ind[(b - 1) * y_Sind] >= j)
+                        canonical = 0;
+                }
+            }
+
+            %(alloc_ptr)s
+            npy_int32* const z_ptr = (npy_int32*)%(z_ptr)s->data;
+            const npy_intp max_nnz = (x_ptr[x_nouter * x_Sptr] - x_ptr[0] +
+                                      y_ptr[y_nouter * y_Sptr] - y_ptr[0] + 1);
+            dtype_%(z_val)s* t_val = (dtype_%(z_val)s*)malloc(max_nnz * sizeof(dtype_%(z_val)s));
+            npy_int32* t_ind = (npy_int32*)malloc(max_nnz * sizeof(npy_int32));
+            npy_intp* next = NULL;
+            npy_int32* row = NULL;
+            dtype_%(z_val)s* A = NULL;
+            dtype_%(z_val)s* B = NULL;
+            if (!canonical)
+            {
+                next = (npy_intp*)malloc((n_inner + 1) * sizeof(npy_intp));
+                row = (npy_int32*)malloc((n_inner + 1) * sizeof(npy_int32));
+                A = (dtype_%(z_val)s*)calloc(n_inner + 1, sizeof(dtype_%(z_val)s));
+                B = (dtype_%(z_val)s*)calloc(n_inner + 1, sizeof(dtype_%(z_val)s));
+            }
+            if (!t_val || !t_ind || (!canonical && (!next || !row || !A || !B)))
+            {
+                free(t_val); free(t_ind); free(next); free(row); free(A); free(B);
+                PyErr_NoMemory();
+                %(fail)s;
+            }
+
+            npy_intp nnz = 0;
+            z_ptr[0] = 0;
+            if (canonical)
+            {
+                // Merge the sorted rows.
+                for (npy_intp k = 0; k < x_nouter; ++k)
+                {
+                    npy_intp a = x_ptr[k * x_Sptr];
+                    const npy_intp a_end = x_ptr[(k + 1) * x_Sptr];
+                    npy_intp b = y_ptr[k * y_Sptr];
+                    const npy_intp b_end = y_ptr[(k + 1) * y_Sptr];
+                    while (a < a_end || b < b_end)
+                    {
+                        npy_int32 j;
+                        dtype_%(z_val)s r;
+                        if (b >= b_end || (a < a_end && x_ind[a * x_Sind] < y_ind[b * y_Sind]))
+                        {
+                            j = x_ind[a * x_Sind];
+                            r = %(op_x)s;
+                            ++a;
+                        }
+                        else if (a >= a_end || y_ind[b * y_Sind] < x_ind[a * x_Sind])
+                        {
+                            j = y_ind[b * y_Sind];
+                            r = %(op_y)s;
+                            ++b;
+                        }
+                        else
+                        {
+                            j = x_ind[a * x_Sind];
+                            r = %(op_xy)s;
+                            ++a;
+                            ++b;
+                        }
+                        if (r != 0)
+                        {
+                            t_ind[nnz] = j;
+                            t_val[nnz] = r;
+                            ++nnz;
+                        }
+                    }
+                    z_ptr[k + 1] = nnz;
+                }
+            }
+            else
+            {
+                // Accumulate each row in A and B. The indices seen in the
+                // row are kept in a linked list in `next`.
+                for (npy_intp j = 0; j < n_inner; ++j)
+                    next[j] = -1;
+                for (npy_intp k = 0; k < x_nouter; ++k)
+                {
+                    npy_intp head = -2;
+                    npy_intp length = 0;
+                    for (npy_intp a = x_ptr[k * x_Sptr]; a < x_ptr[(k + 1) * x_Sptr]; ++a)
+                    {
+                        const npy_intp j = x_ind[a * x_Sind];
+                        A[j] += x_val[a * x_Sval];
+                        if (next[j] == -1)
+                        {
+                            next[j] = head;
+                            head = j;
+                            ++length;
+                        }
+                    }
+                    for (npy_intp b = y_ptr[k * y_Sptr]; b < y_ptr[(k + 1) * y_Sptr]; ++b)
+                    {
+                        const npy_intp j = y_ind[b * y_Sind];
+                        B[j] += y_val[b * y_Sval];
+                        if (next[j] == -1)
+                        {
+                            next[j] = head;
+                            head = j;
+                            ++length;
+                        }
+                    }
+                    for (npy_intp l = 0; l < length; ++l)
+                    {
+                        row[l] = head;
+                        const npy_intp t = head;
+                        head = next[t];
+                        next[t] = -1;
+                    }
+                    std::sort(row, row + length);
+                    for (npy_intp l = 0; l < length; ++l)
+                    {
+                        const npy_intp j = row[l];
+                        const dtype_%(z_val)s r = %(op_AB)s;
+                        if (r != 0)
+                        {
+                            t_ind[nnz] = j;
+                            t_val[nnz] = r;
+                            ++nnz;
+                        }
+                        A[j] = 0;
+                        B[j] = 0;
+                    }
+                    z_ptr[k + 1] = nnz;
+                }
+            }
+
+            Py_XDECREF(%(z_val)s);
+            Py_XDECREF(%(z_ind)s);
+            {
+                npy_intp dims[] = {0};
+                dims[0] = nnz;
+                %(z_val)s = (PyArrayObject*) PyArray_SimpleNew(1, dims, %(typenum_z_val)s);
+                %(z_ind)s = (PyArrayObject*) PyArray_SimpleNew(1, dims, PyArray_INT32);
+            }
+            if (%(z_val)s && %(z_ind)s)
+            {
+                memcpy(%(z_val)s->data, t_val, nnz * sizeof(dtype_%(z_val)s));
+                memcpy(%(z_ind)s->data, t_ind, nnz * sizeof(npy_int32));
+            }
+            free(t_val); free(t_ind); free(next); free(row); free(A); free(B);
+            if (!%(z_val)s || !%(z_ind)s)
+                %(fail)s;
+        }
+        """ % dict(locals(), **sub)
+
+
+class AddSSCSx(_BinopSSCSx):
+    # Add two sparse matrices. It is the same as AddSS, working on the
+    # data, indices and indptr arrays.
+
+    # :param x_val, x_ind, x_ptr, x_shape: The first sparse matrix.
+    # :param y_val, y_ind, y_ptr, y_shape: The second sparse matrix.
+
+    # :return: The data, indices and indptr of `x` + `y`.
+
+    # :note:
+    # - This op is used as an optimization of AddSS.
+
+    def scipy_op(self, x, y):
+        return x + y
+
+    def c_op(self, a, b):
+        return '(%s) + (%s)' % (a, b)
+
+
 class AddSSData(gof.op.Op):
     """Add two sparse matrices assuming they have the same sparsity
     pattern.
@@ -2234,6 +3348,25 @@ class MulSS(gof.op.Op):
 mul_s_s = MulSS()
 
 
+class MulSSCSx(_BinopSSCSx):
+    # Multiply two sparse matrices element wise. It is the same as MulSS,
+    # working on the data, indices and indptr arrays.
+
+    # :param x_val, x_ind, x_ptr, x_shape: The first sparse matrix.
+    # :param y_val, y_ind, y_ptr, y_shape: The second sparse matrix.
+
+    # :return: The data, indices and indptr of `x` * `y`.
+
+    # :note:
+    # - This op is used as an optimization of MulSS.
+
+    def scipy_op(self, x, y):
+        return x.multiply(y)
+
+    def c_op(self, a, b):
+        return '(%s) * (%s)' % (a, b)
+
+
 class MulSD(gof.op.Op):
     """Elementwise multiply a sparse and a dense matrix.
 
@@ -2923,6 +4056,210 @@ def vstack(blocks, format=None, dtype=None):
     return VStack(format=format, dtype=dtype)(*blocks)
 
 
+class StackCSx(_CSxOp):
+    # Stack sparse matrices of the same format. It is the same as HStack
+    # (axis=1) and VStack (axis=0), working on the data, indices, indptr
+    # and shape of each matrix.
+
+    # :param format: The format of the inputs and of the output.
+    # :param axis: 0 to stack vertically, 1 to stack horizontally.
+    # :param blocks: For each matrix, its data, indices, indptr and shape.
+    #                All the data must have the same dtype.
+
+    # :return: The data, indices, indptr and shape of the result.
+
+    # :note:
+    # - This op is used as an optimization of HStack and VStack.
+
+    def __init__(self, format, axis):
+        _CSxOp.__init__(self, format)
+        if axis not in (0, 1):
+            raise ValueError('axis must be 0 or 1', axis)
+        self.axis = axis
+
+    def __eq__(self, other):
+        return _CSxOp.__eq__(self, other) and self.axis == other.axis
+
+    def __hash__(self):
+        return _CSxOp.__hash__(self) ^ hash(self.axis)
+
+    def __str__(self):
+        return '%s{%s,%s}' % (self.__class__.__name__, self.format,
+                              self.axis)
+
+    def _along_outer(self):
+        return (self.axis == 0) == (self.format == 'csr')
+
+    def make_node(self, *blocks):
+        if not blocks or len(blocks) % 4:
+            raise ValueError('Expected the data, indices, indptr and shape '
+                             'of each matrix.')
+        blocks = list(blocks)
+        for i in range(0, len(blocks), 4):
+            blocks[i] = tensor.as_tensor_variable(blocks[i])
+            if blocks[i].type != blocks[0].type:
+                raise NotImplementedError()
+        return gof.Apply(self, blocks,
+                         [blocks[0].type(), tensor.ivector(),
+                          tensor.ivector(), tensor.ivector()])
+
+    def perform(self, node, blocks, (z_val, z_ind, z_ptr, z_shape)):
+        mats = [_csx_from_arrays(self.format, *blocks[i:i + 4])
+                for i in range(0, len(blocks), 4)]
+        outer = 0
+        inner = 1
+        if self.format == 'csc':
+            outer, inner = 1, 0
+        douter = [m.shape[outer] for m in mats]
+        dinner = [m.shape[inner] for m in mats]
+        vals = []
+        inds = []
+        if self._along_outer():
+            if [d for d in dinner if d != dinner[0]]:
+                raise ValueError('the matrices have different shapes')
+            ptr = [numpy.zeros(1, dtype='int32')]
+            nnz = 0
+            for m in mats:
+                b, e = m.indptr[0], m.indptr[-1]
+                vals.append(m.data[b:e])
+                inds.append(m.indices[b:e])
+                ptr.append(m.indptr[1:] - b + nnz)
+                nnz += e - b
+            shape = [sum(douter), dinner[0]]
+        else:
+            if [d for d in douter if d != douter[0]]:
+                raise ValueError('the matrices have different shapes')
+            offsets = numpy.cumsum([0] + dinner[:-1])
+            ptr = [numpy.zeros(1, dtype='int32')]
+            nnz = 0
+            for k in xrange(douter[0]):
+                for m, off in zip(mats, offsets):
+                    b, e = m.indptr[k], m.indptr[k + 1]
+                    vals.append(m.data[b:e])
+                    inds.append(m.indices[b:e] + off)
+                    nnz += e - b
+                ptr.append([nnz])
+            shape = [douter[0], sum(dinner)]
+        if self.format == 'csc':
+            shape.reverse()
+        z_val[0] = theano._asarray(numpy.concatenate(vals),
+                                   dtype=node.outputs[0].dtype)
+        z_ind[0] = theano._asarray(numpy.concatenate(inds), dtype='int32')
+        z_ptr[0] = theano._asarray(numpy.concatenate(ptr), dtype='int32')
+        z_shape[0] = theano._asarray(shape, dtype='int32')
+
+    def c_code(self, node, name, inputs, outputs, sub):
+        z_val, z_ind, z_ptr, z_shape = outputs
+        fail = sub['fail']
+        typenum_z_val = node.outputs[0].type.dtype_specs()[-1]
+        n_blocks = len(inputs) // 4
+        check = ''.join([_csx_c_check(inputs[i], inputs[i + 1],
+                                      inputs[i + 2], fail) +
+                         _csx_c_shape_check(inputs[i + 3], fail)
+                         for i in range(0, len(inputs), 4)])
+        vals = ', '.join(inputs[0::4])
+        inds = ', '.join(inputs[1::4])
+        ptrs = ', '.join(inputs[2::4])
+        shapes = ', '.join(inputs[3::4])
+        outer, inner = 0, 1
+        if self.format == 'csc':
+            outer, inner = 1, 0
+        along_outer = int(self._along_outer())
+        alloc_val = _csx_c_alloc(z_val, 'nnz', typenum_z_val, fail)
+        alloc_ind = _csx_c_alloc(z_ind, 'nnz', 'PyArray_INT32', fail)
+        alloc_ptr = _csx_c_alloc(z_ptr, 'z_douter + 1', 'PyArray_INT32',
+                                 fail)
+        shape_out = _csx_c_shape_out(z_shape, 'z_douter', 'z_dinner',
+                                     self.format, fail)
+        return """
+        %(check)s
+        {
+            const int n_blocks = %(n_blocks)s;
+            PyArrayObject* vals[] = {%(vals)s};
+            PyArrayObject* inds[] = {%(inds)s};
+            PyArrayObject* ptrs[] = {%(ptrs)s};
+            PyArrayObject* shapes[] = {%(shapes)s};
+            npy_intp douter[%(n_blocks)s];
+            npy_intp dinner[%(n_blocks)s];
+            npy_intp nnz = 0;
+            for (int i = 0; i < n_blocks; ++i)
+            {
+                const npy_intp S = ptrs[i]->strides[0] / ptrs[i]->descr->elsize;
+                const npy_int32* P = (npy_int32*)ptrs[i]->data;
+                douter[i] = *(npy_int32*)PyArray_GETPTR1(shapes[i], %(outer)s);
+                dinner[i] = *(npy_int32*)PyArray_GETPTR1(shapes[i], %(inner)s);
+                if (ptrs[i]->dimensions[0] - 1 != douter[i])
+                {PyErr_SetString(PyExc_ValueError, "indptr doesn't match the shape"); %(fail)s;}
+                nnz += P[douter[i] * S] - P[0];
+            }
+            const int along_outer = %(along_outer)s;
+            npy_intp z_douter = douter[0];
+            npy_intp z_dinner = dinner[0];
+            for (int i = 1; i < n_blocks; ++i)
+            {
+                if (along_outer ? dinner[i] != dinner[0] : douter[i] != douter[0])
+                {PyErr_SetString(PyExc_ValueError, "the matrices have different shapes"); %(fail)s;}
+                if (along_outer)
+                    z_douter += douter[i];
+                else
+                    z_dinner += dinner[i];
+            }
+            %(alloc_val)s
+            %(alloc_ind)s
+            %(alloc_ptr)s
+            %(shape_out)s
+            dtype_%(z_val)s* const z_val = (dtype_%(z_val)s*)%(z_val)s->data;
+            npy_int32* const z_ind = (npy_int32*)%(z_ind)s->data;
+            npy_int32* const z_ptr = (npy_int32*)%(z_ptr)s->data;
+            npy_intp pos = 0;
+            z_ptr[0] = 0;
+            // Copy the elements of outer index k of block i, with their
+            // inner index shifted by `offset`.
+            #define STACK_CSX_COPY(i, k, offset) \\
+            { \\
+                const dtype_%(z_val)s* V = (dtype_%(z_val)s*)vals[i]->data; \\
+                const npy_int32* I = (npy_int32*)inds[i]->data; \\
+                const npy_int32* P = (npy_int32*)ptrs[i]->data; \\
+                const npy_intp SV = vals[i]->strides[0] / vals[i]->descr->elsize; \\
+                const npy_intp SI = inds[i]->strides[0] / inds[i]->descr->elsize; \\
+                const npy_intp SP = ptrs[i]->strides[0] / ptrs[i]->descr->elsize; \\
+                for (npy_intp jj = P[k * SP]; jj < P[(k + 1) * SP]; ++jj) \\
+                { \\
+                    z_val[pos] = V[jj * SV]; \\
+                    z_ind[pos] = I[jj * SI] + offset; \\
+                    ++pos; \\
+                } \\
+            }
+            if (along_outer)
+            {
+                npy_intp row = 0;
+                for (int i = 0; i < n_blocks; ++i)
+                {
+                    for (npy_intp k = 0; k < douter[i]; ++k)
+                    {
+                        STACK_CSX_COPY(i, k, 0);
+                        z_ptr[++row] = pos;
+                    }
+                }
+            }
+            else
+            {
+                for (npy_intp k = 0; k < z_douter; ++k)
+                {
+                    npy_intp offset = 0;
+                    for (int i = 0; i < n_blocks; ++i)
+                    {
+                        STACK_CSX_COPY(i, k, offset);
+                        offset += dinner[i];
+                    }
+                    z_ptr[k + 1] = pos;
+                }
+            }
+            #undef STACK_CSX_COPY
+        }
+        """ % dict(locals(), **sub)
+
+
 class Remove0(gof.Op):
     """
     Remove explicit zeros from a sparse matrix, and resort indices
@@ -2965,6 +4302,97 @@ class Remove0(gof.Op):
 remove0 = Remove0()
 
 
+class Remove0CSx(gof.Op):
+    # Remove the explicit zeros of a sparse matrix. It is the same as
+    # Remove0, working on the data, indices and indptr arrays.
+
+    # :param x_val: The data of the sparse matrix.
+    # :param x_ind: The indices of the sparse matrix.
+    # :param x_ptr: The indptr of the sparse matrix.
+
+    # :return: The data, indices and indptr without the zeros.
+
+    # :note:
+    # - There is no inplace version: data and indices are views of the
+    #   same sparse matrix, and the destroy handler doesn't let an Apply
+    #   destroy two views of the same variable. Remove0{inplace} is used
+    #   instead when the input can be destroyed.
+    # - This op is used as an optimization of Remove0.
+
+    def __eq__(self, other):
+        return type(self) == type(other)
+
+    def __hash__(self):
+        return hash(type(self))
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    def make_node(self, x_val, x_ind, x_ptr):
+        x_val = tensor.as_tensor_variable(x_val)
+        return gof.Apply(self, [x_val, x_ind, x_ptr],
+                         [x_val.type(), tensor.ivector(), tensor.ivector()])
+
+    def perform(self, node, (x_val, x_ind, x_ptr), (z_val, z_ind, z_ptr)):
+        b, e = x_ptr[0], x_ptr[-1]
+        keep = x_val[b:e] != 0
+        count = numpy.concatenate([[0], numpy.cumsum(keep)])
+        z_val[0] = x_val[b:e][keep]
+        z_ind[0] = theano._asarray(x_ind[b:e][keep], dtype='int32')
+        z_ptr[0] = theano._asarray(count[x_ptr - b], dtype='int32')
+
+    def c_code(self, node, name, (x_val, x_ind, x_ptr), (z_val, z_ind, z_ptr),
+               sub):
+        fail = sub['fail']
+        if node.inputs[0].type.dtype in ('complex64', 'complex128'):
+            raise NotImplementedError('Complex types are not supported for '
+                                      'x_val')
+        typenum_z_val = node.outputs[0].type.dtype_specs()[-1]
+        check = _csx_c_check(x_val, x_ind, x_ptr, fail)
+        x_vars = _csx_c_vars('x', x_val, x_ind, x_ptr)
+        alloc_val = _csx_c_alloc(z_val, 'nnz', typenum_z_val, fail)
+        alloc_ind = _csx_c_alloc(z_ind, 'nnz', 'PyArray_INT32', fail)
+        alloc_ptr = _csx_c_alloc(z_ptr, 'x_nouter + 1', 'PyArray_INT32',
+                                 fail)
+        return """
+        %(check)s
+        {
+            %(x_vars)s
+            const npy_intp b = x_ptr[0];
+            const npy_intp e = x_ptr[x_nouter * x_Sptr];
+            npy_intp nnz = 0;
+            for (npy_intp jj = b; jj < e; ++jj)
+                if (x_val[jj * x_Sval] != 0)
+                    ++nnz;
+            %(alloc_val)s
+            %(alloc_ind)s
+            %(alloc_ptr)s
+            dtype_%(z_val)s* const z_val = (dtype_%(z_val)s*)%(z_val)s->data;
+            npy_int32* const z_ind = (npy_int32*)%(z_ind)s->data;
+            npy_int32* const z_ptr = (npy_int32*)%(z_ptr)s->data;
+            npy_intp pos = 0;
+            z_ptr[0] = 0;
+            for (npy_intp k = 0; k < x_nouter; ++k)
+            {
+                for (npy_intp jj = x_ptr[k * x_Sptr]; jj < x_ptr[(k + 1) * x_Sptr]; ++jj)
+                {
+                    if (x_val[jj * x_Sval] != 0)
+                    {
+                        z_val[pos] = x_val[jj * x_Sval];
+                        z_ind[pos] = x_ind[jj * x_Sind];
+                        ++pos;
+                    }
+                }
+                z_ptr[k + 1] = pos;
+            }
+        }
+        """ % dict(locals(), **sub)
+
+    def c_code_cache_version(self):
+        return (1,)
+remove0_csx = Remove0CSx()
+
+
 # Probability
 class Poisson(gof.op.Op):
     """Return a sparse having random values from a Poisson density
@@ -3278,6 +4706,13 @@ class StructuredDot(gof.Op):
         #theano._asarray function documentation.
         out[0] = theano._asarray(variable, str(variable.dtype))
 
+    def R_op(self, inputs, eval_points):
+        if None in eval_points:
+            return [None]
+        x, y = inputs
+        ex, ey = eval_points
+        return [structured_dot(ex, y) + structured_dot(x, ey)]
+
     def grad(self, (a, b), (g_out,)):
         # a is sparse, b is dense, g_out is dense
         # ga = g_out x b.T
@@ -3287,6 +4722,10 @@ class StructuredDot(gof.Op):
     def infer_shape(self, node, shapes):
         return [(shapes[0][0], shapes[1][1])]
 
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        return _sparse_dot_cost(node, 0, 1, input_shapes, output_shapes,
+                                input_nnz)
+
 _structured_dot = StructuredDot()
 
 
@@ -3329,7 +4768,76 @@ def structured_dot(x, y):
         return _structured_dot(y.T, x.T).T
 
 
-class StructuredDotCSC(gof.Op):
+def sparse_dot_num_threads():
+    """Return the `num_threads` to give to the sparse-dense product Ops.
+
+    1 means the single-threaded kernels and 0 lets OpenMP choose. See
+    config.sparse.num_threads.
+    """
+    if not config.openmp:
+        return 1
+    return config.sparse.num_threads
+
+
+class _ParallelSparseDot(gof.Op):
+    # Helpers shared by the sparse-dense product Ops that have an OpenMP
+    # kernel.
+
+    # :param num_threads: 1 uses a single thread, 0 lets OpenMP choose and
+    #   n > 1 asks for n threads.
+
+    # Pickles made before num_threads existed are single-threaded.
+    num_threads = 1
+
+    def __init__(self, num_threads=1):
+        self.num_threads = num_threads
+
+    def __eq__(self, other):
+        return (type(self) == type(other) and
+                self.num_threads == other.num_threads)
+
+    def __hash__(self):
+        return hash(type(self)) ^ hash(self.num_threads)
+
+    def __str__(self):
+        if self.num_threads == 1:
+            return self.__class__.__name__
+        return '%s{num_threads=%d}' % (self.__class__.__name__,
+                                       self.num_threads)
+
+    def _openmp_args(self):
+        if self.num_threads == 1:
+            return []
+        return ['-fopenmp']
+
+    def c_compile_args(self):
+        return self._openmp_args()
+
+    def c_headers(self):
+        if self.num_threads == 1:
+            return []
+        return ['<omp.h>']
+
+    def _omp_pragma(self, clauses=''):
+        """Return the pragma to put before the parallel loop."""
+        if self.num_threads == 1:
+            return ''
+        if self.num_threads > 1:
+            clauses += ' num_threads(%d)' % self.num_threads
+        return '#pragma omp parallel for ' + clauses
+
+    def _omp_n_blocks(self, var):
+        """Return C code setting `var` to the number of threads used."""
+        if self.num_threads == 0:
+            return """
+            #ifdef _OPENMP
+            %(var)s = omp_get_max_threads();
+            #endif
+            """ % dict(var=var)
+        return '%s = %d;' % (var, self.num_threads)
+
+
+class StructuredDotCSC(_ParallelSparseDot):
     # Structured Dot CSC is like dot, except that only the
     # gradient wrt non-zero elements of the sparse matrix
     # `a` are calculated and propagated.
@@ -3345,15 +4853,8 @@ class StructuredDotCSC(gof.Op):
     # :note:
     # - The grad implemented is structured.
     # - This op is used as an optimization for StructuredDot.
-
-    def __eq__(self, other):
-        return (type(self) == type(other))
-
-    def __hash__(self):
-        return hash(type(self))
-
-    def __str__(self):
-        return self.__class__.__name__
+    # - With num_threads != 1, the columns of the output are split between
+    #   the threads.
 
     def make_node(self, a_val, a_ind, a_ptr, a_nrows, b):
         dtype_out = scalar.upcast(a_val.type.dtype, b.type.dtype)
@@ -3361,6 +4862,14 @@ class StructuredDotCSC(gof.Op):
                 [tensor.tensor(dtype_out, (False, b.type.broadcastable[1]))])
         return r
 
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        # a_val holds the non-zero elements of a.
+        flops = None
+        if input_shapes[0] is not None and input_shapes[4] is not None:
+            flops = 2 * input_shapes[0][0] * input_shapes[4][1]
+        return (flops,) + gof.op.default_cost_bytes(node, input_shapes,
+                                                    output_shapes)
+
     def perform(self, node, (a_val, a_ind, a_ptr, a_nrows, b), (out,)):
         a = scipy.sparse.csc_matrix((a_val, a_ind, a_ptr),
                 (a_nrows, b.shape[0]),
@@ -3391,6 +4900,8 @@ class StructuredDotCSC(gof.Op):
         typenum_z = node.outputs[0].type.dtype_specs()[-1]  # retrieve dtype number
         typenum_a_val = node.inputs[0].type.dtype_specs()[-1]  # retrieve dtype number
         typenum_b = node.inputs[4].type.dtype_specs()[-1]  # retrieve dtype number
+        n_blocks = self._omp_n_blocks('n_blocks')
+        pragma = self._omp_pragma()
 
         rval = """
 
@@ -3472,39 +4983,61 @@ class StructuredDotCSC(gof.Op):
             //     for n
             //        z[m, n] += a[m, k] * b[k, n]
 
-            // loop over inner dimension
-            for (npy_int32 k = 0; k < K; ++k)
+            // Check the row indices first, we can't fail inside the
+            // parallel loop.
+            for (npy_intp idx = Dptr[0]; idx < Dptr[K * Sptr]; ++idx)
             {
-                // get pointer to k-th row of dense matrix
-                const dtype_%(b)s* __restrict__ bk = (dtype_%(b)s*)(%(b)s->data + %(b)s->strides[0] * k);
+                //RESOLVE: a.shape[0] equals z.shape[0], why is this not an equality constraint?
+                if (Dind[idx * Sind] < 0 || Dind[idx * Sind] >= M)
+                {PyErr_SetString(PyExc_NotImplementedError, "illegal row index in a"); %(fail)s;}
+            }
 
-                // loop over sparse column indices through index pointer array
-                // (amounts to looping over rows M of sparse matrix)
+            // Each block of columns of Z is computed by one thread, so
+            // there are no concurrent writes.
+            npy_intp n_blocks = 1;
+            %(n_blocks)s
+            if (n_blocks > N)
+                n_blocks = N;
+            if (n_blocks < 1)
+                n_blocks = 1;
+
+            %(pragma)s
+            for (npy_intp blk = 0; blk < n_blocks; ++blk)
+            {
+                const npy_intp n_start = blk * N / n_blocks;
+                const npy_intp n_end = (blk + 1) * N / n_blocks;
 
-                for (npy_int32 m_idx = Dptr[k * Sptr]; m_idx < Dptr[(k+1) * Sptr]; ++m_idx)
+                // loop over inner dimension
+                for (npy_intp k = 0; k < K; ++k)
                 {
-                    npy_int32 m = Dind[m_idx * Sind]; // row index of non-null value for column K
-                    const dtype_%(a_val)s Amk = Dval[m_idx * Sval]; // actual value at that location
-
-                    // pointer to m-th row of the output matrix Z
-                    dtype_%(z)s* __restrict__ zm = (dtype_%(z)s*)(%(z)s->data + %(z)s->strides[0] * m);
+                    // get pointer to k-th row of dense matrix
+                    const dtype_%(b)s* __restrict__ bk = (dtype_%(b)s*)(%(b)s->data + %(b)s->strides[0] * k);
 
-                    //RESOLVE: a.shape[0] equals z.shape[0], why is this not an equality constraint?
-                    if (m >= %(z)s->dimensions[0])
-                    {PyErr_SetString(PyExc_NotImplementedError, "illegal row index in a"); %(fail)s;}
+                    // loop over sparse column indices through index pointer array
+                    // (amounts to looping over rows M of sparse matrix)
 
-                    // loop over final dimension (cols of dense matrix) and perform dot product
-                    if ((Szn == 1) && (Sbn == 1)) {
-                        for(npy_int32 n = 0; n < N; ++n)
-                        {
-                            zm[n] += Amk * bk[n];
-                        }
-                    }
-                    else
+                    for (npy_int32 m_idx = Dptr[k * Sptr]; m_idx < Dptr[(k+1) * Sptr]; ++m_idx)
                     {
-                        for(npy_int32 n = 0; n < N; ++n)
+                        npy_int32 m = Dind[m_idx * Sind]; // row index of non-null value for column K
+                        const dtype_%(a_val)s Amk = Dval[m_idx * Sval]; // actual value at that location
+
+                        // pointer to m-th row of the output matrix Z
+                        dtype_%(z)s* __restrict__ zm = (dtype_%(z)s*)(%(z)s->data + %(z)s->strides[0] * m);
+
+                        // loop over this block of the final dimension
+                        // (cols of dense matrix) and perform dot product
+                        if ((Szn == 1) && (Sbn == 1)) {
+                            for(npy_intp n = n_start; n < n_end; ++n)
+                            {
+                                zm[n] += Amk * bk[n];
+                            }
+                        }
+                        else
                         {
-                            zm[n*Szn] += Amk * bk[n*Sbn];
+                            for(npy_intp n = n_start; n < n_end; ++n)
+                            {
+                                zm[n*Szn] += Amk * bk[n*Sbn];
+                            }
                         }
                     }
                 }
@@ -3515,11 +5048,11 @@ class StructuredDotCSC(gof.Op):
         return rval
 
     def c_code_cache_version(self):
-        return (2,)
+        return (3,)
 sd_csc = StructuredDotCSC()
 
 
-class StructuredDotCSR(gof.Op):
+class StructuredDotCSR(_ParallelSparseDot):
     # Structured Dot CSR is like dot, except that only the
     # gradient wrt non-zero elements of the sparse matrix
     # `a` are calculated and propagated.
@@ -3529,30 +5062,39 @@ class StructuredDotCSR(gof.Op):
 
     # :param a: A sparse matrix in csr format.
     # :param b: A sparse or dense matrix.
+    # :param a_ncols: The number of columns of `a` (an int32 scalar). When
+    #   it is given, it is checked against the number of rows of `b`.
 
     # :return: The dot product of `a` and `b`.
 
     # :note:
     # - The grad implemented is structured.
     # - This op is used as an optimization for StructuredDot.
+    # - With num_threads != 1, the rows of the output are split between
+    #   the threads.
 
-    def __eq__(self, other):
-        return (type(self) == type(other))
-
-    def __hash__(self):
-        return hash(type(self))
-
-    def __str__(self):
-        return self.__class__.__name__
-
-    def make_node(self, a_val, a_ind, a_ptr, b):
-        self.dtype_out = scalar.upcast(a_val.type.dtype, b.type.dtype)
-        r = gof.Apply(self, [a_val, a_ind, a_ptr, b],
-                [tensor.tensor(self.dtype_out, (False,
-                                                b.type.broadcastable[1]))])
+    def make_node(self, a_val, a_ind, a_ptr, b, a_ncols=None):
+        dtype_out = scalar.upcast(a_val.type.dtype, b.type.dtype)
+        inputs = [a_val, a_ind, a_ptr, b]
+        if a_ncols is not None:
+            inputs.append(tensor.as_tensor_variable(a_ncols))
+        r = gof.Apply(self, inputs,
+                [tensor.tensor(dtype_out, (False, b.type.broadcastable[1]))])
         return r
 
-    def perform(self, node, (a_val, a_ind, a_ptr, b), (out,)):
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        # a_val holds the non-zero elements of a.
+        flops = None
+        if input_shapes[0] is not None and input_shapes[3] is not None:
+            flops = 2 * input_shapes[0][0] * input_shapes[3][1]
+        return (flops,) + gof.op.default_cost_bytes(node, input_shapes,
+                                                    output_shapes)
+
+    def perform(self, node, inputs, (out,)):
+        a_val, a_ind, a_ptr, b = inputs[:4]
+        if len(inputs) == 5 and inputs[4] != b.shape[0]:
+            raise ValueError("a's number of columns doesn't match b's rows",
+                             inputs[4], b.shape[0])
         a = scipy.sparse.csr_matrix((a_val, a_ind, a_ptr),
                 (len(a_ptr) - 1, b.shape[0]),
                 copy=True)  # use view_map before setting this to False
@@ -3561,7 +5103,7 @@ class StructuredDotCSR(gof.Op):
         # scipy 0.7 automatically converts to dense, but not .6 sometimes
         assert _is_dense(out[0])
 
-    def c_code(self, node, name, (a_val, a_ind, a_ptr, b), (z,), sub):
+    def c_code(self, node, name, inputs, (z,), sub):
         """
         C-implementation of the dot product of the sparse matrix A and matrix
         B.
@@ -3576,11 +5118,26 @@ class StructuredDotCSR(gof.Op):
         @param sub: TODO, not too sure, something to do with weave probably
         """
         # retrieve dtype number
-        typenum_z = tensor.TensorType(self.dtype_out, []).dtype_specs()[-1]
+        typenum_z = node.outputs[0].type.dtype_specs()[-1]
         if node.inputs[0].type.dtype in ('complex64', 'complex128'):
             raise NotImplementedError('Complex types are not supported for a_val')
         if node.inputs[3].type.dtype in ('complex64', 'complex128'):
             raise NotImplementedError('Complex types are not supported for b')
+        # The number of non-zeros per row varies, so rows are handed out
+        # to the threads in small chunks.
+        pragma = self._omp_pragma('schedule(dynamic, 16)')
+        a_val, a_ind, a_ptr, b = inputs[:4]
+        fail = sub['fail']
+        if len(inputs) == 5:
+            check_ncols = """
+        if (%(a_ncols)s->descr->type_num != PyArray_INT32)
+        {PyErr_SetString(PyExc_NotImplementedError, "a_ncols dtype not INT32"); %(fail)s;}
+
+        if (((npy_int32 *)%(a_ncols)s->data)[0] != %(b)s->dimensions[0])
+        {PyErr_SetString(PyExc_ValueError, "a's number of columns doesn't match b's rows"); %(fail)s;}
+""" % dict(a_ncols=inputs[4], b=b, fail=fail)
+        else:
+            check_ncols = ''
 
         return """
         if (%(a_val)s->nd != 1) {PyErr_SetString(PyExc_NotImplementedError, "rank(a_val) != 1"); %(fail)s;}
@@ -3596,7 +5153,7 @@ class StructuredDotCSR(gof.Op):
 
         if (%(a_val)s->dimensions[0] != %(a_ind)s->dimensions[0])
         {PyErr_SetString(PyExc_NotImplementedError, "a_val and a_ind have different lengths"); %(fail)s;}
-
+        %(check_ncols)s
         if ((!%(z)s)
             || (%(z)s->dimensions[0] != %(a_ptr)s->dimensions[0]-1) //a's rows
             || (%(z)s->dimensions[1] != %(b)s->dimensions[1])       //b's columns
@@ -3647,8 +5204,17 @@ class StructuredDotCSR(gof.Op):
             //     for n
             //        z[m, n] += a[m, k] * b[k, n]
 
-            // loop over inner dimension
-            for (npy_int64 m = 0; m < M; ++m)
+            // Check the column indices first, we can't fail inside the
+            // parallel loop.
+            for (npy_intp idx = Dptr[0]; idx < Dptr[M * Sptr]; ++idx)
+            {
+                if (Dind[idx * Sind] < 0 || Dind[idx * Sind] >= K)
+                {PyErr_SetString(PyExc_NotImplementedError, "illegal column index in a"); %(fail)s;}
+            }
+
+            // Each row of Z is computed by one thread.
+            %(pragma)s
+            for (npy_intp m = 0; m < M; ++m)
             {
                 // pointer to m-th row of the output matrix Z
                 dtype_%(z)s* __restrict__ zm = (dtype_%(z)s*)(%(z)s->data + %(z)s->strides[0] * m);
@@ -3664,7 +5230,7 @@ class StructuredDotCSR(gof.Op):
                     const dtype_%(b)s* __restrict__ bk = (dtype_%(b)s*)(%(b)s->data + %(b)s->strides[0] * k);
 
                     // loop over final dimension (cols of dense matrix) and perform dot product
-                    for(npy_int32 n = 0; n < N; ++n)
+                    for(npy_intp n = 0; n < N; ++n)
                     {
                         zm[n*Szn] += Amk * bk[n*Sbn];
                     }
@@ -3675,7 +5241,7 @@ class StructuredDotCSR(gof.Op):
         """ % dict(locals(), **sub)
 
     def c_code_cache_version(self):
-        return (1,)
+        return (3,)
 sd_csr = StructuredDotCSR()
 
 
@@ -3740,13 +5306,8 @@ class SamplingDot(gof.op.Op):
         out[0] = p.__class__(p.multiply(numpy.dot(x, y.T)))
 
     def grad(self, (x, y, p), (gz,)):
-        rval = [
-            dot(p * gz, y),
-            dot((p * gz).T, x),
-            None
-        ]
-
-        return rval
+        gx, gy = sampling_dot_grad(x, y, p, gz)
+        return [gx, gy, None]
 
     def infer_shape(self, node, ins_shapes):
         return [ins_shapes[2]]
@@ -3756,7 +5317,7 @@ class SamplingDot(gof.op.Op):
 sampling_dot = SamplingDot()
 
 
-class SamplingDotCSR(gof.Op):
+class SamplingDotCSR(_ParallelSparseDot):
     # Operand optimized for calculating the dot product dot(`x`, `y`.T) = `z`
     # when you only want to calculate a subset of `z`.
 
@@ -3789,15 +5350,15 @@ class SamplingDotCSR(gof.Op):
     #   in the graph to be able to call blas function as they don't
     #   allow mixed dtype.
     # - This op is used as an optimization for SamplingDot.
-
-    def __eq__(self, other):
-        return type(self) == type(other)
-
-    def __hash__(self):
-        return hash(type(self))
+    # - The non-zeros of a row of `p` that are in consecutive columns are
+    #   computed with one gemv over the matching rows of `y`, the others
+    #   with a dot. With num_threads != 1, the rows of `p` are split
+    #   between the threads.
 
     def __str__(self):
-        return 'SamplingDot{Csr}'
+        if self.num_threads == 1:
+            return 'SamplingDot{Csr}'
+        return 'SamplingDot{Csr,num_threads=%d}' % self.num_threads
 
     def make_node(self, x, y, p_data, p_ind, p_ptr, p_ncols):
         x = tensor.as_tensor_variable(x)
@@ -3830,7 +5391,8 @@ class SamplingDotCSR(gof.Op):
         return blas.ldflags()
 
     def c_compile_args(self):
-        return blas.ldflags(libs=False, flags=True)
+        return (blas.ldflags(libs=False, flags=True) +
+                self._openmp_args())
 
     def c_lib_dirs(self):
         return blas.ldflags(libs=False, libs_dir=True)
@@ -3855,9 +5417,14 @@ class SamplingDotCSR(gof.Op):
         if dot_out == "float32":
             conv_type = "float"
             cdot = "sdot_"
+            gemv = "sgemv_"
         else:
             conv_type = "double"
             cdot = "ddot_"
+            gemv = "dgemv_"
+        # gemv writes its result in z_data, so it is only used when z_data
+        # has the dtype of the dot products.
+        use_gemv = int(node.outputs[0].dtype == dot_out)
 
         # retrieve dtype number
         typenum_x = node.inputs[0].type.dtype_specs()[-1]
@@ -3869,6 +5436,9 @@ class SamplingDotCSR(gof.Op):
                                        []).dtype_specs()[-1]
         typenum_zp = tensor.TensorType(node.outputs[2].dtype,
                                        []).dtype_specs()[-1]
+        # The number of non-zeros per row varies, so rows are handed out
+        # to the threads in small chunks.
+        pragma = self._omp_pragma('schedule(dynamic, 16)')
 
         rval = """
         if (%(x)s->nd != 2) {
@@ -3932,13 +5502,11 @@ PyErr_SetString(PyExc_NotImplementedError, "rank(y) != 2"); %(fail)s;}
 
         {
             // Product of MxK and NxK, output MxN
-            npy_intp M = %(x)s->dimensions[0];
-            npy_intp N = %(y)s->dimensions[0];
-            npy_intp K = %(y)s->dimensions[1];
+            const npy_intp M = %(x)s->dimensions[0];
+            const npy_intp N = %(y)s->dimensions[0];
+            const int K = %(y)s->dimensions[1];
 
             // pointers to access actual data in the arrays passed as params.
-            const dtype_%(x)s* __restrict__ Dx = (dtype_%(x)s*)%(x)s->data;
-            const dtype_%(y)s* __restrict__ Dy = (dtype_%(y)s*)%(y)s->data;
             const dtype_%(p_data)s* __restrict__ Dpd = (dtype_%(p_data)s*)%(p_data)s->data;
             const dtype_%(p_ind)s* __restrict__ Dpi = (dtype_%(p_ind)s*)%(p_ind)s->data;
             const dtype_%(p_ptr)s* __restrict__ Dpp = (dtype_%(p_ptr)s*)%(p_ptr)s->data;
@@ -3946,36 +5514,438 @@ PyErr_SetString(PyExc_NotImplementedError, "rank(y) != 2"); %(fail)s;}
             dtype_%(z_ind)s* __restrict__ Dzi = (dtype_%(z_ind)s*)%(z_ind)s->data;
             dtype_%(z_ptr)s* __restrict__ Dzp = (dtype_%(z_ptr)s*)%(z_ptr)s->data;
 
-            const npy_intp Sdx = %(x)s->strides[1]/%(x)s->descr->elsize;
-            const npy_intp Sdy = %(y)s->strides[1]/%(y)s->descr->elsize;
             const npy_intp Sdpd = %(p_data)s->strides[0] / %(p_data)s->descr->elsize;
             const npy_intp Sdpi = %(p_ind)s->strides[0] / %(p_ind)s->descr->elsize;
             const npy_intp Sdpp = %(p_ptr)s->strides[0] / %(p_ptr)s->descr->elsize;
-            const npy_intp Sdzd = %(z_data)s->strides[0] / %(z_data)s->descr->elsize;
-            const npy_intp Sdzi = %(z_ind)s->strides[0] / %(z_ind)s->descr->elsize;
-            const npy_intp Sdzp = %(z_ptr)s->strides[0] / %(z_ptr)s->descr->elsize;
-
-            memcpy(Dzi, Dpi, %(p_ind)s->dimensions[0]*sizeof(dtype_%(p_ind)s));
-            memcpy(Dzp, Dpp, %(p_ptr)s->dimensions[0]*sizeof(dtype_%(p_ptr)s));
 
-            for (npy_int32 m = 0; m < M; ++m) {
-                for (npy_int32 n_idx = Dpp[m * Sdpp]; n_idx < Dpp[(m+1)*Sdpp]; ++n_idx) {
-                    const npy_int32 n = Dpi[n_idx * Sdpi]; // row index of non-null value for column K
+            for (npy_intp i = 0; i < %(p_ind)s->dimensions[0]; ++i)
+                Dzi[i] = Dpi[i * Sdpi];
+            for (npy_intp i = 0; i < %(p_ptr)s->dimensions[0]; ++i)
+                Dzp[i] = Dpp[i * Sdpp];
 
-                    const dtype_%(x)s* x_row = (dtype_%(x)s*)(%(x)s->data + %(x)s->strides[0] * m);
+            // Check the column indices first, we can't fail inside the
+            // parallel loop.
+            for (npy_intp idx = Dpp[0]; idx < Dpp[M * Sdpp]; ++idx)
+            {
+                if (Dpi[idx * Sdpi] < 0 || Dpi[idx * Sdpi] >= N)
+                {PyErr_SetString(PyExc_NotImplementedError, "illegal column index in the pattern"); %(fail)s;}
+            }
 
-                    const dtype_%(y)s* y_col = (dtype_%(y)s*)(%(y)s->data + %(y)s->strides[0] * n);
+            // The rows of x and y are read with a unit stride, and y is
+            // given to gemv as a (column major) KxN matrix.
+            PyArrayObject* xc = PyArray_GETCONTIGUOUS(%(x)s);
+            PyArrayObject* yc = PyArray_GETCONTIGUOUS(%(y)s);
+            if (!xc || !yc)
+            {
+                Py_XDECREF(xc);
+                Py_XDECREF(yc);
+                %(fail)s;
+            }
+            const %(conv_type)s* __restrict__ Dx = (%(conv_type)s*)xc->data;
+            const %(conv_type)s* __restrict__ Dy = (%(conv_type)s*)yc->data;
+            const int use_gemv = %(use_gemv)s && K > 0;
 
-                    Dzd[n_idx * Sdzd] = Dpd[n_idx * Sdpd] * %(cdot)s((int*)&K, (const %(conv_type)s*)x_row, (int*)&Sdx, (const %(conv_type)s*)y_col, (int*)&Sdy);
+            %(pragma)s
+            for (npy_intp m = 0; m < M; ++m)
+            {
+                const %(conv_type)s* x_row = Dx + m * K;
+                const int one_i = 1;
+                const %(conv_type)s one = 1, zero = 0;
+                char cT = 'T';
+                npy_intp n_idx = Dpp[m * Sdpp];
+                const npy_intp n_end = Dpp[(m + 1) * Sdpp];
+                while (n_idx < n_end)
+                {
+                    const npy_intp n = Dpi[n_idx * Sdpi];
+                    // Length of the run of consecutive columns starting
+                    // at n.
+                    int run = 1;
+                    if (use_gemv)
+                        while (n_idx + run < n_end &&
+                               Dpi[(n_idx + run) * Sdpi] == n + run)
+                            ++run;
+                    if (run > 1)
+                    {
+                        // z[n_idx:n_idx+run] = y[n:n+run] . x[m]
+                        %(gemv)s(&cT, &K, &run, &one, Dy + n * K, &K,
+                                 x_row, &one_i, &zero,
+                                 (%(conv_type)s*)(Dzd + n_idx), &one_i);
+                        for (int r = 0; r < run; ++r)
+                            Dzd[n_idx + r] *= Dpd[(n_idx + r) * Sdpd];
+                    }
+                    else
+                    {
+                        Dzd[n_idx] = Dpd[n_idx * Sdpd] * %(cdot)s(&K, x_row, &one_i, Dy + n * K, &one_i);
+                    }
+                    n_idx += run;
                 }
             }
+            Py_DECREF(xc);
+            Py_DECREF(yc);
         }
         """ % dict(locals(), **sub)
 
         return rval
+
+    def c_code_cache_version(self):
+        return (1,)
 sampling_dot_csr = SamplingDotCSR()
 
 
+class SamplingDotGrad(gof.op.Op):
+    """Compute the gradient of SamplingDot with respect to `x` and `y`.
+
+    With `w` = `p` o `gz`, where o is the element-wise product, the
+    gradients are dot(`w`, `y`) and dot(`w`.T, `x`).
+
+    :param x: Tensor matrix.
+    :param y: Tensor matrix.
+    :param p: Sparse matrix, the pattern of the SamplingDot.
+    :param gz: Sparse matrix, the gradient of the output of the SamplingDot.
+
+    :return: The gradients with respect to `x` and `y`, as dense matrices.
+
+    :note:
+    - The grad is the one of dot(`p` * `gz`, `y`) and dot((`p` * `gz`).T,
+      `x`), so SamplingDot can be differentiated more than once.
+    - This op is inserted by SamplingDot.grad and replaced by
+      SamplingDotCSRGrad when `p` and `gz` are in csr format.
+    """
+
+    def __eq__(self, other):
+        return type(self) == type(other)
+
+    def __hash__(self):
+        return hash(type(self))
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    def make_node(self, x, y, p, gz):
+        x = tensor.as_tensor_variable(x)
+        y = tensor.as_tensor_variable(y)
+        p = as_sparse_variable(p)
+        gz = as_sparse_variable(gz)
+
+        # The dtypes of dot(p * gz, y) and dot((p * gz).T, x)
+        gx_dtype = scalar.upcast(p.type.dtype, gz.type.dtype, y.type.dtype)
+        gy_dtype = scalar.upcast(p.type.dtype, gz.type.dtype, x.type.dtype)
+
+        return gof.Apply(self, [x, y, p, gz],
+                         [tensor.matrix(dtype=gx_dtype),
+                          tensor.matrix(dtype=gy_dtype)])
+
+    def perform(self, node, (x, y, p, gz), (gx, gy)):
+        w = scipy.sparse.csr_matrix(p.multiply(gz))
+        gx[0] = theano._asarray(w * y, dtype=node.outputs[0].dtype)
+        gy[0] = theano._asarray(w.T * x, dtype=node.outputs[1].dtype)
+
+    def grad(self, (x, y, p, gz), (ggx, ggy)):
+        # Differentiate the same computation made of differentiable ops.
+        w = p * gz
+        sources = [(out, g) for out, g in [(dot(w, y), ggx),
+                                           (dot(w.T, x), ggy)]
+                   if g is not None]
+        gmap = theano.gradient.grad_sources_inputs(sources, [x, y, gz])
+        return [gmap.get(x), gmap.get(y), None, gmap.get(gz)]
+
+    def infer_shape(self, node, shapes):
+        return [shapes[0], shapes[1]]
+sampling_dot_grad = SamplingDotGrad()
+
+
+class SamplingDotCSRGrad(_ParallelSparseDot):
+    # Optimized version of SamplingDotGrad, when the pattern `p` and the
+    # gradient `gz` are in csr format.
+
+    # :param x: Tensor matrix.
+    # :param y: Tensor matrix.
+    # :param p_data: Pattern data.
+    # :param p_ind: Pattern indices.
+    # :param p_ptr: Pattern indptr.
+    # :param gz_data: Gradient data.
+    # :param gz_ind: Gradient indices.
+    # :param gz_ptr: Gradient indptr.
+
+    # :return: The gradients with respect to `x` and `y`.
+
+    # :note:
+    # - All the inputs are cast to the same float dtype, the one of the
+    #   outputs.
+    # - `gz` usually has the structure of `p`, its values are then used
+    #   as is. Otherwise they are looked up for each non-zero of `p`.
+    # - The gradient of `x` uses one gemv for each run of consecutive
+    #   columns in a row of `p`, and the rows are split between the
+    #   threads. The gradient of `y` splits its columns between the
+    #   threads, so no two threads write the same element.
+
+    def __str__(self):
+        if self.num_threads == 1:
+            return 'SamplingDotGrad{Csr}'
+        return 'SamplingDotGrad{Csr,num_threads=%d}' % self.num_threads
+
+    def make_node(self, x, y, p_data, p_ind, p_ptr, gz_data, gz_ind, gz_ptr):
+        x = tensor.as_tensor_variable(x)
+        y = tensor.as_tensor_variable(y)
+        p_data = tensor.as_tensor_variable(p_data)
+        gz_data = tensor.as_tensor_variable(gz_data)
+        for i in [p_ind, p_ptr, gz_ind, gz_ptr]:
+            assert i.dtype == 'int32'
+
+        dtype_out = scalar.upcast(x.type.dtype, y.type.dtype,
+                                  p_data.type.dtype, gz_data.type.dtype)
+        if dtype_out not in ('float32', 'float64'):
+            raise NotImplementedError('only float types are supported in '
+                                      'operands')
+        # The blas functions don't allow mixed dtype.
+        x = tensor.cast(x, dtype_out)
+        y = tensor.cast(y, dtype_out)
+        p_data = tensor.cast(p_data, dtype_out)
+        gz_data = tensor.cast(gz_data, dtype_out)
+
+        return gof.Apply(self,
+                         [x, y, p_data, p_ind, p_ptr, gz_data, gz_ind,
+                          gz_ptr],
+                         [tensor.matrix(dtype=dtype_out),
+                          tensor.matrix(dtype=dtype_out)])
+
+    def perform(self, node, (x, y, p_data, p_ind, p_ptr, gz_data, gz_ind,
+                             gz_ptr), (gx, gy)):
+        shape = (x.shape[0], y.shape[0])
+        p = scipy.sparse.csr_matrix((p_data, p_ind, p_ptr), shape)
+        gz = scipy.sparse.csr_matrix((gz_data, gz_ind, gz_ptr), shape)
+        w = scipy.sparse.csr_matrix(p.multiply(gz))
+        gx[0] = theano._asarray(w * y, dtype=node.outputs[0].dtype)
+        gy[0] = theano._asarray(w.T * x, dtype=node.outputs[1].dtype)
+
+    def infer_shape(self, node, shapes):
+        return [shapes[0], shapes[1]]
+
+    def c_support_code(self):
+        return blas.blas_header_text()
+
+    def c_libraries(self):
+        return blas.ldflags()
+
+    def c_compile_args(self):
+        return (blas.ldflags(libs=False, flags=True) +
+                self._openmp_args())
+
+    def c_lib_dirs(self):
+        return blas.ldflags(libs=False, libs_dir=True)
+
+    def c_header_dirs(self):
+        return blas.ldflags(libs=False, include_dir=True)
+
+    def c_code(self, node, name, inputs, outputs, sub):
+        x, y, p_data, p_ind, p_ptr, gz_data, gz_ind, gz_ptr = inputs
+        gx, gy = outputs
+        if node.outputs[0].type.dtype == "float32":
+            conv_type = "float"
+            gemv = "sgemv_"
+            axpy = "saxpy_"
+        else:
+            conv_type = "double"
+            gemv = "dgemv_"
+            axpy = "daxpy_"
+        typenum = node.outputs[0].type.dtype_specs()[-1]
+        n_blocks = self._omp_n_blocks('n_blocks')
+        pragma_rows = self._omp_pragma('schedule(dynamic, 16)')
+        pragma_cols = self._omp_pragma()
+
+        return """
+        if (%(x)s->nd != 2 || %(y)s->nd != 2)
+        {PyErr_SetString(PyExc_NotImplementedError, "rank(x) or rank(y) != 2"); %(fail)s;}
+        if (%(x)s->descr->type_num != %(typenum)s || %(y)s->descr->type_num != %(typenum)s
+            || %(p_data)s->descr->type_num != %(typenum)s || %(gz_data)s->descr->type_num != %(typenum)s)
+        {PyErr_SetString(PyExc_NotImplementedError, "Invalid type for x, y, p_data or gz_data"); %(fail)s;}
+        if (%(p_ind)s->descr->type_num != PyArray_INT32 || %(p_ptr)s->descr->type_num != PyArray_INT32
+            || %(gz_ind)s->descr->type_num != PyArray_INT32 || %(gz_ptr)s->descr->type_num != PyArray_INT32)
+        {PyErr_SetString(PyExc_NotImplementedError, "The indices and indptr must be int32"); %(fail)s;}
+        if (%(x)s->dimensions[1] != %(y)s->dimensions[1])
+        {PyErr_SetString(PyExc_ValueError, "x and y must have the same number of columns"); %(fail)s;}
+        if (%(p_ptr)s->dimensions[0] != %(x)s->dimensions[0] + 1
+            || %(gz_ptr)s->dimensions[0] != %(x)s->dimensions[0] + 1)
+        {PyErr_SetString(PyExc_ValueError, "The pattern and the gradient must have one row for each row of x"); %(fail)s;}
+        if (%(p_data)s->dimensions[0] != %(p_ind)s->dimensions[0]
+            || %(gz_data)s->dimensions[0] != %(gz_ind)s->dimensions[0])
+        {PyErr_SetString(PyExc_ValueError, "data and indices have different lengths"); %(fail)s;}
+
+        if (!%(gx)s || %(gx)s->dimensions[0] != %(x)s->dimensions[0]
+            || %(gx)s->dimensions[1] != %(x)s->dimensions[1]
+            || !PyArray_ISCARRAY(%(gx)s))
+        {
+            Py_XDECREF(%(gx)s);
+            %(gx)s = (PyArrayObject*) PyArray_SimpleNew(2, %(x)s->dimensions, %(typenum)s);
+            if (!%(gx)s) %(fail)s;
+        }
+        if (!%(gy)s || %(gy)s->dimensions[0] != %(y)s->dimensions[0]
+            || %(gy)s->dimensions[1] != %(y)s->dimensions[1]
+            || !PyArray_ISCARRAY(%(gy)s))
+        {
+            Py_XDECREF(%(gy)s);
+            %(gy)s = (PyArrayObject*) PyArray_SimpleNew(2, %(y)s->dimensions, %(typenum)s);
+            if (!%(gy)s) %(fail)s;
+        }
+        memset(%(gx)s->data, 0, PyArray_NBYTES(%(gx)s));
+        memset(%(gy)s->data, 0, PyArray_NBYTES(%(gy)s));
+
+        {
+            const npy_intp M = %(x)s->dimensions[0];
+            const npy_intp N = %(y)s->dimensions[0];
+            const int K = %(x)s->dimensions[1];
+
+            const npy_intp Spd = %(p_data)s->strides[0] / %(p_data)s->descr->elsize;
+            const npy_intp Spi = %(p_ind)s->strides[0] / %(p_ind)s->descr->elsize;
+            const npy_intp Spp = %(p_ptr)s->strides[0] / %(p_ptr)s->descr->elsize;
+            const npy_intp Sgd = %(gz_data)s->strides[0] / %(gz_data)s->descr->elsize;
+            const npy_intp Sgi = %(gz_ind)s->strides[0] / %(gz_ind)s->descr->elsize;
+            const npy_intp Sgp = %(gz_ptr)s->strides[0] / %(gz_ptr)s->descr->elsize;
+            const %(conv_type)s* Dpd = (%(conv_type)s*)%(p_data)s->data;
+            const npy_int32* Dpi = (npy_int32*)%(p_ind)s->data;
+            const npy_int32* Dpp = (npy_int32*)%(p_ptr)s->data;
+            const %(conv_type)s* Dgd = (%(conv_type)s*)%(gz_data)s->data;
+            const npy_int32* Dgi = (npy_int32*)%(gz_ind)s->data;
+            const npy_int32* Dgp = (npy_int32*)%(gz_ptr)s->data;
+
+            // Check the indices first, we can't fail inside the parallel
+            // loops.
+            if (Dpp[0] < 0 || Dpp[M * Spp] > %(p_ind)s->dimensions[0]
+                || Dgp[0] < 0 || Dgp[M * Sgp] > %(gz_ind)s->dimensions[0])
+            {PyErr_SetString(PyExc_ValueError, "indptr out of bounds"); %(fail)s;}
+            for (npy_intp m = 0; m < M; ++m)
+            {
+                if (Dpp[(m + 1) * Spp] < Dpp[m * Spp] || Dgp[(m + 1) * Sgp] < Dgp[m * Sgp])
+                {PyErr_SetString(PyExc_ValueError, "indptr is not increasing"); %(fail)s;}
+            }
+            for (npy_intp idx = Dpp[0]; idx < Dpp[M * Spp]; ++idx)
+            {
+                if (Dpi[idx * Spi] < 0 || Dpi[idx * Spi] >= N)
+                {PyErr_SetString(PyExc_ValueError, "illegal column index in the pattern"); %(fail)s;}
+            }
+            for (npy_intp idx = Dgp[0]; idx < Dgp[M * Sgp]; ++idx)
+            {
+                if (Dgi[idx * Sgi] < 0 || Dgi[idx * Sgi] >= N)
+                {PyErr_SetString(PyExc_ValueError, "illegal column index in the gradient"); %(fail)s;}
+            }
+
+            // w = p o gz, one value for each non-zero of p.
+            const npy_intp nnz = Dpp[M * Spp];
+            %(conv_type)s* w = (%(conv_type)s*)malloc((nnz + 1) * sizeof(%(conv_type)s));
+            if (!w)
+            {PyErr_NoMemory(); %(fail)s;}
+            int same_structure = 1;
+            for (npy_intp m = 0; same_structure && m <= M; ++m)
+                same_structure = Dpp[m * Spp] == Dgp[m * Sgp];
+            for (npy_intp idx = Dpp[0]; same_structure && idx < nnz; ++idx)
+                same_structure = Dpi[idx * Spi] == Dgi[idx * Sgi];
+            if (same_structure)
+            {
+                for (npy_intp idx = Dpp[0]; idx < nnz; ++idx)
+                    w[idx] = Dpd[idx * Spd] * Dgd[idx * Sgd];
+            }
+            else
+            {
+                // Scatter each row of gz in a dense buffer, look up the
+                // non-zeros of p, and clear the buffer.
+                %(conv_type)s* acc = (%(conv_type)s*)calloc(N + 1, sizeof(%(conv_type)s));
+                if (!acc)
+                {
+                    free(w);
+                    PyErr_NoMemory();
+                    %(fail)s;
+                }
+                for (npy_intp m = 0; m < M; ++m)
+                {
+                    for (npy_intp idx = Dgp[m * Sgp]; idx < Dgp[(m + 1) * Sgp]; ++idx)
+                        acc[Dgi[idx * Sgi]] += Dgd[idx * Sgd];
+                    for (npy_intp idx = Dpp[m * Spp]; idx < Dpp[(m + 1) * Spp]; ++idx)
+                        w[idx] = Dpd[idx * Spd] * acc[Dpi[idx * Spi]];
+                    for (npy_intp idx = Dgp[m * Sgp]; idx < Dgp[(m + 1) * Sgp]; ++idx)
+                        acc[Dgi[idx * Sgi]] = 0;
+                }
+                free(acc);
+            }
+
+            PyArrayObject* xc = PyArray_GETCONTIGUOUS(%(x)s);
+            PyArrayObject* yc = PyArray_GETCONTIGUOUS(%(y)s);
+            if (!xc || !yc)
+            {
+                free(w);
+                Py_XDECREF(xc);
+                Py_XDECREF(yc);
+                %(fail)s;
+            }
+            const %(conv_type)s* __restrict__ Dx = (%(conv_type)s*)xc->data;
+            const %(conv_type)s* __restrict__ Dy = (%(conv_type)s*)yc->data;
+            %(conv_type)s* __restrict__ Dgx = (%(conv_type)s*)%(gx)s->data;
+            %(conv_type)s* __restrict__ Dgy = (%(conv_type)s*)%(gy)s->data;
+
+            if (K > 0)
+            {
+                // gx[m] = sum_n w[m, n] y[n], each row by one thread.
+                %(pragma_rows)s
+                for (npy_intp m = 0; m < M; ++m)
+                {
+                    const int one_i = 1;
+                    const %(conv_type)s one = 1;
+                    char cN = 'N';
+                    %(conv_type)s* gx_row = Dgx + m * K;
+                    npy_intp idx = Dpp[m * Spp];
+                    const npy_intp end = Dpp[(m + 1) * Spp];
+                    while (idx < end)
+                    {
+                        const npy_intp n = Dpi[idx * Spi];
+                        int run = 1;
+                        while (idx + run < end && Dpi[(idx + run) * Spi] == n + run)
+                            ++run;
+                        if (run > 1)
+                            // gx[m] += y[n:n+run].T . w[idx:idx+run]
+                            %(gemv)s(&cN, &K, &run, &one, Dy + n * K, &K,
+                                     w + idx, &one_i, &one, gx_row, &one_i);
+                        else
+                            %(axpy)s(&K, w + idx, Dy + n * K, &one_i,
+                                     gx_row, &one_i);
+                        idx += run;
+                    }
+                }
+
+                // gy[n] += w[m, n] x[m], each block of columns by one
+                // thread.
+                npy_intp n_blocks = 1;
+                %(n_blocks)s
+                if (n_blocks > K)
+                    n_blocks = K;
+                if (n_blocks < 1)
+                    n_blocks = 1;
+
+                %(pragma_cols)s
+                for (npy_intp blk = 0; blk < n_blocks; ++blk)
+                {
+                    const npy_intp k_start = blk * K / n_blocks;
+                    const int len = (blk + 1) * K / n_blocks - k_start;
+                    const int one_i = 1;
+                    for (npy_intp m = 0; m < M; ++m)
+                    {
+                        for (npy_intp idx = Dpp[m * Spp]; idx < Dpp[(m + 1) * Spp]; ++idx)
+                        {
+                            %(axpy)s(&len, w + idx, Dx + m * K + k_start, &one_i,
+                                     Dgy + Dpi[idx * Spi] * K + k_start, &one_i);
+                        }
+                    }
+                }
+            }
+            free(w);
+            Py_DECREF(xc);
+            Py_DECREF(yc);
+        }
+        """ % dict(locals(), **sub)
+
+    def c_code_cache_version(self):
+        return (1,)
+sampling_dot_csr_grad = SamplingDotCSRGrad()
+
+
 # register a specialization to replace StructuredDot -> StructuredDotCSx
 @gof.local_optimizer([_structured_dot])
 def local_structured_dot(node):
@@ -4013,6 +5983,10 @@ def structured_dot_grad(sparse_A, dense_B, ga):
         return CSx(g_A_data, csm_indices(sparse_A), \
                                  csm_indptr(sparse_A), \
                                  csm_shape(sparse_A))
+    elif sparse_A.type.format == 'bsr':
+        a_val, a_ind, a_ptr, a_shape = bsm_properties(sparse_A)
+        g_A_data = sdg_bsr(a_val, a_ind, a_ptr, a_shape, dense_B, ga)
+        return BSR(g_A_data, a_ind, a_ptr, a_shape)
     else:
         raise NotImplementedError()
 
@@ -4294,7 +6268,7 @@ sdg_csr = StructuredDotGradCSR()
 
 class Dot(gof.op.Op):
     """Operation for efficiently calculating the dot product when
-    one or all operands is sparse. Supported format are CSC and CSR.
+    one or all operands is sparse. Supported format are CSC, CSR and BSR.
     The output of the operation is dense.
 
     :param x: Matrix variable.
@@ -4329,6 +6303,10 @@ class Dot(gof.op.Op):
             return [()]
         raise NotImplementedError()
 
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        return _sparse_dot_cost(node, 0, 1, input_shapes, output_shapes,
+                                input_nnz)
+
     def make_node(self, x, y):
         dtype_out = scalar.upcast(x.type.dtype, y.type.dtype)
 
@@ -4354,6 +6332,13 @@ class Dot(gof.op.Op):
 
         out[0] = rval
 
+    def R_op(self, inputs, eval_points):
+        if None in eval_points:
+            return [None]
+        x, y = inputs
+        ex, ey = eval_points
+        return [dot(ex, y) + dot(x, ey)]
+
     def grad(self, (x, y), (gz,)):
         assert _is_sparse_variable(x) or _is_sparse_variable(y)
         rval = []
@@ -4373,7 +6358,7 @@ _dot = Dot()
 
 def dot(x, y):
     """Operation for efficiently calculating the dot product when
-    one or all operands is sparse. Supported format are CSC and CSR.
+    one or all operands is sparse. Supported format are CSC, CSR and BSR.
     The output of the operation is dense.
 
     :param x: Matrix variable.
@@ -4427,6 +6412,14 @@ class Usmm(gof.op.Op):
     def __str__(self):
         return 'Usmm{no_inplace}'
 
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        flops, read, written = _sparse_dot_cost(node, 1, 2, input_shapes,
+                                                output_shapes, input_nnz)
+        if flops is not None and output_shapes[0] is not None:
+            # The scaling by alpha and the addition of z.
+            flops += 2 * int(numpy.prod(output_shapes[0]))
+        return (flops, read, written)
+
     def make_node(self, alpha, x, y, z):
         if not _is_sparse_variable(x) and not _is_sparse_variable(y):
             # If x and y are tensor, we don't want to use this class
@@ -4474,7 +6467,7 @@ class Usmm(gof.op.Op):
 usmm = Usmm()
 
 
-class UsmmCscDense(gof.Op):
+class UsmmCscDense(_ParallelSparseDot):
     # Performs the expression is `alpha` * `x` `y` + `z`.
 
     # :param x: Matrix variable.
@@ -4488,23 +6481,41 @@ class UsmmCscDense(gof.Op):
     # - The grad is not implemented for this op.
     # - Optimized version os Usmm when `x` is in csc format and
     #   `y` is dense.
+    # - With num_threads != 1, the columns of the output are split between
+    #   the threads.
 
-    def __init__(self, inplace):
+    def __init__(self, inplace, num_threads=1):
         self.inplace = inplace
+        self.num_threads = num_threads
         if inplace:
             self.destroy_map = {0: [6]}
 
     def __str__(self):
         if self.inplace:
-            return 'UsmmCscDense{inplace}'
+            s = 'inplace'
         else:
-            return 'UsmmCscDense{no_inplace}'
+            s = 'no_inplace'
+        if self.num_threads != 1:
+            s += ',num_threads=%d' % self.num_threads
+        return 'UsmmCscDense{%s}' % s
 
     def __eq__(self, other):
-        return (type(self) == type(other)) and self.inplace == other.inplace
+        return (type(self) == type(other) and
+                self.inplace == other.inplace and
+                self.num_threads == other.num_threads)
 
     def __hash__(self):
-        return hash(type(self)) ^ self.inplace
+        return hash(type(self)) ^ self.inplace ^ hash(self.num_threads)
+
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        # x_val holds the non-zero elements of x. The scaling by alpha and
+        # the addition of z are done once per element of the output.
+        flops = None
+        if None not in (input_shapes[1], input_shapes[5], output_shapes[0]):
+            flops = (2 * input_shapes[1][0] * input_shapes[5][1] +
+                     2 * int(numpy.prod(output_shapes[0])))
+        return (flops,) + gof.op.default_cost_bytes(node, input_shapes,
+                                                    output_shapes)
 
     def make_node(self, alpha, x_val, x_ind, x_ptr, x_nrows, y, z):
         alpha = tensor.as_tensor_variable(alpha)
@@ -4553,7 +6564,8 @@ class UsmmCscDense(gof.Op):
         return blas.ldflags()
 
     def c_compile_args(self):
-        return blas.ldflags(libs=False, flags=True)
+        return (blas.ldflags(libs=False, flags=True) +
+                self._openmp_args())
 
     def c_lib_dirs(self):
         return blas.ldflags(libs=False, libs_dir=True)
@@ -4586,6 +6598,8 @@ class UsmmCscDense(gof.Op):
         typenum_zn = node.outputs[0].type.dtype_specs()[-1]
 
         inplace = int(self.inplace)
+        n_blocks = self._omp_n_blocks('n_blocks')
+        pragma = self._omp_pragma()
 
         rval = """
         if (%(x_val)s->nd != 1) {PyErr_SetString(PyExc_NotImplementedError, "rank(x_val) != 1"); %(fail)s;}
@@ -4689,36 +6703,652 @@ class UsmmCscDense(gof.Op):
                 }
             }
 
-            for (npy_int32 k = 0; k < K; ++k)
+            // Check the row indices first, we can't fail inside the
+            // parallel loop.
+            for (npy_intp idx = Dptr[0]; idx < Dptr[K * Sptr]; ++idx)
             {
-                for (npy_int32 m_idx = Dptr[k * Sptr]; m_idx < Dptr[(k+1)*Sptr]; ++m_idx)
+                if (Dind[idx * Sind] < 0 || Dind[idx * Sind] >= M)
+                {PyErr_SetString(PyExc_NotImplementedError, "illegal row index in x"); %(fail)s;}
+            }
+
+            // Each block of columns of Z is updated by one thread, so
+            // there are no concurrent writes.
+            npy_intp n_blocks = 1;
+            %(n_blocks)s
+            if (n_blocks > N)
+                n_blocks = N;
+            if (n_blocks < 1)
+                n_blocks = 1;
+
+            %(pragma)s
+            for (npy_intp blk = 0; blk < n_blocks; ++blk)
+            {
+                const npy_intp n_start = blk * N / n_blocks;
+                const npy_intp n_end = (blk + 1) * N / n_blocks;
+                int len = n_end - n_start;
+                int inc_y = Sy;
+                int inc_z = Szn;
+
+                for (npy_int32 k = 0; k < K; ++k)
                 {
-                    const npy_int32 m = Dind[m_idx * Sind]; // row index of non-null value for column K
+                    for (npy_int32 m_idx = Dptr[k * Sptr]; m_idx < Dptr[(k+1)*Sptr]; ++m_idx)
+                    {
+                        const npy_int32 m = Dind[m_idx * Sind]; // row index of non-null value for column K
+
+                        const dtype_%(x_val)s Amk = alpha * Dval[m_idx * Sval]; // actual value at that location
+
+                        // axpy expects pointer to the beginning of memory
+                        // arrays, so when the stride is negative, we need
+                        // to get the last element of the block.
+                        dtype_%(y)s* y_row = (dtype_%(y)s*)(%(y)s->data + %(y)s->strides[0] * k);
+                        if (Sy < 0)
+                            y_row += (n_end - 1) * Sy;
+                        else
+                            y_row += n_start * Sy;
+
+                        dtype_%(zn)s* z_row = (dtype_%(zn)s*)(%(zn)s->data + %(zn)s->strides[0] * m);
+                        if (Szn < 0)
+                            z_row += (n_end - 1) * Szn;
+                        else
+                            z_row += n_start * Szn;
+
+                        %(axpy)s(&len, (%(conv_type)s*)&Amk, (%(conv_type)s*)y_row, &inc_y, (%(conv_type)s*)z_row, &inc_z);
+                    }
+                }
+            }
+        }
+        """ % dict(locals(), **sub)
+
+        return rval
+
+    def c_code_cache_version(self):
+        return (2,)
+
+
+usmm_csc_dense = UsmmCscDense(inplace=False)
+usmm_csc_dense_inplace = UsmmCscDense(inplace=True)
+
+
+class _BSRDot(gof.Op):
+    # Helpers shared by the products of a BSR matrix with a dense
+    # matrix. Their C code calls one small GEMM per block of the sparse
+    # matrix, so it needs config.blas.ldflags.
+
+    def c_support_code(self):
+        return blas.blas_header_text()
+
+    def c_libraries(self):
+        return blas.ldflags()
+
+    def c_compile_args(self):
+        return blas.ldflags(libs=False, flags=True)
+
+    def c_lib_dirs(self):
+        return blas.ldflags(libs=False, libs_dir=True)
+
+    def c_header_dirs(self):
+        return blas.ldflags(libs=False, include_dir=True)
+
+    def _gemm(self, node):
+        """Return the name of the GEMM to call on the outputs' dtype."""
+        dtype = node.outputs[0].type.dtype
+        if dtype not in ('float32', 'float64') or not config.blas.ldflags:
+            raise theano.gof.utils.MethodNotDefined(
+                '%s.c_code' % self.__class__.__name__)
+        if dtype == 'float32':
+            return 'sgemm_'
+        return 'dgemm_'
+
+    def _c_begin(self, a_val, a_ind, a_ptr, a_shape, dense, typenum_val,
+                 typenum_dense, fail):
+        """Return C code that checks the BSR matrix.
+
+        It declares `bsr_val`, `bsr_ind`, `bsr_ptr` and `bsr_dense`,
+        C-contiguous versions of `a_val`, `a_ind`, `a_ptr` and `dense`,
+        that must be released by the code from `_c_end`. It also declares
+        the sizes nblk (number of blocks), R, C (the blocksize), nbr, nbc
+        (number of block rows and columns), M, K (the shape of the
+        matrix) and `bsr_err`, a message that is not NULL if the matrix
+        is invalid.
+
+        If `typenum_val` is None, the dtype of `a_val` is not checked.
+        """
+        check_val = ''
+        if typenum_val is not None:
+            check_val = '%s->descr->type_num != %s ||' % (a_val, typenum_val)
+        return """
+        if (%(a_val)s->nd != 3)
+        {PyErr_SetString(PyExc_NotImplementedError, "rank(a_val) != 3"); %(fail)s;}
+        if (%(a_ind)s->nd != 1 || %(a_ind)s->descr->type_num != PyArray_INT32)
+        {PyErr_SetString(PyExc_NotImplementedError, "a_ind is not an int32 vector"); %(fail)s;}
+        if (%(a_ptr)s->nd != 1 || %(a_ptr)s->descr->type_num != PyArray_INT32)
+        {PyErr_SetString(PyExc_NotImplementedError, "a_ptr is not an int32 vector"); %(fail)s;}
+        if (%(a_shape)s->nd != 1 || %(a_shape)s->dimensions[0] != 2 || %(a_shape)s->descr->type_num != PyArray_INT32)
+        {PyErr_SetString(PyExc_NotImplementedError, "a_shape is not an int32 vector of length 2"); %(fail)s;}
+        if (%(dense)s->nd != 2)
+        {PyErr_SetString(PyExc_NotImplementedError, "rank of the dense input != 2"); %(fail)s;}
+        if (%(check_val)s %(dense)s->descr->type_num != %(typenum_dense)s)
+        {PyErr_SetString(PyExc_NotImplementedError, "Invalid type for the blocks or the dense input"); %(fail)s;}
+
+        PyArrayObject* bsr_val = PyArray_GETCONTIGUOUS(%(a_val)s);
+        PyArrayObject* bsr_ind = PyArray_GETCONTIGUOUS(%(a_ind)s);
+        PyArrayObject* bsr_ptr = PyArray_GETCONTIGUOUS(%(a_ptr)s);
+        PyArrayObject* bsr_dense = PyArray_GETCONTIGUOUS(%(dense)s);
+        if (!bsr_val || !bsr_ind || !bsr_ptr || !bsr_dense)
+        {
+            Py_XDECREF(bsr_val); Py_XDECREF(bsr_ind);
+            Py_XDECREF(bsr_ptr); Py_XDECREF(bsr_dense);
+            %(fail)s;
+        }
+
+        const char* bsr_err = NULL;
+        const npy_intp nblk = bsr_val->dimensions[0];
+        const npy_intp R = bsr_val->dimensions[1];
+        const npy_intp C = bsr_val->dimensions[2];
+        const npy_intp nbr = bsr_ptr->dimensions[0] - 1;
+        const npy_intp M = *(npy_int32*)PyArray_GETPTR1(%(a_shape)s, 0);
+        const npy_intp K = *(npy_int32*)PyArray_GETPTR1(%(a_shape)s, 1);
+        npy_intp nbc = 0;
+        const npy_int32* Aind = (npy_int32*)bsr_ind->data;
+        const npy_int32* Aptr = (npy_int32*)bsr_ptr->data;
+
+        if (R < 1 || C < 1)
+            bsr_err = "the blocksize must be positive";
+        else if (nbr < 0 || M != nbr * R)
+            bsr_err = "the number of block rows doesn't match the shape";
+        else if (K %% C != 0)
+            bsr_err = "the number of columns isn't a multiple of the blocksize";
+        else if (bsr_ind->dimensions[0] != nblk)
+            bsr_err = "a_val and a_ind have different lengths";
+        else if (Aptr[0] < 0 || Aptr[nbr] > nblk)
+            bsr_err = "a_ptr is out of bounds";
+        if (!bsr_err)
+        {
+            nbc = K / C;
+            for (npy_intp i = 0; i < nbr; ++i)
+                if (Aptr[i + 1] < Aptr[i])
+                    bsr_err = "a_ptr is not increasing";
+        }
+        if (!bsr_err)
+        {
+            for (npy_intp jj = Aptr[0]; jj < Aptr[nbr]; ++jj)
+                if (Aind[jj] < 0 || Aind[jj] >= nbc)
+                    bsr_err = "illegal block column index in a";
+        }
+        """ % dict(locals())
+
+    def _c_end(self):
+        """Return C code that releases what `_c_begin` acquired."""
+        return """
+        Py_DECREF(bsr_val); Py_DECREF(bsr_ind);
+        Py_DECREF(bsr_ptr); Py_DECREF(bsr_dense);
+        """
+
+
+class StructuredDotBSR(_BSRDot):
+    # Structured Dot BSR is like dot, except that only the
+    # gradient wrt non-zero elements of the sparse matrix
+    # `a` are calculated and propagated.
+
+    # The output is presumed to be a dense matrix, and is represented by a
+    # TensorType instance.
+
+    # :param a_val: The blocks of a sparse matrix in bsr format, a 3d
+    #               tensor.
+    # :param a_ind: Sparse matrix indices (of the blocks).
+    # :param a_ptr: Sparse matrix indptr (of the blocks).
+    # :param a_shape: The shape of the sparse matrix.
+    # :param b: A dense matrix.
+
+    # :return: The dot product of `a` and `b`, or of the transpose of `a`
+    #          and `b` if `transpose` is True.
+
+    # :note:
+    # - The grad is not implemented for this op.
+    # - Each block of `a` is multiplied by the rows of `b` it touches
+    #   with one GEMM call.
+
+    def __init__(self, transpose=False):
+        self.transpose = transpose
+
+    def __eq__(self, other):
+        return (type(self) == type(other) and
+                self.transpose == other.transpose)
+
+    def __hash__(self):
+        return hash(type(self)) ^ hash(self.transpose)
+
+    def __str__(self):
+        if self.transpose:
+            return '%s{transpose}' % self.__class__.__name__
+        return self.__class__.__name__
+
+    def make_node(self, a_val, a_ind, a_ptr, a_shape, b):
+        a_val = tensor.as_tensor_variable(a_val)
+        b = tensor.as_tensor_variable(b)
+        assert a_val.ndim == 3
+        assert a_ind.dtype == 'int32'
+        assert a_ptr.dtype == 'int32'
+        assert a_shape.dtype == 'int32'
+        assert b.ndim == 2
+
+        dtype_out = scalar.upcast(a_val.type.dtype, b.type.dtype)
+        if dtype_out != a_val.type.dtype:
+            a_val = tensor.cast(a_val, dtype_out)
+        if dtype_out != b.type.dtype:
+            b = tensor.cast(b, dtype_out)
 
-                    const dtype_%(x_val)s Amk = alpha * Dval[m_idx * Sval]; // actual value at that location
+        return gof.Apply(self, [a_val, a_ind, a_ptr, a_shape, b],
+                [tensor.tensor(dtype_out, (False, b.type.broadcastable[1]))])
+
+    def perform(self, node, (a_val, a_ind, a_ptr, a_shape, b), (out,)):
+        a = scipy.sparse.bsr_matrix((a_val, a_ind, a_ptr),
+                                    shape=tuple(a_shape), copy=False)
+        if self.transpose:
+            a = a.transpose()
+        if a.shape[1] != b.shape[0]:
+            raise ValueError('shape mismatch in StructuredDotBSR.perform',
+                             (a.shape, b.shape))
+        out[0] = theano._asarray(a * b, dtype=node.outputs[0].type.dtype)
+
+    def infer_shape(self, node, shapes):
+        a_shape = node.inputs[3]
+        return [(a_shape[int(self.transpose)], shapes[4][1])]
 
-                    dtype_%(y)s* y_row = (dtype_%(y)s*)(%(y)s->data + %(y)s->strides[0] * k);
-                    // axpy expects pointer to the beginning of memory arrays,
-                    // so when the stride is negative, we need to get the
-                    // last element
-                    if (Sy < 0)
-                        y_row += (K - 1) * Sy;
+    def c_code(self, node, name, inputs, outputs, sub):
+        a_val, a_ind, a_ptr, a_shape, b = inputs
+        z, = outputs
+        fail = sub['fail']
+        gemm = self._gemm(node)
+        typenum_z = node.outputs[0].type.dtype_specs()[-1]
+        begin = self._c_begin(a_val, a_ind, a_ptr, a_shape, b,
+                              typenum_z, typenum_z, fail)
+        end = self._c_end()
+        transpose = int(self.transpose)
+
+        return """
+        {
+        %(begin)s
+        const npy_intp N = bsr_dense->dimensions[1];
+        const npy_intp out_rows = %(transpose)s ? K : M;
+        if (!bsr_err && bsr_dense->dimensions[0] != (%(transpose)s ? M : K))
+            bsr_err = "shape mismatch between a and b";
+        if (bsr_err)
+        {
+            %(end)s
+            PyErr_SetString(PyExc_ValueError, bsr_err);
+            %(fail)s;
+        }
 
-                    dtype_%(zn)s* z_row = (dtype_%(zn)s*)(%(zn)s->data + %(zn)s->strides[0] * m);
-                    if (Szn < 0)
-                        z_row += (N - 1) * Szn;
+        if (!%(z)s || %(z)s->dimensions[0] != out_rows
+            || %(z)s->dimensions[1] != N
+            || !PyArray_ISCARRAY(%(z)s))
+        {
+            Py_XDECREF(%(z)s);
+            npy_intp dims[2] = {out_rows, N};
+            %(z)s = (PyArrayObject*) PyArray_ZEROS(2, dims, %(typenum_z)s, 0);
+            if (!%(z)s)
+            {
+                %(end)s
+                %(fail)s;
+            }
+        }
+        else
+            memset(%(z)s->data, 0, PyArray_NBYTES(%(z)s));
 
-                    %(axpy)s((int*)&N, (%(conv_type)s*)&Amk, (%(conv_type)s*)y_row, (int*)&Sy, (%(conv_type)s*)z_row, (int*)&Szn);
+        if (N > 0)
+        {
+            char cN = 'N', cT = 'T';
+            const int iN = N, iR = R, iC = C;
+            const dtype_%(z)s one = 1;
+            const dtype_%(z)s* Aval = (dtype_%(z)s*)bsr_val->data;
+            const dtype_%(z)s* Bd = (dtype_%(z)s*)bsr_dense->data;
+            dtype_%(z)s* Zd = (dtype_%(z)s*)%(z)s->data;
+
+            // Row-major buffers are seen by the (column-major) BLAS as
+            // the transposed matrices.
+            for (npy_intp i = 0; i < nbr; ++i)
+            {
+                for (npy_int32 jj = Aptr[i]; jj < Aptr[i + 1]; ++jj)
+                {
+                    const npy_intp j = Aind[jj];
+                    const dtype_%(z)s* A_jj = Aval + jj * R * C;
+                    if (%(transpose)s)
+                        // Z[j] += A_jj^T . B[i]
+                        %(gemm)s(&cN, &cT, &iN, &iC, &iR, &one,
+                                 Bd + i * R * N, &iN, A_jj, &iC,
+                                 &one, Zd + j * C * N, &iN);
+                    else
+                        // Z[i] += A_jj . B[j]
+                        %(gemm)s(&cN, &cN, &iN, &iR, &iC, &one,
+                                 Bd + j * C * N, &iN, A_jj, &iC,
+                                 &one, Zd + i * R * N, &iN);
                 }
             }
         }
+        %(end)s
+        }
         """ % dict(locals(), **sub)
 
-        return rval
+    def c_code_cache_version(self):
+        return (1,)
+sd_bsr = StructuredDotBSR()
+sd_bsr_transpose = StructuredDotBSR(transpose=True)
+
+
+class UsmmBSR(_BSRDot):
+    # Performs the expression is `alpha` * `x` `y` + `z`.
+
+    # :param alpha: A tensor scalar.
+    # :param x_val, x_ind, x_ptr, x_shape: A sparse matrix in bsr format,
+    #                                      see StructuredDotBSR.
+    # :param y: Dense matrix.
+    # :param z: Dense matrix.
+
+    # :return: The dense matrix resulting from `alpha` * `x` `y` + `z`.
+
+    # :note:
+    # - The grad is not implemented for this op.
+    # - Optimized version os Usmm when `x` is in bsr format and
+    #   `y` is dense.
+
+    def __init__(self, inplace):
+        self.inplace = inplace
+        if inplace:
+            self.destroy_map = {0: [6]}
+
+    def __str__(self):
+        if self.inplace:
+            return 'UsmmBSR{inplace}'
+        return 'UsmmBSR{no_inplace}'
+
+    def __eq__(self, other):
+        return (type(self) == type(other) and
+                self.inplace == other.inplace)
+
+    def __hash__(self):
+        return hash(type(self)) ^ self.inplace
+
+    def make_node(self, alpha, x_val, x_ind, x_ptr, x_shape, y, z):
+        alpha = tensor.as_tensor_variable(alpha)
+        x_val = tensor.as_tensor_variable(x_val)
+        y = tensor.as_tensor_variable(y)
+        z = tensor.as_tensor_variable(z)
+        assert x_ind.dtype == 'int32'
+        assert x_ptr.dtype == 'int32'
+        assert x_shape.dtype == 'int32'
+        assert alpha.ndim == 2 and alpha.type.broadcastable == (True, True)
+        assert x_val.ndim == 3
+        assert y.ndim == 2
+        assert z.ndim == 2
+
+        dtype_out = scalar.upcast(alpha.type.dtype, x_val.type.dtype,
+            y.type.dtype, z.type.dtype)
+
+        if dtype_out not in ('float32', 'float64'):
+            raise NotImplementedError('only float types are supported in '
+                                      'operands')
+
+        if self.inplace:
+            assert z.type.dtype == dtype_out
+
+        # gemm work only with the same dtype, so we should upcast the input
+        if dtype_out != alpha.type.dtype:
+            alpha = tensor.cast(alpha, dtype_out)
+        if dtype_out != x_val.type.dtype:
+            x_val = tensor.cast(x_val, dtype_out)
+        if dtype_out != y.type.dtype:
+            y = tensor.cast(y, dtype_out)
+        if dtype_out != z.type.dtype:
+            z = tensor.cast(z, dtype_out)
+
+        return gof.Apply(self, [alpha, x_val, x_ind, x_ptr, x_shape, y, z],
+                [tensor.tensor(dtype_out, (False, False))])
+
+    def perform(self, node, (alpha, x_val, x_ind, x_ptr, x_shape, y, z),
+                (out,)):
+        x = scipy.sparse.bsr_matrix((x_val, x_ind, x_ptr),
+                                    shape=tuple(x_shape), copy=False)
+        rval = x * y
+        rval *= alpha
+        if not self.inplace:
+            z = z.copy()
+        z += rval
+        out[0] = z
+
+    def infer_shape(self, node, shapes):
+        return [shapes[6]]
+
+    def c_code(self, node, name, inputs, outputs, sub):
+        alpha, x_val, x_ind, x_ptr, x_shape, y, z = inputs
+        zn, = outputs
+        fail = sub['fail']
+        gemm = self._gemm(node)
+        typenum_alpha = node.inputs[0].type.dtype_specs()[-1]
+        typenum_z = node.inputs[6].type.dtype_specs()[-1]
+        typenum_zn = node.outputs[0].type.dtype_specs()[-1]
+        begin = self._c_begin(x_val, x_ind, x_ptr, x_shape, y,
+                              typenum_zn, typenum_zn, fail)
+        end = self._c_end()
+        inplace = int(self.inplace)
+
+        return """
+        if (%(alpha)s->descr->type_num != %(typenum_alpha)s || PyArray_SIZE(%(alpha)s) != 1)
+        {PyErr_SetString(PyExc_NotImplementedError, "alpha must be one element of the output type"); %(fail)s;}
+        if (%(z)s->nd != 2 || %(z)s->descr->type_num != %(typenum_z)s)
+        {PyErr_SetString(PyExc_NotImplementedError, "Invalid type for z"); %(fail)s;}
+        {
+        %(begin)s
+        const npy_intp N = bsr_dense->dimensions[1];
+        if (!bsr_err && bsr_dense->dimensions[0] != K)
+            bsr_err = "shape mismatch between x and y";
+        if (!bsr_err && (%(z)s->dimensions[0] != M || %(z)s->dimensions[1] != N))
+            bsr_err = "shape mismatch between x . y and z";
+        if (bsr_err)
+        {
+            %(end)s
+            PyErr_SetString(PyExc_ValueError, bsr_err);
+            %(fail)s;
+        }
+
+        if (%(inplace)s)
+        {
+            Py_XDECREF(%(zn)s);
+            %(zn)s = %(z)s;
+            Py_INCREF(%(zn)s);
+        }
+        else
+        {
+            if (!%(zn)s || %(zn)s->dimensions[0] != M
+                || %(zn)s->dimensions[1] != N)
+            {
+                Py_XDECREF(%(zn)s);
+                npy_intp dims[2] = {M, N};
+                %(zn)s = (PyArrayObject*) PyArray_SimpleNew(2, dims, %(typenum_zn)s);
+            }
+            if (!%(zn)s || PyArray_CopyInto(%(zn)s, %(z)s))
+            {
+                %(end)s
+                %(fail)s;
+            }
+        }
+
+        // The GEMMs need a C-contiguous output, we copy it back after.
+        PyArrayObject* zc = PyArray_GETCONTIGUOUS(%(zn)s);
+        if (!zc)
+        {
+            %(end)s
+            %(fail)s;
+        }
+
+        if (N > 0)
+        {
+            char cN = 'N';
+            const int iN = N, iR = R, iC = C;
+            const dtype_%(zn)s one = 1;
+            const dtype_%(zn)s alpha = ((dtype_%(alpha)s*)%(alpha)s->data)[0];
+            const dtype_%(zn)s* Aval = (dtype_%(zn)s*)bsr_val->data;
+            const dtype_%(zn)s* Bd = (dtype_%(zn)s*)bsr_dense->data;
+            dtype_%(zn)s* Zd = (dtype_%(zn)s*)zc->data;
+
+            for (npy_intp i = 0; i < nbr; ++i)
+            {
+                for (npy_int32 jj = Aptr[i]; jj < Aptr[i + 1]; ++jj)
+                {
+                    // Z[i] += alpha * A_jj . Y[j]
+                    %(gemm)s(&cN, &cN, &iN, &iR, &iC, &alpha,
+                             Bd + Aind[jj] * C * N, &iN, Aval + jj * R * C,
+                             &iC, &one, Zd + i * R * N, &iN);
+                }
+            }
+        }
+
+        int copy_err = 0;
+        if (zc != %(zn)s)
+            copy_err = PyArray_CopyInto(%(zn)s, zc);
+        Py_DECREF(zc);
+        %(end)s
+        if (copy_err)
+            %(fail)s;
+        }
+        """ % dict(locals(), **sub)
 
     def c_code_cache_version(self):
         return (1,)
 
+usmm_bsr = UsmmBSR(inplace=False)
+usmm_bsr_inplace = UsmmBSR(inplace=True)
 
-usmm_csc_dense = UsmmCscDense(inplace=False)
-usmm_csc_dense_inplace = UsmmCscDense(inplace=True)
+
+class StructuredDotGradBSR(_BSRDot):
+    # Op that produces the grad of StructuredDot for a matrix in bsr
+    # format.
+
+    # :param a_val: The blocks of the sparse matrix, only their shape is
+    #               used.
+    # :param a_ind: Matrix indices (of the blocks)
+    # :param a_ptr: Matrix indptr (of the blocks)
+    # :param a_shape: The shape of the matrix
+    # :param b: Right operand
+    # :param g_ab: Accumulated gradient.
+
+    # :return: The grad of `a`.`b` for `a` accumulated
+    #          with g_ab, one block for each block of `a`.
+
+    # :note:
+    # - The grad implemented is structured.
+    # - Each block of the gradient is computed with one GEMM call.
+
+    def __eq__(self, other):
+        return (type(self) == type(other))
+
+    def __hash__(self):
+        return hash(type(self))
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    def make_node(self, a_val, a_ind, a_ptr, a_shape, b, g_ab):
+        b = tensor.as_tensor_variable(b)
+        g_ab = tensor.as_tensor_variable(g_ab)
+        dtype_out = scalar.upcast(b.type.dtype, g_ab.type.dtype)
+        if dtype_out != b.type.dtype:
+            b = tensor.cast(b, dtype_out)
+        if dtype_out != g_ab.type.dtype:
+            g_ab = tensor.cast(g_ab, dtype_out)
+        return gof.Apply(self, [a_val, a_ind, a_ptr, a_shape, b, g_ab],
+                         [tensor.tensor(dtype_out, (False,) * 3)])
+
+    def perform(self, node, (a_val, a_ind, a_ptr, a_shape, b, g_ab),
+                (out,)):
+        nblk, R, C = a_val.shape
+        M, K = a_shape
+        N = b.shape[1]
+        g_blocks = g_ab.reshape(M // R, R, N)
+        b_blocks = b.reshape(K // C, C, N)
+        g_a_data = numpy.zeros((nblk, R, C), node.outputs[0].dtype)
+        for i in xrange(len(a_ptr) - 1):
+            for jj in xrange(a_ptr[i], a_ptr[i + 1]):
+                g_a_data[jj] = numpy.dot(g_blocks[i],
+                                         b_blocks[a_ind[jj]].T)
+        out[0] = g_a_data
+
+    def infer_shape(self, node, shapes):
+        return [shapes[0]]
+
+    def c_code(self, node, name, inputs, outputs, sub):
+        a_val, a_ind, a_ptr, a_shape, b, g_ab = inputs
+        g, = outputs
+        fail = sub['fail']
+        gemm = self._gemm(node)
+        typenum_g = node.outputs[0].type.dtype_specs()[-1]
+        # Only the shape of the blocks of a is used, not their values.
+        begin = self._c_begin(a_val, a_ind, a_ptr, a_shape, b,
+                              None, typenum_g, fail)
+        end = self._c_end()
+
+        return """
+        if (%(g_ab)s->nd != 2 || %(g_ab)s->descr->type_num != %(typenum_g)s)
+        {PyErr_SetString(PyExc_NotImplementedError, "Invalid type for g_ab"); %(fail)s;}
+        {
+        %(begin)s
+        const npy_intp N = bsr_dense->dimensions[1];
+        if (!bsr_err && bsr_dense->dimensions[0] != K)
+            bsr_err = "shape mismatch between a and b";
+        if (!bsr_err && (%(g_ab)s->dimensions[0] != M || %(g_ab)s->dimensions[1] != N))
+            bsr_err = "shape mismatch between a . b and g_ab";
+        if (bsr_err)
+        {
+            %(end)s
+            PyErr_SetString(PyExc_ValueError, bsr_err);
+            %(fail)s;
+        }
+        PyArrayObject* gzc = PyArray_GETCONTIGUOUS(%(g_ab)s);
+        if (!gzc)
+        {
+            %(end)s
+            %(fail)s;
+        }
+
+        if (!%(g)s || %(g)s->dimensions[0] != nblk || %(g)s->dimensions[1] != R
+            || %(g)s->dimensions[2] != C || !PyArray_ISCARRAY(%(g)s))
+        {
+            Py_XDECREF(%(g)s);
+            npy_intp dims[3] = {nblk, R, C};
+            %(g)s = (PyArrayObject*) PyArray_ZEROS(3, dims, %(typenum_g)s, 0);
+        }
+        if (%(g)s)
+        {
+            dtype_%(g)s* Gd = (dtype_%(g)s*)%(g)s->data;
+            if (N == 0)
+                memset(Gd, 0, PyArray_NBYTES(%(g)s));
+            else
+            {
+                char cN = 'N', cT = 'T';
+                const int iN = N, iR = R, iC = C;
+                const dtype_%(g)s one = 1, zero = 0;
+                const dtype_%(g)s* Bd = (dtype_%(g)s*)bsr_dense->data;
+                const dtype_%(g)s* GZd = (dtype_%(g)s*)gzc->data;
+                for (npy_intp i = 0; i < nbr; ++i)
+                {
+                    for (npy_int32 jj = Aptr[i]; jj < Aptr[i + 1]; ++jj)
+                    {
+                        // G_jj = GZ[i] . B[j]^T
+                        %(gemm)s(&cT, &cN, &iC, &iR, &iN, &one,
+                                 Bd + Aind[jj] * C * N, &iN,
+                                 GZd + i * R * N, &iN,
+                                 &zero, Gd + jj * R * C, &iC);
+                    }
+                }
+            }
+        }
+        Py_DECREF(gzc);
+        %(end)s
+        if (!%(g)s)
+            %(fail)s;
+        }
+        """ % dict(locals(), **sub)
+
+    def c_code_cache_version(self):
+        return (1,)
+sdg_bsr = StructuredDotGradBSR()
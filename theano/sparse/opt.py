@@ -6,10 +6,13 @@ from theano import gof, scalar
 from theano.sparse import (CSC, CSR, csm_properties, Remove0,
                            register_specialize,
                            csm_grad, csm_grad_c,
-                           usmm_csc_dense, usmm)
+                           usmm_csc_dense, usmm, bsm_properties,
+                           usmm_bsr, usmm_bsr_inplace)
 from theano.sparse import basic as sparse
 
-from basic import _is_sparse_variable
+from basic import (_is_sparse_variable, sd_csc, sd_csr, StructuredDotCSC,
+                   StructuredDotCSR, UsmmCscDense, sparse_dot_num_threads,
+                   sd_bsr, sd_bsr_transpose)
 
 
 # This is tested in tests/test_basic.py:UsmmTests
@@ -94,11 +97,93 @@ def local_structured_dot(node):
 # This is tested in tests/test_basic.py:UsmmTests
 @gof.local_optimizer([usmm_csc_dense])
 def local_usmm_csc_dense_inplace(node):
-    if node.op == usmm_csc_dense:
-        return [sparse.usmm_csc_dense_inplace(*node.inputs)]
+    if isinstance(node.op, UsmmCscDense) and not node.op.inplace:
+        return [UsmmCscDense(inplace=True,
+                             num_threads=node.op.num_threads)(*node.inputs)]
 register_specialize(local_usmm_csc_dense_inplace, 'inplace')
 
 
+# This is tested in tests/test_opt.py:test_local_usmm_bsr
+@gof.local_optimizer([usmm_bsr])
+def local_usmm_bsr_inplace(node):
+    if node.op == usmm_bsr:
+        return [usmm_bsr_inplace(*node.inputs)]
+register_specialize(local_usmm_bsr_inplace, 'inplace')
+
+
+def _parallel_sparse_dot(x, y, num_threads):
+    """Return dot(x, y) computed by StructuredDotCSC or StructuredDotCSR.
+
+    The sparse operand is used as is, so a CSR matrix goes to the
+    row-partitioned kernel and a CSC matrix to the column-partitioned one.
+    When `y` is the sparse operand, we compute dot(y.T, x.T).T: the
+    transpose of a CSR matrix is a CSC matrix with the same data, and
+    vice versa.
+
+    Return None when the kernels can't be used.
+    """
+    if _is_sparse_variable(x) == _is_sparse_variable(y):
+        return None
+    if _is_sparse_variable(x):
+        a, b, transpose = x, y, False
+    else:
+        a, b, transpose = y, x, True
+    if a.type.format not in ('csc', 'csr'):
+        return None
+    if transpose:
+        fmt = {'csc': 'csr', 'csr': 'csc'}[a.type.format]
+    else:
+        fmt = a.type.format
+    if b.ndim != 2:
+        return None
+    if scalar.upcast(a.type.dtype, b.type.dtype) not in ('float32',
+                                                          'float64'):
+        return None
+    if transpose:
+        b = b.T
+    a_val, a_ind, a_ptr, a_shape = csm_properties(a)
+    if fmt == 'csc':
+        # The number of rows of the (possibly transposed) sparse matrix.
+        a_nrows = a_shape[int(transpose)]
+        rval = StructuredDotCSC(num_threads)(a_val, a_ind, a_ptr, a_nrows, b)
+    else:
+        # The number of columns of the (possibly transposed) sparse
+        # matrix, checked against the rows of b.
+        a_ncols = a_shape[1 - int(transpose)]
+        rval = StructuredDotCSR(num_threads)(a_val, a_ind, a_ptr, b, a_ncols)
+    if transpose:
+        rval = rval.T
+    return rval
+
+
+# This is tested in tests/test_opt.py:test_local_parallel_sparse_dot
+@gof.local_optimizer([sparse._dot, sparse._structured_dot])
+def local_parallel_sparse_dot(node):
+    """
+    sparse-dense dot -> StructuredDotCSC or StructuredDotCSR with OpenMP
+
+    Only done when config.openmp is True and config.sparse.num_threads is
+    not 1. This runs after local_usmm, so the products that were merged
+    into an Usmm are left alone.
+    """
+    if node.op not in (sparse._dot, sparse._structured_dot):
+        return False
+    num_threads = sparse_dot_num_threads()
+    if num_threads == 1:
+        return False
+    x, y = node.inputs
+    out = node.outputs[0]
+    if _is_sparse_variable(out) or out.ndim != 2:
+        return False
+    rval = _parallel_sparse_dot(x, y, num_threads)
+    if rval is None:
+        return False
+    if rval.type.dtype != out.type.dtype:
+        rval = theano.tensor.cast(rval, out.type.dtype)
+    return [theano.tensor.patternbroadcast(rval, out.broadcastable)]
+theano.tensor.opt.register_specialize_device(local_parallel_sparse_dot)
+
+
 @gof.local_optimizer([sparse.csm_properties])
 def local_csm_properties_csm(node):
     """if we find csm_properties(CSM(*args)), then we can replace that with the
@@ -136,12 +221,89 @@ def local_usmm_csx(node):
                 if y.type.dtype != dtype_out:
                     return False
 
-                return [usmm_csc_dense(alpha, x_val, x_ind, x_ptr,
-                                       x_nsparse, y, z)]
+                op = UsmmCscDense(inplace=False,
+                                  num_threads=sparse_dot_num_threads())
+                return [op(alpha, x_val, x_ind, x_ptr, x_nsparse, y, z)]
     return False
 sparse.register_specialize(local_usmm_csx)
 
 
+# This is tested in tests/test_opt.py:test_local_usmm_bsr
+@gof.local_optimizer([usmm])
+def local_usmm_bsr(node):
+    """ usmm -> usmm_bsr """
+    if node.op != usmm:
+        return False
+    alpha, x, y, z = node.inputs
+    if (not _is_sparse_variable(x) or _is_sparse_variable(y) or
+            x.type.format != 'bsr' or alpha.ndim != 2):
+        return False
+    dtype_out = scalar.upcast(alpha.type.dtype, x.type.dtype,
+                              y.type.dtype, z.type.dtype)
+    if dtype_out not in ('float32', 'float64'):
+        return False
+    x_val, x_ind, x_ptr, x_shape = bsm_properties(x)
+    return [usmm_bsr(alpha, x_val, x_ind, x_ptr, x_shape, y, z)]
+sparse.register_specialize(local_usmm_bsr)
+
+
+# This is tested in tests/test_opt.py:test_local_bsm_properties_bsm
+@gof.local_optimizer([bsm_properties])
+def local_bsm_properties_bsm(node):
+    """bsm_properties(BSR(*args)) -> args"""
+    if node.op == bsm_properties:
+        bsm, = node.inputs
+        if bsm.owner and bsm.owner.op == sparse.BSR:
+            return [theano.tensor.patternbroadcast(i, o.broadcastable)
+                    for i, o in izip(bsm.owner.inputs, node.outputs)]
+    return False
+sparse.register_specialize(local_bsm_properties_bsm)
+
+
+# This is tested in tests/test_opt.py:test_local_structured_dot_bsr
+@gof.local_optimizer([sparse._dot, sparse._structured_dot])
+def local_structured_dot_bsr(node):
+    """
+    dot of a BSR matrix and a dense matrix -> StructuredDotBSR
+
+    dot(x, y) with a dense `x` and a BSR `y` is computed as
+    dot(y.T, x.T).T, and the transpose of a BSR matrix isn't built.
+    Like local_parallel_sparse_dot, this runs after local_usmm.
+    """
+    if node.op not in (sparse._dot, sparse._structured_dot):
+        return False
+    x, y = node.inputs
+    out = node.outputs[0]
+    if (_is_sparse_variable(out) or out.ndim != 2 or
+            _is_sparse_variable(x) == _is_sparse_variable(y)):
+        return False
+    if _is_sparse_variable(x):
+        a, b, transpose = x, y, False
+    else:
+        a, b, transpose = y, x, True
+        b = b.T
+    if a.type.format != 'bsr' or b.ndim != 2:
+        return False
+    if scalar.upcast(a.type.dtype, b.type.dtype) not in ('float32',
+                                                          'float64'):
+        return False
+    # Look through the transposition of the sparse matrix.
+    if a.owner and a.owner.op == sparse.transpose:
+        a = a.owner.inputs[0]
+        transpose = not transpose
+    a_val, a_ind, a_ptr, a_shape = bsm_properties(a)
+    if transpose:
+        rval = sd_bsr_transpose(a_val, a_ind, a_ptr, a_shape, b)
+    else:
+        rval = sd_bsr(a_val, a_ind, a_ptr, a_shape, b)
+    if not _is_sparse_variable(x):
+        rval = rval.T
+    if rval.type.dtype != out.type.dtype:
+        rval = theano.tensor.cast(rval, out.type.dtype)
+    return [theano.tensor.patternbroadcast(rval, out.broadcastable)]
+theano.tensor.opt.register_specialize_device(local_structured_dot_bsr)
+
+
 # register a specialization to replace MulSD -> MulSDCSX
 @gof.local_optimizer([sparse.mul_s_d])
 def local_mul_s_d(node):
@@ -166,7 +328,7 @@ def local_mul_s_d(node):
             CSx = sparse.CSR
             mul_s_d_csx = sparse.mul_s_d_csr
         else:
-            raise NotImplemented()
+            return False
 
         c_data = mul_s_d_csx(sparse.csm_data(svar),
                              sparse.csm_indices(svar),
@@ -254,10 +416,287 @@ def local_sampling_dot_csr(node):
         if p.type.format == 'csr':
             p_data, p_ind, p_ptr, p_shape = sparse.csm_properties(p)
 
-            z_data, z_ind, z_ptr = sparse.sampling_dot_csr(x, y, p_data,
-                p_ind, p_ptr, p_shape[1])
+            op = sparse.SamplingDotCSR(sparse_dot_num_threads())
+            z_data, z_ind, z_ptr = op(x, y, p_data, p_ind, p_ptr,
+                                      p_shape[1])
 
             return [sparse.CSR(z_data, z_ind, z_ptr, p_shape)]
     return False
 sparse.register_specialize(local_sampling_dot_csr,
                            name='local_sampling_dot_csr')
+
+
+# This is tested in tests/test_opt.py:test_local_sampling_dot_grad_csr
+@gof.local_optimizer([sparse.sampling_dot_grad])
+def local_sampling_dot_grad_csr(node):
+    """ SamplingDotGrad -> SamplingDotCSRGrad """
+    if node.op != sparse.sampling_dot_grad:
+        return False
+    x, y, p, gz = node.inputs
+    if p.type.format != 'csr' or gz.type.format != 'csr':
+        return False
+    if scalar.upcast(x.type.dtype, y.type.dtype, p.type.dtype,
+                     gz.type.dtype) not in ('float32', 'float64'):
+        return False
+    p_data, p_ind, p_ptr, p_shape = sparse.csm_properties(p)
+    gz_data, gz_ind, gz_ptr, gz_shape = sparse.csm_properties(gz)
+    op = sparse.SamplingDotCSRGrad(sparse_dot_num_threads())
+    rval = op(x, y, p_data, p_ind, p_ptr, gz_data, gz_ind, gz_ptr)
+    return [theano.tensor.cast(r, o.type.dtype)
+            for r, o in izip(rval, node.outputs)]
+sparse.register_specialize(local_sampling_dot_grad_csr)
+
+
+# The optimizations below replace Ops whose perform goes through
+# scipy.sparse by Ops with a C implementation working on the data, indices
+# and indptr arrays of the matrices (see _CSxOp in basic.py).
+
+# This is tested in tests/test_opt.py:test_local_csm_properties_transpose
+@gof.local_optimizer([csm_properties])
+def local_csm_properties_transpose(node):
+    """
+    csm_properties(transpose(x)) -> csm_properties(x), with the shape
+    reversed
+
+    The transpose of a CSR matrix is a CSC matrix with the same data,
+    indices and indptr, and vice versa.
+    """
+    if node.op == csm_properties:
+        x, = node.inputs
+        if x.owner and x.owner.op == sparse.transpose:
+            val, ind, ptr, shape = csm_properties(x.owner.inputs[0])
+            ret_var = [val, ind, ptr, shape[::-1]]
+            return [theano.tensor.patternbroadcast(i, o.broadcastable)
+                    for i, o in izip(ret_var, node.outputs)]
+    return False
+sparse.register_specialize(local_csm_properties_transpose)
+
+
+# This is tested in tests/test_opt.py:test_local_transpose_csm
+@gof.local_optimizer([sparse.transpose])
+def local_transpose_csm(node):
+    """
+    transpose(CSC(data, indices, indptr, shape)) ->
+        CSR(data, indices, indptr, shape[::-1]), and vice versa
+    """
+    if node.op == sparse.transpose:
+        x, = node.inputs
+        if x.owner and (x.owner.op == CSC or x.owner.op == CSR):
+            val, ind, ptr, shape = x.owner.inputs
+            CSx = CSR
+            if x.owner.op == CSR:
+                CSx = CSC
+            return [CSx(val, ind, ptr, shape[::-1])]
+    return False
+sparse.register_specialize(local_transpose_csm)
+
+
+def _csx_binop(node, op_class):
+    x, y = node.inputs
+    if x.type.format != y.type.format or x.type.format not in ('csc', 'csr'):
+        return False
+    if x.type.dtype != y.type.dtype or x.type.dtype in sparse.complex_dtypes:
+        return False
+    CSx = {'csc': CSC, 'csr': CSR}[x.type.format]
+    x_val, x_ind, x_ptr, x_shape = csm_properties(x)
+    y_val, y_ind, y_ptr, y_shape = csm_properties(y)
+    z_val, z_ind, z_ptr = op_class(x.type.format)(x_val, x_ind, x_ptr,
+                                                  x_shape, y_val, y_ind,
+                                                  y_ptr, y_shape)
+    return [CSx(z_val, z_ind, z_ptr, x_shape)]
+
+
+# This is tested in tests/test_opt.py:test_local_add_s_s_csx
+@gof.local_optimizer([sparse.add_s_s])
+def local_add_s_s_csx(node):
+    """ add_s_s -> AddSSCSx """
+    if node.op == sparse.add_s_s:
+        return _csx_binop(node, sparse.AddSSCSx)
+    return False
+sparse.register_specialize(local_add_s_s_csx)
+
+
+# This is tested in tests/test_opt.py:test_local_mul_s_s_csx
+@gof.local_optimizer([sparse.mul_s_s])
+def local_mul_s_s_csx(node):
+    """ mul_s_s -> MulSSCSx """
+    if node.op == sparse.mul_s_s:
+        return _csx_binop(node, sparse.MulSSCSx)
+    return False
+sparse.register_specialize(local_mul_s_s_csx)
+
+
+# This is tested in tests/test_opt.py:test_local_stack_csx
+@gof.local_optimizer([None])
+def local_stack_csx(node):
+    """ HStack, VStack -> StackCSx
+
+    Only done when all the blocks have the format of the output.
+    """
+    if type(node.op) not in (sparse.HStack, sparse.VStack):
+        return False
+    format = node.op.format
+    if format not in ('csc', 'csr'):
+        return False
+    for b in node.inputs:
+        if b.type.format != format:
+            return False
+    axis = 1
+    if isinstance(node.op, sparse.VStack):
+        axis = 0
+    inputs = []
+    for b in node.inputs:
+        val, ind, ptr, shape = csm_properties(b)
+        if val.type.dtype != node.op.dtype:
+            val = theano.tensor.cast(val, node.op.dtype)
+        inputs += [val, ind, ptr, shape]
+    z_val, z_ind, z_ptr, z_shape = sparse.StackCSx(format, axis)(*inputs)
+    CSx = {'csc': CSC, 'csr': CSR}[format]
+    return [CSx(z_val, z_ind, z_ptr, z_shape)]
+sparse.register_specialize(local_stack_csx)
+
+
+# This is tested in tests/test_opt.py:test_local_sp_sum_csx
+@gof.local_optimizer([None])
+def local_sp_sum_csx(node):
+    """ SpSum -> SpSumCSx """
+    if not isinstance(node.op, sparse.SpSum):
+        return False
+    x, = node.inputs
+    if (x.type.dtype not in sparse.float_dtypes or
+            x.type.format not in ('csc', 'csr')):
+        return False
+    x_val, x_ind, x_ptr, x_shape = csm_properties(x)
+    return [sparse.SpSumCSx(x.type.format, node.op.axis)(x_val, x_ind,
+                                                         x_ptr, x_shape)]
+sparse.register_specialize(local_sp_sum_csx)
+
+
+# This is tested in tests/test_opt.py:test_local_get_item_2d_csx
+@gof.local_optimizer([sparse.get_item_2d])
+def local_get_item_2d_csx(node):
+    """ get_item_2d -> GetItem2dCSx """
+    if node.op != sparse.get_item_2d:
+        return False
+    x = node.inputs[0]
+    if x.type.format not in ('csc', 'csr'):
+        return False
+    bounds = []
+    for i, b in enumerate(node.inputs[1:]):
+        if isinstance(b, gof.Constant) and b.data is None:
+            if i % 2 == 0:
+                b = theano.tensor.constant(0, dtype='int64')
+            else:
+                # Clipped to the size of the matrix by the Op.
+                b = theano.tensor.constant(numpy.iinfo(numpy.int64).max,
+                                           dtype='int64')
+        bounds.append(b)
+    if x.type.format == 'csc':
+        bounds = bounds[2:] + bounds[:2]
+    CSx = {'csc': CSC, 'csr': CSR}[x.type.format]
+    x_val, x_ind, x_ptr, x_shape = csm_properties(x)
+    z_val, z_ind, z_ptr, z_shape = sparse.GetItem2dCSx(x.type.format)(
+        x_val, x_ind, x_ptr, x_shape, *bounds)
+    return [CSx(z_val, z_ind, z_ptr, z_shape)]
+sparse.register_specialize(local_get_item_2d_csx)
+
+
+# This is tested in tests/test_basic.py:EnsureSortedIndicesTester
+@gof.local_optimizer([None])
+def local_inplace_ensure_sorted_indices(node):
+    """
+    Optimization to insert inplace versions of EnsureSortedIndices.
+    """
+    if (isinstance(node.op, sparse.EnsureSortedIndices) and
+            not node.op.inplace):
+        return [sparse.EnsureSortedIndices(inplace=True)(*node.inputs)]
+    return False
+theano.compile.optdb.register('local_inplace_ensure_sorted_indices',
+                              gof.TopoOptimizer(
+    local_inplace_ensure_sorted_indices,
+    failure_callback=gof.TopoOptimizer.warn_inplace),
+                              60, 'fast_run', 'inplace')
+
+
+# Remove0 and EnsureSortedIndices are replaced after the inplace
+# optimizations above, so that the inplace versions are kept when the input
+# can be destroyed: the C versions can't work inplace.
+
+# This is tested in tests/test_opt.py:test_local_remove0_csx
+@gof.local_optimizer([None])
+def local_remove0_csx(node):
+    """ Remove0 -> Remove0CSx """
+    if not isinstance(node.op, Remove0) or node.op.inplace:
+        return False
+    x, = node.inputs
+    if (x.type.dtype in sparse.complex_dtypes or
+            x.type.format not in ('csc', 'csr')):
+        return False
+    CSx = {'csc': CSC, 'csr': CSR}[x.type.format]
+    x_val, x_ind, x_ptr, x_shape = csm_properties(x)
+    z_val, z_ind, z_ptr = sparse.remove0_csx(x_val, x_ind, x_ptr)
+    return [CSx(z_val, z_ind, z_ptr, x_shape)]
+theano.compile.optdb.register('local_remove0_csx',
+                              theano.tensor.opt.in2out(
+    local_remove0_csx, local_csm_properties_csm),
+                              60.5, 'fast_run')
+
+
+# This is tested in tests/test_opt.py:test_local_ensure_sorted_indices_csx
+@gof.local_optimizer([None])
+def local_ensure_sorted_indices_csx(node):
+    """ EnsureSortedIndices -> EnsureSortedIndicesCSx """
+    if (not isinstance(node.op, sparse.EnsureSortedIndices) or
+            node.op.inplace):
+        return False
+    x, = node.inputs
+    if (x.type.dtype in sparse.complex_dtypes or
+            x.type.format not in ('csc', 'csr')):
+        return False
+    CSx = {'csc': CSC, 'csr': CSR}[x.type.format]
+    x_val, x_ind, x_ptr, x_shape = csm_properties(x)
+    z_val, z_ind = sparse.ensure_sorted_indices_csx(x_val, x_ind, x_ptr)
+    return [CSx(z_val, z_ind, x_ptr, x_shape)]
+theano.compile.optdb.register('local_ensure_sorted_indices_csx',
+                              theano.tensor.opt.in2out(
+    local_ensure_sorted_indices_csx, local_csm_properties_csm),
+                              60.6, 'fast_run')
+
+
+# This is tested in tests/test_opt.py:test_local_add_s_d_sparse_grad
+@gof.local_optimizer([sparse.add_s_d])
+def local_add_s_d_sparse_grad(node):
+    """
+    add_s_d(c * construct_sparse_from_list(x, y, idx), d) ->
+        advanced_inc_subtensor1(d, c * y, idx)
+
+    where c is a scalar, and the sparse operand may also be negated. This
+    is a step of SGD with the gradient of a matrix indexed by a vector
+    (see theano.sparse_grad): the increment only touches the rows in idx,
+    and can be done inplace.
+    """
+    if node.op != sparse.add_s_d:
+        return False
+    s, d = node.inputs
+    factors = []
+    negate = False
+    while s.owner and len(s.clients) == 1:
+        if s.owner.op == sparse.neg:
+            negate = not negate
+        elif (s.owner.op == sparse.mul_s_d and
+              numpy.all(s.owner.inputs[1].broadcastable)):
+            factors.append(s.owner.inputs[1].dimshuffle())
+        else:
+            break
+        s = s.owner.inputs[0]
+    if not (s.owner and s.owner.op == sparse.construct_sparse_from_list):
+        return False
+    x, y, idx = s.owner.inputs
+    if factors:
+        y = theano.tensor.mul(*(factors + [y]))
+    if negate:
+        y = -y
+    if y.type.dtype != d.type.dtype:
+        y = theano.tensor.cast(y, d.type.dtype)
+    return [theano.tensor.advanced_inc_subtensor1(d, y, idx)]
+sparse.register_specialize(local_add_s_d_sparse_grad)
@@ -261,7 +261,7 @@ class SparseInferShapeTester(utt.InferShapeTester):
                                                config.floatX, 3)),
                                  sp.csr_matrix(random_lil((10, 40),
                                                config.floatX, 3))],
-                                AddSS)
+                                AddSS, excluding=["local_add_s_s_csx"])
 
     def test_add_sd(self):
         x = SparseType('csr', dtype=config.floatX)()
@@ -282,7 +282,7 @@ class SparseInferShapeTester(utt.InferShapeTester):
                                 [sp.csr_matrix(random_lil((10, 40),
                                                config.floatX, 3)),
                                 ] * 2,
-                                MulSS)
+                                MulSS, excluding=["local_mul_s_s_csx"])
 
     def test_mul_sd(self):
         x = SparseType('csr', dtype=config.floatX)()
@@ -301,7 +301,7 @@ class SparseInferShapeTester(utt.InferShapeTester):
                                 [Remove0()(x)],
                                 [sp.csr_matrix(random_lil((10, 40),
                                                config.floatX, 3))],
-                                Remove0)
+                                Remove0, excluding=["local_remove0_csx"])
 
     def test_dot(self):
         x = SparseType('csc', dtype=config.floatX)()
@@ -1256,6 +1256,31 @@ class UsmmTests(unittest.TestCase):
             assert sum([isinstance(node.op, (Dot, Usmm, UsmmCscDense))
                         for node in topo]) == nb
 
+    def test_num_threads(self):
+        if not theano.config.openmp or theano.config.mode == 'FAST_COMPILE':
+            raise SkipTest('OpenMP or the optimizations are disabled')
+        x = theano.sparse.csc_matrix('x')
+        y = theano.tensor.matrix('y')
+        z = theano.tensor.matrix('z')
+        a = theano.tensor.scalar('a')
+        x_data = as_sparse_format(self.x, 'csc')
+        # A negative stride on the columns of y.
+        y_data = self.y[:, ::-1]
+
+        orig = theano.config.sparse.num_threads
+        theano.config.sparse.num_threads = 3
+        try:
+            f = theano.function([a, x, y, z],
+                                z - a * theano.sparse.dot(x, y))
+        finally:
+            theano.config.sparse.num_threads = orig
+        ops = [node.op for node in f.maker.fgraph.toposort()
+               if isinstance(node.op, UsmmCscDense)]
+        assert len(ops) == 1
+        assert ops[0].num_threads == 3
+        out = f(1.5, x_data, y_data, self.z)
+        assert _allclose(out, self.z - 1.5 * (x_data * y_data))
+
 
 class test_zeros_like(unittest.TestCase):
     def test(self):
@@ -1487,7 +1512,8 @@ class SpSumTester(utt.InferShapeTester):
                 self._compile_and_check(variable,
                                         [self.op(variable[0], axis=axis)],
                                         data,
-                                        self.op_class)
+                                        self.op_class,
+                                        excluding=["local_sp_sum_csx"])
 
     def test_grad(self):
         for format in sparse.sparse_formats:
@@ -1604,10 +1630,9 @@ class EnsureSortedIndicesTester(utt.InferShapeTester):
         for format in sparse.sparse_formats:
             for shape in zip(range(5, 9), range(3, 7)[::-1]):
                 variable, data = sparse_random_inputs(format, shape=shape)
-                self._compile_and_check(variable,
-                                        [self.op(*variable)],
-                                        data,
-                                        self.op_class)
+                self._compile_and_check(
+                    variable, [self.op(*variable)], data, self.op_class,
+                    excluding=["local_ensure_sorted_indices_csx"])
 
     def test_grad(self):
         for format in sparse.sparse_formats:
@@ -1708,14 +1733,16 @@ class Remove0Tester(utt.InferShapeTester):
         self._compile_and_check([x_csc],
                                 [Remove0()(x_csc)],
                                 [mat_csc],
-                                self.op_class)
+                                self.op_class,
+                                excluding=["local_remove0_csx"])
 
         x_csr = theano.sparse.csr_matrix(dtype=theano.config.floatX)
         mat_csr = sp.csr_matrix(mat, dtype=theano.config.floatX)
         self._compile_and_check([x_csr],
                                 [Remove0()(x_csr)],
                                 [mat_csr],
-                                self.op_class)
+                                self.op_class,
+                                excluding=["local_remove0_csx"])
 
     def test_grad(self):
         mat = (numpy.arange(9) + 1).reshape((3, 3))
@@ -1910,6 +1937,165 @@ class Test_getitem(unittest.TestCase):
             assert r1.shape == t1.shape
             assert numpy.all(t1 == r1)
 
+class ConstructSparseFromListTester(utt.InferShapeTester):
+    def setUp(self):
+        super(ConstructSparseFromListTester, self).setUp()
+        self.op_class = sparse.ConstructSparseFromList
+        self.op = sparse.construct_sparse_from_list
+
+    def test_op(self):
+        x = tensor.matrix()
+        y = tensor.matrix()
+        idx = tensor.ivector()
+        f = theano.function([x, y, idx], self.op(x, y, idx))
+
+        x_val = numpy.zeros((10, 3), dtype=config.floatX)
+        y_val = numpy.arange(12, dtype=config.floatX).reshape(4, 3)
+        idx_val = numpy.asarray([7, 2, 7, -1], dtype='int32')
+        tested = f(x_val, y_val, idx_val)
+        assert tested.format == 'csr'
+        expected = x_val.copy()
+        for j, i in enumerate(idx_val):
+            expected[i] += y_val[j]
+        assert numpy.allclose(tested.toarray(), expected)
+        # Only the rows in idx are stored.
+        assert tested.nnz == 3 * 3
+
+    def test_infer_shape(self):
+        x = tensor.matrix()
+        y = tensor.matrix()
+        idx = tensor.ivector()
+        self._compile_and_check(
+            [x, y, idx], [self.op(x, y, idx)],
+            [numpy.zeros((10, 3), dtype=config.floatX),
+             numpy.ones((2, 3), dtype=config.floatX),
+             numpy.asarray([1, 5], dtype='int32')],
+            self.op_class)
+
+    def test_sparse_grad(self):
+        W = tensor.matrix()
+        idx = tensor.ivector()
+        cost = (theano.sparse_grad(W[idx]) ** 2).sum()
+        g = theano.grad(cost, W)
+        assert _is_sparse_variable(g)
+        f = theano.function([W, idx], g)
+
+        W_val = numpy.random.rand(10, 3).astype(config.floatX)
+        idx_val = numpy.asarray([3, 8, 3], dtype='int32')
+        tested = f(W_val, idx_val)
+        expected = theano.function(
+            [W, idx], theano.grad((W[idx] ** 2).sum(), W))(W_val, idx_val)
+        assert numpy.allclose(tested.toarray(), expected)
+        assert tested.nnz == 2 * 3
+
+
+class BSRTester(utt.InferShapeTester):
+    def setUp(self):
+        super(BSRTester, self).setUp()
+        utt.seed_rng()
+
+    @staticmethod
+    def _random_bsr(shape, blocksize, nnz, dtype=config.floatX):
+        return sp.bsr_matrix(random_lil(shape, dtype, nnz),
+                             blocksize=blocksize)
+
+    def _props(self):
+        a_val = tensor.tensor3()
+        a_ind, a_ptr, a_shape = (tensor.ivector(), tensor.ivector(),
+                                 tensor.ivector())
+        return a_val, a_ind, a_ptr, a_shape
+
+    def _props_val(self, a):
+        return [a.data, a.indices.astype('int32'), a.indptr.astype('int32'),
+                numpy.asarray(a.shape, dtype='int32')]
+
+    def test_bsm(self):
+        x = sparse.bsr_matrix()
+        f = theano.function([x], sparse.BSR(*sparse.bsm_properties(x)))
+        a = self._random_bsr((6, 9), (2, 3), 10)
+        tested = f(a)
+        assert tested.format == 'bsr'
+        assert tested.blocksize == (2, 3)
+        assert numpy.allclose(tested.toarray(), a.toarray())
+
+        f = theano.function([x], sparse.sp_ones_like(x))
+        assert numpy.all(f(a).toarray() == (a.toarray() != 0))
+        f = theano.function([x], sparse.transpose(x))
+        assert numpy.allclose(f(a).toarray(), a.toarray().T)
+
+    def test_infer_shape(self):
+        a_val, a_ind, a_ptr, a_shape = self._props()
+        a = self._random_bsr((6, 9), (2, 3), 10)
+        self._compile_and_check([a_val, a_ind, a_ptr, a_shape],
+                                [sparse.BSR(a_val, a_ind, a_ptr, a_shape)],
+                                self._props_val(a), sparse.BSM)
+
+        b = tensor.matrix()
+        for op, b_val in [(sparse.sd_bsr, numpy.random.rand(9, 4)),
+                          (sparse.sd_bsr_transpose,
+                           numpy.random.rand(6, 4))]:
+            self._compile_and_check(
+                [a_val, a_ind, a_ptr, a_shape, b],
+                [op(a_val, a_ind, a_ptr, a_shape, b)],
+                self._props_val(a) + [b_val.astype(config.floatX)],
+                sparse.StructuredDotBSR)
+
+        g = tensor.matrix()
+        self._compile_and_check(
+            [a_val, a_ind, a_ptr, a_shape, b, g],
+            [sparse.sdg_bsr(a_val, a_ind, a_ptr, a_shape, b, g)],
+            self._props_val(a) +
+            [numpy.random.rand(9, 4).astype(config.floatX),
+             numpy.random.rand(6, 4).astype(config.floatX)],
+            sparse.StructuredDotGradBSR)
+
+    def test_ops(self):
+        a_val, a_ind, a_ptr, a_shape = self._props()
+        b = tensor.matrix()
+        z = tensor.matrix()
+        alpha = tensor.TensorType(config.floatX, (True, True))()
+        g = tensor.matrix()
+        f = theano.function(
+            [a_val, a_ind, a_ptr, a_shape, b, z, alpha, g],
+            [sparse.sd_bsr(a_val, a_ind, a_ptr, a_shape, b),
+             sparse.sd_bsr_transpose(a_val, a_ind, a_ptr, a_shape, z),
+             sparse.usmm_bsr(alpha, a_val, a_ind, a_ptr, a_shape, b, z),
+             sparse.sdg_bsr(a_val, a_ind, a_ptr, a_shape, b, g)])
+
+        for shape, blocksize, nnz in [((6, 9), (2, 3), 10),
+                                      ((8, 8), (4, 4), 20),
+                                      ((4, 6), (2, 3), 0)]:
+            a = self._random_bsr(shape, blocksize, nnz)
+            a_dense = a.toarray()
+            b_val = numpy.random.rand(shape[1], 5).astype(config.floatX)
+            z_val = numpy.random.rand(shape[0], 5).astype(config.floatX)
+            g_val = numpy.random.rand(shape[0], 5).astype(config.floatX)
+            alpha_val = numpy.asarray([[-0.5]], dtype=config.floatX)
+            dot, dot_t, usmm, grad = f(*(self._props_val(a) +
+                                         [b_val, z_val, alpha_val, g_val]))
+            assert numpy.allclose(dot, numpy.dot(a_dense, b_val))
+            assert numpy.allclose(dot_t, numpy.dot(a_dense.T, z_val))
+            assert numpy.allclose(usmm,
+                                  z_val - 0.5 * numpy.dot(a_dense, b_val))
+            # The gradient is only kept on the blocks of a.
+            g_dense = numpy.dot(g_val, b_val.T)
+            g_a = sp.bsr_matrix((grad, a.indices, a.indptr), shape=shape)
+            mask = sp.bsr_matrix((numpy.ones_like(a.data), a.indices,
+                                  a.indptr), shape=shape).toarray()
+            assert numpy.allclose(g_a.toarray(), g_dense * mask)
+
+    def test_structured_dot_grad(self):
+        for dtype in ['float32', 'float64']:
+            spmat = self._random_bsr((4, 6), (2, 3), 8, dtype)
+            mat = numpy.asarray(numpy.random.randn(6, 2), dtype)
+
+            verify_grad_sparse(structured_dot, [spmat, mat], structured=True)
+
+            def buildgraph_T(spmat, mat):
+                return structured_dot(mat.T, spmat.T)
+
+            verify_grad_sparse(buildgraph_T, [spmat, mat], structured=True)
+
 
 class TestCast(utt.InferShapeTester):
     compatible_types = (tensor.int_dtypes +
@@ -2026,7 +2212,8 @@ class _HVStackTester(utt.InferShapeTester):
                                     [self.op_class(dtype='float64')
                                      (*self.x[format])],
                                     self.mat[format],
-                                    self.op_class)
+                                    self.op_class,
+                                    excluding=["local_stack_csx"])
 
     def test_grad(self):
         for format in sparse.sparse_formats:
@@ -2397,6 +2584,23 @@ class SamplingDotTester(utt.InferShapeTester):
             return sampling_dot(x, y, self.a[2])
         verify_grad_sparse(_helper, self.a[:2])
 
+    def test_second_grad(self):
+        # The gradient of SamplingDot can itself be differentiated.
+        def _helper(x, y):
+            cost = sparse.sp_sum(sampling_dot(x, y, self.a[2]),
+                                 sparse_grad=True)
+            gx = theano.grad(cost, x)
+            return (gx ** 2).sum()
+        utt.verify_grad(_helper, self.a[:2])
+
+    def test_grad_infer_shape(self):
+        gz = sparse.csr_matrix()
+        self._compile_and_check(self.x + [gz],
+                                sparse.sampling_dot_grad(*(self.x + [gz])),
+                                self.a + [self.a[2] * 3],
+                                sparse.SamplingDotGrad,
+                                excluding=['local_sampling_dot_grad_csr'])
+
 
 import theano.tensor.tests.test_sharedvar
 test_shared_options = theano.tensor.tests.test_sharedvar.makeSharedTester(
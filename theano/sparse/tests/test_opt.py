@@ -1,3 +1,4 @@
+from nose.plugins.skip import SkipTest
 import numpy
 try:
     import scipy.sparse as sp
@@ -121,3 +122,448 @@ def test_local_sampling_dot_csr():
 
         assert not any(isinstance(node.op, sparse.SamplingDot) for node
                        in f.maker.fgraph.toposort())
+
+
+def _sampling_dot_inputs(density):
+    # A pattern with runs of consecutive columns (the first columns of
+    # each row) and isolated non-zeros.
+    rng = numpy.random.RandomState(23455)
+    x_val = numpy.asarray(rng.rand(6, 7), dtype=config.floatX)
+    y_val = numpy.asarray(rng.rand(20, 7), dtype=config.floatX)
+    p_val = (rng.rand(6, 20) < density).astype(config.floatX)
+    p_val[:, :4] = 1
+    p_val[2] = 0
+    return x_val, y_val, sp.csr_matrix(p_val * 2)
+
+
+def test_sampling_dot_csr_values():
+    mode = _csx_mode('local_sampling_dot_csr')
+    inputs = [tensor.matrix(), tensor.matrix(), sparse.csr_matrix()]
+    orig = config.sparse.num_threads
+    try:
+        for num_threads in [1, 2]:
+            config.sparse.num_threads = num_threads
+            f = theano.function(inputs, sparse.sampling_dot(*inputs),
+                                mode=mode)
+            assert any(isinstance(node.op, sparse.SamplingDotCSR)
+                       for node in f.maker.fgraph.toposort())
+            for density in [0, 0.1, 0.5, 1]:
+                x_val, y_val, p_val = _sampling_dot_inputs(density)
+                tested = f(x_val, y_val, p_val)
+                expected = p_val.multiply(numpy.dot(x_val, y_val.T))
+                assert tested.format == 'csr'
+                assert numpy.allclose(tested.toarray(), expected.toarray())
+                # Inputs that are not C-contiguous
+                tested = f(numpy.asfortranarray(x_val),
+                           numpy.asfortranarray(y_val), p_val)
+                assert numpy.allclose(tested.toarray(), expected.toarray())
+    finally:
+        config.sparse.num_threads = orig
+
+
+def test_local_sampling_dot_grad_csr():
+    mode = _csx_mode('local_sampling_dot_grad_csr')
+    ref_mode = mode.excluding('local_sampling_dot_grad_csr')
+    x, y = tensor.matrix(), tensor.matrix()
+    p, gz = sparse.csr_matrix(), sparse.csr_matrix()
+    out = sparse.sampling_dot_grad(x, y, p, gz)
+    orig = config.sparse.num_threads
+    try:
+        for num_threads in [1, 2]:
+            config.sparse.num_threads = num_threads
+            f = theano.function([x, y, p, gz], out, mode=mode)
+            topo = f.maker.fgraph.toposort()
+            assert any(isinstance(node.op, sparse.SamplingDotCSRGrad)
+                       for node in topo)
+            assert not any(isinstance(node.op, sparse.SamplingDotGrad)
+                           for node in topo)
+            f_ref = theano.function([x, y, p, gz], out, mode=ref_mode)
+            for density in [0, 0.1, 0.5, 1]:
+                x_val, y_val, p_val = _sampling_dot_inputs(density)
+                # A gradient with the structure of p, and one with another
+                # structure.
+                gz_same = p_val.copy()
+                gz_same.data = numpy.arange(gz_same.nnz,
+                                            dtype=config.floatX)
+                gz_other = sp.csr_matrix(random_lil((6, 20), config.floatX,
+                                                    30))
+                for gz_val in [gz_same, gz_other]:
+                    tested = f(x_val, y_val, p_val, gz_val)
+                    expected = f_ref(x_val, y_val, p_val, gz_val)
+                    for t, e in zip(tested, expected):
+                        assert numpy.allclose(t, e)
+    finally:
+        config.sparse.num_threads = orig
+
+    # The gradient of SamplingDot uses it.
+    cost = sparse.sp_sum(sparse.sampling_dot(x, y, p), sparse_grad=True)
+    f = theano.function([x, y, p], theano.grad(cost, [x, y]), mode=mode)
+    assert any(isinstance(node.op, sparse.SamplingDotCSRGrad)
+               for node in f.maker.fgraph.toposort())
+
+
+def test_local_parallel_sparse_dot():
+    if not theano.config.openmp:
+        raise SkipTest('OpenMP is disabled')
+    mode = theano.compile.mode.get_default_mode()
+    if theano.config.mode == 'FAST_COMPILE':
+        mode = theano.compile.Mode(linker='c|py', optimizer='fast_run')
+    orig = config.sparse.num_threads
+    config.sparse.num_threads = 2
+    try:
+        for sp_format in sparse.sparse_formats:
+            for dense_first in [False, True]:
+                s = getattr(theano.sparse, sp_format + '_matrix')()
+                d = tensor.matrix()
+                s_val = getattr(sp, sp_format + '_matrix')(
+                    random_lil((7, 10), config.floatX, 12))
+                if dense_first:
+                    d_val = numpy.random.rand(5, 7).astype(config.floatX)
+                    inputs, vals = [d, s], [d_val, s_val]
+                    expected = numpy.dot(d_val, s_val.toarray())
+                else:
+                    d_val = numpy.random.rand(10, 5).astype(config.floatX)
+                    inputs, vals = [s, d], [s_val, d_val]
+                    expected = numpy.dot(s_val.toarray(), d_val)
+                for dot in [sparse.dot, sparse.structured_dot]:
+                    f = theano.function(inputs, dot(*inputs), mode=mode)
+                    topo = f.maker.fgraph.toposort()
+                    assert not any(isinstance(node.op, (sparse.Dot,
+                                                        sparse.StructuredDot))
+                                   for node in topo)
+                    ops = [node.op for node in topo
+                           if isinstance(node.op, (sparse.StructuredDotCSC,
+                                                   sparse.StructuredDotCSR))]
+                    assert len(ops) == 1
+                    assert ops[0].num_threads == 2
+                    assert numpy.allclose(f(*vals), expected)
+                    # The shapes of the operands are checked (StructuredDotCSC
+                    # raises a NotImplementedError).
+                    bad_vals = list(vals)
+                    if dense_first:
+                        bad_vals[0] = numpy.random.rand(5, 8).astype(
+                            config.floatX)
+                    else:
+                        bad_vals[1] = numpy.random.rand(11, 5).astype(
+                            config.floatX)
+                    try:
+                        f(*bad_vals)
+                        assert False
+                    except (ValueError, NotImplementedError):
+                        pass
+    finally:
+        config.sparse.num_threads = orig
+
+
+def _csx_mode(name):
+    mode = theano.compile.mode.get_default_mode()
+    if theano.config.mode == 'FAST_COMPILE':
+        mode = theano.compile.Mode(linker='c|py', optimizer='fast_run')
+    return mode.including("specialize", name)
+
+
+def _unsorted(m):
+    # The same matrix, with the indices of each row (or column) reversed
+    # and an explicit zero.
+    data = m.data.copy()
+    indices = m.indices.copy()
+    data[0] = 0
+    for k in range(len(m.indptr) - 1):
+        b, e = m.indptr[k], m.indptr[k + 1]
+        data[b:e] = data[b:e][::-1].copy()
+        indices[b:e] = indices[b:e][::-1].copy()
+    return m.__class__((data, indices, m.indptr.copy()), m.shape)
+
+
+def _check_binop_csx(name, op, op_class, np_op):
+    mode = _csx_mode(name)
+    for sp_format in sparse.sparse_formats:
+        x = getattr(theano.sparse, sp_format + '_matrix')()
+        y = getattr(theano.sparse, sp_format + '_matrix')()
+        f = theano.function([x, y], op(x, y), mode=mode)
+        topo = f.maker.fgraph.toposort()
+        assert any(isinstance(node.op, op_class) for node in topo)
+        assert not any(isinstance(node.op, (sparse.AddSS, sparse.MulSS))
+                       for node in topo)
+
+        cast = getattr(sp, sp_format + '_matrix')
+        x_val = cast(random_lil((10, 40), config.floatX, 30))
+        y_val = cast(random_lil((10, 40), config.floatX, 30))
+        for a, b in [(x_val, y_val), (x_val, x_val),
+                     (_unsorted(x_val), y_val), (x_val, -x_val)]:
+            out = f(a, b)
+            assert out.format == sp_format
+            assert out.has_sorted_indices
+            assert numpy.all(out.data != 0)
+            assert numpy.allclose(out.toarray(),
+                                  np_op(a.toarray(), b.toarray()))
+
+
+def test_local_add_s_s_csx():
+    _check_binop_csx('local_add_s_s_csx', sparse.add_s_s, sparse.AddSSCSx,
+                     numpy.add)
+
+
+def test_local_mul_s_s_csx():
+    _check_binop_csx('local_mul_s_s_csx', sparse.mul_s_s, sparse.MulSSCSx,
+                     numpy.multiply)
+
+
+def test_local_stack_csx():
+    mode = _csx_mode('local_stack_csx')
+    for sp_format in sparse.sparse_formats:
+        cast = getattr(sp, sp_format + '_matrix')
+        for stack, np_stack, shapes in [
+                (sparse.hstack, numpy.hstack, [(5, 3), (5, 1), (5, 7)]),
+                (sparse.vstack, numpy.vstack, [(3, 5), (1, 5), (7, 5)])]:
+            blocks = [getattr(theano.sparse, sp_format + '_matrix')()
+                      for s in shapes]
+            f = theano.function(blocks,
+                                stack(blocks, format=sp_format,
+                                      dtype='float64'),
+                                mode=mode)
+            topo = f.maker.fgraph.toposort()
+            assert any(isinstance(node.op, sparse.StackCSx) for node in topo)
+            assert not any(isinstance(node.op, sparse.HStack)
+                           for node in topo)
+
+            vals = [cast(random_lil(s, config.floatX, 6)) for s in shapes]
+            vals[1] = _unsorted(vals[1])
+            out = f(*vals)
+            assert out.format == sp_format
+            assert out.dtype == 'float64'
+            assert numpy.allclose(out.toarray(),
+                                  np_stack([v.toarray() for v in vals]))
+
+
+def test_local_sp_sum_csx():
+    mode = _csx_mode('local_sp_sum_csx')
+    for sp_format in sparse.sparse_formats:
+        x = getattr(theano.sparse, sp_format + '_matrix')()
+        cast = getattr(sp, sp_format + '_matrix')
+        x_val = cast(random_lil((10, 40), config.floatX, 30))
+        for axis in [None, 0, 1]:
+            f = theano.function([x], sparse.sp_sum(x, axis=axis), mode=mode)
+            topo = f.maker.fgraph.toposort()
+            assert any(isinstance(node.op, sparse.SpSumCSx) for node in topo)
+            assert not any(isinstance(node.op, sparse.SpSum)
+                           for node in topo)
+            expected = numpy.asarray(x_val.toarray().sum(axis)).ravel()
+            assert numpy.allclose(f(x_val), expected)
+
+
+def test_local_get_item_2d_csx():
+    mode = _csx_mode('local_get_item_2d_csx')
+    a, b = tensor.iscalars('ab')
+    for sp_format in sparse.sparse_formats:
+        x = getattr(theano.sparse, sp_format + '_matrix')()
+        cast = getattr(sp, sp_format + '_matrix')
+        x_val = cast(random_lil((10, 40), config.floatX, 30))
+        for idx, sl, args in [
+                ((slice(a, b),), (slice(2, 7),), [2, 7]),
+                ((slice(a, b), slice(None, None)), (slice(-3, 20),), [-3, 20]),
+                ((slice(None, None), slice(a, b)),
+                 (slice(None), slice(5, 30)), [5, 30]),
+                ((slice(a, None), slice(None, b)),
+                 (slice(1, None), slice(None, -4)), [1, -4]),
+                ((slice(a, b), slice(a, b)), (slice(-8, 9), slice(-8, 9)),
+                 [-8, 9])]:
+            f = theano.function([x, a, b], x[idx], mode=mode)
+            topo = f.maker.fgraph.toposort()
+            assert any(isinstance(node.op, sparse.GetItem2dCSx)
+                       for node in topo)
+            assert not any(isinstance(node.op, sparse.GetItem2d)
+                           for node in topo)
+            out = f(x_val, *args)
+            expected = x_val.toarray()[sl]
+            assert out.format == sp_format
+            assert out.shape == expected.shape
+            assert numpy.allclose(out.toarray(), expected)
+
+
+def test_local_csm_properties_transpose():
+    mode = _csx_mode('local_csm_properties_transpose')
+    for sp_format in sparse.sparse_formats:
+        x = getattr(theano.sparse, sp_format + '_matrix')()
+        f = theano.function([x],
+                            sparse.csm_properties(sparse.transpose(x)),
+                            mode=mode)
+        assert not any(isinstance(node.op, sparse.Transpose)
+                       for node in f.maker.fgraph.toposort())
+        x_val = getattr(sp, sp_format + '_matrix')(
+            random_lil((10, 40), config.floatX, 30))
+        val, ind, ptr, shape = f(x_val)
+        assert numpy.all(val == x_val.data)
+        assert numpy.all(ind == x_val.indices)
+        assert numpy.all(ptr == x_val.indptr)
+        assert tuple(shape) == (40, 10)
+
+
+def test_local_transpose_csm():
+    data = tensor.vector()
+    indices, indptr, shape = (tensor.ivector(), tensor.ivector(),
+                              tensor.ivector())
+    mode = _csx_mode('local_transpose_csm')
+    for CS, cast in [(sparse.CSC, sp.csc_matrix),
+                     (sparse.CSR, sp.csr_matrix)]:
+        f = theano.function([data, indices, indptr, shape],
+                            sparse.transpose(CS(data, indices, indptr,
+                                                shape)),
+                            mode=mode)
+        assert not any(isinstance(node.op, sparse.Transpose)
+                       for node in f.maker.fgraph.toposort())
+        v = cast(random_lil((10, 40), config.floatX, 3))
+        out = f(v.data, v.indices, v.indptr, v.shape)
+        assert numpy.allclose(out.toarray(), v.toarray().T)
+
+
+def test_local_remove0_csx():
+    if theano.config.mode == 'FAST_COMPILE':
+        raise SkipTest('The optimizations are disabled')
+    mode = theano.compile.mode.get_default_mode()
+    for sp_format in sparse.sparse_formats:
+        x = getattr(theano.sparse, sp_format + '_matrix')()
+        f = theano.function([x], sparse.remove0(x), mode=mode)
+        topo = f.maker.fgraph.toposort()
+        assert any(isinstance(node.op, sparse.Remove0CSx) for node in topo)
+        assert not any(isinstance(node.op, sparse.Remove0) for node in topo)
+        x_val = _unsorted(getattr(sp, sp_format + '_matrix')(
+            random_lil((10, 40), config.floatX, 30)))
+        out = f(x_val)
+        assert numpy.all(out.data != 0)
+        assert out.nnz == x_val.nnz - 1
+        assert numpy.allclose(out.toarray(), x_val.toarray())
+
+        # The inplace version is kept when the input can be destroyed.
+        f = theano.function([theano.In(x, mutable=True)],
+                            sparse.remove0(x), mode=mode)
+        assert any(isinstance(node.op, sparse.Remove0) and node.op.inplace
+                   for node in f.maker.fgraph.toposort())
+
+
+def test_local_ensure_sorted_indices_csx():
+    if theano.config.mode == 'FAST_COMPILE':
+        raise SkipTest('The optimizations are disabled')
+    mode = theano.compile.mode.get_default_mode()
+    for sp_format in sparse.sparse_formats:
+        x = getattr(theano.sparse, sp_format + '_matrix')()
+        f = theano.function([x], sparse.ensure_sorted_indices(x), mode=mode)
+        topo = f.maker.fgraph.toposort()
+        assert any(isinstance(node.op, sparse.EnsureSortedIndicesCSx)
+                   for node in topo)
+        x_val = _unsorted(getattr(sp, sp_format + '_matrix')(
+            random_lil((10, 40), config.floatX, 30)))
+        out = f(x_val)
+        expected = x_val.sorted_indices()
+        assert numpy.all(out.indices == expected.indices)
+        assert numpy.all(out.data == expected.data)
+        assert numpy.all(out.indptr == expected.indptr)
+
+        f = theano.function([theano.In(x, mutable=True)],
+                            sparse.ensure_sorted_indices(x), mode=mode)
+        assert any(isinstance(node.op, sparse.EnsureSortedIndices) and
+                   node.op.inplace
+                   for node in f.maker.fgraph.toposort())
+
+
+def test_local_add_s_d_sparse_grad():
+    mode = _csx_mode('local_add_s_d_sparse_grad')
+    W = tensor.matrix()
+    idx = tensor.ivector()
+    lr = tensor.scalar()
+    cost = (theano.sparse_grad(W[idx]) ** 2).sum()
+    g = theano.grad(cost, W)
+    f = theano.function([W, idx, lr], W - lr * g, mode=mode)
+    topo = f.maker.fgraph.toposort()
+    assert not any(isinstance(node.op, (sparse.AddSD,
+                                        sparse.ConstructSparseFromList))
+                   for node in topo)
+    assert any(isinstance(node.op, tensor.AdvancedIncSubtensor1)
+               for node in topo)
+
+    W_val = numpy.random.rand(10, 3).astype(config.floatX)
+    idx_val = numpy.asarray([3, 8, 3], dtype='int32')
+    expected = W_val.copy()
+    for i in idx_val:
+        expected[i] -= 0.1 * 2 * W_val[i]
+    assert numpy.allclose(f(W_val, idx_val, 0.1), expected)
+
+    # With a shared variable, the update is done inplace.
+    if theano.config.mode == 'FAST_COMPILE':
+        return
+    sW = theano.shared(W_val.copy())
+    cost = (theano.sparse_grad(sW[idx]) ** 2).sum()
+    f = theano.function([idx], [],
+                        updates=[(sW, sW - 0.1 * theano.grad(cost, sW))])
+    assert any(isinstance(node.op, tensor.AdvancedIncSubtensor1) and
+               node.op.inplace
+               for node in f.maker.fgraph.toposort())
+    f(idx_val)
+    assert numpy.allclose(sW.get_value(), expected)
+
+
+def _random_bsr(shape, blocksize, nnz):
+    return sp.bsr_matrix(random_lil(shape, config.floatX, nnz),
+                         blocksize=blocksize)
+
+
+def test_local_bsm_properties_bsm():
+    data = tensor.tensor3()
+    indices, indptr, shape = (tensor.ivector(), tensor.ivector(),
+                              tensor.ivector())
+    mode = _csx_mode('local_bsm_properties_bsm')
+    f = theano.function([data, indices, indptr, shape],
+                        sparse.bsm_properties(
+                            sparse.BSR(data, indices, indptr, shape)),
+                        mode=mode)
+    assert not any(isinstance(node.op, (sparse.BSM, sparse.BSMProperties))
+                   for node in f.maker.fgraph.toposort())
+    v = _random_bsr((6, 9), (2, 3), 10)
+    f(v.data, v.indices, v.indptr, numpy.asarray(v.shape, dtype='int32'))
+
+
+def test_local_structured_dot_bsr():
+    mode = _csx_mode('local_structured_dot_bsr')
+    s = sparse.bsr_matrix()
+    d = tensor.matrix()
+    s_val = _random_bsr((6, 9), (2, 3), 12)
+    for graph, d_shape, expected in [
+            (lambda s, d: (s, d), (9, 5),
+             lambda s, d: numpy.dot(s, d)),
+            (lambda s, d: (d, s), (5, 6),
+             lambda s, d: numpy.dot(d, s)),
+            (lambda s, d: (s.T, d), (6, 5),
+             lambda s, d: numpy.dot(s.T, d)),
+            (lambda s, d: (d, s.T), (5, 9),
+             lambda s, d: numpy.dot(d, s.T))]:
+        d_val = numpy.random.rand(*d_shape).astype(config.floatX)
+        for dot in [sparse.dot, sparse.structured_dot]:
+            f = theano.function([s, d], dot(*graph(s, d)), mode=mode)
+            topo = f.maker.fgraph.toposort()
+            assert not any(isinstance(node.op, (sparse.Dot,
+                                                sparse.StructuredDot))
+                           for node in topo)
+            assert any(isinstance(node.op, sparse.StructuredDotBSR)
+                       for node in topo)
+            assert numpy.allclose(f(s_val, d_val),
+                                  expected(s_val.toarray(), d_val))
+
+
+def test_local_usmm_bsr():
+    mode = _csx_mode('local_usmm_bsr')
+    x = sparse.bsr_matrix()
+    y = tensor.matrix()
+    z = tensor.matrix()
+    alpha = tensor.scalar()
+    f = theano.function([alpha, x, y, z], z - alpha * sparse.dot(x, y),
+                        mode=mode)
+    topo = f.maker.fgraph.toposort()
+    assert any(isinstance(node.op, sparse.UsmmBSR) for node in topo)
+    assert not any(isinstance(node.op, (sparse.Usmm, sparse.Dot))
+                   for node in topo)
+
+    x_val = _random_bsr((6, 9), (2, 3), 12)
+    y_val = numpy.random.rand(9, 5).astype(config.floatX)
+    z_val = numpy.random.rand(6, 5).astype(config.floatX)
+    assert numpy.allclose(f(0.5, x_val, y_val, z_val),
+                          z_val - 0.5 * numpy.dot(x_val.toarray(), y_val))
@@ -8,8 +8,10 @@ from basic import *
 import opt
 import opt_uncanonicalize
 import blas
+from blas import batched_dot
 import blas_scipy
 import blas_c
+import blas_blocked
 import xlogx
 
 import raw_random
@@ -52,6 +54,6 @@ def shared(*args, **kw):
 import nnet  # used for softmax, sigmoid, etc.
 
 from theano.gradient import Rop, Lop, grad, numeric_grad, verify_grad, \
-    jacobian, hessian
+    jacobian, hessian, hessian_vector_product
 
 from theano.tensor.sort import sort
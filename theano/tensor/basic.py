@@ -3183,6 +3183,11 @@ class Mean(elemwise.CAReduce):
   *((double *)PyArray_DATA(%s)) /= PyArray_SIZE(%s);
   """ % (onames[0], inames[0])
 
+    def R_op(self, inputs, eval_points):
+        if eval_points[0] is None:
+            return [None]
+        return self.make_node(*eval_points).outputs
+
 #TODO: implement the grad. When done and tested, you can make this the default
 # version.
 #    def grad(self, (x,), (gout,)):
@@ -3829,6 +3834,10 @@ class Subtensor(Op):
         assert len(outshp) == node.outputs[0].ndim
         return [outshp]
 
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        # The output is a view: nothing is computed or copied.
+        return (0, 0, 0)
+
     def grad(self, inputs, grads):
         gz, = grads
         x = inputs[0]
@@ -4477,6 +4486,25 @@ class IncSubtensor(Op):
     def infer_shape(self, node, shapes):
         return [shapes[0]]
 
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        # One addition per element of y.
+        y_nbytes = gof.op.shape_nbytes(node.inputs[1], input_shapes[1])
+        if input_shapes[1] is None:
+            flops = None
+        elif self.set_instead_of_inc:
+            flops = 0
+        else:
+            flops = int(numpy.prod(input_shapes[1]))
+        # Read y, and the part of x it is added to.
+        read = y_nbytes * (1 + (not self.set_instead_of_inc))
+        written = y_nbytes
+        if not self.inplace:
+            # x is copied first.
+            x_nbytes = gof.op.shape_nbytes(node.inputs[0], input_shapes[0])
+            read += x_nbytes
+            written += x_nbytes
+        return (flops, read, written)
+
     def R_op(self, inputs, eval_points):
         if eval_points[0] is None or eval_points[1] is None:
             return [None]
@@ -5783,13 +5811,28 @@ def inverse_permutation(perm):
 
 
 class AdvancedSubtensor1(Op):
-    """Implement x[ilist] where ilist is a vector of integers."""
+    """Implement x[ilist] where ilist is a vector of integers.
+
+    :param sparse_grad: if True, the gradient with respect to `x` is a
+        CSR matrix holding only the rows in `ilist`, instead of a dense
+        tensor of the shape of `x`. Only for matrices. See
+        `theano.sparse_grad`.
+    """
+
+    def __init__(self, sparse_grad=False):
+        self.sparse_grad = sparse_grad
 
     def __hash__(self):
-        return hash(type(self))
+        return hash(type(self)) ^ hash(self.sparse_grad)
 
     def __eq__(self, other):
-        return type(self) == type(other)
+        return (type(self) == type(other) and
+                self.sparse_grad == other.sparse_grad)
+
+    def __str__(self):
+        if self.sparse_grad:
+            return self.__class__.__name__ + "{sparse_grad}"
+        return self.__class__.__name__
 
     def make_node(self, x, ilist):
         x_ = as_tensor_variable(x)
@@ -5823,7 +5866,18 @@ class AdvancedSubtensor1(Op):
     def grad(self, inputs, grads):
         gz, = grads
         assert len(inputs) == 2
-        rval1 = [advanced_inc_subtensor1(zeros_like(inputs[0]), gz, inputs[1])]
+        if self.sparse_grad:
+            if inputs[0].type.ndim != 2:
+                raise TypeError('sparse_grad only works with matrices',
+                                inputs[0].type)
+            # Imported here as theano.sparse imports this module, and is
+            # optional (it needs scipy).
+            from theano import sparse
+            rval1 = [sparse.construct_sparse_from_list(inputs[0], gz,
+                                                       inputs[1])]
+        else:
+            rval1 = [advanced_inc_subtensor1(zeros_like(inputs[0]), gz,
+                                             inputs[1])]
         return rval1 + [None] * (len(inputs) - 1)
 
     def R_op(self, inputs, eval_points):
@@ -5835,6 +5889,12 @@ class AdvancedSubtensor1(Op):
         x, ilist = ishapes
         return [ilist + x[1:]]
 
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        # Gather the rows: read and write the output once.
+        out_nbytes = gof.op.shape_nbytes(node.outputs[0], output_shapes[0])
+        ilist_nbytes = gof.op.shape_nbytes(node.inputs[1], input_shapes[1])
+        return (0, out_nbytes + ilist_nbytes, out_nbytes)
+
 advanced_subtensor1 = AdvancedSubtensor1()
 
 
@@ -5917,6 +5977,26 @@ class AdvancedIncSubtensor1(Op):
         x, y, ilist = ishapes
         return [x]
 
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        # One addition per element of y, the rows to update.
+        y_nbytes = gof.op.shape_nbytes(node.inputs[1], input_shapes[1])
+        if input_shapes[1] is None:
+            flops = None
+        elif self.set_instead_of_inc:
+            flops = 0
+        else:
+            flops = int(numpy.prod(input_shapes[1]))
+        # Read y, and the part of x it is added to.
+        read = y_nbytes * (1 + (not self.set_instead_of_inc))
+        written = y_nbytes
+        if not self.inplace:
+            # x is copied first.
+            x_nbytes = gof.op.shape_nbytes(node.inputs[0], input_shapes[0])
+            read += x_nbytes
+            written += x_nbytes
+        read += gof.op.shape_nbytes(node.inputs[2], input_shapes[2])
+        return (flops, read, written)
+
     def R_op(self, inputs, eval_points):
         if None in eval_points[:2]:
             return [None]
@@ -6279,6 +6359,16 @@ class Dot(Op):
             return [()]
         raise NotImplementedError()
 
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        # A multiplication and an addition per term of each output
+        # element: the summed dimension is the last one of x.
+        flops = None
+        x_shape = input_shapes[0]
+        if x_shape is not None and output_shapes[0] is not None:
+            flops = 2 * int(numpy.prod(output_shapes[0])) * x_shape[-1]
+        return (flops,) + gof.op.default_cost_bytes(node, input_shapes,
+                                                    output_shapes)
+
     def __str__(self):
         return "dot"
 dot = Dot()
@@ -6324,17 +6414,26 @@ class TensorDotGrad(Op):
         [sum_over_x.remove(q) for q in self.axes[0]]
         tdot_axes = [range(x.ndim - len(self.axes[0]), gz.ndim), sum_over_y]
         _gx = numpy.tensordot(gz, y, tdot_axes)
-        idx = numpy.hstack((sum_over_x, self.axes[0]))
+        # The last axes of _gx are the summed axes of y in increasing
+        # order, which is not necessarily the order of self.axes[1].
+        idx = numpy.hstack((sum_over_x,
+                            [self.axes[0][list(self.axes[1]).index(a)]
+                             for a in sorted(self.axes[1])]))
         newshapex = numpy.zeros(x.ndim)
         newshapex[[newpos for newpos in idx]] = range(x.ndim)
         gx[0] = numpy.transpose(_gx, newshapex)
         tdot_axes = [sum_over_x, range(x.ndim - len(self.axes[0]))]
         _gy = numpy.tensordot(x, gz, tdot_axes)
-        idy = numpy.hstack((self.axes[1], sum_over_y))
+        idy = numpy.hstack(([self.axes[1][list(self.axes[0]).index(a)]
+                             for a in sorted(self.axes[0])],
+                            sum_over_y))
         newshapey = numpy.zeros(y.ndim)
         newshapey[[newpos for newpos in idy]] = range(y.ndim)
         gy[0] = numpy.transpose(_gy, newshapey)
 
+    def infer_shape(self, node, shapes):
+        return [shapes[0], shapes[1]]
+
 tensordot_grad = TensorDotGrad
 
 
@@ -6416,6 +6515,22 @@ class TensorDot(Op):
         gx, gy = tensordot_grad(self.axes)(x, y, gz)
         return [gx, gy]
 
+    def R_op(self, inputs, eval_points):
+        # Like Dot, x . ey + ex . y
+        if None in eval_points:
+            return [None]
+        x, y = inputs
+        ex, ey = eval_points
+        return [self(ex, y) + self(x, ey)]
+
+    def infer_shape(self, node, shapes):
+        x, y = node.inputs
+        xshp, yshp = shapes
+        sum_x = [a % x.ndim for a in node.op.axes[0]]
+        sum_y = [a % y.ndim for a in node.op.axes[1]]
+        return [[xshp[i] for i in xrange(x.ndim) if i not in sum_x] +
+                [yshp[i] for i in xrange(y.ndim) if i not in sum_y]]
+
     def __str__(self):
         return "tensordot"
 
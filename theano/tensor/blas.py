@@ -61,6 +61,21 @@ The BLAS GER operation implements Z <- a X' Y + Z,
 where X and Y are vectors, and matrix Z gets a rank-1 update.
 
 
+Batched GEMM: BatchedDot
+------------------------
+
+BatchedDot computes Z[i] <- dot(X[i], Y[i]) for 3-tensors X, Y and Z,
+with one GEMM call per slice inside a single thunk.
+
+
+Tensor contraction: TensorDotGemm
+---------------------------------
+
+TensorDotGemm computes tensordot(X, Y, axes) with one GEMM call, viewing X
+and Y as matrices through their strides and copying them only when that
+is not possible.
+
+
 Other Notable BLAS-related Ops
 ------------------------------
 
@@ -75,18 +90,29 @@ Optimizations
 
 The optimization pipeline works something like this:
 
-    1. identify dot22 from dot
-    2. identify gemm from dot22
-    3. identify dot22scalar from dot22 that are not gemm
-    4. specialize gemm to gemv where applicable
-    5. specialize gemm to ger where applicable
-    6. specialize dot22 -> gemv or ger where applicable
+    1. lower tensordot to dot (or TensorDotGemm)
+    2. identify dot22 from dot
+    3. identify batched_dot from a stack of dot/dot22 of matching slices
+    4. identify gemm from dot22
+    5. identify dot22scalar from dot22 that are not gemm
+    6. specialize gemm to gemv where applicable
+    7. specialize gemm to ger where applicable
+    8. specialize dot22 -> gemv or ger where applicable
 
 :note: GEMM is the most canonical BLAS signature that we deal with so far, it
     would be good to turn most things into GEMM (dot, inner, outer, dot22,
     dot22scalar), and then to specialize from gemm to the various other L2 and
     L3 operations.
 
+Lower TensorDot
+---------------
+
+`local_tensordot_to_dot` rewrites tensordot(x, y, axes) as a dimshuffle and
+reshape of each input, a dot and a reshape of the result, when both input
+reshapes are views of c-contiguous inputs. Otherwise, float tensordots
+become TensorDotGemm. TensorDotGrad is first expanded into the two
+tensordots it computes so the same rules apply to it.
+
 Identify Dot22
 --------------
 
@@ -121,6 +147,15 @@ Specialize Gemm to Gemv
 If arguments to GEMM are dimshuffled vectors, then we can use GEMV
 instead. This optimization is `local_gemm_to_gemv`.
 
+Identify BatchedDot
+-------------------
+
+A graph like stack(dot(x[0], y[0]), ..., dot(x[n-1], y[n-1])) does one
+GEMM thunk per slice and then copies the results into a new tensor.
+`local_stacked_dot_to_batched_dot` replaces it by batched_dot(x[:n], y[:n]).
+Scan loops whose only work is such a product are rewritten the same way by
+`scan_batched_dot` in scan_opt.py.
+
 
 """
 import copy
@@ -130,7 +165,6 @@ import sys
 import time
 
 import numpy
-import numpy.distutils
 
 from theano.configparser import config, AddConfigVar, StrParam
 from theano.gof import (utils, Op, view_roots, DestroyHandler,
@@ -138,29 +172,41 @@ from theano.gof import (utils, Op, view_roots, DestroyHandler,
                         InconsistencyError, toolbox, SequenceDB,
                         EquilibriumOptimizer, Apply,
                         ReplacementDidntRemovedError)
+from theano.gof.op import default_cost_bytes
 from theano.printing import pprint, FunctionPrinter, debugprint
 from theano.compile.mode import optdb
 from theano.gof.python25 import all, any
 import theano.scalar
 import basic as T
 from theano.tensor.blas_headers import blas_header_text
-from theano.tensor.opt import local_dimshuffle_lift
+from theano.tensor.opt import in2out, local_dimshuffle_lift
 
 _logger = logging.getLogger('theano.tensor.blas')
 
-try:
-    import scipy.linalg.blas
-    _have_fblas = True
-    _blas_gemv_fns = {
-            numpy.dtype('float32'): scipy.linalg.blas.fblas.sgemv,
-            numpy.dtype('float64'): scipy.linalg.blas.fblas.dgemv,
-            numpy.dtype('complex64'): scipy.linalg.blas.fblas.cgemv,
-            numpy.dtype('complex128'): scipy.linalg.blas.fblas.zgemv,
-            }
-except ImportError, e:
-    _have_fblas = False
-    _logger.warning('Failed to import scipy.linalg.blas.fblas. '
-            'Falling back on slower implementations (%s)', str(e))
+# scipy.linalg.blas.fblas, False if it can't be imported, or None before
+# the first call to scipy_fblas.
+_fblas = None
+
+
+def scipy_fblas():
+    """Return scipy.linalg.blas.fblas, or None if scipy is not available.
+
+    Importing scipy is slow, so it is done the first time a scipy BLAS
+    function is needed rather than when Theano is imported.
+    """
+    global _fblas
+    if _fblas is None:
+        try:
+            import scipy.linalg.blas
+            _fblas = scipy.linalg.blas.fblas
+        except ImportError, e:
+            _fblas = False
+            _logger.warning('Failed to import scipy.linalg.blas.fblas. '
+                    'Falling back on slower implementations (%s)', str(e))
+    return _fblas or None
+
+_blas_gemv_names = {'float32': 'sgemv', 'float64': 'dgemv',
+                    'complex64': 'cgemv', 'complex128': 'zgemv'}
 
 
 class Gemv(Op):
@@ -189,6 +235,25 @@ class Gemv(Op):
     def __hash__(self):
         return hash(type(self)) ^ hash(self.inplace)
 
+    def R_op(self, inputs, eval_points):
+        # beta * y + alpha * dot(A, x)
+        if None in eval_points:
+            return [None]
+        y, alpha, A, x, beta = inputs
+        ey, ealpha, eA, ex, ebeta = eval_points
+        return [ebeta * y + beta * ey + ealpha * T.dot(A, x) +
+                alpha * (T.dot(eA, x) + T.dot(A, ex))]
+
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        # 2MN for A x, then M each to scale A x and y and to add them.
+        flops = None
+        A_shape = input_shapes[2]
+        if A_shape is not None:
+            m, n = A_shape
+            flops = 2 * m * n + 3 * m
+        return (flops,) + default_cost_bytes(node, input_shapes,
+                                             output_shapes)
+
     def make_node(self, y, alpha, A, x, beta):
         y = T.as_tensor_variable(y)
         x = T.as_tensor_variable(x)
@@ -216,8 +281,9 @@ class Gemv(Op):
 
     def perform(self, node, inputs, out_storage):
         y, alpha, A, x, beta = inputs
-        if _have_fblas and y.shape[0] != 0 and x.shape[0] != 0:
-            gemv = _blas_gemv_fns[y.dtype]
+        fblas = scipy_fblas()
+        if fblas and y.shape[0] != 0 and x.shape[0] != 0:
+            gemv = getattr(fblas, _blas_gemv_names[str(y.dtype)])
 
             if (A.shape[0] != y.shape[0] or A.shape[1] != x.shape[0]):
                 raise ValueError('Incompatible shapes for gemv '
@@ -279,6 +345,25 @@ class Ger(Op):
         else:
             return '%s{non-destructive}' % self.__class__.__name__
 
+    def R_op(self, inputs, eval_points):
+        # A + alpha * outer(x, y)
+        if None in eval_points:
+            return [None]
+        A, alpha, x, y = inputs
+        eA, ealpha, ex, ey = eval_points
+        return [eA + ealpha * T.outer(x, y) +
+                alpha * (T.outer(ex, y) + T.outer(x, ey))]
+
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        # M to scale x, then a multiply and an add per element of A.
+        flops = None
+        A_shape = input_shapes[0]
+        if A_shape is not None:
+            m, n = A_shape
+            flops = 2 * m * n + m
+        return (flops,) + default_cost_bytes(node, input_shapes,
+                                             output_shapes)
+
     def make_node(self, A, alpha, x, y):
         A = T.as_tensor_variable(A)
         y = T.as_tensor_variable(y)
@@ -319,6 +404,9 @@ ger_destructive = Ger(destructive=True)
 
 
 def default_blas_ldflags():
+    # This imports numpy.distutils, which is slow, so config.blas.ldflags
+    # only calls it when the flag is first used.
+    import numpy.distutils
     try:
         # If we are in a EPD installation, mkl is available
         blas_info = numpy.distutils.__config__.blas_opt_info
@@ -382,7 +470,7 @@ def default_blas_ldflags():
 
 AddConfigVar('blas.ldflags',
         "lib[s] to include for [Fortran] level-3 blas implementation",
-        StrParam(default_blas_ldflags()))
+        StrParam(default_blas_ldflags))
 
 
 @utils.memoize
@@ -800,6 +888,26 @@ class Gemm(GemmRelated):
     def __getstate__(self):
         return dict(inplace=self.inplace)
 
+    def R_op(self, inputs, eval_points):
+        # b * z + a * dot(x, y)
+        if None in eval_points:
+            return [None]
+        z, a, x, y, b = inputs
+        ez, ea, ex, ey, eb = eval_points
+        return [eb * z + b * ez + ea * T.dot(x, y) +
+                a * (T.dot(ex, y) + T.dot(x, ey))]
+
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        # 2MNK for x y, then MN each to scale x y and z and to add them.
+        flops = None
+        x_shape, y_shape = input_shapes[2:4]
+        if x_shape is not None and y_shape is not None:
+            m, k = x_shape
+            n = y_shape[1]
+            flops = 2 * m * n * k + 3 * m * n
+        return (flops,) + default_cost_bytes(node, input_shapes,
+                                             output_shapes)
+
     def make_node(self, *inputs):
         inputs = map(T.as_tensor_variable, inputs)
         if len(inputs) != 5:
@@ -1438,6 +1546,22 @@ class Dot22(GemmRelated):
     """Compute a matrix-matrix product.
     This is a specialization of the more general Dot()
     """
+    def R_op(self, inputs, eval_points):
+        if None in eval_points:
+            return [None]
+        x, y = inputs
+        ex, ey = eval_points
+        return [self(ex, y) + self(x, ey)]
+
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        # A multiplication and an addition per term of each output element.
+        flops = None
+        x_shape, y_shape = input_shapes
+        if x_shape is not None and y_shape is not None:
+            flops = 2 * x_shape[0] * x_shape[1] * y_shape[1]
+        return (flops,) + default_cost_bytes(node, input_shapes,
+                                             output_shapes)
+
     def make_node(self, x, y):
         dtypes = ('float32', 'float64', 'complex64', 'complex128')
         if x.type.ndim != 2 or x.type.dtype not in dtypes:
@@ -1702,6 +1826,25 @@ class Dot22Scalar(GemmRelated):
     Also used to generate a gemm later.
     compute scalar*dot(x,y)
     """
+    def R_op(self, inputs, eval_points):
+        # a * dot(x, y)
+        if None in eval_points:
+            return [None]
+        x, y, a = inputs
+        ex, ey, ea = eval_points
+        return [self(ex, y, a) + self(x, ey, a) + ea * _dot22(x, y)]
+
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        # 2MNK for x y and MN to scale it.
+        flops = None
+        x_shape, y_shape = input_shapes[:2]
+        if x_shape is not None and y_shape is not None:
+            m, k = x_shape
+            n = y_shape[1]
+            flops = 2 * m * n * k + m * n
+        return (flops,) + default_cost_bytes(node, input_shapes,
+                                             output_shapes)
+
     def make_node(self, x, y, a):
         if a.ndim != 0:
             raise TypeError(Gemm.E_scalar, a)
@@ -1898,6 +2041,704 @@ blas_optdb.register('local_dot22_to_dot22scalar',
         11, 'fast_run')
 
 
+class BatchedDot(Op):
+    """Compute z[i] = dot(x[i], y[i]) for 3-tensors x and y.
+
+    The C implementation does one BLAS GEMM call per slice, all from the
+    same thunk, instead of one thunk (and one Python call) per slice.
+    """
+    def __eq__(self, other):
+        return type(self) == type(other)
+
+    def __hash__(self):
+        return hash(type(self))
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    def make_node(self, x, y):
+        x = T.as_tensor_variable(x)
+        y = T.as_tensor_variable(y)
+        dtypes = ('float32', 'float64', 'complex64', 'complex128')
+        if x.type.ndim != 3 or x.type.dtype not in dtypes:
+            raise TypeError('BatchedDot requires a float 3-tensor for x',
+                            x.type)
+        if y.type.ndim != 3 or y.type.dtype not in dtypes:
+            raise TypeError('BatchedDot requires a float 3-tensor for y',
+                            y.type)
+        if y.type.dtype != x.type.dtype:
+            raise TypeError('dtype mismatch to BatchedDot',
+                            (x.type.dtype, y.type.dtype))
+        bz = (x.type.broadcastable[0] or y.type.broadcastable[0],
+              x.type.broadcastable[1], y.type.broadcastable[2])
+        return Apply(self, [x, y], [T.tensor(x.type.dtype, bz)])
+
+    def perform(self, node, inp, out):
+        x, y = inp
+        z, = out
+        if x.shape[0] != y.shape[0] or x.shape[2] != y.shape[1]:
+            raise ValueError('Shape mismatch in BatchedDot', x.shape, y.shape)
+        rval = numpy.empty((x.shape[0], x.shape[1], y.shape[2]),
+                           dtype=node.outputs[0].dtype)
+        for i in xrange(x.shape[0]):
+            rval[i] = numpy.dot(x[i], y[i])
+        z[0] = rval
+
+    def grad(self, inp, grads):
+        x, y = inp
+        gz, = grads
+        xgrad = batched_dot(gz, y.dimshuffle(0, 2, 1))
+        ygrad = batched_dot(x.dimshuffle(0, 2, 1), gz)
+        return [T.patternbroadcast(xgrad, x.broadcastable),
+                T.patternbroadcast(ygrad, y.broadcastable)]
+
+    def R_op(self, inputs, eval_points):
+        x, y = inputs
+        ex, ey = eval_points
+        if ex is None and ey is None:
+            return [None]
+        rval = None
+        if ex is not None:
+            rval = batched_dot(ex, y)
+        if ey is not None:
+            t = batched_dot(x, ey)
+            if rval is None:
+                rval = t
+            else:
+                rval = rval + t
+        return [rval]
+
+    def infer_shape(self, node, shapes):
+        xshp, yshp = shapes
+        return [(xshp[0], xshp[1], yshp[2])]
+
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        # One matrix product of 2MNK per slice.
+        flops = None
+        x_shape, y_shape = input_shapes
+        if x_shape is not None and y_shape is not None:
+            b, m, k = x_shape
+            flops = 2 * b * m * k * y_shape[2]
+        return (flops,) + default_cost_bytes(node, input_shapes,
+                                             output_shapes)
+
+    def c_support_code(self):
+        return blas_header_text() + """
+        // Return 0 if the matrices a[i] are row-major (C order), 1 if they
+        // are column-major (Fortran order) and -1 if BLAS can't use them.
+        // *ld is set to the corresponding leading dimension, in elements.
+        static int batched_dot_layout(PyArrayObject * a, int * ld)
+        {
+            const npy_intp es = a->descr->elsize;
+            const npy_intp r = a->dimensions[1];
+            const npy_intp c = a->dimensions[2];
+            const npy_intp s1 = a->strides[1];
+            const npy_intp s2 = a->strides[2];
+            if ((c <= 1 || s2 == es)
+                && (r <= 1 || (s1 > 0 && (s1 % es) == 0 && s1 / es >= c)))
+            {
+                *ld = (r <= 1) ? ((c > 1) ? c : 1) : s1 / es;
+                return 0;
+            }
+            if ((r <= 1 || s1 == es)
+                && (c <= 1 || (s2 > 0 && (s2 % es) == 0 && s2 / es >= r)))
+            {
+                *ld = (c <= 1) ? ((r > 1) ? r : 1) : s2 / es;
+                return 1;
+            }
+            return -1;
+        }
+        """
+
+    def c_libraries(self):
+        return ldflags()
+
+    def c_compile_args(self):
+        return ldflags(libs=False, flags=True)
+
+    def c_lib_dirs(self):
+        return ldflags(libs=False, libs_dir=True)
+
+    def c_header_dirs(self):
+        return ldflags(libs=False, include_dir=True)
+
+    def c_code(self, node, name, inp, out, sub):
+        _x, _y = inp
+        _z, = out
+        fail = sub['fail']
+        dtype = node.outputs[0].dtype
+        if dtype == 'float32':
+            gemm = 'sgemm_'
+        elif dtype == 'float64':
+            gemm = 'dgemm_'
+        else:
+            raise utils.MethodNotDefined('%s.c_code'
+                                         % self.__class__.__name__)
+        if not config.blas.ldflags:
+            raise utils.MethodNotDefined('%s.c_code'
+                                         % self.__class__.__name__)
+        return """
+        {
+        if (%(_x)s->nd != 3 || %(_y)s->nd != 3)
+        {
+            PyErr_SetString(PyExc_NotImplementedError,
+                            "BatchedDot: rank(x) != 3 or rank(y) != 3");
+            %(fail)s;
+        }
+        if (%(_x)s->dimensions[0] != %(_y)s->dimensions[0]
+            || %(_x)s->dimensions[2] != %(_y)s->dimensions[1])
+        {
+            PyErr_Format(PyExc_ValueError,
+                "Shape mismatch in BatchedDot: x is (%%ld, %%ld, %%ld), y is (%%ld, %%ld, %%ld)",
+                (long int)%(_x)s->dimensions[0], (long int)%(_x)s->dimensions[1],
+                (long int)%(_x)s->dimensions[2], (long int)%(_y)s->dimensions[0],
+                (long int)%(_y)s->dimensions[1], (long int)%(_y)s->dimensions[2]);
+            %(fail)s;
+        }
+
+        npy_intp dims[3];
+        dims[0] = %(_x)s->dimensions[0];
+        dims[1] = %(_x)s->dimensions[1];
+        dims[2] = %(_y)s->dimensions[2];
+        if ((NULL == %(_z)s) || !PyArray_ISCONTIGUOUS(%(_z)s)
+            || (%(_z)s->dimensions[0] != dims[0])
+            || (%(_z)s->dimensions[1] != dims[1])
+            || (%(_z)s->dimensions[2] != dims[2]))
+        {
+            Py_XDECREF(%(_z)s);
+            %(_z)s = (PyArrayObject*)PyArray_SimpleNew(3, dims,
+                                                        type_num_%(_x)s);
+            if (!%(_z)s)
+            {
+                PyErr_SetString(PyExc_MemoryError,
+                                "failed to alloc BatchedDot output");
+                %(fail)s
+            }
+        }
+
+        // Copy the inputs whose slices can't be given to BLAS as they are.
+        int ldx, ldy;
+        int layout_x = batched_dot_layout(%(_x)s, &ldx);
+        int layout_y = batched_dot_layout(%(_y)s, &ldy);
+        PyArrayObject * x = %(_x)s;
+        PyArrayObject * y = %(_y)s;
+        Py_INCREF(x);
+        Py_INCREF(y);
+        if (layout_x < 0)
+        {
+            Py_DECREF(x);
+            x = (PyArrayObject *) PyArray_NewCopy(%(_x)s, NPY_CORDER);
+            layout_x = x ? batched_dot_layout(x, &ldx) : -1;
+        }
+        if (layout_y < 0)
+        {
+            Py_DECREF(y);
+            y = (PyArrayObject *) PyArray_NewCopy(%(_y)s, NPY_CORDER);
+            layout_y = y ? batched_dot_layout(y, &ldy) : -1;
+        }
+        if (!x || !y)
+        {
+            Py_XDECREF(x);
+            Py_XDECREF(y);
+            %(fail)s
+        }
+
+        // z[i] (M x N, C order) = x[i] . y[i]
+        // In fortran order: z[i]' = y[i]' . x[i]'
+        char transy = layout_y ? 'T' : 'N';
+        char transx = layout_x ? 'T' : 'N';
+        const int M = dims[1];
+        const int N = dims[2];
+        const int K = %(_x)s->dimensions[2];
+        const int ldz = (N > 1) ? N : 1;
+        const dtype_%(_z)s one = 1.0;
+        const dtype_%(_z)s zero = 0.0;
+        const npy_intp xs0 = x->strides[0];
+        const npy_intp ys0 = y->strides[0];
+        const npy_intp zs0 = %(_z)s->strides[0];
+        if (M > 0 && N > 0)
+        {
+            for (npy_intp i = 0; i < dims[0]; ++i)
+            {
+                dtype_%(_z)s * zi = (dtype_%(_z)s *)(%(_z)s->data + i * zs0);
+                if (K == 0)
+                {
+                    memset(zi, 0, sizeof(dtype_%(_z)s) * M * N);
+                    continue;
+                }
+                %(gemm)s(&transy, &transx, &N, &M, &K, &one,
+                         (dtype_%(_z)s *)(y->data + i * ys0), &ldy,
+                         (dtype_%(_z)s *)(x->data + i * xs0), &ldx,
+                         &zero, zi, &ldz);
+            }
+        }
+        Py_DECREF(x);
+        Py_DECREF(y);
+        }
+        """ % locals()
+
+    def c_code_cache_version(self):
+        return (1,)
+
+batched_dot = BatchedDot()
+
+
+def _stacked_slice(var, i):
+    """If `var` is x[i] for a constant int i, return x, else None."""
+    if not (var.owner and isinstance(var.owner.op, T.Subtensor)):
+        return None
+    idx = T.get_idx_list(var.owner.inputs, var.owner.op.idx_list)
+    if len(idx) != 1 or isinstance(idx[0], slice):
+        return None
+    # idx_list keeps the constant indices as Python ints.
+    if isinstance(idx[0], (int, long)):
+        if idx[0] != i:
+            return None
+    else:
+        try:
+            if T.get_constant_value(idx[0]) != i:
+                return None
+        except TypeError:
+            return None
+    return var.owner.inputs[0]
+
+
+@local_optimizer([T.join])
+def local_stacked_dot_to_batched_dot(node):
+    """stack(dot(x[0], y[0]), ..., dot(x[n-1], y[n-1]))
+       -> batched_dot(x[:n], y[:n])
+
+    stack is join(0, *[shape_padleft(t) for t in tensors]), and the dot can
+    already be a _dot22.
+    """
+    if not (isinstance(node.op, T.Join) and node.outputs[0].ndim == 3):
+        return
+    try:
+        axis = T.get_constant_value(node.inputs[0])
+    except TypeError:
+        return
+    if axis != 0:
+        return
+    tensors = node.inputs[1:]
+    x = y = None
+    for i, t in enumerate(tensors):
+        if not (t.owner and isinstance(t.owner.op, T.DimShuffle) and
+                tuple(t.owner.op.new_order) == ('x', 0, 1)):
+            return
+        d = t.owner.inputs[0]
+        if not (d.owner and d.owner.op in (T.dot, _dot22)):
+            return
+        xi = _stacked_slice(d.owner.inputs[0], i)
+        yi = _stacked_slice(d.owner.inputs[1], i)
+        if xi is None or yi is None or xi.ndim != 3 or yi.ndim != 3:
+            return
+        if x is None:
+            x, y = xi, yi
+        elif x is not xi or y is not yi:
+            return
+    if x.dtype != y.dtype or x.dtype not in ('float32', 'float64'):
+        return
+    n = len(tensors)
+    rval = batched_dot(x[:n], y[:n])
+    if rval.dtype != node.outputs[0].dtype:
+        return
+    return [T.patternbroadcast(rval, node.outputs[0].broadcastable)]
+
+blas_optdb.register('local_stacked_dot_to_batched_dot',
+        EquilibriumOptimizer([local_stacked_dot_to_batched_dot],
+                             max_use_ratio=5),
+        5, 'fast_run')
+
+
+def _tensordot_free_axes(ndim, axes):
+    return [i for i in xrange(ndim) if i not in axes]
+
+
+def _tensordot_view_axes(x_ndim, y_ndim, axes):
+    """Order the pairs of summed axes so that
+    x.dimshuffle(free_x + sum_x) and y.dimshuffle(sum_y + free_y) can both
+    be reshaped to matrices without a copy when x and y are c-contiguous.
+
+    That is the case when the summed axes (and hence the free axes) of
+    each input form a single run of consecutive axes. Return
+    (sum_x, sum_y), or None if no ordering of the pairs allows it.
+    """
+    def is_view(ndim, sum_axes):
+        if not sum_axes:
+            return True
+        return (list(sum_axes) == range(sum_axes[0],
+                                        sum_axes[0] + len(sum_axes))
+                and (sum_axes[0] == 0 or sum_axes[-1] == ndim - 1))
+
+    pairs = zip([a % x_ndim for a in axes[0]],
+                [a % y_ndim for a in axes[1]])
+    for key in (0, 1):
+        sorted_pairs = sorted(pairs, key=lambda p: p[key])
+        sum_x = [p[0] for p in sorted_pairs]
+        sum_y = [p[1] for p in sorted_pairs]
+        if is_view(x_ndim, sum_x) and is_view(y_ndim, sum_y):
+            return sum_x, sum_y
+    return None
+
+
+def _prod(shapes):
+    rval = 1
+    for shp in shapes:
+        rval = rval * shp
+    return rval
+
+
+@local_optimizer([T.TensorDotGrad])
+def local_tensordot_grad_to_tensordot(node):
+    """TensorDotGrad(axes)(x, y, gz) -> the two tensordot it computes
+
+    Each tensordot can then be lowered to a dot or a TensorDotGemm.
+    """
+    if not isinstance(node.op, T.TensorDotGrad):
+        return
+    x, y, gz = node.inputs
+    sum_x = [a % x.ndim for a in node.op.axes[0]]
+    sum_y = [a % y.ndim for a in node.op.axes[1]]
+    free_x = _tensordot_free_axes(x.ndim, sum_x)
+    free_y = _tensordot_free_axes(y.ndim, sum_y)
+    nfx = len(free_x)
+
+    # gz has the free axes of x and then those of y.
+    gx = T.tensordot(gz, y, [range(nfx, gz.ndim), free_y])
+    # The last axes of gx are the summed axes of y in increasing order.
+    src_x = free_x + [sum_x[sum_y.index(a)] for a in sorted(sum_y)]
+    gx = gx.dimshuffle([src_x.index(i) for i in xrange(x.ndim)])
+
+    gy = T.tensordot(x, gz, [free_x, range(nfx)])
+    src_y = [sum_y[sum_x.index(a)] for a in sorted(sum_x)] + free_y
+    gy = gy.dimshuffle([src_y.index(i) for i in xrange(y.ndim)])
+
+    rval = []
+    for g, o in zip([gx, gy], node.outputs):
+        if g.dtype != o.dtype:
+            g = T.cast(g, o.dtype)
+        rval.append(T.patternbroadcast(g, o.broadcastable))
+    return rval
+
+
+@local_optimizer([T.TensorDot])
+def local_tensordot_to_dot(node):
+    """tensordot(x, y, axes) -> reshape(dot(reshape(x'), reshape(y')))
+
+    x' and y' are dimshuffles of x and y. This is only done when both
+    reshapes are views for c-contiguous inputs (see _tensordot_view_axes),
+    so the only work left is the GEMM. Other tensordots are handled by
+    TensorDotGemm.
+    """
+    if type(node.op) != T.TensorDot:
+        return
+    x, y = node.inputs
+    out, = node.outputs
+    axes = _tensordot_view_axes(x.ndim, y.ndim, node.op.axes)
+    if axes is None:
+        return
+    sum_x, sum_y = axes
+    free_x = _tensordot_free_axes(x.ndim, sum_x)
+    free_y = _tensordot_free_axes(y.ndim, sum_y)
+
+    x2 = x.dimshuffle(free_x + sum_x)
+    x2 = x2.reshape((_prod([x.shape[i] for i in free_x]),
+                     _prod([x.shape[i] for i in sum_x])), ndim=2)
+    y2 = y.dimshuffle(sum_y + free_y)
+    y2 = y2.reshape((_prod([y.shape[i] for i in sum_y]),
+                     _prod([y.shape[i] for i in free_y])), ndim=2)
+    z = T.dot(x2, y2)
+    if out.ndim == 0:
+        rval = z[0, 0]
+    else:
+        rval = z.reshape([x.shape[i] for i in free_x] +
+                         [y.shape[i] for i in free_y], ndim=out.ndim)
+    if rval.dtype != out.dtype:
+        return
+    return [T.patternbroadcast(rval, out.broadcastable)]
+
+
+class TensorDotGemm(T.TensorDot):
+    """TensorDot implemented with a single GEMM call.
+
+    Each input is viewed as a matrix (free axes x summed axes for x,
+    summed axes x free axes for y) directly from its strides whenever
+    that is possible, and only copied otherwise. This handles the
+    tensordots that `local_tensordot_to_dot` can't turn into views.
+    """
+    def __init__(self, axes):
+        super(TensorDotGemm, self).__init__(axes)
+        if isinstance(self.axes, int):
+            raise TypeError('TensorDotGemm needs explicit axes', axes)
+
+    def make_node(self, x, y):
+        x = T.as_tensor_variable(x)
+        y = T.as_tensor_variable(y)
+        if x.type.dtype not in ('float32', 'float64'):
+            raise TypeError('TensorDotGemm requires float inputs', x.type)
+        if y.type.dtype != x.type.dtype:
+            raise TypeError('dtype mismatch to TensorDotGemm',
+                            (x.type.dtype, y.type.dtype))
+        return super(TensorDotGemm, self).make_node(x, y)
+
+    def __str__(self):
+        return '%s{%s}' % (self.__class__.__name__, self.axes)
+
+    def c_support_code(self):
+        return blas_header_text() + """
+        // Collapse the axes ax[0..n-1] of `a` into one dimension of *size
+        // elements separated by *stride bytes. Return -1 if the strides
+        // of those axes don't allow it.
+        static int tensordot_group(PyArrayObject * a, int n, const int * ax,
+                                   npy_intp * size, npy_intp * stride)
+        {
+            npy_intp sz = 1, st = 0, next = 0;
+            int ok = 1;
+            for (int i = n - 1; i >= 0; --i)
+            {
+                const npy_intp d = a->dimensions[ax[i]];
+                const npy_intp s = a->strides[ax[i]];
+                if (d == 1)
+                    continue;
+                if (sz == 1)
+                    st = s;
+                else if (s != next)
+                    ok = 0;
+                next = s * d;
+                sz *= d;
+            }
+            *size = sz;
+            *stride = st;
+            return (ok || sz == 0) ? 0 : -1;
+        }
+
+        // View the axes rows then cols of `a` as an R x C matrix.
+        // Return 0 if it is row-major (C order), 1 if it is column-major
+        // (Fortran order) and -1 if BLAS can't use it without a copy.
+        // *ld is set to the leading dimension, in elements.
+        static int tensordot_as_matrix(PyArrayObject * a,
+                                       int nr, const int * rows,
+                                       int nc, const int * cols,
+                                       int * R, int * C, int * ld)
+        {
+            const npy_intp es = a->descr->elsize;
+            npy_intp r, c, sr, sc;
+            if (tensordot_group(a, nr, rows, &r, &sr)
+                || tensordot_group(a, nc, cols, &c, &sc))
+                return -1;
+            *R = r;
+            *C = c;
+            if ((c <= 1 || sc == es)
+                && (r <= 1 || (sr > 0 && (sr % es) == 0 && sr / es >= c)))
+            {
+                *ld = (r <= 1) ? ((c > 1) ? c : 1) : sr / es;
+                return 0;
+            }
+            if ((r <= 1 || sr == es)
+                && (c <= 1 || (sc > 0 && (sc % es) == 0 && sc / es >= r)))
+            {
+                *ld = (c <= 1) ? ((r > 1) ? r : 1) : sc / es;
+                return 1;
+            }
+            return -1;
+        }
+
+        // Return a new reference to `a`, or to a c-contiguous copy of its
+        // axes rows + cols if the strides of `a` don't allow a matrix view.
+        static PyArrayObject * tensordot_matrix(PyArrayObject * a,
+                int nr, const int * rows, int nc, const int * cols,
+                int * R, int * C, int * ld, int * layout)
+        {
+            *layout = tensordot_as_matrix(a, nr, rows, nc, cols, R, C, ld);
+            if (*layout >= 0)
+            {
+                Py_INCREF(a);
+                return a;
+            }
+            npy_intp perm[NPY_MAXDIMS];
+            int ident[NPY_MAXDIMS];
+            for (int i = 0; i < nr; ++i)
+                perm[i] = rows[i];
+            for (int i = 0; i < nc; ++i)
+                perm[nr + i] = cols[i];
+            for (int i = 0; i < nr + nc; ++i)
+                ident[i] = i;
+            PyArray_Dims pd;
+            pd.ptr = perm;
+            pd.len = nr + nc;
+            PyArrayObject * t = (PyArrayObject *) PyArray_Transpose(a, &pd);
+            if (!t)
+                return NULL;
+            PyArrayObject * cp = (PyArrayObject *) PyArray_NewCopy(t,
+                                                                NPY_CORDER);
+            Py_DECREF(t);
+            if (!cp)
+                return NULL;
+            *layout = tensordot_as_matrix(cp, nr, ident, nc, ident + nr,
+                                          R, C, ld);
+            return cp;
+        }
+        """
+
+    def c_libraries(self):
+        return ldflags()
+
+    def c_compile_args(self):
+        return ldflags(libs=False, flags=True)
+
+    def c_lib_dirs(self):
+        return ldflags(libs=False, libs_dir=True)
+
+    def c_header_dirs(self):
+        return ldflags(libs=False, include_dir=True)
+
+    def c_code(self, node, name, inp, out, sub):
+        _x, _y = inp
+        _z, = out
+        fail = sub['fail']
+        x_var, y_var = node.inputs
+        if x_var.dtype == 'float32':
+            gemm = 'sgemm_'
+        elif x_var.dtype == 'float64':
+            gemm = 'dgemm_'
+        else:
+            raise utils.MethodNotDefined('%s.c_code'
+                                         % self.__class__.__name__)
+        if not config.blas.ldflags:
+            raise utils.MethodNotDefined('%s.c_code'
+                                         % self.__class__.__name__)
+
+        sum_x = [a % x_var.ndim for a in self.axes[0]]
+        sum_y = [a % y_var.ndim for a in self.axes[1]]
+        free_x = _tensordot_free_axes(x_var.ndim, sum_x)
+        free_y = _tensordot_free_axes(y_var.ndim, sum_y)
+
+        def c_array(lst):
+            # C doesn't allow empty initializers
+            return '{%s}' % ', '.join(map(str, lst or [0]))
+
+        nx = x_var.ndim
+        ny = y_var.ndim
+        nsum = len(sum_x)
+        nfx = len(free_x)
+        nfy = len(free_y)
+        nz = nfx + nfy
+        nz_alloc = max(nz, 1)
+        x_free = c_array(free_x)
+        x_sum = c_array(sum_x)
+        y_sum = c_array(sum_y)
+        y_free = c_array(free_y)
+        return """
+        {
+        const int x_free[] = %(x_free)s;
+        const int x_sum[] = %(x_sum)s;
+        const int y_sum[] = %(y_sum)s;
+        const int y_free[] = %(y_free)s;
+        if (%(_x)s->nd != %(nx)s || %(_y)s->nd != %(ny)s)
+        {
+            PyErr_SetString(PyExc_NotImplementedError,
+                            "TensorDotGemm: wrong rank for x or y");
+            %(fail)s;
+        }
+        for (int i = 0; i < %(nsum)s; ++i)
+        {
+            if (%(_x)s->dimensions[x_sum[i]] != %(_y)s->dimensions[y_sum[i]])
+            {
+                PyErr_Format(PyExc_ValueError,
+                    "Shape mismatch in TensorDotGemm: x.shape[%%i] is %%ld,"
+                    " y.shape[%%i] is %%ld", x_sum[i],
+                    (long int)%(_x)s->dimensions[x_sum[i]], y_sum[i],
+                    (long int)%(_y)s->dimensions[y_sum[i]]);
+                %(fail)s;
+            }
+        }
+
+        npy_intp dims[%(nz_alloc)s];
+        for (int i = 0; i < %(nfx)s; ++i)
+            dims[i] = %(_x)s->dimensions[x_free[i]];
+        for (int i = 0; i < %(nfy)s; ++i)
+            dims[%(nfx)s + i] = %(_y)s->dimensions[y_free[i]];
+        int alloc = (NULL == %(_z)s) || !PyArray_ISCONTIGUOUS(%(_z)s);
+        for (int i = 0; !alloc && i < %(nz)s; ++i)
+            alloc = (%(_z)s->dimensions[i] != dims[i]);
+        if (alloc)
+        {
+            Py_XDECREF(%(_z)s);
+            %(_z)s = (PyArrayObject*)PyArray_SimpleNew(%(nz)s, dims,
+                                                        type_num_%(_x)s);
+            if (!%(_z)s)
+            {
+                PyErr_SetString(PyExc_MemoryError,
+                                "failed to alloc TensorDotGemm output");
+                %(fail)s
+            }
+        }
+
+        // x is viewed as M x K and y as K x N, copying them only if their
+        // strides don't allow it.
+        int M, K, Ky, N, ldx, ldy, layout_x, layout_y;
+        PyArrayObject * x = tensordot_matrix(%(_x)s, %(nfx)s, x_free,
+                %(nsum)s, x_sum, &M, &K, &ldx, &layout_x);
+        PyArrayObject * y = tensordot_matrix(%(_y)s, %(nsum)s, y_sum,
+                %(nfy)s, y_free, &Ky, &N, &ldy, &layout_y);
+        if (!x || !y)
+        {
+            Py_XDECREF(x);
+            Py_XDECREF(y);
+            %(fail)s
+        }
+
+        // z (M x N, C order) = x . y
+        // In fortran order: z' = y' . x'
+        char transy = layout_y ? 'T' : 'N';
+        char transx = layout_x ? 'T' : 'N';
+        const int ldz = (N > 1) ? N : 1;
+        const dtype_%(_z)s one = 1.0;
+        const dtype_%(_z)s zero = 0.0;
+        if (M > 0 && N > 0)
+        {
+            if (K == 0)
+            {
+                memset(%(_z)s->data, 0, sizeof(dtype_%(_z)s) * M * N);
+            }
+            else
+            {
+                %(gemm)s(&transy, &transx, &N, &M, &K, &one,
+                         (dtype_%(_z)s *)y->data, &ldy,
+                         (dtype_%(_z)s *)x->data, &ldx,
+                         &zero, (dtype_%(_z)s *)%(_z)s->data, &ldz);
+            }
+        }
+        Py_DECREF(x);
+        Py_DECREF(y);
+        }
+        """ % locals()
+
+    def c_code_cache_version(self):
+        return (1,)
+
+
+@local_optimizer([T.TensorDot])
+def local_tensordot_to_gemm(node):
+    """tensordot(x, y, axes) -> TensorDotGemm(axes)(x, y)
+
+    For float inputs of the same dtype, when a BLAS library is available.
+    """
+    if type(node.op) != T.TensorDot or not config.blas.ldflags:
+        return
+    x, y = node.inputs
+    if x.dtype != y.dtype or x.dtype not in ('float32', 'float64'):
+        return
+    return [TensorDotGemm(node.op.axes)(x, y)]
+
+# Before local_dot_to_dot22, so that the dots we introduce become Dot22.
+blas_optdb.register('local_tensordot_to_dot',
+        in2out(local_tensordot_grad_to_tensordot,
+               local_tensordot_to_dot,
+               local_tensordot_to_gemm),
+        -1, 'fast_run')
+
+
 #from opt import register_specialize, register_canonicalize
 #@register_specialize
 @local_optimizer([])
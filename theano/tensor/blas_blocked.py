@@ -0,0 +1,223 @@
+"""
+A blocked, optionally Strassen-based, implementation of Dot22 for very large
+matrices.
+
+Dot22 does a single GEMM call, which touches all of both inputs at once.
+BlockedDot22 computes the output tile by tile instead, so that only one
+block row of x and one block column of y need to be in memory at a time.
+This matters when the inputs are numpy.memmap arrays that don't fit in
+RAM.
+
+Above a size threshold, the product of two tiles can use Strassen's
+algorithm, which does 7 half-size products instead of 8. That is less
+accurate than a plain GEMM. Every Strassen tile is therefore checked
+against a random projection of the plain product (Freivalds' check), and
+recomputed with numpy.dot if the error is too large.
+
+The optimization is enabled by the blas.dot22_mode flag, which is read
+when a function is compiled.
+"""
+import logging
+
+import numpy
+
+from theano.configparser import config, AddConfigVar, EnumStr, IntParam
+from theano.gof import Op, Apply
+from theano.gof.op import default_cost_bytes
+from theano.tensor.opt import in2out
+
+from blas import _dot22, blas_optdb, local_optimizer
+
+_logger = logging.getLogger('theano.tensor.blas_blocked')
+
+AddConfigVar('blas.dot22_mode',
+        "How to compute the remaining Dot22 after the other BLAS "
+        "optimizations: 'gemm' does one GEMM call, 'blocked' computes the "
+        "output tile by tile (see blas.dot22_block_size) and 'strassen' "
+        "also uses Strassen's algorithm on tiles larger than "
+        "blas.strassen_min_size.",
+        EnumStr('gemm', 'blocked', 'strassen'),
+        in_c_key=False)
+
+AddConfigVar('blas.dot22_block_size',
+        "Size of the tiles used when blas.dot22_mode is not 'gemm'. "
+        "Products whose dimensions are all smaller than this are done with "
+        "one GEMM call.",
+        IntParam(4096, lambda i: i > 0),
+        in_c_key=False)
+
+AddConfigVar('blas.strassen_min_size',
+        "Strassen's algorithm recurses while the smallest dimension of the "
+        "product is at least this large.",
+        IntParam(2048, lambda i: i > 0),
+        in_c_key=False)
+
+
+def strassen(a, b, min_size, out=None):
+    """Return dot(a, b) computed with Strassen's algorithm.
+
+    The recursion stops, and numpy.dot is used, when one of the
+    dimensions is smaller than `min_size`. Odd dimensions are handled by
+    peeling off the last row or column.
+
+    :param out: if given, the result is stored in it.
+    """
+    m, k = a.shape
+    n = b.shape[1]
+    if out is None:
+        out = numpy.empty((m, n), dtype=numpy.find_common_type(
+            [a.dtype, b.dtype], []))
+    if min(m, k, n) < max(min_size, 2):
+        out[...] = numpy.dot(a, b)
+        return out
+
+    m2, k2, n2 = m // 2, k // 2, n // 2
+    me, ke, ne = 2 * m2, 2 * k2, 2 * n2
+    a11, a12 = a[:m2, :k2], a[:m2, k2:ke]
+    a21, a22 = a[m2:me, :k2], a[m2:me, k2:ke]
+    b11, b12 = b[:k2, :n2], b[:k2, n2:ne]
+    b21, b22 = b[k2:ke, :n2], b[k2:ke, n2:ne]
+    c11, c12 = out[:m2, :n2], out[:m2, n2:ne]
+    c21, c22 = out[m2:me, :n2], out[m2:me, n2:ne]
+
+    m1 = strassen(a11 + a22, b11 + b22, min_size)
+    m2_ = strassen(a21 + a22, b11, min_size)
+    m3 = strassen(a11, b12 - b22, min_size)
+    m4 = strassen(a22, b21 - b11, min_size)
+    m5 = strassen(a11 + a12, b22, min_size)
+    m6 = strassen(a21 - a11, b11 + b12, min_size)
+    m7 = strassen(a12 - a22, b21 + b22, min_size)
+
+    c11[...] = m1 + m4 - m5 + m7
+    c12[...] = m3 + m5
+    c21[...] = m2_ + m4
+    c22[...] = m1 - m2_ + m3 + m6
+
+    # Peel off the odd row, column and inner dimension.
+    if k != ke:
+        out[:me, :ne] += numpy.outer(a[:me, ke], b[ke, :ne])
+    if n != ne:
+        out[:me, ne:] = numpy.dot(a[:me], b[:, ne:])
+    if m != me:
+        out[me:] = numpy.dot(a[me:], b)
+    return out
+
+
+class BlockedDot22(Op):
+    """Compute a matrix-matrix product tile by tile.
+
+    This is a drop-in replacement for Dot22 on very large matrices, see
+    the module docstring.
+
+    :param block_size: side of the square output tiles, and of the blocks
+        along the summed dimension.
+    :param strassen_min_size: if not 0, tile products whose dimensions
+        are all at least this large use Strassen's algorithm.
+    """
+    # Relative error accepted from Strassen's algorithm, measured by
+    # Freivalds' check.
+    strassen_rtol = {'float32': 1e-4, 'float64': 1e-10,
+                     'complex64': 1e-4, 'complex128': 1e-10}
+
+    def __init__(self, block_size, strassen_min_size=0):
+        self.block_size = block_size
+        self.strassen_min_size = strassen_min_size
+
+    def __eq__(self, other):
+        return (type(self) == type(other) and
+                self.block_size == other.block_size and
+                self.strassen_min_size == other.strassen_min_size)
+
+    def __hash__(self):
+        return (hash(type(self)) ^ hash(self.block_size) ^
+                hash(self.strassen_min_size))
+
+    def __str__(self):
+        return '%s{%d,%d}' % (self.__class__.__name__, self.block_size,
+                              self.strassen_min_size)
+
+    def make_node(self, x, y):
+        # Same checks and output type as Dot22.
+        node = _dot22.make_node(x, y)
+        return Apply(self, node.inputs, [o.type() for o in node.outputs])
+
+    def infer_shape(self, node, shapes):
+        xshp, yshp = shapes
+        return [(xshp[0], yshp[1])]
+
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        # The flops of the usual product, even when Strassen's algorithm
+        # does less, so the rates compare with Dot22.
+        flops = None
+        x_shape, y_shape = input_shapes
+        if x_shape is not None and y_shape is not None:
+            flops = 2 * x_shape[0] * x_shape[1] * y_shape[1]
+        return (flops,) + default_cost_bytes(node, input_shapes,
+                                             output_shapes)
+
+    def _tile_dot(self, a, b):
+        if (not self.strassen_min_size or
+                min(a.shape[0], a.shape[1], b.shape[1]) <
+                self.strassen_min_size):
+            return numpy.dot(a, b)
+        c = strassen(a, b, self.strassen_min_size)
+        # Freivalds' check: compare c . r with a . (b . r) for a random
+        # vector r, relative to the magnitude of |a| . |b| . |r|.
+        r = numpy.random.RandomState(c.shape[1]).uniform(
+                size=c.shape[1]).astype(c.dtype)
+        err = abs(numpy.dot(c, r) - numpy.dot(a, numpy.dot(b, r))).max()
+        scale = numpy.dot(abs(a), numpy.dot(abs(b), abs(r))).max()
+        if err > self.strassen_rtol.get(str(c.dtype), 1e-10) * scale:
+            _logger.warning('Strassen product of shape %s was not accurate'
+                            ' enough (error %g, scale %g), recomputing it'
+                            ' with a GEMM.', c.shape, err, scale)
+            c = numpy.dot(a, b)
+        return c
+
+    def perform(self, node, inp, out):
+        x, y = inp
+        z, = out
+        if x.ndim != 2 or y.ndim != 2 or x.shape[1] != y.shape[0]:
+            raise ValueError('Shape mismatch in BlockedDot22',
+                             x.shape, y.shape)
+        m, k = x.shape
+        n = y.shape[1]
+        bs = self.block_size
+        dtype = node.outputs[0].dtype
+        if max(m, k, n) <= bs:
+            z[0] = numpy.asarray(self._tile_dot(x, y), dtype=dtype)
+            return
+
+        zz = z[0]
+        if zz is None or zz.shape != (m, n) or zz.dtype != dtype:
+            zz = numpy.empty((m, n), dtype=dtype)
+        if k == 0:
+            zz[...] = 0
+        for i in xrange(0, m, bs):
+            for j in xrange(0, n, bs):
+                for l in xrange(0, k, bs):
+                    t = self._tile_dot(x[i:i + bs, l:l + bs],
+                                       y[l:l + bs, j:j + bs])
+                    if l == 0:
+                        zz[i:i + bs, j:j + bs] = t
+                    else:
+                        zz[i:i + bs, j:j + bs] += t
+        z[0] = zz
+
+
+@local_optimizer([_dot22])
+def local_dot22_to_blocked(node):
+    """_dot22 -> BlockedDot22, when config.blas.dot22_mode asks for it"""
+    if node.op != _dot22 or config.blas.dot22_mode == 'gemm':
+        return
+    strassen_min_size = 0
+    if config.blas.dot22_mode == 'strassen':
+        strassen_min_size = config.blas.strassen_min_size
+    op = BlockedDot22(config.blas.dot22_block_size, strassen_min_size)
+    return [op(*node.inputs)]
+
+# After the Dot22 that can be merged into a Gemm, Dot22Scalar or Gemv have
+# been, and before the C BLAS optimizations (20).
+blas_optdb.register('local_dot22_to_blocked',
+        in2out(local_dot22_to_blocked),
+        16, 'fast_run')
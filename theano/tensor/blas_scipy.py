@@ -1,30 +1,16 @@
 """
 Implementations of BLAS Ops based on scipy's BLAS bindings.
 """
-import numpy
 
 from blas import Ger, ger, ger_destructive
 from blas import blas_optdb, optdb,local_optimizer
+from blas import scipy_fblas
 
 from theano.tensor.opt import in2out
 
-try:
-    import scipy.linalg.blas
-    have_fblas = True
-    _blas_gemv_fns = {
-            numpy.dtype('float32'):scipy.linalg.blas.fblas.sgemv,
-            numpy.dtype('float64'):scipy.linalg.blas.fblas.dgemv,
-            numpy.dtype('complex64'):scipy.linalg.blas.fblas.cgemv,
-            numpy.dtype('complex128'):scipy.linalg.blas.fblas.zgemv,
-            }
-    _blas_ger_fns = {
-            numpy.dtype('float32'):scipy.linalg.blas.fblas.sger,
-            numpy.dtype('float64'):scipy.linalg.blas.fblas.dger,
-            numpy.dtype('complex64'):scipy.linalg.blas.fblas.cgeru,
-            numpy.dtype('complex128'):scipy.linalg.blas.fblas.zgeru,
-            }
-except ImportError, e:
-    have_fblas = False
+# scipy is only imported when these are first needed, see scipy_fblas.
+_blas_ger_names = {'float32': 'sger', 'float64': 'dger',
+                   'complex64': 'cgeru', 'complex128': 'zgeru'}
 
 
 class ScipyGer(Ger):
@@ -38,7 +24,8 @@ class ScipyGer(Ger):
         # get vars for containers
         cA, calpha, cx, cy = node_input_storage
         cZ, = node_output_storage
-        local_ger = _blas_ger_fns[numpy.dtype(node.inputs[0].type.dtype)]
+        local_ger = getattr(scipy_fblas(),
+                            _blas_ger_names[node.inputs[0].type.dtype])
 
         def rval():
             # N.B. some versions of scipy (e.g. mine) don't actually work
@@ -69,7 +56,7 @@ class ScipyGer(Ger):
 
 @local_optimizer([ger, ger_destructive])
 def use_scipy_ger(node):
-    if node.op == ger:
+    if node.op == ger and scipy_fblas():
         return [ScipyGer(False)(*node.inputs)]
 
 @local_optimizer([ScipyGer(False)])
@@ -80,17 +67,18 @@ def make_ger_destructive(node):
 use_scipy_blas = in2out(use_scipy_ger)
 make_scipy_blas_destructive = in2out(make_ger_destructive)
 
-if have_fblas:
-    # scipy_blas is scheduled in the blas_optdb very late, because scipy sortof
-    # sucks, but it is almost always present.
-    # C implementations should be scheduled earlier than this, so that they take
-    # precedence. Once the original Ger is replaced, then these optimizations
-    # have no effect.
-    blas_optdb.register('scipy_blas',
-        use_scipy_blas,
-        100, 'fast_run')
+# scipy_blas is scheduled in the blas_optdb very late, because scipy sortof
+# sucks, but it is almost always present. It does nothing when scipy is
+# not available; this is only checked when a Ger is found, so that scipy is
+# not imported with Theano.
+# C implementations should be scheduled earlier than this, so that they take
+# precedence. Once the original Ger is replaced, then these optimizations
+# have no effect.
+blas_optdb.register('scipy_blas',
+    use_scipy_blas,
+    100, 'fast_run')
 
-    # this matches the InplaceBlasOpt defined in blas.py
-    optdb.register('make_scipy_blas_destructive',
-            make_scipy_blas_destructive,
-            70.0, 'fast_run', 'inplace')
+# this matches the InplaceBlasOpt defined in blas.py
+optdb.register('make_scipy_blas_destructive',
+        make_scipy_blas_destructive,
+        70.0, 'fast_run', 'inplace')
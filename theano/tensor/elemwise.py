@@ -878,6 +878,18 @@ class Elemwise(Op):
             rval.append(tuple(oshp))
         return rval
 
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        # One operation per output element and scalar op of the (possibly
+        # fused) graph.
+        flops = None
+        if output_shapes[0] is not None:
+            n_ops = 1
+            if isinstance(self.scalar_op, scalar.Composite):
+                n_ops = len(self.scalar_op.fgraph.toposort())
+            flops = int(numpy.prod(output_shapes[0])) * n_ops
+        return (flops,) + gof.op.default_cost_bytes(
+                node, input_shapes, output_shapes)
+
     def _c_all(self, node, nodename, inames, onames, sub):
         _inames = inames
         _onames = onames
@@ -1195,6 +1207,35 @@ class CAReduce(Op):
         else:
             return "Reduce{%s}" % self.scalar_op
 
+    def R_op(self, inputs, eval_points):
+        x, = inputs
+        ev, = eval_points
+        out = self.make_node(x).outputs[0]
+        if ev is None or out.dtype in theano.tensor.discrete_dtypes:
+            return [None]
+        if not isinstance(self.scalar_op, (scalar.Maximum, scalar.Minimum)):
+            # The R_op of the other reductions is derived from their grad.
+            raise NotImplementedError()
+        axis = self.axis
+        if axis is None:
+            axis = range(x.type.ndim)
+        pattern = []
+        i = 0
+        for j in range(x.type.ndim):
+            if j in axis:
+                pattern.append('x')
+            else:
+                pattern.append(i)
+                i += 1
+        out = DimShuffle(out.type.broadcastable, pattern)(out)
+        # Only the elements equal to the max (or min) move it. Like the
+        # grad, this is not defined where several elements are equal: the
+        # ties share the move.
+        mask = theano.tensor.eq(x, out)
+        n = theano.tensor.sum(mask, axis=axis)
+        return [(theano.tensor.sum(mask * ev, axis=axis) / n).astype(
+            x.dtype)]
+
     def perform(self, node, inp, out):
         input, = inp
         output, = out
@@ -1252,6 +1293,14 @@ class CAReduce(Op):
                 for (i, b) in enumerate(node.inputs[0].type.broadcastable)
                 if i not in axis],
 
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        # One operation per reduced element.
+        flops = None
+        if input_shapes[0] is not None:
+            flops = int(numpy.prod(input_shapes[0]))
+        return (flops,) + gof.op.default_cost_bytes(
+                node, input_shapes, output_shapes)
+
     def _c_all(self, node, name, inames, onames, sub):
 
         input = node.inputs[0]
@@ -47,6 +47,100 @@ class DiffOp(theano.Op):
         z = output_storage[0]
         z[0] = np.diff(x, n=self.n, axis=self.axis)
 
+    def c_code_cache_version(self):
+        return (1,)
+
+    def c_code(self, node, name, inputs, outputs, sub):
+        x, = inputs
+        z, = outputs
+        fail = sub['fail']
+        n = self.n
+        ndim = node.inputs[0].ndim
+        axis = self.axis
+        if axis < 0:
+            axis += ndim
+        # n == 0 returns a view, and complex numbers have no C operator-.
+        if (n < 1 or not 0 <= axis < ndim or
+                node.inputs[0].dtype.startswith('complex')):
+            return theano.Op.c_code(self, node, name, inputs, outputs, sub)
+        return """
+        {
+        // View x as an (outer, length, inner) C-contiguous array, so that
+        // the innermost loops are contiguous.
+        npy_intp dims[%(ndim)s];
+        npy_intp outer = 1, inner = 1;
+        PyArrayObject* xc = PyArray_GETCONTIGUOUS(%(x)s);
+        if (!xc)
+            %(fail)s;
+        for (int i = 0; i < %(ndim)s; ++i)
+        {
+            dims[i] = xc->dimensions[i];
+            if (i < %(axis)s)
+                outer *= dims[i];
+            else if (i > %(axis)s)
+                inner *= dims[i];
+        }
+        npy_intp length = dims[%(axis)s];
+        npy_intp olength = 0;
+        if (length > %(n)s)
+            olength = length - %(n)s;
+        dims[%(axis)s] = olength;
+
+        bool alloc = (%(z)s == NULL) || !PyArray_ISCONTIGUOUS(%(z)s);
+        for (int i = 0; !alloc && i < %(ndim)s; ++i)
+            alloc = (%(z)s->dimensions[i] != dims[i]);
+        if (alloc)
+        {
+            Py_XDECREF(%(z)s);
+            %(z)s = (PyArrayObject*)PyArray_EMPTY(%(ndim)s, dims,
+                                                  type_num_%(x)s, 0);
+            if (!%(z)s)
+            {
+                Py_DECREF(xc);
+                %(fail)s;
+            }
+        }
+
+        const dtype_%(x)s* xp = (dtype_%(x)s*)xc->data;
+        dtype_%(z)s* zp = (dtype_%(z)s*)%(z)s->data;
+        if (olength > 0 && inner > 0 && %(n)s == 1)
+        {
+            for (npy_intp o = 0; o < outer; ++o)
+            {
+                const dtype_%(x)s* xo = xp + o * length * inner;
+                dtype_%(z)s* zo = zp + o * olength * inner;
+                for (npy_intp j = 0; j < olength * inner; ++j)
+                    zo[j] = xo[j + inner] - xo[j];
+            }
+        }
+        else if (olength > 0 && inner > 0)
+        {
+            // Difference a copy of each slab n times in place; row j only
+            // depends on rows j and j + 1, so we can go forward.
+            dtype_%(x)s* buf = (dtype_%(x)s*)malloc(
+                length * inner * sizeof(dtype_%(x)s));
+            if (!buf)
+            {
+                Py_DECREF(xc);
+                PyErr_NoMemory();
+                %(fail)s;
+            }
+            for (npy_intp o = 0; o < outer; ++o)
+            {
+                memcpy(buf, xp + o * length * inner,
+                       length * inner * sizeof(dtype_%(x)s));
+                for (npy_intp k = 1; k <= %(n)s; ++k)
+                    for (npy_intp j = 0; j < (length - k) * inner; ++j)
+                        buf[j] = buf[j + inner] - buf[j];
+                memcpy(zp + o * olength * inner, buf,
+                       olength * inner * sizeof(dtype_%(z)s));
+            }
+            free(buf);
+        }
+        Py_DECREF(xc);
+        }
+        """ % locals()
+
     def grad(self, inputs, outputs_gradients):
         inputs = inputs[0]
 
@@ -157,6 +251,67 @@ class BinCountOp(theano.Op):
 
         z[0] = np.bincount(x, weights=weights, minlength=self.minlength)
 
+    def c_code_cache_version(self):
+        return (2,)
+
+    def c_code(self, node, name, inputs, outputs, sub):
+        x, weights = inputs
+        z, = outputs
+        fail = sub['fail']
+        minlength = self.minlength or 0
+        if isinstance(node.inputs[1].type, basic.TensorType):
+            weight = ('*(dtype_%(w)s*)(%(w)s->data + i * %(w)s->strides[0])'
+                      % dict(w=weights))
+            # The weights input is a PyObject* when there are none, so
+            # only access its dimensions when it is an array.
+            check_weights = """
+        if (%(w)s->dimensions[0] != n)
+        {
+            PyErr_SetString(PyExc_TypeError,
+                            "All inputs must have the same shape.");
+            %(fail)s;
+        }""" % dict(w=weights, fail=fail)
+        else:
+            weight = '1'
+            check_weights = ''
+        return """
+        {
+        npy_intp n = %(x)s->dimensions[0];
+        npy_intp length = %(minlength)s;
+        for (npy_intp i = 0; i < n; ++i)
+        {
+            dtype_%(x)s v = *(dtype_%(x)s*)(%(x)s->data +
+                                            i * %(x)s->strides[0]);
+            if (v < 0)
+            {
+                PyErr_SetString(PyExc_ValueError,
+                    "BinCountOp: the input must be non-negative");
+                %(fail)s;
+            }
+            if ((npy_intp)v >= length)
+                length = (npy_intp)v + 1;
+        }
+        %(check_weights)s
+        if (%(z)s == NULL || %(z)s->dimensions[0] != length ||
+            !PyArray_ISCONTIGUOUS(%(z)s))
+        {
+            Py_XDECREF(%(z)s);
+            %(z)s = (PyArrayObject*)PyArray_EMPTY(1, &length,
+                                                  type_num_%(z)s, 0);
+            if (!%(z)s)
+                %(fail)s;
+        }
+        dtype_%(z)s* zp = (dtype_%(z)s*)%(z)s->data;
+        memset(zp, 0, length * sizeof(dtype_%(z)s));
+        for (npy_intp i = 0; i < n; ++i)
+        {
+            npy_intp v = (npy_intp)*(dtype_%(x)s*)(%(x)s->data +
+                                                   i * %(x)s->strides[0]);
+            zp[v] += %(weight)s;
+        }
+        }
+        """ % locals()
+
     def grad(self, inputs, outputs_gradients):
         return [None for i in inputs]
 
@@ -299,6 +454,28 @@ class RepeatOp(theano.Op):
         z = output_storage[0]
         z[0] = np.repeat(x, repeats=repeats, axis=self.axis)
 
+    def c_code_cache_version(self):
+        return (1,)
+
+    def c_code(self, node, name, inputs, outputs, sub):
+        x, repeats = inputs
+        z, = outputs
+        fail = sub['fail']
+        if node.inputs[1].dtype not in BinCountOp.compatible_type:
+            return theano.Op.c_code(self, node, name, inputs, outputs, sub)
+        if self.axis is None:
+            # PyArray_Repeat flattens x for this axis, like numpy.repeat.
+            axis = 'NPY_MAXDIMS'
+        else:
+            axis = self.axis
+        return """
+        Py_XDECREF(%(z)s);
+        %(z)s = (PyArrayObject*)PyArray_Repeat(%(x)s, (PyObject*)%(repeats)s,
+                                               %(axis)s);
+        if (!%(z)s)
+            %(fail)s;
+        """ % locals()
+
     def grad(self, (x, repeats), (gz, )):
         if repeats.ndim == 0:
             if self.axis is None:
@@ -409,6 +586,42 @@ class Bartlett(gof.Op):
         out, = out_
         out[0] = numpy.bartlett(M)
 
+    def c_code_cache_version(self):
+        return (1,)
+
+    def c_code(self, node, name, inputs, outputs, sub):
+        M, = inputs
+        z, = outputs
+        fail = sub['fail']
+        return """
+        {
+        // Same formula, and operation order, as numpy.bartlett.
+        npy_intp M = ((dtype_%(M)s*)%(M)s->data)[0];
+        if (M < 0)
+            M = 0;
+        if (%(z)s == NULL || %(z)s->dimensions[0] != M)
+        {
+            Py_XDECREF(%(z)s);
+            %(z)s = (PyArrayObject*)PyArray_EMPTY(1, &M, NPY_FLOAT64, 0);
+            if (!%(z)s)
+                %(fail)s;
+        }
+        char* zp = %(z)s->data;
+        npy_intp zs = %(z)s->strides[0];
+        for (npy_intp i = 0; i < M; ++i)
+        {
+            double v = 1.;
+            if (M > 1)
+            {
+                v = 2. * i / (M - 1);
+                if (i > (M - 1) / 2.)
+                    v = 2. - v;
+            }
+            *(npy_float64*)(zp + i * zs) = v;
+        }
+        }
+        """ % locals()
+
     def infer_shape(self, node, in_shapes):
         temp = node.inputs[0]
         M = tensor.switch(tensor.lt(temp, 0),
@@ -447,7 +660,7 @@ class FillDiagonal(gof.Op):
     def __eq__(self, other):
         return type(self) == type(other)
 
-    def __hash_(self):
+    def __hash__(self):
         return hash(type(self))
 
     def __str__(self):
@@ -487,6 +700,40 @@ class FillDiagonal(gof.Op):
 
         output_storage[0][0] = a
 
+    def c_code_cache_version(self):
+        return (1,)
+
+    def c_code(self, node, name, inputs, outputs, sub):
+        a, val = inputs
+        z, = outputs
+        fail = sub['fail']
+        if node.inputs[0].ndim != 2:
+            return gof.Op.c_code(self, node, name, inputs, outputs, sub)
+        return """
+        {
+        if (%(z)s == NULL ||
+            %(z)s->dimensions[0] != %(a)s->dimensions[0] ||
+            %(z)s->dimensions[1] != %(a)s->dimensions[1])
+        {
+            Py_XDECREF(%(z)s);
+            %(z)s = (PyArrayObject*)PyArray_EMPTY(2, %(a)s->dimensions,
+                                                  type_num_%(a)s, 0);
+            if (!%(z)s)
+                %(fail)s;
+        }
+        if (PyArray_CopyInto(%(z)s, %(a)s))
+            %(fail)s;
+        // Like perform, rectangular matrices are accepted.
+        npy_intp n = %(z)s->dimensions[0];
+        if (%(z)s->dimensions[1] < n)
+            n = %(z)s->dimensions[1];
+        npy_intp step = %(z)s->strides[0] + %(z)s->strides[1];
+        dtype_%(val)s v = ((dtype_%(val)s*)%(val)s->data)[0];
+        for (npy_intp i = 0; i < n; ++i)
+            *(dtype_%(z)s*)(%(z)s->data + i * step) = v;
+        }
+        """ % locals()
+
     def grad(self, inp, cost_grad):
         """
         Note: The gradient is currently implemented for matrices
@@ -0,0 +1,843 @@
+"""
+BLAS-backed versions of Conv3D, ConvGrad3D and ConvTransp3D.
+
+The ops in Conv3D.py, ConvGrad3D.py and ConvTransp3D.py loop over every
+filter tap in C. The ops in this file instead lower the 3D patches of one
+video into a matrix (one row per output location, one column per filter
+tap) and then do a single GEMM per video. The outer loop over the
+minibatch is parallelized with OpenMP when config.openmp is True.
+
+The optimization local_conv3d_gemm substitutes them for the original ops
+when a BLAS library is available (config.blas.ldflags is not empty) and
+all inputs have the same float32 or float64 dtype.
+"""
+import numpy as N
+from numpy.lib.stride_tricks import as_strided
+
+from theano import config
+from theano.gof import local_optimizer
+from theano.gof.python25 import all
+from theano.gof.utils import MethodNotDefined
+from theano.tensor import basic as T
+from theano.tensor import opt
+from theano.tensor.blas_headers import blas_header_text
+from theano.tensor.blas import ldflags
+from theano.misc import strutil
+
+from Conv3D import Conv3D, conv3D
+from ConvGrad3D import ConvGrad3D, convGrad3D
+from ConvTransp3D import ConvTransp3D, convTransp3D
+
+
+def lower_patches(V, filter_shape, d):
+    """Return the (filterHeight, filterWidth, filterDur) patches of V taken
+    with strides d, as an array of shape (batchSize, nPatches, patchSize).
+
+    Rows are ordered like the (r, c, t) positions of the output of Conv3D
+    and columns like W[j].flatten(), so that
+    Conv3D(V, W, b, d)[i].reshape(nPatches, -1) ==
+        dot(lower_patches(V, W.shape[1:4], d)[i], W.reshape(W.shape[0], -1).T) + b
+    """
+    batchSize, vidHeight, vidWidth, vidDur, inputChannels = V.shape
+    filterHeight, filterWidth, filterDur = filter_shape
+    dr, dc, dt = d
+    outputHeight = (vidHeight - filterHeight) // dr + 1
+    outputWidth = (vidWidth - filterWidth) // dc + 1
+    outputDur = (vidDur - filterDur) // dt + 1
+    s0, s1, s2, s3, s4 = V.strides
+    patches = as_strided(V,
+            shape=(batchSize, outputHeight, outputWidth, outputDur,
+                   filterHeight, filterWidth, filterDur, inputChannels),
+            strides=(s0, s1 * dr, s2 * dc, s3 * dt, s1, s2, s3, s4))
+    return patches.reshape((batchSize,
+                            outputHeight * outputWidth * outputDur,
+                            filterHeight * filterWidth * filterDur *
+                            inputChannels))
+
+
+def computeH_gemm(V, W, b, d):
+    """Vectorized equivalent of Conv3D.computeH"""
+    outputChannels, filterHeight, filterWidth, filterDur, inputChannels = \
+            W.shape
+    if V.shape[4] != inputChannels:
+        raise ValueError("Conv3DGemm: W operates on a %i channel image but "
+                         "the image has %i channels" % (inputChannels,
+                                                        V.shape[4]))
+    if (V.shape[1] < filterHeight or V.shape[2] < filterWidth or
+            V.shape[3] < filterDur):
+        raise ValueError("Conv3DGemm: filter of shape %s larger than "
+                         "video of shape %s" % (W.shape[1:4], V.shape[1:4]))
+    dr, dc, dt = d
+    batchSize = V.shape[0]
+    outputHeight = (V.shape[1] - filterHeight) // dr + 1
+    outputWidth = (V.shape[2] - filterWidth) // dc + 1
+    outputDur = (V.shape[3] - filterDur) // dt + 1
+
+    cols = lower_patches(V, (filterHeight, filterWidth, filterDur), d)
+    Wmat = W.reshape((outputChannels, -1))
+    H = N.dot(cols, Wmat.T)
+    H += b
+    return N.asarray(H.reshape((batchSize, outputHeight, outputWidth,
+                                outputDur, outputChannels)), dtype=V.dtype)
+
+
+def computeGradW_gemm(V, d, WShape, dCdH):
+    """Vectorized equivalent of ConvGrad3D.perform"""
+    WShape = tuple(int(s) for s in WShape)
+    cols = lower_patches(V, WShape[1:4], d)
+    batchSize, nPatches, patchSize = cols.shape
+    if dCdH.shape[0] != batchSize or dCdH.shape[4] != WShape[0]:
+        raise ValueError("ConvGrad3DGemm: dCdH has shape %s, incompatible "
+                         "with V of shape %s and W of shape %s" %
+                         (dCdH.shape, V.shape, WShape))
+    dCdHmat = dCdH.reshape((batchSize * nPatches, WShape[0]))
+    dCdW = N.dot(dCdHmat.T, cols.reshape((batchSize * nPatches, patchSize)))
+    return N.asarray(dCdW.reshape(WShape), dtype=V.dtype)
+
+
+def computeR_gemm(W, b, d, H, RShape=None):
+    """Vectorized equivalent of ConvTransp3D.computeR"""
+    outputChannels, filterHeight, filterWidth, filterDur, inputChannels = \
+            W.shape
+    batchSize, outputHeight, outputWidth, outputDur, outputChannelsAgain = \
+            H.shape
+    if outputChannelsAgain != outputChannels:
+        raise ValueError("ConvTransp3DGemm: H has %i channels but W has "
+                         "%i output channels" % (outputChannelsAgain,
+                                                 outputChannels))
+    if b.shape[0] != inputChannels:
+        raise ValueError("ConvTransp3DGemm: b has %i elements but W has "
+                         "%i input channels" % (b.shape[0], inputChannels))
+    dr, dc, dt = d
+
+    videoHeight = (outputHeight - 1) * dr + filterHeight
+    videoWidth = (outputWidth - 1) * dc + filterWidth
+    videoDur = (outputDur - 1) * dt + filterDur
+    if RShape is not None and RShape[0] != -1:
+        if (RShape[0] < videoHeight or RShape[1] < videoWidth or
+                RShape[2] < videoDur):
+            raise ValueError("ConvTransp3DGemm: RShape %s is smaller than "
+                             "the minimal video shape %s" %
+                             (tuple(RShape),
+                              (videoHeight, videoWidth, videoDur)))
+        videoHeight, videoWidth, videoDur = [int(s) for s in RShape]
+
+    R = N.empty((batchSize, videoHeight, videoWidth, videoDur,
+                 inputChannels), dtype=H.dtype)
+    R[...] = b
+
+    # cols[i, r, c, t, k, l, m, z] is the contribution of output location
+    # (r, c, t) to R[i, r * dr + k, c * dc + l, t * dt + m, z]
+    cols = N.dot(H.reshape((-1, outputChannels)),
+                 W.reshape((outputChannels, -1)))
+    cols = cols.reshape((batchSize, outputHeight, outputWidth, outputDur,
+                         filterHeight, filterWidth, filterDur, inputChannels))
+    for k in xrange(filterHeight):
+        for l in xrange(filterWidth):
+            for m in xrange(filterDur):
+                R[:, k:k + dr * (outputHeight - 1) + 1:dr,
+                     l:l + dc * (outputWidth - 1) + 1:dc,
+                     m:m + dt * (outputDur - 1) + 1:dt, :] += \
+                        cols[:, :, :, :, k, l, m, :]
+    return R
+
+
+class GemmConv3DMixin(object):
+    """Compilation settings shared by the GEMM-based 3D convolution ops.
+
+    :param openmp: parallelize the loop over the minibatch with OpenMP.
+        By default, the value of config.openmp.
+
+    :note: config.openmp is defined after theano.tensor is imported, so
+        we do not build module-level instances of these ops.
+    """
+    def __init__(self, openmp=None):
+        if openmp is None:
+            openmp = config.openmp
+        self.openmp = openmp
+
+    def __eq__(self, other):
+        return type(self) == type(other) and self.openmp == other.openmp
+
+    def __hash__(self):
+        return hash(type(self)) ^ hash(self.openmp)
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    def c_headers(self):
+        if self.openmp:
+            return ['<omp.h>']
+        return []
+
+    def c_support_code(self):
+        return blas_header_text()
+
+    def c_libraries(self):
+        return ldflags()
+
+    def c_compile_args(self):
+        flags = list(ldflags(libs=False, flags=True))
+        if self.openmp:
+            flags.append('-fopenmp')
+        return flags
+
+    def c_lib_dirs(self):
+        return ldflags(libs=False, libs_dir=True)
+
+    def c_header_dirs(self):
+        return ldflags(libs=False, include_dir=True)
+
+    def c_code_cache_version(self):
+        return (1, self.openmp)
+
+    def _gemm_name(self, node):
+        dtype = node.outputs[0].dtype
+        for var in node.inputs:
+            if var.ndim == 5 and var.dtype != dtype:
+                raise MethodNotDefined('%s.c_code' % self.__class__.__name__)
+        if dtype == 'float64':
+            return 'dgemm_'
+        elif dtype == 'float32':
+            return 'sgemm_'
+        raise MethodNotDefined('%s.c_code' % self.__class__.__name__)
+
+    def c_code(self, node, nodename, inputs, outputs, sub):
+        if not config.blas.ldflags:
+            raise MethodNotDefined('%s.c_code' % self.__class__.__name__)
+        gemm = self._gemm_name(node)
+        return strutil.renderString(self.c_code_template, dict(
+            zip(self.c_input_names, inputs) + zip(self.c_output_names,
+                                                  outputs),
+            gemm=gemm, fail=sub['fail']))
+
+
+class Conv3DGemm(GemmConv3DMixin, Conv3D):
+    """ Conv3D computed as one GEMM per video on the lowered patches """
+
+    def perform(self, node, inputs, output_storage):
+        V, W, b, d = inputs
+        output_storage[0][0] = computeH_gemm(V, W, b, d)
+
+    c_input_names = ('V', 'W', 'b', 'd')
+    c_output_names = ('H',)
+    c_code_template = """
+{
+    if (%(V)s->nd != 5 || %(W)s->nd != 5)
+    {
+        PyErr_SetString(PyExc_ValueError,
+                        "Conv3DGemm: V and W must be 5 dimensional tensors");
+        %(fail)s
+    }
+    if (%(b)s->nd != 1)
+    {
+        PyErr_SetString(PyExc_ValueError, "Conv3DGemm: b must be a vector");
+        %(fail)s
+    }
+    if (%(d)s->nd != 1 || %(d)s->dimensions[0] != 3)
+    {
+        PyErr_SetString(PyExc_ValueError,
+                        "Conv3DGemm: d must be a vector of 3 strides");
+        %(fail)s
+    }
+
+    const int batchSize = %(V)s->dimensions[0];
+    const int vidHeight = %(V)s->dimensions[1];
+    const int vidWidth = %(V)s->dimensions[2];
+    const int vidDur = %(V)s->dimensions[3];
+    const int inputChannels = %(V)s->dimensions[4];
+    const int outputChannels = %(W)s->dimensions[0];
+    const int filterHeight = %(W)s->dimensions[1];
+    const int filterWidth = %(W)s->dimensions[2];
+    const int filterDur = %(W)s->dimensions[3];
+
+    if (%(W)s->dimensions[4] != inputChannels)
+    {
+        PyErr_Format(PyExc_ValueError,
+            "Conv3DGemm: W operates on a %%ld channel image but the image has %%d channels",
+            (long)%(W)s->dimensions[4], inputChannels);
+        %(fail)s
+    }
+    if (%(b)s->dimensions[0] != outputChannels)
+    {
+        PyErr_Format(PyExc_ValueError,
+            "Conv3DGemm: b adds to a(n) %%ld channel output image but the output has %%d channels",
+            (long)%(b)s->dimensions[0], outputChannels);
+        %(fail)s
+    }
+    if (vidHeight < filterHeight || vidWidth < filterWidth || vidDur < filterDur)
+    {
+        PyErr_Format(PyExc_ValueError,
+            "Conv3DGemm: W has shape (%%d,%%d,%%d) but V is only (%%d,%%d,%%d)",
+            filterHeight, filterWidth, filterDur, vidHeight, vidWidth, vidDur);
+        %(fail)s
+    }
+
+    const int dr = *(dtype_%(d)s*) PyArray_GETPTR1(%(d)s, 0);
+    const int dc = *(dtype_%(d)s*) PyArray_GETPTR1(%(d)s, 1);
+    const int dt = *(dtype_%(d)s*) PyArray_GETPTR1(%(d)s, 2);
+    if (dr <= 0 || dc <= 0 || dt <= 0)
+    {
+        PyErr_Format(PyExc_ValueError,
+            "Conv3DGemm: Strides must all be positive but are %%i, %%i, %%i",
+            dr, dc, dt);
+        %(fail)s
+    }
+
+    const int outputHeight = (vidHeight - filterHeight) / dr + 1;
+    const int outputWidth = (vidWidth - filterWidth) / dc + 1;
+    const int outputDur = (vidDur - filterDur) / dt + 1;
+    const int nPatches = outputHeight * outputWidth * outputDur;
+    const int patchSize = filterHeight * filterWidth * filterDur * inputChannels;
+    const int run = filterDur * inputChannels;
+
+    npy_intp dims[5];
+    dims[0] = batchSize;
+    dims[1] = outputHeight;
+    dims[2] = outputWidth;
+    dims[3] = outputDur;
+    dims[4] = outputChannels;
+
+    if (!(%(H)s) || !PyArray_ISCONTIGUOUS(%(H)s)
+        || %(H)s->dimensions[0] != dims[0]
+        || %(H)s->dimensions[1] != dims[1]
+        || %(H)s->dimensions[2] != dims[2]
+        || %(H)s->dimensions[3] != dims[3]
+        || %(H)s->dimensions[4] != dims[4])
+    {
+        Py_XDECREF(%(H)s);
+        %(H)s = (PyArrayObject *) PyArray_SimpleNew(5, dims, type_num_%(V)s);
+        if (!(%(H)s))
+        {
+            PyErr_SetString(PyExc_MemoryError,
+                            "Conv3DGemm: Could not allocate output.");
+            %(fail)s
+        }
+    }
+
+    PyArrayObject * Vc = PyArray_GETCONTIGUOUS(%(V)s);
+    PyArrayObject * Wc = PyArray_GETCONTIGUOUS(%(W)s);
+    if (!Vc || !Wc)
+    {
+        Py_XDECREF(Vc);
+        Py_XDECREF(Wc);
+        %(fail)s
+    }
+
+    const dtype_%(H)s * Vdata = (dtype_%(H)s *) Vc->data;
+    const dtype_%(H)s * Wdata = (dtype_%(H)s *) Wc->data;
+    dtype_%(H)s * Hdata = (dtype_%(H)s *) %(H)s->data;
+    const npy_intp vs3 = inputChannels;
+    const npy_intp vs2 = vs3 * vidDur;
+    const npy_intp vs1 = vs2 * vidWidth;
+    const npy_intp vs0 = vs1 * vidHeight;
+    const npy_intp hs0 = (npy_intp) nPatches * outputChannels;
+    const npy_intp bs = %(b)s->strides[0];
+    int err = 0;
+
+    #pragma omp parallel for schedule(static) if(batchSize > 1)
+    for (int i = 0; i < batchSize; ++i)
+    {
+        dtype_%(H)s * Hi = Hdata + i * hs0;
+        // H[i, r, c, t, :] = b
+        for (int p = 0; p < nPatches; ++p)
+            for (int j = 0; j < outputChannels; ++j)
+                Hi[p * outputChannels + j] = (dtype_%(H)s)
+                    *(dtype_%(b)s *)(%(b)s->data + j * bs);
+        if (outputChannels == 0 || patchSize == 0)
+            continue;
+
+        dtype_%(H)s * col = (dtype_%(H)s *) malloc(
+            sizeof(dtype_%(H)s) * (size_t) nPatches * patchSize);
+        if (!col)
+        {
+            #pragma omp atomic
+            err += 1;
+            continue;
+        }
+        // Lower the patches of video i into col (nPatches x patchSize).
+        // For a fixed (k, l), V[i, dr*r+k, dc*c+l, dt*t:dt*t+filterDur, :]
+        // is contiguous, so we copy it in one run.
+        dtype_%(H)s * colp = col;
+        for (int r = 0; r < outputHeight; ++r)
+          for (int c = 0; c < outputWidth; ++c)
+            for (int t = 0; t < outputDur; ++t)
+              for (int k = 0; k < filterHeight; ++k)
+                for (int l = 0; l < filterWidth; ++l)
+                {
+                    memcpy(colp,
+                           Vdata + i * vs0 + (r * dr + k) * vs1
+                           + (c * dc + l) * vs2 + t * dt * vs3,
+                           sizeof(dtype_%(H)s) * run);
+                    colp += run;
+                }
+
+        // H_i (nPatches x outputChannels) += col . W.T
+        // In fortran order: H_i' = W' . col'
+        char transW = 'T';
+        char transC = 'N';
+        const dtype_%(H)s one = 1.0;
+        %(gemm)s(&transW, &transC, &outputChannels, &nPatches, &patchSize,
+                 &one, Wdata, &patchSize, col, &patchSize,
+                 &one, Hi, &outputChannels);
+        free(col);
+    }
+
+    Py_DECREF(Vc);
+    Py_DECREF(Wc);
+    if (err)
+    {
+        PyErr_SetString(PyExc_MemoryError,
+                        "Conv3DGemm: Could not allocate the patch matrix.");
+        %(fail)s
+    }
+}
+"""
+
+
+class ConvGrad3DGemm(GemmConv3DMixin, ConvGrad3D):
+    """ ConvGrad3D computed as one GEMM per video on the lowered patches """
+
+    def perform(self, node, inputs, output_storage):
+        V, d, WShape, dCdH = inputs
+        output_storage[0][0] = computeGradW_gemm(V, d, WShape, dCdH)
+
+    c_input_names = ('V', 'd', 'WShape', 'dCdH')
+    c_output_names = ('dCdW',)
+    c_code_template = """
+{
+    if (%(V)s->nd != 5 || %(dCdH)s->nd != 5)
+    {
+        PyErr_SetString(PyExc_ValueError,
+            "ConvGrad3DGemm: V and dCdH must be 5 dimensional tensors");
+        %(fail)s
+    }
+    if (%(WShape)s->nd != 1 || %(WShape)s->dimensions[0] != 5)
+    {
+        PyErr_SetString(PyExc_ValueError,
+                        "ConvGrad3DGemm: WShape must specify a 5D shape");
+        %(fail)s
+    }
+    if (%(d)s->nd != 1 || %(d)s->dimensions[0] != 3)
+    {
+        PyErr_SetString(PyExc_ValueError,
+                        "ConvGrad3DGemm: d must be a vector of 3 strides");
+        %(fail)s
+    }
+
+    const int batchSize = %(V)s->dimensions[0];
+    const int vidHeight = %(V)s->dimensions[1];
+    const int vidWidth = %(V)s->dimensions[2];
+    const int vidDur = %(V)s->dimensions[3];
+    const int inputChannels = %(V)s->dimensions[4];
+    const int outputChannels = *(dtype_%(WShape)s*) PyArray_GETPTR1(%(WShape)s, 0);
+    const int filterHeight = *(dtype_%(WShape)s*) PyArray_GETPTR1(%(WShape)s, 1);
+    const int filterWidth = *(dtype_%(WShape)s*) PyArray_GETPTR1(%(WShape)s, 2);
+    const int filterDur = *(dtype_%(WShape)s*) PyArray_GETPTR1(%(WShape)s, 3);
+
+    if (*(dtype_%(WShape)s*) PyArray_GETPTR1(%(WShape)s, 4) != inputChannels)
+    {
+        PyErr_Format(PyExc_ValueError,
+            "ConvGrad3DGemm: W operates on a %%ld channel image but the image has %%d channels",
+            (long) *(dtype_%(WShape)s*) PyArray_GETPTR1(%(WShape)s, 4),
+            inputChannels);
+        %(fail)s
+    }
+    if (vidHeight < filterHeight || vidWidth < filterWidth || vidDur < filterDur)
+    {
+        PyErr_Format(PyExc_ValueError,
+            "ConvGrad3DGemm: W has shape (%%d,%%d,%%d) but V is only (%%d,%%d,%%d)",
+            filterHeight, filterWidth, filterDur, vidHeight, vidWidth, vidDur);
+        %(fail)s
+    }
+
+    const int dr = *(dtype_%(d)s*) PyArray_GETPTR1(%(d)s, 0);
+    const int dc = *(dtype_%(d)s*) PyArray_GETPTR1(%(d)s, 1);
+    const int dt = *(dtype_%(d)s*) PyArray_GETPTR1(%(d)s, 2);
+    if (dr <= 0 || dc <= 0 || dt <= 0)
+    {
+        PyErr_Format(PyExc_ValueError,
+            "ConvGrad3DGemm: Strides must all be positive but are %%i, %%i, %%i",
+            dr, dc, dt);
+        %(fail)s
+    }
+
+    const int outputHeight = (vidHeight - filterHeight) / dr + 1;
+    const int outputWidth = (vidWidth - filterWidth) / dc + 1;
+    const int outputDur = (vidDur - filterDur) / dt + 1;
+    const int nPatches = outputHeight * outputWidth * outputDur;
+    const int patchSize = filterHeight * filterWidth * filterDur * inputChannels;
+    const int run = filterDur * inputChannels;
+
+    if (%(dCdH)s->dimensions[0] != batchSize
+        || %(dCdH)s->dimensions[1] != outputHeight
+        || %(dCdH)s->dimensions[2] != outputWidth
+        || %(dCdH)s->dimensions[3] != outputDur
+        || %(dCdH)s->dimensions[4] != outputChannels)
+    {
+        PyErr_Format(PyExc_ValueError,
+            "ConvGrad3DGemm: dCdH is the wrong size, expected (%%i,%%i,%%i,%%i,%%i), got (%%li,%%li,%%li,%%li,%%li)",
+            batchSize, outputHeight, outputWidth, outputDur, outputChannels,
+            (long)%(dCdH)s->dimensions[0], (long)%(dCdH)s->dimensions[1],
+            (long)%(dCdH)s->dimensions[2], (long)%(dCdH)s->dimensions[3],
+            (long)%(dCdH)s->dimensions[4]);
+        %(fail)s
+    }
+
+    npy_intp dims[5];
+    dims[0] = outputChannels;
+    dims[1] = filterHeight;
+    dims[2] = filterWidth;
+    dims[3] = filterDur;
+    dims[4] = inputChannels;
+
+    if (!(%(dCdW)s) || !PyArray_ISCONTIGUOUS(%(dCdW)s)
+        || %(dCdW)s->dimensions[0] != dims[0]
+        || %(dCdW)s->dimensions[1] != dims[1]
+        || %(dCdW)s->dimensions[2] != dims[2]
+        || %(dCdW)s->dimensions[3] != dims[3]
+        || %(dCdW)s->dimensions[4] != dims[4])
+    {
+        Py_XDECREF(%(dCdW)s);
+        %(dCdW)s = (PyArrayObject *) PyArray_SimpleNew(5, dims, type_num_%(V)s);
+        if (!(%(dCdW)s))
+        {
+            PyErr_SetString(PyExc_MemoryError,
+                            "ConvGrad3DGemm: Could not allocate dCdW");
+            %(fail)s
+        }
+    }
+
+    const npy_intp wsize = (npy_intp) outputChannels * patchSize;
+    dtype_%(dCdW)s * dWdata = (dtype_%(dCdW)s *) %(dCdW)s->data;
+    memset(dWdata, 0, sizeof(dtype_%(dCdW)s) * wsize);
+
+    if (wsize > 0 && nPatches > 0 && batchSize > 0)
+    {
+        PyArrayObject * Vc = PyArray_GETCONTIGUOUS(%(V)s);
+        PyArrayObject * dHc = PyArray_GETCONTIGUOUS(%(dCdH)s);
+        if (!Vc || !dHc)
+        {
+            Py_XDECREF(Vc);
+            Py_XDECREF(dHc);
+            %(fail)s
+        }
+
+        int nthreads = 1;
+    #ifdef _OPENMP
+        nthreads = omp_get_max_threads();
+        if (nthreads > batchSize)
+            nthreads = batchSize;
+    #endif
+        // One accumulator per thread, summed at the end, so that the
+        // parallel loop over the minibatch does not need any locking.
+        dtype_%(dCdW)s * acc = (dtype_%(dCdW)s *) calloc(
+            (size_t) nthreads * wsize, sizeof(dtype_%(dCdW)s));
+        if (!acc)
+        {
+            Py_DECREF(Vc);
+            Py_DECREF(dHc);
+            PyErr_SetString(PyExc_MemoryError,
+                            "ConvGrad3DGemm: Could not allocate accumulators");
+            %(fail)s
+        }
+
+        const dtype_%(dCdW)s * Vdata = (dtype_%(dCdW)s *) Vc->data;
+        const dtype_%(dCdW)s * dHdata = (dtype_%(dCdW)s *) dHc->data;
+        const npy_intp vs3 = inputChannels;
+        const npy_intp vs2 = vs3 * vidDur;
+        const npy_intp vs1 = vs2 * vidWidth;
+        const npy_intp vs0 = vs1 * vidHeight;
+        const npy_intp hs0 = (npy_intp) nPatches * outputChannels;
+        int err = 0;
+
+        #pragma omp parallel for schedule(static) num_threads(nthreads)
+        for (int i = 0; i < batchSize; ++i)
+        {
+            int tid = 0;
+    #ifdef _OPENMP
+            tid = omp_get_thread_num();
+    #endif
+            dtype_%(dCdW)s * col = (dtype_%(dCdW)s *) malloc(
+                sizeof(dtype_%(dCdW)s) * (size_t) nPatches * patchSize);
+            if (!col)
+            {
+                #pragma omp atomic
+                err += 1;
+                continue;
+            }
+            dtype_%(dCdW)s * colp = col;
+            for (int r = 0; r < outputHeight; ++r)
+              for (int c = 0; c < outputWidth; ++c)
+                for (int t = 0; t < outputDur; ++t)
+                  for (int k = 0; k < filterHeight; ++k)
+                    for (int l = 0; l < filterWidth; ++l)
+                    {
+                        memcpy(colp,
+                               Vdata + i * vs0 + (r * dr + k) * vs1
+                               + (c * dc + l) * vs2 + t * dt * vs3,
+                               sizeof(dtype_%(dCdW)s) * run);
+                        colp += run;
+                    }
+
+            // acc (outputChannels x patchSize) += dCdH_i.T . col
+            // In fortran order: acc' = col' . dCdH_i
+            char transC = 'N';
+            char transH = 'T';
+            const dtype_%(dCdW)s one = 1.0;
+            %(gemm)s(&transC, &transH, &patchSize, &outputChannels, &nPatches,
+                     &one, col, &patchSize, dHdata + i * hs0, &outputChannels,
+                     &one, acc + tid * wsize, &patchSize);
+            free(col);
+        }
+
+        for (int tid = 0; tid < nthreads; ++tid)
+            for (npy_intp w = 0; w < wsize; ++w)
+                dWdata[w] += acc[tid * wsize + w];
+
+        free(acc);
+        Py_DECREF(Vc);
+        Py_DECREF(dHc);
+        if (err)
+        {
+            PyErr_SetString(PyExc_MemoryError,
+                    "ConvGrad3DGemm: Could not allocate the patch matrix.");
+            %(fail)s
+        }
+    }
+}
+"""
+
+
+class ConvTransp3DGemm(GemmConv3DMixin, ConvTransp3D):
+    """ ConvTransp3D computed as one GEMM per video followed by a scatter of
+    the patches back into the video """
+
+    def perform(self, node, inputs, output_storage):
+        W, b, d, H, RShape = inputs
+        output_storage[0][0] = computeR_gemm(W, b, d, H, RShape)
+
+    c_input_names = ('W', 'b', 'd', 'H', 'RShape')
+    c_output_names = ('R',)
+    c_code_template = """
+{
+    if (%(W)s->nd != 5 || %(H)s->nd != 5)
+    {
+        PyErr_SetString(PyExc_ValueError,
+            "ConvTransp3DGemm: W and H must be 5 dimensional tensors");
+        %(fail)s
+    }
+    if (%(b)s->nd != 1)
+    {
+        PyErr_SetString(PyExc_ValueError,
+                        "ConvTransp3DGemm: b must be a vector");
+        %(fail)s
+    }
+    if (%(d)s->nd != 1 || %(d)s->dimensions[0] != 3)
+    {
+        PyErr_SetString(PyExc_ValueError,
+                        "ConvTransp3DGemm: d must be a vector of 3 strides");
+        %(fail)s
+    }
+    if (%(RShape)s->nd != 1 || %(RShape)s->dimensions[0] != 3)
+    {
+        PyErr_SetString(PyExc_ValueError,
+                        "ConvTransp3DGemm: RShape must be a vector of 3 sizes");
+        %(fail)s
+    }
+
+    const int outputChannels = %(W)s->dimensions[0];
+    const int filterHeight = %(W)s->dimensions[1];
+    const int filterWidth = %(W)s->dimensions[2];
+    const int filterDur = %(W)s->dimensions[3];
+    const int inputChannels = %(W)s->dimensions[4];
+    const int batchSize = %(H)s->dimensions[0];
+    const int outputHeight = %(H)s->dimensions[1];
+    const int outputWidth = %(H)s->dimensions[2];
+    const int outputDur = %(H)s->dimensions[3];
+
+    if (%(H)s->dimensions[4] != outputChannels)
+    {
+        PyErr_Format(PyExc_ValueError,
+            "ConvTransp3DGemm: W produces a %%d channel image but the image has %%ld channels",
+            outputChannels, (long)%(H)s->dimensions[4]);
+        %(fail)s
+    }
+    if (%(b)s->dimensions[0] != inputChannels)
+    {
+        PyErr_Format(PyExc_ValueError,
+            "ConvTransp3DGemm: b operates on a %%ld channel image but the image has %%d channels",
+            (long)%(b)s->dimensions[0], inputChannels);
+        %(fail)s
+    }
+
+    const int dr = *(dtype_%(d)s*) PyArray_GETPTR1(%(d)s, 0);
+    const int dc = *(dtype_%(d)s*) PyArray_GETPTR1(%(d)s, 1);
+    const int dt = *(dtype_%(d)s*) PyArray_GETPTR1(%(d)s, 2);
+    if (dr <= 0 || dc <= 0 || dt <= 0)
+    {
+        PyErr_Format(PyExc_ValueError,
+            "ConvTransp3DGemm: Strides must all be positive but are %%i, %%i, %%i",
+            dr, dc, dt);
+        %(fail)s
+    }
+
+    int videoHeight = (outputHeight - 1) * dr + filterHeight;
+    int videoWidth = (outputWidth - 1) * dc + filterWidth;
+    int videoDur = (outputDur - 1) * dt + filterDur;
+
+    if (*(dtype_%(RShape)s*) PyArray_GETPTR1(%(RShape)s, 0) != -1)
+    {
+        const int rh = *(dtype_%(RShape)s*) PyArray_GETPTR1(%(RShape)s, 0);
+        const int rw = *(dtype_%(RShape)s*) PyArray_GETPTR1(%(RShape)s, 1);
+        const int rd = *(dtype_%(RShape)s*) PyArray_GETPTR1(%(RShape)s, 2);
+        if (rh < videoHeight || rw < videoWidth || rd < videoDur)
+        {
+            PyErr_Format(PyExc_ValueError,
+                "ConvTransp3DGemm: RShape (%%d,%%d,%%d) is smaller than the minimal video shape (%%d,%%d,%%d)",
+                rh, rw, rd, videoHeight, videoWidth, videoDur);
+            %(fail)s
+        }
+        videoHeight = rh;
+        videoWidth = rw;
+        videoDur = rd;
+    }
+
+    const int nPatches = outputHeight * outputWidth * outputDur;
+    const int patchSize = filterHeight * filterWidth * filterDur * inputChannels;
+    const int run = filterDur * inputChannels;
+
+    npy_intp dims[5];
+    dims[0] = batchSize;
+    dims[1] = videoHeight;
+    dims[2] = videoWidth;
+    dims[3] = videoDur;
+    dims[4] = inputChannels;
+
+    if (!(%(R)s) || !PyArray_ISCONTIGUOUS(%(R)s)
+        || %(R)s->dimensions[0] != dims[0]
+        || %(R)s->dimensions[1] != dims[1]
+        || %(R)s->dimensions[2] != dims[2]
+        || %(R)s->dimensions[3] != dims[3]
+        || %(R)s->dimensions[4] != dims[4])
+    {
+        Py_XDECREF(%(R)s);
+        %(R)s = (PyArrayObject *) PyArray_SimpleNew(5, dims, type_num_%(H)s);
+        if (!(%(R)s))
+        {
+            PyErr_SetString(PyExc_MemoryError,
+                            "ConvTransp3DGemm: Could not allocate R");
+            %(fail)s
+        }
+    }
+
+    PyArrayObject * Wc = PyArray_GETCONTIGUOUS(%(W)s);
+    PyArrayObject * Hc = PyArray_GETCONTIGUOUS(%(H)s);
+    if (!Wc || !Hc)
+    {
+        Py_XDECREF(Wc);
+        Py_XDECREF(Hc);
+        %(fail)s
+    }
+
+    const dtype_%(R)s * Wdata = (dtype_%(R)s *) Wc->data;
+    const dtype_%(R)s * Hdata = (dtype_%(R)s *) Hc->data;
+    dtype_%(R)s * Rdata = (dtype_%(R)s *) %(R)s->data;
+    const npy_intp rs3 = inputChannels;
+    const npy_intp rs2 = rs3 * videoDur;
+    const npy_intp rs1 = rs2 * videoWidth;
+    const npy_intp rs0 = rs1 * videoHeight;
+    const npy_intp hs0 = (npy_intp) nPatches * outputChannels;
+    const npy_intp bs = %(b)s->strides[0];
+    int err = 0;
+
+    #pragma omp parallel for schedule(static) if(batchSize > 1)
+    for (int i = 0; i < batchSize; ++i)
+    {
+        dtype_%(R)s * Ri = Rdata + i * rs0;
+        // R[i, :, :, :, :] = b
+        for (npy_intp p = 0; p < rs0; p += inputChannels)
+            for (int z = 0; z < inputChannels; ++z)
+                Ri[p + z] = (dtype_%(R)s)
+                    *(dtype_%(b)s *)(%(b)s->data + z * bs);
+        if (outputChannels == 0 || patchSize == 0 || nPatches == 0)
+            continue;
+
+        dtype_%(R)s * col = (dtype_%(R)s *) malloc(
+            sizeof(dtype_%(R)s) * (size_t) nPatches * patchSize);
+        if (!col)
+        {
+            #pragma omp atomic
+            err += 1;
+            continue;
+        }
+
+        // col (nPatches x patchSize) = H_i . W
+        // In fortran order: col' = W' . H_i'
+        char transW = 'N';
+        char transH = 'N';
+        const dtype_%(R)s one = 1.0;
+        const dtype_%(R)s zero = 0.0;
+        %(gemm)s(&transW, &transH, &patchSize, &nPatches, &outputChannels,
+                 &one, Wdata, &patchSize, Hdata + i * hs0, &outputChannels,
+                 &zero, col, &patchSize);
+
+        // Scatter-add each patch back at its place in the video.
+        const dtype_%(R)s * colp = col;
+        for (int r = 0; r < outputHeight; ++r)
+          for (int c = 0; c < outputWidth; ++c)
+            for (int t = 0; t < outputDur; ++t)
+              for (int k = 0; k < filterHeight; ++k)
+                for (int l = 0; l < filterWidth; ++l)
+                {
+                    dtype_%(R)s * dst = Ri + (r * dr + k) * rs1
+                        + (c * dc + l) * rs2 + t * dt * rs3;
+                    for (int q = 0; q < run; ++q)
+                        dst[q] += colp[q];
+                    colp += run;
+                }
+        free(col);
+    }
+
+    Py_DECREF(Wc);
+    Py_DECREF(Hc);
+    if (err)
+    {
+        PyErr_SetString(PyExc_MemoryError,
+                "ConvTransp3DGemm: Could not allocate the patch matrix.");
+        %(fail)s
+    }
+}
+"""
+
+
+def _all_float_same_dtype(node):
+    dtype = node.outputs[0].dtype
+    if dtype not in ('float32', 'float64'):
+        return False
+    return all(var.dtype == dtype for var in node.inputs if var.ndim == 5)
+
+
+@local_optimizer([conv3D, convGrad3D, convTransp3D])
+def local_conv3d_gemm(node):
+    """Conv3D -> Conv3DGemm, ConvGrad3D -> ConvGrad3DGemm and
+    ConvTransp3D -> ConvTransp3DGemm when we can call BLAS.
+    """
+    if not config.blas.ldflags:
+        return
+    if type(node.op) not in (Conv3D, ConvGrad3D, ConvTransp3D):
+        return
+    if not _all_float_same_dtype(node):
+        return
+    if type(node.op) == Conv3D:
+        new_op = Conv3DGemm()
+    elif type(node.op) == ConvGrad3D:
+        new_op = ConvGrad3DGemm()
+    else:
+        new_op = ConvTransp3DGemm()
+    rval = new_op.make_node(*node.inputs).outputs[0]
+    if rval.type != node.outputs[0].type:
+        rval = T.patternbroadcast(rval, node.outputs[0].broadcastable)
+    return [rval]
+
+opt.register_specialize(local_conv3d_gemm, 'conv3d_gemm')
@@ -3,4 +3,5 @@ from conv import conv2d, ConvOp
 from Conv3D import *
 from ConvGrad3D import *
 from ConvTransp3D import *
+from Conv3DGemm import Conv3DGemm, ConvGrad3DGemm, ConvTransp3DGemm
 from sigm import softplus, sigmoid, sigmoid_inplace, scalar_sigmoid
@@ -21,17 +21,31 @@ from theano import Op, config
 from theano.gof import Apply
 from theano.gof.python25 import any
 
-imported_scipy_signal = False
-try:
-    # TODO: move these back out to global scope when they no longer cause an atexit error
-    from scipy.signal.signaltools import  _valfrommode, _bvalfromboundary
-    from scipy.signal.sigtools import _convolve2d
-    imported_scipy_signal = True
-except ImportError:
-    pass
-
 _logger=logging.getLogger("theano.tensor.nnet.conv")
 
+# (_valfrommode, _bvalfromboundary, _convolve2d) of scipy.signal, False if
+# they can't be imported, or None before the first call to _scipy_signal.
+_signal = None
+
+
+def _scipy_signal():
+    """Return the scipy.signal functions used by ConvOp.perform, or None if
+    scipy is not available.
+
+    Importing scipy is slow, so it is done the first time ConvOp.perform is
+    called rather than when Theano is imported.
+    """
+    global _signal
+    if _signal is None:
+        try:
+            from scipy.signal.signaltools import (_valfrommode,
+                                                  _bvalfromboundary)
+            from scipy.signal.sigtools import _convolve2d
+            _signal = (_valfrommode, _bvalfromboundary, _convolve2d)
+        except ImportError:
+            _signal = False
+    return _signal or None
+
 
 def conv2d(input, filters, image_shape=None, filter_shape=None,
                 border_mode='valid', subsample=(1,1), **kargs):
@@ -593,6 +607,24 @@ class ConvOp(Op):
             # we simply let the default function do its work.
             raise theano.tensor.ShapeError()
 
+    def cost(self, node, input_shapes, output_shapes, input_nnz=None):
+        # Like set_flops, but from the shapes of the values: a
+        # multiplication and an addition per kernel tap and output pixel in
+        # valid mode, per kernel tap and input pixel in full mode.
+        flops = None
+        imshp, kshp = input_shapes
+        outshp = output_shapes[0]
+        if imshp is not None and kshp is not None and outshp is not None:
+            bsize, stack = imshp[:2]
+            nkern = kshp[0]
+            flops = 2 * bsize * nkern * stack * kshp[2] * kshp[3]
+            if self.out_mode == 'valid':
+                flops *= outshp[2] * outshp[3]
+            else:
+                flops *= imshp[2] * imshp[3]
+                flops //= self.dx * self.dy
+        return (flops,) + theano.gof.op.default_cost_bytes(
+                node, input_shapes, output_shapes)
 
     def perform(self,node, inp, out):
         """
@@ -600,12 +632,13 @@ class ConvOp(Op):
         """
         img2d, filtersflipped = inp
         z, = out
-        if not imported_scipy_signal:
+        signal = _scipy_signal()
+        if signal is None:
             raise theano.gof.utils.MethodNotDefined(
                 "c_headers", type(self), self.__class__.__name__,
                 "Need the python package for scipy.signal to be installed for the python implementation. You can use the C implementation instead.")
 
-        # TODO: move these back out to global scope when they no longer cause an atexit error
+        _valfrommode, _bvalfromboundary, _convolve2d = signal
         imshp = self.imshp
         if imshp is None or any([x is None for x in imshp]):
             imshp = tuple(img2d.shape[1:])
@@ -709,6 +742,14 @@ class ConvOp(Op):
         z[0]=zz
 
 
+    def R_op(self, inputs, eval_points):
+        # The convolution is linear in the images and in the kernels.
+        if None in eval_points:
+            return [None]
+        images, kerns = inputs
+        eval_images, eval_kerns = eval_points
+        return [self(eval_images, kerns) + self(images, eval_kerns)]
+
     def grad(self, inp, grads):
         inputs, kerns = inp
         gz, = grads
@@ -81,6 +81,14 @@ class SoftmaxWithBias(gof.Op):
         db = tensor.sum(dx, axis=0)
         return dx, db
 
+    def R_op(self, inputs, eval_points):
+        # Like Softmax, the Jacobian wrt the row is symmetric.
+        if None in eval_points:
+            return [None]
+        x, b = inputs
+        ex, eb = eval_points
+        return [softmax_grad(ex + eb, softmax_with_bias(x, b))]
+
     def infer_shape(self, node, shape):
         return [shape[0]]
 
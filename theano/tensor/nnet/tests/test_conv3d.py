@@ -5,7 +5,10 @@ from theano import function, shared
 from theano.tests import unittest_tools as utt
 from theano.tensor.nnet.ConvTransp3D import convTransp3D, ConvTransp3D
 from theano.tensor.nnet.ConvGrad3D import convGrad3D, ConvGrad3D
-from theano.tensor.nnet.Conv3D import conv3D, Conv3D
+from theano.tensor.nnet.Conv3D import conv3D, Conv3D, computeH
+from theano.tensor.nnet.ConvTransp3D import computeR
+from theano.tensor.nnet.Conv3DGemm import (Conv3DGemm, ConvGrad3DGemm,
+        ConvTransp3DGemm, computeH_gemm, computeGradW_gemm, computeR_gemm)
 import numpy as N
 import copy
 import theano.sparse
@@ -493,6 +496,89 @@ class TestConv3D(utt.InferShapeTester):
                                         [0.0], n_tests=testsPerDir)
 
 
+class TestConv3DGemm(unittest.TestCase):
+    def setUp(self):
+        utt.seed_rng()
+        self.rng = N.random.RandomState(utt.fetch_seed())
+        self.tol = 1e-5
+        if floatX == 'float32':
+            self.tol = 1e-4
+
+    def random_tensor(self, *dims):
+        return N.asarray(self.rng.uniform(-.05, .05, dims), dtype=floatX)
+
+    def random_problem(self):
+        d = self.rng.randint(1, 4, size=3)
+        filter_shape = self.rng.randint(1, 4, size=3)
+        out_shape = self.rng.randint(1, 4, size=3)
+        vid_shape = (out_shape - 1) * d + filter_shape + \
+                self.rng.randint(0, 3, size=3)
+        batchSize = self.rng.randint(1, 4)
+        inputChannels = self.rng.randint(1, 4)
+        numFilters = self.rng.randint(1, 4)
+        V = self.random_tensor(batchSize, *(list(vid_shape) +
+                                            [inputChannels]))
+        W = self.random_tensor(numFilters, *(list(filter_shape) +
+                                             [inputChannels]))
+        b = self.random_tensor(numFilters)
+        rb = self.random_tensor(inputChannels)
+        return V, W, b, rb, d
+
+    def grad_w_loops(self, V, d, WShape, dCdH):
+        out = [[None]]
+        convGrad3D.perform(None, [V, d, WShape, dCdH], out)
+        return out[0][0]
+
+    def test_python_against_loops(self):
+        for i in xrange(3):
+            V, W, b, rb, d = self.random_problem()
+            H = computeH(V, W, b, d)
+            assert N.allclose(H, computeH_gemm(V, W, b, d), atol=self.tol)
+
+            dCdH = self.random_tensor(*H.shape)
+            R = computeR(W, rb, d, dCdH, V.shape[1:4])
+            assert N.allclose(R, computeR_gemm(W, rb, d, dCdH, V.shape[1:4]),
+                              atol=self.tol)
+
+            assert N.allclose(self.grad_w_loops(V, d, W.shape, dCdH),
+                              computeGradW_gemm(V, d, W.shape, dCdH),
+                              atol=self.tol)
+
+    def test_c_against_python(self):
+        if not theano.config.blas.ldflags:
+            raise SkipTest('No BLAS library to link the Gemm 3D ops with')
+        mode = theano.compile.mode.get_default_mode().including('fast_run')
+        Vt = T.TensorType(floatX, (False,) * 5)()
+        Wt = T.TensorType(floatX, (False,) * 5)()
+        dCdHt = T.TensorType(floatX, (False,) * 5)()
+        bt = T.vector(dtype=floatX)
+        dt = T.ivector()
+        RShape = T.ivector()
+
+        f = function([Vt, Wt, bt, dt], conv3D(Vt, Wt, bt, dt), mode=mode)
+        g = function([Wt, bt, dt, dCdHt, RShape],
+                     convTransp3D(Wt, bt, dt, dCdHt, RShape), mode=mode)
+        h = function([Vt, Wt, dt, dCdHt],
+                     convGrad3D(Vt, dt, Wt.shape, dCdHt), mode=mode)
+        for fn, op in ((f, Conv3DGemm), (g, ConvTransp3DGemm),
+                       (h, ConvGrad3DGemm)):
+            assert any(isinstance(node.op, op)
+                       for node in fn.maker.fgraph.toposort())
+
+        for i in xrange(3):
+            V, W, b, rb, d = self.random_problem()
+            d = N.asarray(d, dtype='int32')
+            H = f(V, W, b, d)
+            assert N.allclose(H, computeH(V, W, b, d), atol=self.tol)
+
+            dCdH = self.random_tensor(*H.shape)
+            RS = N.asarray(V.shape[1:4], dtype='int32')
+            assert N.allclose(g(W, rb, d, dCdH, RS),
+                              computeR(W, rb, d, dCdH, RS), atol=self.tol)
+            assert N.allclose(h(V, W, d, dCdH),
+                              self.grad_w_loops(V, d, W.shape, dCdH),
+                              atol=self.tol)
+
 if __name__ == '__main__':
 
     t = TestConv3D('setUp')
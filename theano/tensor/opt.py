@@ -1979,6 +1979,80 @@ def local_IncSubtensor_serialize(node):
         #print incsub_inputs, [id(i.owner.inputs[0]) for i in incsub_inputs]
 
 
+@register_canonicalize
+@gof.local_optimizer([None])
+def local_advanced_inc_subtensor1_of_zeros(node):
+    """
+    Move the update of a matrix by the gradient of some of its rows into
+    the AdvancedIncSubtensor1 of that gradient.
+
+    The gradient of W[idx] is AdvancedIncSubtensor1(zeros_like(W), g, idx).
+    A step of SGD, W - lr * grad, then builds and scales a matrix the size
+    of W to change a few rows. This does:
+
+        mul(c, inc(zeros, y, idx)) -> inc(zeros, c * y, idx)
+        neg(inc(zeros, y, idx)) -> inc(zeros, -y, idx)
+        sub(x, inc(zeros, y, idx)) -> inc(x, -y, idx)
+        add(x, inc(zeros, y, idx)) -> inc(x, y, idx)
+
+    where c are scalars (broadcastable in all dimensions). The increment
+    is then done inplace by local_inplace_incsubtensor1 when possible, so
+    only the rows in idx are touched.
+    """
+    if not isinstance(node.op, Elemwise) or len(node.outputs) != 1:
+        return False
+    if node.op.scalar_op not in (scalar.mul, scalar.neg, scalar.sub,
+                                 scalar.add):
+        return False
+    o_type = node.outputs[0].type
+
+    def inc_of_zeros(i):
+        # Return True iff `i` is an increment of zeros that only this node
+        # uses.
+        if not (i.owner and
+                i.owner.op.__class__ is T.AdvancedIncSubtensor1 and
+                not i.owner.op.set_instead_of_inc and
+                i.type == o_type and
+                len(i.clients) == 1):
+            return False
+        try:
+            return get_constant_value(i.owner.inputs[0]) == 0
+        except TypeError:
+            return False
+
+    incs = [i for i in node.inputs if inc_of_zeros(i)]
+    if len(incs) != 1:
+        return False
+    inc = incs[0]
+    zeros, y, idx = inc.owner.inputs
+    others = [i for i in node.inputs if i is not inc]
+
+    if node.op.scalar_op == scalar.mul:
+        if not all(numpy.all(i.broadcastable) for i in others):
+            return False
+        new_y = T.mul(*([i.dimshuffle() for i in others] + [y]))
+        base = zeros
+    elif node.op.scalar_op == scalar.neg:
+        new_y = -y
+        base = zeros
+    elif node.op.scalar_op == scalar.sub:
+        if node.inputs[1] is not inc:
+            return False
+        new_y = -y
+        base = node.inputs[0]
+    else:
+        new_y = y
+        if len(others) == 1:
+            base = others[0]
+        else:
+            base = T.add(*others)
+    if base.type != o_type:
+        return False
+    if new_y.type.dtype != o_type.dtype:
+        new_y = T.cast(new_y, o_type.dtype)
+    return [inc.owner.op(base, new_y, idx)]
+
+
 #after priority 50 Destructive inplace operations
 #gemm is the first one now, at priority 70
 
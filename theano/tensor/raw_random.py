@@ -1,7 +1,6 @@
 """Define random number Type (`RandomStateType`) and Op (`RandomFunction`)."""
 __docformat__ = "restructuredtext en"
 import sys
-from copy import copy
 
 import numpy
 
@@ -63,6 +62,33 @@ theano.compile.mode.register_OutputGuard_c_code(RandomStateType)
 random_state_type = RandomStateType()
 
 
+def copy_random_state(r):
+    """Return a copy of the numpy.RandomState `r`.
+
+    copy.copy goes through pickling, which seeds a new RandomState from
+    the OS entropy pool before overwriting its state. Seeding it with a
+    constant is much cheaper.
+    """
+    rval = numpy.random.RandomState(0)
+    rval.set_state(r.get_state())
+    return rval
+
+
+def _broadcast_to(a, shape, name):
+    """Return `a` broadcasted to `shape`, or raise a ValueError.
+
+    `a` must have the same number of dimensions as `shape`, each of them
+    being 1 or equal to the one of `shape`.
+    """
+    rval = numpy.empty(shape, dtype=a.dtype)
+    try:
+        rval[...] = a
+    except ValueError:
+        raise ValueError('%s.shape %s can not be broadcasted to %s'
+                         % (name, a.shape, shape))
+    return rval
+
+
 class RandomFunction(gof.Op):
     """Op that draws random numbers from a numpy.RandomState object
 
@@ -213,7 +239,7 @@ class RandomFunction(gof.Op):
                              ' len(shape) (%i) + self.ndim_added (%i)'
                             % (self.outtype.ndim, len(shape), self.ndim_added))
         if not self.inplace:
-            r = copy(r)
+            r = copy_random_state(r)
         rout[0] = r
         rval = self.fn(r, *(args + [shape]))
         if not isinstance(rval, numpy.ndarray) \
@@ -369,52 +395,6 @@ def _infer_ndim_bcast(ndim, shape, *args):
     return ndim, tensor.cast(v_shape, 'int32'), tuple(bcast)
 
 
-def _generate_broadcasting_indices(out_shape, *shapes):
-    '''
-    Return indices over each shape that broadcast them to match out_shape.
-
-    The first returned list is equivalent to numpy.ndindex(out_shape),
-    the other returned lists are indices corresponding to the other shapes,
-    such that looping over these indices produce tensors of shape out_shape.
-    In particular, the indices over broadcasted dimensions should all be 0.
-
-    The shapes should have the same length as out_shape. If they are longer,
-    the right-most dimensions are ignored.
-    '''
-    all_shapes = (out_shape,) + shapes
-    # Will contain the return value: a list of indices for each argument
-    ret_indices = [[()] for shape in all_shapes]
-
-    for dim in xrange(len(out_shape)):
-        # Temporary list to generate the indices
-        _ret_indices = [[] for shape in all_shapes]
-
-        out_range = range(out_shape[dim])
-
-        # Verify the shapes are compatible along that dimension
-        # and generate the appropriate range: out_range, or [0, ..., 0]
-        ranges = [out_range]
-        for shape in shapes:
-            if shape[dim] == out_shape[dim]:
-                ranges.append(out_range)
-            elif shape[dim] == 1:  # broadcast
-                ranges.append([0] * out_shape[dim])
-            else:
-                raise ValueError(
-                    'shape[%i] (%i) should be equal to out_shape[%i] (%i) or'
-                    ' to 1'
-                    % (dim, shape[dim], dim, out_shape[dim]), shape,
-                    out_shape, shapes)
-
-        for prev_index in zip(*ret_indices):
-            for dim_index in zip(*ranges):
-                for i in xrange(len(all_shapes)):
-                    _ret_indices[i].append(prev_index[i] + (dim_index[i],))
-        ret_indices = _ret_indices
-
-    return ret_indices
-
-
 def uniform(random_state, size=None, low=0.0, high=1.0, ndim=None, dtype=None):
     """
     Sample from a uniform distribution between low and high.
@@ -528,13 +508,18 @@ def random_integers_helper(random_state, low, high, size):
             dim_len = max(low.shape[dim], high.shape[dim])
             out_size = out_size + (dim_len,)
 
-    # Build the indices over which to loop
-    out = numpy.ndarray(out_size)
-    broadcast_ind = _generate_broadcasting_indices(out_size, low.shape,
-                                                   high.shape)
-    # Iterate over these indices, drawing one sample at a time from numpy
-    for oi, li, hi in zip(*broadcast_ind):
-        out[oi] = random_state.random_integers(low=low[li], high=high[hi])
+    if low.size == 1 and high.size == 1:
+        # numpy draws the samples in the same order as the loop below.
+        return random_state.random_integers(low=low.item(),
+                                            high=high.item(), size=out_size)
+
+    low = _broadcast_to(low, out_size, 'low').reshape(-1)
+    high = _broadcast_to(high, out_size, 'high').reshape(-1)
+    out = numpy.empty(out_size, dtype='int64')
+    out_flat = out.reshape(-1)
+    # Draw one sample at a time from numpy, as each one has its own range
+    for i in xrange(out_flat.shape[0]):
+        out_flat[i] = random_state.random_integers(low=low[i], high=high[i])
 
     return out
 
@@ -579,13 +564,14 @@ def permutation_helper(random_state, n, shape):
     if shape is None:
         # Draw only one permutation, equivalent to shape = ()
         shape = ()
-    out_shape = list(shape)
-    out_shape.append(n)
-    out = numpy.zeros(out_shape, int)
-    for i in numpy.ndindex(*shape):
-        out[i] = random_state.permutation(n)
-
-    #print 'RETURNING', out.shape
+    out_shape = tuple(shape) + (n,)
+    # random_state.permutation(n) shuffles arange(n): shuffling the rows
+    # inplace draws the same numbers without allocating each one.
+    out = numpy.empty(out_shape, dtype='int64')
+    out[...] = numpy.arange(n)
+    if n > 1:
+        for row in out.reshape(-1, n):
+            random_state.shuffle(row)
     return out
 
 
@@ -653,36 +639,46 @@ def multinomial_helper(random_state, n, pvals, size):
             size = size + (dim_len,)
     out_size = size + (pvals.shape[-1],)
 
-    # Build the indices over which to loop
-    # Note that here, the rows (inner-most 1D subtensors) of pvals and out
-    # are indexed, not their individual elements
-    out = numpy.ndarray(out_size)
-    broadcast_ind = _generate_broadcasting_indices(size, n.shape,
-                                                   pvals.shape[:-1])
-    # Iterate over these indices, drawing from one multinomial at a
-    # time from numpy
+    # This might someday be fixed upstream
+    # Currently numpy raises an exception in this method if the sum
+    # of probabilities meets or exceeds 1.0.
+    # In  perfect arithmetic this would be correct, but in float32 or
+    # float64 it is too strict.
+    # So we correct the rows that went a little over, because mtrand.pyx
+    # has a ValueError that will trigger if sum(pvals[:-1]) > 1.0, and
+    # those whose last probability is tiny.
     assert pvals.min() >= 0
-    for mi, ni, pi in zip(*broadcast_ind):
-        pvi = pvals[pi]
-
-        # This might someday be fixed upstream
-        # Currently numpy raises an exception in this method if the sum
-        # of probabilities meets or exceeds 1.0.
-        # In  perfect arithmetic this would be correct, but in float32 or
-        # float64 it is too strict.
-        pisum = numpy.sum(pvi)
-        if 1.0 < pisum < 1.0 + 1e-5:  # correct if we went a little over
-            # because mtrand.pyx has a ValueError that will trigger if
-            # sum(pvals[:-1]) > 1.0
-            pvi = pvi * (1.0 - 5e-5)
-            #pvi = pvi * .9
-            pisum = numpy.sum(pvi)
-        elif pvi[-1] < 5e-5:  # will this even work?
-            pvi = pvi * (1.0 - 5e-5)
-            pisum = numpy.sum(pvi)
-        assert pisum <= 1.0, pisum
-        out[mi] = random_state.multinomial(n=n[ni],
-                                           pvals=pvi.astype('float64'))
+    if pvals.dtype.kind != 'f':
+        pvals = pvals.astype('float64')
+    pisum = pvals.sum(axis=-1)
+    fix = ((1.0 < pisum) & (pisum < 1.0 + 1e-5)) | (pvals[..., -1] < 5e-5)
+    if fix.any():
+        # Scale in the dtype of pvals, like pvals * (1.0 - 5e-5) would.
+        scale = numpy.where(fix, 1.0 - 5e-5, 1.0).astype(pvals.dtype)
+        pvals = pvals * scale[..., None]
+        pisum = pvals.sum(axis=-1)
+    assert numpy.all(pisum <= 1.0), pisum.max()
+    pvals = pvals.astype('float64')
+
+    if n.size == 1 and pvals.size == pvals.shape[-1]:
+        # One distribution: numpy draws the rows in the same order as the
+        # loop below.
+        if size == ():
+            return random_state.multinomial(n=n.item(),
+                                            pvals=pvals.reshape(-1))
+        return random_state.multinomial(n=n.item(), pvals=pvals.reshape(-1),
+                                        size=size)
+
+    # Draw from one multinomial at a time from numpy. Here, the rows
+    # (inner-most 1D subtensors) of pvals and out are indexed, not their
+    # individual elements.
+    n = _broadcast_to(n, size, 'n').reshape(-1)
+    pvals = _broadcast_to(pvals, out_size, 'pvals').reshape(
+            -1, out_size[-1])
+    out = numpy.empty(out_size, dtype='int64')
+    out_rows = out.reshape(-1, out_size[-1])
+    for i in xrange(out_rows.shape[0]):
+        out_rows[i] = random_state.multinomial(n=n[i], pvals=pvals[i])
     return out
 
 
@@ -58,10 +58,13 @@ class RandomStreams(raw_random.RandomStreamsBase):
     """numpy.RandomState instance that gen() uses to seed new streams.
     """
 
+    worker_id = 0
+    num_workers = 1
+
     def updates(self):
         return list(self.state_updates)
 
-    def __init__(self, seed=None):
+    def __init__(self, seed=None, worker_id=0, num_workers=1):
         """
         :type seed: None or int
 
@@ -69,12 +72,32 @@ class RandomStreams(raw_random.RandomStreamsBase):
         instances after build.  See `RandomStreamsInstance.__init__`
         for more details.
 
+        :param worker_id, num_workers: when `num_workers` processes use
+        the same seed, give each one a different `worker_id` between 0
+        and `num_workers` - 1. The seed generator draws `num_workers`
+        seeds for each random variable and worker `worker_id` uses the
+        one at its index, so the workers never use the same seed for
+        one variable. With the default values, the seeds are the same
+        as without workers.
+
         """
         super(RandomStreams, self).__init__()
+        if num_workers < 1 or not 0 <= worker_id < num_workers:
+            raise ValueError('worker_id should be between 0 and'
+                             ' num_workers - 1', worker_id, num_workers)
         self.state_updates = []
         self.default_instance_seed = seed
+        self.worker_id = worker_id
+        self.num_workers = num_workers
         self.gen_seedgen = numpy.random.RandomState(seed)
 
+    def _next_seed(self, seedgen):
+        """Return the seed of this worker for the next stream"""
+        if self.num_workers == 1:
+            return int(seedgen.randint(2 ** 30))
+        seeds = seedgen.randint(2 ** 30, size=self.num_workers)
+        return int(seeds[self.worker_id])
+
     def seed(self, seed=None):
         """Re-initialize each random stream
 
@@ -91,8 +114,8 @@ class RandomStreams(raw_random.RandomStreamsBase):
 
         seedgen = numpy.random.RandomState(seed)
         for old_r, new_r in self.state_updates:
-            old_r_seed = seedgen.randint(2 ** 30)
-            old_r.set_value(numpy.random.RandomState(int(old_r_seed)),
+            old_r_seed = self._next_seed(seedgen)
+            old_r.set_value(numpy.random.RandomState(old_r_seed),
                     borrow=True)
 
     def __getitem__(self, item):
@@ -146,7 +169,7 @@ class RandomStreams(raw_random.RandomStreamsBase):
         :rtype: TensorVariable
 
         """
-        seed = int(self.gen_seedgen.randint(2 ** 30))
+        seed = self._next_seed(self.gen_seedgen)
         random_state_variable = shared(numpy.random.RandomState(seed))
         new_r, out = op(random_state_variable, *args, **kwargs)
         out.rng = random_state_variable
@@ -6,6 +6,23 @@ from theano.tensor import tensor
 from basic import mul
 
 
+_c_sort_kinds = {'quicksort': 'NPY_QUICKSORT',
+                 'mergesort': 'NPY_MERGESORT',
+                 'heapsort': 'NPY_HEAPSORT'}
+
+
+def _c_axis_code(node, axis):
+    """Return the C expression of the sort axis of `node`.
+
+    The axis is NPY_MAXDIMS when it is None, for which numpy sorts the
+    flattened array.
+    """
+    if isinstance(node.inputs[1], theano.Constant) and \
+            node.inputs[1].data is None:
+        return 'NPY_MAXDIMS'
+    return '(int)((dtype_%(axis)s*)%(axis)s->data)[0]' % dict(axis=axis)
+
+
 class SortOp(theano.Op):
     """
     This class is a wrapper for numpy sort function
@@ -42,6 +59,51 @@ class SortOp(theano.Op):
         z = output_storage[0]
         z[0] = np.sort(a, axis, self.kind, self.order)
 
+    def c_code_cache_version(self):
+        return (1,)
+
+    def c_code(self, node, name, inputs, outputs, sub):
+        a, axis = inputs
+        z, = outputs
+        fail = sub['fail']
+        if self.order or self.kind not in _c_sort_kinds:
+            return theano.Op.c_code(self, node, name, inputs, outputs, sub)
+        kind = _c_sort_kinds[self.kind]
+        axis = _c_axis_code(node, axis)
+        return """
+        {
+        // Sort a copy of a in place, like numpy.sort.
+        int axis = %(axis)s;
+        PyArrayObject* a = %(a)s;
+        if (axis == NPY_MAXDIMS)
+        {
+            a = (PyArrayObject*)PyArray_Ravel(%(a)s, NPY_CORDER);
+            if (!a)
+                %(fail)s;
+            axis = 0;
+        }
+        else
+            Py_INCREF(a);
+        bool alloc = (%(z)s == NULL) || (%(z)s->nd != a->nd);
+        for (int i = 0; !alloc && i < a->nd; ++i)
+            alloc = (%(z)s->dimensions[i] != a->dimensions[i]);
+        if (alloc)
+        {
+            Py_XDECREF(%(z)s);
+            %(z)s = (PyArrayObject*)PyArray_EMPTY(a->nd, a->dimensions,
+                                                  type_num_%(a)s, 0);
+        }
+        if (!%(z)s || PyArray_CopyInto(%(z)s, a))
+        {
+            Py_DECREF(a);
+            %(fail)s;
+        }
+        Py_DECREF(a);
+        if (PyArray_Sort(%(z)s, axis, %(kind)s))
+            %(fail)s;
+        }
+        """ % locals()
+
     def infer_shape(self, node, inputs_shapes):
         if (isinstance(node.inputs[1], theano.Constant) and
             node.inputs[1].data is None):
@@ -130,6 +192,38 @@ class ArgSortOp(theano.Op):
         z = output_storage[0]
         z[0] = np.argsort(a, axis, self.kind, self.order)
 
+    def c_code_cache_version(self):
+        return (1,)
+
+    def c_code(self, node, name, inputs, outputs, sub):
+        a, axis = inputs
+        z, = outputs
+        fail = sub['fail']
+        if self.order or self.kind not in _c_sort_kinds:
+            return theano.Op.c_code(self, node, name, inputs, outputs, sub)
+        kind = _c_sort_kinds[self.kind]
+        axis = _c_axis_code(node, axis)
+        return """
+        {
+        // PyArray_ArgSort flattens a when axis is NPY_MAXDIMS.
+        PyArrayObject* idx = (PyArrayObject*)PyArray_ArgSort(%(a)s, %(axis)s,
+                                                             %(kind)s);
+        if (!idx)
+            %(fail)s;
+        Py_XDECREF(%(z)s);
+        if (idx->descr->type_num == NPY_INT64)
+            %(z)s = idx;
+        else
+        {
+            // npy_intp is not 64 bits on this platform.
+            %(z)s = (PyArrayObject*)PyArray_Cast(idx, NPY_INT64);
+            Py_DECREF(idx);
+            if (!%(z)s)
+                %(fail)s;
+        }
+        }
+        """ % locals()
+
     def infer_shape(self, node, inputs_shapes):
         if (isinstance(node.inputs[1], theano.Constant) and
                 node.inputs[1].data is None):
@@ -5144,6 +5144,20 @@ class test_tensordot(unittest.TestCase):
         self.assertTrue(numpy.allclose(o1[0],o2[0]))
         self.assertTrue(numpy.allclose(o1[1],o2[1]))
 
+    def test_unsorted_axes(self):
+        # The summed axes of y are not in increasing order.
+        atens = tensor3()
+        btens = tensor3()
+        axes = ((0,2),(2,0))
+        aval = rand(2,3,4)
+        bval = rand(4,5,2)
+        c = tensordot(atens, btens, axes)
+        f = inplace_func([atens,btens],c)
+        self.assertTrue(numpy.allclose(numpy.tensordot(aval,bval,axes),
+                                       f(aval,bval)))
+        utt.verify_grad(TensorDot(axes), [aval,bval])
+        utt.verify_grad(TensorDot((axes[1],axes[0])), [bval,aval])
+
 def test_smallest_stack():
     sx, sy = dscalar(), dscalar()
 
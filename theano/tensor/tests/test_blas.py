@@ -1,10 +1,10 @@
-#from nose.plugins.skip import SkipTest
+from nose.plugins.skip import SkipTest
 #import traceback
 import itertools
 import sys
 import theano.tensor as T
 from theano import tensor
-from theano.gof.python25 import product as itertools_product
+from theano.gof.python25 import any, product as itertools_product
 from theano.printing import pp
 
 import numpy
@@ -19,7 +19,8 @@ from theano.tensor.blas import (_dot22, _dot22scalar, res_is_a, _as_scalar,
                                 _is_real_matrix, _gemm_canonicalize,
                                 _factor_canonicalized, Gemm, Gemv,
                                 gemm_inplace, gemm_no_inplace,
-                                InconsistencyError, Ger, ger, ger_destructive)
+                                InconsistencyError, Ger, ger, ger_destructive,
+                                BatchedDot, batched_dot, TensorDotGemm)
 from unittest import TestCase
 from theano.tests import unittest_tools
 from copy import copy, deepcopy
@@ -1037,6 +1038,148 @@ def test_dot_w_self():
     f(numpy.asarray([[0, 1], [2, 3]], dtype=config.floatX))
 
 
+def test_cost():
+    x, y, z = T.matrix(), T.matrix(), T.matrix()
+    a, b = T.scalar(), T.scalar()
+    itemsize = numpy.dtype(config.floatX).itemsize
+    node = _dot22(x, y).owner
+    flops, read, written = node.op.cost(node, [(2, 3), (3, 4)], [(2, 4)])
+    assert flops == 2 * 2 * 3 * 4
+    assert read == (6 + 12) * itemsize
+    assert written == 8 * itemsize
+    node = gemm_inplace(z, a, x, y, b).owner
+    flops, read, written = node.op.cost(node, [(2, 4), (), (2, 3), (3, 4),
+                                              ()], [(2, 4)])
+    assert flops == 2 * 2 * 3 * 4 + 3 * 2 * 4
+    # The output is z, updated in place.
+    assert written == 8 * itemsize
+    # Unknown shapes give an unknown number of flops.
+    assert node.op.cost(node, [None] * 5, [None]) == (None, 0, 0)
+
+
+class TestBatchedDot(TestCase):
+    def setUp(self):
+        unittest_tools.seed_rng()
+        self.rng = numpy.random.RandomState(unittest_tools.fetch_seed())
+
+    def rand(self, *shp):
+        return self.rng.uniform(size=shp).astype(config.floatX)
+
+    def test_values(self):
+        x = T.tensor3('x')
+        y = T.tensor3('y')
+        f = theano.function([x, y], batched_dot(x, y),
+                            mode=mode_not_fast_compile)
+        vx = self.rand(4, 2, 3)
+        vy = self.rand(4, 3, 5)
+        ref = numpy.asarray([numpy.dot(a, b) for a, b in zip(vx, vy)])
+        assert numpy.allclose(f(vx, vy), ref)
+        # non-contiguous inputs must give the same result
+        vxt = self.rand(4, 3, 2).transpose(0, 2, 1)
+        vyt = self.rand(5, 3, 4).transpose(2, 1, 0)
+        ref = numpy.asarray([numpy.dot(a, b) for a, b in zip(vxt, vyt)])
+        assert numpy.allclose(f(vxt, vyt), ref)
+
+    def test_grad(self):
+        unittest_tools.verify_grad(batched_dot,
+                                   [self.rand(3, 2, 4), self.rand(3, 4, 5)])
+
+    def test_stacked_dot_opt(self):
+        x = T.tensor3('x')
+        y = T.tensor3('y')
+        z = T.stack(*[T.dot(x[i], y[i]) for i in range(3)])
+        f = theano.function([x, y], z, mode=mode_not_fast_compile)
+        if config.mode != 'FAST_COMPILE':
+            assert any([isinstance(n.op, BatchedDot)
+                        for n in f.maker.fgraph.toposort()])
+        vx = self.rand(3, 2, 4)
+        vy = self.rand(3, 4, 5)
+        ref = numpy.asarray([numpy.dot(a, b) for a, b in zip(vx, vy)])
+        assert numpy.allclose(f(vx, vy), ref)
+
+    def test_stacked_dot_int_indices(self):
+        # The indices of x[i] are Python ints in Subtensor.idx_list.
+        x = T.tensor3('x')
+        y = T.tensor3('y')
+        assert theano.tensor.blas._stacked_slice(x[1], 1) is x
+        assert theano.tensor.blas._stacked_slice(x[1], 0) is None
+        z = T.stack(*[T.dot(x[i], y[i]) for i in range(3)])
+        rval = theano.tensor.blas.local_stacked_dot_to_batched_dot.transform(
+            z.owner)
+        assert isinstance(rval[0].owner.op, BatchedDot)
+
+        # Slices in another order are not rewritten, and still compile.
+        z = T.stack(*[T.dot(x[i], y[i]) for i in [1, 0, 2]])
+        f = theano.function([x, y], z, mode=mode_not_fast_compile)
+        assert not any([isinstance(n.op, BatchedDot)
+                        for n in f.maker.fgraph.toposort()])
+        vx = self.rand(3, 2, 4)
+        vy = self.rand(3, 4, 5)
+        ref = numpy.asarray([numpy.dot(vx[i], vy[i]) for i in [1, 0, 2]])
+        assert numpy.allclose(f(vx, vy), ref)
+
+
+class TestTensorDotOpt(unittest_tools.InferShapeTester):
+    def setUp(self):
+        super(TestTensorDotOpt, self).setUp()
+        self.rng = numpy.random.RandomState(unittest_tools.fetch_seed())
+        self.mode = theano.compile.get_mode(mode_not_fast_compile)
+
+    def rand(self, *shp):
+        return self.rng.uniform(size=shp).astype(config.floatX)
+
+    def test_lowered_to_dot22(self):
+        x = T.tensor3('x')
+        y = T.tensor3('y')
+        vx = self.rand(2, 3, 4)
+        vy = self.rand(3, 4, 5)
+        # the summed axes are a block at the start or at the end
+        for axes, xv, yv in [(((1, 2), (0, 1)), vx, vy),
+                             (((0, 1), (1, 2)), vy, vx)]:
+            f = theano.function([x, y], T.tensordot(x, y, axes),
+                                mode=self.mode)
+            topo = f.maker.fgraph.toposort()
+            if config.mode != 'FAST_COMPILE':
+                assert any([n.op == _dot22 for n in topo])
+                assert not any([isinstance(n.op, T.TensorDot)
+                                for n in topo])
+            assert numpy.allclose(f(xv, yv), numpy.tensordot(xv, yv, axes))
+
+    def test_gemm(self):
+        if not config.blas.ldflags:
+            raise SkipTest('No BLAS')
+        x = T.tensor3('x')
+        y = T.tensor3('y')
+        axes = ((0, 2), (1, 0))
+        f = theano.function([x, y], T.tensordot(x, y, axes), mode=self.mode)
+        if config.mode != 'FAST_COMPILE':
+            assert any([isinstance(n.op, TensorDotGemm)
+                        for n in f.maker.fgraph.toposort()])
+        vx = self.rand(2, 3, 4)
+        vy = self.rand(4, 2, 5)
+        assert numpy.allclose(f(vx, vy), numpy.tensordot(vx, vy, axes))
+        # inputs whose strides allow a matrix view, and inputs that don't
+        vx = self.rand(4, 3, 2).transpose(2, 1, 0)
+        vy = self.rand(5, 2, 8)[:, :, ::2].transpose(2, 1, 0)
+        assert numpy.allclose(f(vx, vy), numpy.tensordot(vx, vy, axes))
+
+    def test_grad(self):
+        vx = self.rand(2, 3, 4)
+        vy = self.rand(4, 5, 2)
+        for axes in [((0, 2), (2, 0)), ((2,), (0,)), ((0,), (2,))]:
+            unittest_tools.verify_grad(
+                lambda x, y: T.tensordot(x, y, axes), [vx, vy])
+
+    def test_infer_shape(self):
+        x = T.tensor3('x')
+        y = T.tensor3('y')
+        axes = ((0, 2), (1, 0))
+        self._compile_and_check([x, y], [T.tensordot(x, y, axes)],
+                                [self.rand(2, 3, 4), self.rand(4, 2, 5)],
+                                T.TensorDot,
+                                excluding=['local_tensordot_to_dot'])
+
+
 ###############################################################################
 ## Tests for Gemv
 ###############################################################################
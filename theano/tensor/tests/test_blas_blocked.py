@@ -0,0 +1,65 @@
+import numpy
+
+import theano
+import theano.tensor as tensor
+from theano import config
+from theano.tensor.blas_blocked import BlockedDot22, strassen
+
+from test_blas import TestCase, mode_not_fast_compile
+from theano.tests import unittest_tools
+
+
+class TestBlockedDot22(TestCase):
+
+    def setUp(self):
+        unittest_tools.seed_rng()
+        self.rng = numpy.random.RandomState(unittest_tools.fetch_seed())
+
+    def rand(self, *shp):
+        return self.rng.uniform(size=shp).astype('float64')
+
+    def test_strassen(self):
+        # odd and even dimensions, several levels of recursion
+        for m, k, n in [(8, 8, 8), (9, 7, 11), (16, 17, 15), (3, 40, 2)]:
+            a = self.rand(m, k)
+            b = self.rand(k, n)
+            assert numpy.allclose(strassen(a, b, 2), numpy.dot(a, b))
+
+    def test_perform(self):
+        x = tensor.dmatrix()
+        y = tensor.dmatrix()
+        # tiles that don't divide the shapes, with and without Strassen
+        for op in [BlockedDot22(4), BlockedDot22(8, 2), BlockedDot22(100)]:
+            f = theano.function([x, y], op(x, y), mode=mode_not_fast_compile)
+            for shp in [(10, 9, 13), (8, 8, 8), (1, 17, 3), (5, 0, 4)]:
+                xv = self.rand(shp[0], shp[1])
+                yv = self.rand(shp[1], shp[2])
+                assert numpy.allclose(f(xv, yv), numpy.dot(xv, yv))
+
+    def test_opt(self):
+        x = tensor.dmatrix()
+        y = tensor.dmatrix()
+        orig = (config.blas.dot22_mode, config.blas.dot22_block_size,
+                config.blas.strassen_min_size)
+        try:
+            config.blas.dot22_mode = 'strassen'
+            config.blas.dot22_block_size = 8
+            config.blas.strassen_min_size = 4
+            f = theano.function([x, y], tensor.dot(x, y),
+                                mode=mode_not_fast_compile)
+        finally:
+            (config.blas.dot22_mode, config.blas.dot22_block_size,
+             config.blas.strassen_min_size) = orig
+        if config.mode != 'FAST_COMPILE':
+            assert BlockedDot22(8, 4) in [n.op for n in
+                                          f.maker.fgraph.toposort()]
+        xv = self.rand(20, 18)
+        yv = self.rand(18, 19)
+        assert numpy.allclose(f(xv, yv), numpy.dot(xv, yv))
+
+    def test_default_is_gemm(self):
+        x = tensor.dmatrix()
+        f = theano.function([x], tensor.dot(x, x.T),
+                            mode=mode_not_fast_compile)
+        assert not any([isinstance(n.op, BlockedDot22)
+                        for n in f.maker.fgraph.toposort()])
@@ -285,6 +285,77 @@ class TestFillDiagonal(utt.InferShapeTester):
                                  numpy.random.rand()],
                                 self.op_class)
 
+def test_c_code():
+    # The C implementations give the same results as perform.
+    rng = numpy.random.RandomState(utt.fetch_seed())
+    x = tensor.matrix()
+    t3 = tensor.tensor3()
+    i = tensor.lvector()
+    b = tensor.bvector()
+    w = tensor.vector()
+    m = tensor.lscalar()
+    val = tensor.scalar()
+    cases = [
+        ([x], [diff(x), diff(x, n=3, axis=0), diff(x, n=2, axis=1),
+               diff(x, n=40)],
+         [rng.rand(7, 5).astype(config.floatX)]),
+        ([t3], [diff(t3, axis=1), diff(t3, n=2, axis=0)],
+         [rng.rand(4, 3, 5).astype(config.floatX)]),
+        ([b], [diff(b, n=2)], [rng.randint(-128, 128, 30).astype('int8')]),
+        ([i, w], [bincount(i), bincount(i, minlength=60),
+                  bincount(i, weights=w)],
+         [rng.randint(50, size=25), rng.rand(25).astype(config.floatX)]),
+        ([x, i], [repeat(x, 3), repeat(x, 2, axis=0),
+                  repeat(x, i, axis=-1)],
+         [rng.rand(4, 5).astype(config.floatX), rng.randint(4, size=5)]),
+        ([m], [bartlett(m)], [17]),
+        ([m], [bartlett(m)], [1]),
+        ([m], [bartlett(m)], [-3]),
+        ([x, val], [fill_diagonal(x, val)],
+         [rng.rand(5, 8).astype(config.floatX), numpy.cast[config.floatX](3)]),
+        ([x, val], [fill_diagonal(x.T, val)],
+         [rng.rand(5, 8).astype(config.floatX), numpy.cast[config.floatX](3)]),
+        ]
+    for inputs, outputs, values in cases:
+        results = []
+        for linker in ['py', 'c']:
+            f = function(inputs, outputs,
+                         mode=theano.Mode(linker=linker, optimizer=None))
+            # Call twice to check that the output buffers are reused right.
+            f(*values)
+            results.append(f(*values))
+        for py, c in zip(*results):
+            assert py.shape == c.shape, (py.shape, c.shape)
+            assert numpy.allclose(py, c), (py, c)
+
+    # Negative inputs of bincount are detected.
+    f = function([i], bincount(i),
+                 mode=theano.Mode(linker='c', optimizer=None))
+    try:
+        f(numpy.asarray([1, -1]))
+        assert False
+    except ValueError:
+        pass
+
+
+def test_bincount_c_no_weights():
+    # Without weights, the weights input is not an array in the C code.
+    i = tensor.lvector()
+    w = tensor.vector()
+    for linker in ['c', 'c|py', 'cvm']:
+        mode = theano.Mode(linker=linker, optimizer=None)
+        f = function([i], bincount(i, minlength=5), mode=mode)
+        assert numpy.all(f(numpy.asarray([0, 2, 2])) == [1, 0, 2, 0, 0])
+        # With weights, the shapes are still checked.
+        f = function([i, w], bincount(i, weights=w), mode=mode)
+        try:
+            f(numpy.asarray([0, 2, 2]),
+              numpy.ones(2, dtype=config.floatX))
+            assert False
+        except TypeError:
+            pass
+
+
 if __name__ == "__main__":
     utt.unittest.main()
     t = TestFillDiagonal('setUp')
@@ -2159,6 +2159,43 @@ class Test_alloc_zero(unittest.TestCase):
                                       f.maker.fgraph.toposort() ])
 
 
+def test_local_advanced_inc_subtensor1_of_zeros():
+    mode = theano.compile.mode.get_default_mode()
+    if theano.config.mode == 'FAST_COMPILE':
+        mode = compile.Mode(linker='py', optimizer='fast_run')
+    W = tensor.matrix('W')
+    idx = tensor.ivector('idx')
+    lr = tensor.scalar('lr')
+    g = theano.grad((W[idx] ** 2).sum(), W)
+
+    W_val = numpy.random.rand(10, 3).astype(config.floatX)
+    idx_val = numpy.asarray([3, 8, 3], dtype='int32')
+    g_val = numpy.zeros_like(W_val)
+    for i in idx_val:
+        g_val[i] += 2 * W_val[i]
+
+    for out, expected in [(W - lr * g, W_val - 0.5 * g_val),
+                          (W + g * lr, W_val + 0.5 * g_val),
+                          (-g + W, W_val - g_val)]:
+        f = function([W, idx, lr], out, mode=mode, on_unused_input='ignore')
+        topo = f.maker.fgraph.toposort()
+        # The increment is done directly on W, without the zeros.
+        incs = [node for node in topo
+                if isinstance(node.op, tensor.AdvancedIncSubtensor1)]
+        assert len(incs) == 1
+        assert incs[0].inputs[0] is f.maker.fgraph.inputs[0]
+        assert numpy.allclose(f(W_val, idx_val, 0.5), expected)
+
+    # Only the rows in idx of a shared variable are updated inplace.
+    sW = shared(W_val.copy())
+    g = theano.grad((sW[idx] ** 2).sum(), sW)
+    f = function([idx], [], updates=[(sW, sW - 0.5 * g)], mode=mode)
+    assert any(isinstance(node.op, tensor.AdvancedIncSubtensor1) and
+               node.op.inplace for node in f.maker.fgraph.toposort())
+    f(idx_val)
+    assert numpy.allclose(sW.get_value(), W_val - 0.5 * g_val)
+
+
 def test_local_subtensor_of_alloc():
     x = tensor.matrix('x')
 
@@ -797,6 +797,23 @@ class T_random_function(utt.InferShapeTester):
     # Vectorized permutation don't make sense: the only parameter, n,
     # controls one dimension of the returned tensor.
 
+    def test_permutation_matrix_size(self):
+        rng_R = random_state_type()
+        post_r, out = permutation(rng_R, size=(2, 3), n=5)
+        assert out.ndim == 3
+        f = compile.function([rng_R], [post_r, out], accept_inplace=True)
+
+        rng = numpy.random.RandomState(utt.fetch_seed())
+        numpy_rng = numpy.random.RandomState(utt.fetch_seed())
+        rng0, val0 = f(rng)
+        numpy_val0 = numpy.asarray([numpy_rng.permutation(5)
+                                    for i in range(6)]).reshape(2, 3, 5)
+        assert numpy.all(val0 == numpy_val0)
+        # The input state was copied, not updated.
+        self.assertTrue(rng_R.type.values_eq(
+                rng, numpy.random.RandomState(utt.fetch_seed())))
+        self.assertTrue(rng_R.type.values_eq(rng0, numpy_rng))
+
     def test_multinomial_vector(self):
         rng_R = random_state_type()
         n = tensor.lvector()
@@ -77,6 +77,30 @@ class T_SharedRandomStreams(unittest.TestCase):
         assert numpy.allclose(fn_val0, numpy_val0)
         assert numpy.allclose(fn_val1, numpy_val1)
 
+    def test_workers(self):
+        # The workers that share a seed use different streams.
+        vals = []
+        for worker_id in range(3):
+            random = RandomStreams(utt.fetch_seed(), worker_id=worker_id,
+                                   num_workers=3)
+            fn = function([], random.uniform((4,)), updates=random.updates())
+            vals.append(fn())
+        for i in range(3):
+            for j in range(i):
+                assert not numpy.allclose(vals[i], vals[j])
+
+        # The streams of worker 1 are seeded by every third seed.
+        random = RandomStreams(234, worker_id=1, num_workers=3)
+        fn = function([], random.uniform((2, 2)), updates=random.updates())
+        random.seed(utt.fetch_seed())
+        rng_seed = numpy.random.RandomState(utt.fetch_seed()).randint(
+            2 ** 30, size=3)[1]
+        rng = numpy.random.RandomState(int(rng_seed))
+        assert numpy.allclose(fn(), rng.uniform(size=(2, 2)))
+
+        self.assertRaises(ValueError, RandomStreams, 234, worker_id=3,
+                          num_workers=3)
+
     def test_getitem(self):
 
         random = RandomStreams(234)
@@ -144,3 +144,25 @@ def test_argsort():
     gv = f(m_val)
     gt = np.argsort(m_val, None)
     assert_allclose(gv, gt)
+
+
+def test_c_code():
+    # The C implementations give the same results as numpy.
+    rng = np.random.RandomState(seed=utt.fetch_seed())
+    m_val = rng.rand(6, 5)
+    a = tensor.dmatrix()
+    axis = tensor.lscalar()
+    mode = theano.Mode(linker='c', optimizer=None)
+    for kind in ['quicksort', 'mergesort', 'heapsort']:
+        f = theano.function([a, axis], [sort(a, axis, kind),
+                                        argsort(a, axis, kind)], mode=mode)
+        for axis_val in [0, 1, -1]:
+            s, i = f(m_val, axis_val)
+            assert np.all(s == np.sort(m_val, axis_val, kind))
+            assert i.dtype == 'int64'
+            assert np.all(i == np.argsort(m_val, axis_val, kind))
+        f = theano.function([a], [sort(a, None, kind),
+                                  argsort(a, None, kind)], mode=mode)
+        s, i = f(m_val.T)
+        assert np.all(s == np.sort(m_val.T, None, kind))
+        assert np.all(i == np.argsort(m_val.T, None, kind))
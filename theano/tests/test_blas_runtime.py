@@ -0,0 +1,70 @@
+"""
+Test the BLAS runtime layer in theano.blas.
+"""
+import copy
+import unittest
+
+from nose.plugins.skip import SkipTest
+import numpy
+
+import theano
+from theano import blas, config, tensor
+
+
+class T_blas_runtime(unittest.TestCase):
+
+    def test_info(self):
+        d = blas.info()
+        for k in ['library', 'path', 'num_threads', 'thread_control',
+                  'ldflags']:
+            assert k in d
+        if d['thread_control'] and d['num_threads'] is not None:
+            assert d['num_threads'] >= 1
+
+    def test_set_num_threads(self):
+        if not blas.info()['thread_control'] or \
+                blas.get_num_threads() is None:
+            raise SkipTest('The BLAS library does not expose its threads')
+        orig = blas.get_num_threads()
+        try:
+            assert blas.set_num_threads(1) == orig
+            assert blas.get_num_threads() == 1
+        finally:
+            blas.set_num_threads(orig)
+        assert blas.get_num_threads() == orig
+
+    def test_function_num_threads(self):
+        x = tensor.matrix()
+        orig_flag = config.blas.num_threads
+        config.blas.num_threads = 1
+        try:
+            f = theano.function([x], tensor.dot(x, x))
+        finally:
+            config.blas.num_threads = orig_flag
+        assert f.blas_num_threads == 1
+        assert copy.copy(f).blas_num_threads == 1
+
+        orig = blas.get_num_threads()
+        v = numpy.ones((5, 5), dtype=config.floatX)
+        assert numpy.allclose(f(v), numpy.dot(v, v))
+        # The thread count must be restored after the call.
+        assert blas.get_num_threads() == orig
+
+    def test_function_num_threads_no_getter(self):
+        # With a BLAS that can set its threads but not report them, the
+        # count could not be restored, so it is not changed.
+        calls = []
+        orig_runtime = blas._runtime
+        blas._runtime = blas._BlasRuntime('goto', None, calls.append, None)
+        try:
+            x = tensor.matrix()
+            f = theano.function([x], tensor.dot(x, x))
+            f.blas_num_threads = 2
+            v = numpy.ones((5, 5), dtype=config.floatX)
+            assert numpy.allclose(f(v), numpy.dot(v, v))
+            assert calls == []
+            # An explicit call still sets it.
+            assert blas.set_num_threads(3) is None
+            assert calls == [3]
+        finally:
+            blas._runtime = orig_runtime
@@ -269,5 +269,54 @@ def test_grad_name():
     g = theano.tensor.grad(f,x)
     assert g.name == '(df/dx)'
 
+
+def test_grad_memoized():
+    x = theano.tensor.vector('x')
+    w = theano.tensor.vector('w')
+    cost = (theano.tensor.exp(x * w) * w).sum()
+    gx = theano.tensor.grad(cost, x)
+    # The second time, the graph of the first one is returned.
+    assert theano.tensor.grad(cost, x) is gx
+    gx2, gw = theano.tensor.grad(cost, [x, w])
+    assert gx2 is gx
+    f = theano.function([x, w], [gx, gw])
+    vx = numpy.asarray([1., 2.], dtype=theano.config.floatX)
+    vw = numpy.asarray([3., 4.], dtype=theano.config.floatX)
+    e = numpy.exp(vx * vw)
+    out = f(vx, vw)
+    assert numpy.allclose(out[0], e * vw * vw)
+    assert numpy.allclose(out[1], e + e * vx * vw)
+
+    # The cached gradients are not pickled with the graph.
+    import cPickle
+    cost2 = cPickle.loads(cPickle.dumps(cost))
+    assert not cost2.owner.tag.grad_cache
+
+    # A clone of the graph shares a shallow copy of the tags, but not the
+    # cached gradients.
+    x3 = x.type('x3')
+    cost3 = theano.clone(cost, replace={x: x3})
+    gx3 = theano.tensor.grad(cost3, x3)
+    assert gx3 is not gx
+    graph_inputs = theano.gof.graph.inputs([gx3])
+    assert x3 in graph_inputs and x not in graph_inputs
+    assert cost3.owner.tag.grad_cache is not cost.owner.tag.grad_cache
+    assert theano.tensor.grad(cost, x) is gx
+
+
+def test_grad_wrt_only():
+    # Only the nodes between wrt and the cost are differentiated.
+    class NoGrad(gof.op.Op):
+        def make_node(self, x):
+            return gof.Apply(self, [x], [x.type()])
+
+        def grad(self, inp, grads):
+            raise AssertionError('grad should not be called')
+    x = theano.tensor.vector('x')
+    y = theano.tensor.vector('y')
+    cost = (NoGrad()(y) * x).sum()
+    theano.tensor.grad(cost, x)
+
+
 if __name__ == '__main__':
     unittest.main()
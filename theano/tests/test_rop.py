@@ -286,6 +286,52 @@ class test_RopLop(RopLop_checker):
     def test_sum(self):
         self.check_mat_rop_lop(self.mx.sum(axis=1), (self.mat_in_shape[0],))
 
+    def test_prod(self):
+        # Prod has no R_op: it is computed from its grad.
+        self.check_mat_rop_lop(self.mx.prod(axis=1), (self.mat_in_shape[0],))
+
+    def test_tensordot(self):
+        vW = numpy.asarray(self.rng.uniform(size=self.mat_in_shape[1:]),
+                           theano.config.floatX)
+        W = theano.shared(vW)
+        self.check_mat_rop_lop(tensor.tensordot(self.mx, W, axes=1),
+                               (self.mat_in_shape[0],))
+
+    def test_max_careduce(self):
+        # The CAReduce max has no grad, compare it to MaxAndArgmax.
+        out = tensor.elemwise.CAReduce(theano.scalar.maximum,
+                                       axis=0)(self.mx)
+        rop_f = function([self.mx, self.mv],
+                         [tensor.Rop(out, self.mx, self.mv),
+                          tensor.Rop(tensor.max(self.mx, axis=0),
+                                     self.mx, self.mv)])
+        vx = numpy.asarray(self.rng.uniform(size=self.mat_in_shape),
+                           theano.config.floatX)
+        vv = numpy.asarray(self.rng.uniform(size=self.mat_in_shape),
+                           theano.config.floatX)
+        v1, v2 = rop_f(vx, vv)
+        assert numpy.allclose(v1, v2), ('ROP mismatch: %s %s' % (v1, v2))
+
+    def test_hessian_vector_product(self):
+        cost = (tensor.exp(self.x) * tensor.sum(self.x ** 3)).sum()
+        H = theano.gradient.hessian(cost, self.x)
+        outs = [tensor.dot(H, self.v)]
+        for method in ['auto', 'forward', 'reverse']:
+            outs.append(theano.gradient.hessian_vector_product(
+                cost, self.x, self.v, method=method))
+        f = function([self.x, self.v], outs)
+        vx = numpy.asarray(self.rng.uniform(size=self.in_shape),
+                           theano.config.floatX)
+        vv = numpy.asarray(self.rng.uniform(size=self.in_shape),
+                           theano.config.floatX)
+        values = f(vx, vv)
+        for v in values[1:]:
+            assert numpy.allclose(values[0], v)
+
+        hvp = theano.gradient.hessian_vector_product(cost, [self.x],
+                                                     [self.v])
+        assert isinstance(hvp, list) and len(hvp) == 1
+
     def test_softmax(self):
         # Softmax adds an extra dimnesion !
         self.check_rop_lop(tensor.nnet.softmax(self.x)[0], self.in_shape[0])